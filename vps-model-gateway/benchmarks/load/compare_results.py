@@ -0,0 +1,71 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+"""
+Compares two load test result files written by run_load_test.
+
+    python -m benchmarks.load.compare_results baseline.json candidate.json
+"""
+
+import argparse
+import json
+
+METRICS = [
+    ("throughput_rps", ("summary", "throughput_rps"), True),
+    ("error_rate", ("summary", "error_rate"), False),
+    ("latency p50 ms", ("summary", "latency_ms", "p50"), False),
+    ("latency p95 ms", ("summary", "latency_ms", "p95"), False),
+    ("latency p99 ms", ("summary", "latency_ms", "p99"), False),
+    ("gateway cpu %", ("gateway", "cpu_percent_mean"), False),
+    ("gateway rss max MB", ("gateway", "rss_mb_max"), False)
+]
+
+def lookup(report: dict, path: tuple):
+    value = report
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+def compare(baseline: dict, candidate: dict):
+    rows = []
+    for name, path, higher_is_better in METRICS:
+        before, after = lookup(baseline, path), lookup(candidate, path)
+        change = None
+        if before not in (None, 0) and after is not None:
+            change = 100 * (after - before) / before
+        better = None if change is None or change == 0 else (change > 0) == higher_is_better
+        rows.append((name, before, after, change, better))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two load test result files")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args()
+
+    with open(args.baseline, "r") as file:
+        baseline = json.load(file)
+    with open(args.candidate, "r") as file:
+        candidate = json.load(file)
+
+    print(f"{'metric':<22}{'baseline':>14}{'candidate':>14}{'change':>10}")
+    for name, before, after, change, better in compare(baseline, candidate):
+        change_text = "n/a" if change is None else f"{change:+.1f}%"
+        marker = "" if better is None else (" better" if better else " worse")
+        print(f"{name:<22}{str(before):>14}{str(after):>14}{change_text:>10}{marker}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+"""
+Single node Redis Cluster stand-in for the load harness.
+
+Speaks enough RESP2 for redis-py-cluster to bootstrap (CLUSTER SLOTS, CONFIG GET) and for the
+commands the gateway issues. All 16384 slots are owned by this node, keys live in memory.
+"""
+
+import argparse
+import asyncio
+import fnmatch
+import time
+
+class RespError(Exception):
+    pass
+
+class FakeRedisStore:
+    def __init__(self):
+        self.values = {}
+        self.expiries = {}
+
+    def _expire_if_needed(self, key):
+        expiry = self.expiries.get(key)
+        if expiry is not None and expiry <= time.monotonic():
+            self.values.pop(key, None)
+            self.expiries.pop(key, None)
+
+    def get(self, key):
+        self._expire_if_needed(key)
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None, px=None, nx=False, xx=False):
+        self._expire_if_needed(key)
+        exists = key in self.values
+        if (nx and exists) or (xx and not exists):
+            return False
+        self.values[key] = value
+        self.expiries.pop(key, None)
+        if ex is not None:
+            self.expiries[key] = time.monotonic() + ex
+        elif px is not None:
+            self.expiries[key] = time.monotonic() + px / 1000
+        return True
+
+    def delete(self, key):
+        self._expire_if_needed(key)
+        self.expiries.pop(key, None)
+        return self.values.pop(key, None) is not None
+
+    def ttl(self, key):
+        self._expire_if_needed(key)
+        if key not in self.values:
+            return -2
+        expiry = self.expiries.get(key)
+        if expiry is None:
+            return -1
+        return max(0, int(round(expiry - time.monotonic())))
+
+class FakeRedisServer:
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.store = FakeRedisStore()
+        self.sorted_sets = {}
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                command = await read_command(reader)
+                if command is None:
+                    break
+                try:
+                    reply = self.execute(command)
+                except RespError as e:
+                    writer.write(f"-{e}\r\n".encode())
+                else:
+                    writer.write(encode_reply(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def execute(self, command):
+        name = command[0].upper()
+        args = command[1:]
+        handler = getattr(self, f"command_{name.lower().replace('-', '_')}", None)
+        if handler is None:
+            raise RespError(f"ERR unknown command '{name}'")
+        return handler(*args)
+
+    def command_ping(self, *args):
+        return SimpleString("PONG") if not args else args[0]
+
+    def command_cluster(self, subcommand, *args):
+        if subcommand.upper() == "SLOTS":
+            return [[0, 16383, [self.host, self.port, "fake-redis-node"]]]
+        if subcommand.upper() == "INFO":
+            return "cluster_state:ok\r\ncluster_slots_assigned:16384\r\ncluster_known_nodes:1\r\n"
+        raise RespError(f"ERR unsupported CLUSTER subcommand '{subcommand}'")
+
+    def command_config(self, subcommand, *args):
+        if subcommand.upper() == "GET":
+            return [args[0], "no"]
+        return SimpleString("OK")
+
+    def command_readonly(self):
+        return SimpleString("OK")
+
+    def command_get(self, key):
+        return self.store.get(key)
+
+    def command_set(self, key, value, *options):
+        ex = px = None
+        nx = xx = False
+        options = list(options)
+        while options:
+            option = options.pop(0).upper()
+            if option == "EX":
+                ex = int(options.pop(0))
+            elif option == "PX":
+                px = int(options.pop(0))
+            elif option == "NX":
+                nx = True
+            elif option == "XX":
+                xx = True
+        return SimpleString("OK") if self.store.set(key, value, ex=ex, px=px, nx=nx, xx=xx) else None
+
+    def command_incrby(self, key, amount):
+        value = int(self.store.get(key) or 0) + int(amount)
+        ttl = self.store.ttl(key)
+        self.store.set(key, str(value), ex=ttl if ttl > 0 else None)
+        return value
+
+    def command_incr(self, key):
+        return self.command_incrby(key, 1)
+
+    def command_decrby(self, key, amount):
+        return self.command_incrby(key, -int(amount))
+
+    def command_decr(self, key):
+        return self.command_incrby(key, -1)
+
+    def command_del(self, *keys):
+        return sum(1 for key in keys if self.store.delete(key))
+
+    def command_exists(self, *keys):
+        return sum(1 for key in keys if self.store.get(key) is not None)
+
+    def command_ttl(self, key):
+        return self.store.ttl(key)
+
+    def command_expire(self, key, seconds):
+        value = self.store.get(key)
+        if value is None:
+            return 0
+        self.store.set(key, value, ex=int(seconds))
+        return 1
+
+    def command_keys(self, pattern):
+        return [key for key in list(self.store.values) if self.store.get(key) is not None and fnmatch.fnmatchcase(key, pattern)]
+
+    def command_xadd(self, key, *arguments):
+        # Only the entry count is kept, the usage event benchmark just needs XADD to succeed
+        length = int(self.store.get(key) or 0) + 1
+        self.store.set(key, str(length))
+        return f"{int(time.time() * 1000)}-{length}"
+
+    def command_zincrby(self, key, increment, member):
+        scores = self.sorted_sets.setdefault(key, {})
+        scores[member] = scores.get(member, 0.0) + float(increment)
+        return repr(scores[member])
+
+    def command_zrevrange(self, key, start, stop, *options):
+        # Sorted sets never expire here, EXPIRE on them is accepted but ignored
+        ranked = sorted(self.sorted_sets.get(key, {}).items(), key=lambda item: item[1], reverse=True)
+        stop = int(stop)
+        ranked = ranked[int(start):None if stop == -1 else stop + 1]
+        if options and options[0].upper() == "WITHSCORES":
+            return [value for member, score in ranked for value in (member, repr(score))]
+        return [member for member, _ in ranked]
+
+class SimpleString(str):
+    pass
+
+async def read_command(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # Inline command, as sent by redis-cli or telnet
+        return line.decode().split()
+    count = int(line[1:])
+    command = []
+    for _ in range(count):
+        header = await reader.readline()
+        length = int(header[1:])
+        data = await reader.readexactly(length + 2)
+        command.append(data[:-2].decode())
+    return command
+
+def encode_reply(reply):
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, SimpleString):
+        return f"+{reply}\r\n".encode()
+    if isinstance(reply, bool):
+        return f":{int(reply)}\r\n".encode()
+    if isinstance(reply, int):
+        return f":{reply}\r\n".encode()
+    if isinstance(reply, (list, tuple)):
+        return f"*{len(reply)}\r\n".encode() + b"".join(encode_reply(item) for item in reply)
+    data = reply if isinstance(reply, bytes) else str(reply).encode()
+    return f"${len(data)}\r\n".encode() + data + b"\r\n"
+
+def main():
+    parser = argparse.ArgumentParser(description="Single node Redis Cluster stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    asyncio.run(FakeRedisServer(args.host, args.port).serve())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+"""
+Path-style S3 stand-in for the load harness.
+
+Implements the object and multipart upload calls the gateway makes. Objects are kept in memory
+unless FAKE_S3_DISCARD_BODIES is set, in which case only their size is recorded so long runs
+do not grow the harness memory.
+"""
+
+from fastapi import FastAPI, Request, Response
+from uuid import uuid4
+import hashlib
+import os
+
+app = FastAPI()
+
+DISCARD_BODIES = os.environ.get("FAKE_S3_DISCARD_BODIES", "false").lower() == "true"
+
+objects = {}
+object_metadata = {}
+multipart_uploads = {}
+
+def xml_response(body: str, status_code: int = 200):
+    return Response(content=f'<?xml version="1.0" encoding="UTF-8"?>\n{body}', status_code=status_code, media_type="application/xml")
+
+def no_such_key(key: str):
+    return xml_response(f"<Error><Code>NoSuchKey</Code><Message>The specified key does not exist.</Message><Key>{key}</Key></Error>", 404)
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "objects": len(objects), "multipart_uploads": len(multipart_uploads)}
+
+@app.put("/{bucket}/{key:path}")
+async def put_object(bucket: str, key: str, request: Request):
+    body = await request.body()
+    upload_id = request.query_params.get("uploadId")
+    etag = hashlib.md5(body).hexdigest()
+
+    if upload_id is not None:
+        part_number = int(request.query_params["partNumber"])
+        multipart_uploads[upload_id]["parts"][part_number] = b"" if DISCARD_BODIES else body
+        multipart_uploads[upload_id]["sizes"][part_number] = len(body)
+    else:
+        objects[(bucket, key)] = b"" if DISCARD_BODIES else body
+        object_metadata[(bucket, key)] = {"size": len(body), "content_encoding": request.headers.get("content-encoding")}
+
+    return Response(status_code=200, headers={"ETag": f'"{etag}"'})
+
+@app.post("/{bucket}/{key:path}")
+async def post_object(bucket: str, key: str, request: Request):
+    if "uploads" in request.query_params:
+        upload_id = uuid4().hex
+        multipart_uploads[upload_id] = {"bucket": bucket, "key": key, "parts": {}, "sizes": {}, "content_encoding": request.headers.get("content-encoding")}
+        return xml_response(f"<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>")
+
+    upload_id = request.query_params.get("uploadId")
+    if upload_id is not None:
+        await request.body()
+        upload = multipart_uploads.pop(upload_id)
+        part_numbers = sorted(upload["parts"])
+        objects[(bucket, key)] = b"".join(upload["parts"][number] for number in part_numbers)
+        object_metadata[(bucket, key)] = {"size": sum(upload["sizes"].values()), "content_encoding": upload["content_encoding"]}
+        return xml_response(f'<CompleteMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key><ETag>"{uuid4().hex}-{len(part_numbers)}"</ETag></CompleteMultipartUploadResult>')
+
+    return xml_response("<Error><Code>NotImplemented</Code></Error>", 501)
+
+@app.get("/{bucket}/{key:path}")
+async def get_object(bucket: str, key: str):
+    if (bucket, key) not in objects:
+        return no_such_key(key)
+    metadata = object_metadata[(bucket, key)]
+    headers = {"Content-Encoding": metadata["content_encoding"]} if metadata["content_encoding"] else {}
+    return Response(content=objects[(bucket, key)], media_type="binary/octet-stream", headers=headers)
+
+@app.head("/{bucket}")
+async def head_bucket(bucket: str):
+    return Response(status_code=200)
+
+@app.head("/{bucket}/{key:path}")
+async def head_object(bucket: str, key: str):
+    if (bucket, key) not in objects:
+        return Response(status_code=404)
+    return Response(status_code=200, headers={"Content-Length": str(object_metadata[(bucket, key)]["size"])})
+
+@app.delete("/{bucket}/{key:path}")
+async def delete_object(bucket: str, key: str, request: Request):
+    upload_id = request.query_params.get("uploadId")
+    if upload_id is not None:
+        multipart_uploads.pop(upload_id, None)
+    else:
+        objects.pop((bucket, key), None)
+        object_metadata.pop((bucket, key), None)
+    return Response(status_code=204)
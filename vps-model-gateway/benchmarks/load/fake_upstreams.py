@@ -0,0 +1,210 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+"""
+Stand-ins for every HTTP dependency of the gateway, served from one app.
+
+The user admin, payment, project admin, deploy admin, transformer and Kourier model paths do not
+overlap, so a single server can be used for all the *_SERVICE_URL settings. Latency, error rate,
+response size and chunked encoding are read from the scenario file named by FAKE_UPSTREAM_SCENARIO.
+"""
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+import asyncio
+import random
+import json
+import os
+
+PROJECT_ID = "prj-benchmark"
+ENTITY_ID = "ent-benchmark"
+CHUNK_SIZE = 64 * 1024
+
+def load_scenario(path: str):
+    with open(path, "r") as file:
+        return json.load(file)
+
+def model_service_name(model_id: str):
+    # Mirrors the service name built by retrieve_info_for_model_and_transformer_if_exists
+    return f"mdl-{PROJECT_ID[4:]}-{model_id[4:]}"
+
+def build_prediction_payload(deployment_system: str, size: int):
+    # Builds a response body of roughly `size` bytes in the shape each deployment system returns
+    values = json.dumps([round(random.random(), 6) for _ in range(max(1, size // 10))])
+    if deployment_system in ("KserveV1", "TokenClassification", "TextClassification"):
+        body = '{"predictions": [' + values + ']}'
+    elif deployment_system in ("KserveV2", "MLFlow"):
+        body = '{"model_name": "benchmark", "outputs": [{"name": "output-0", "datatype": "FP32", "shape": [1], "data": ' + values + '}]}'
+    else:
+        text = "x" * max(1, size - 200)
+        body = json.dumps({"id": "cmpl-benchmark", "object": "text_completion", "choices": [{"index": 0, "text": text, "finish_reason": "length"}]})
+    return body.encode()
+
+class UpstreamBehaviour:
+    def __init__(self, settings: dict):
+        self.latency_ms = settings.get("latency_ms", 0)
+        self.latency_jitter_ms = settings.get("latency_jitter_ms", 0)
+        self.error_rate = settings.get("error_rate", 0.0)
+
+    async def delay(self):
+        latency = self.latency_ms + random.uniform(-self.latency_jitter_ms, self.latency_jitter_ms)
+        if latency > 0:
+            await asyncio.sleep(latency / 1000)
+
+    def should_fail(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+def error_response(service: str):
+    return JSONResponse(status_code=503, content={"detail": f"Injected {service} failure"})
+
+def create_app(scenario: dict = None):
+    if scenario is None:
+        scenario = load_scenario(os.environ["FAKE_UPSTREAM_SCENARIO"])
+
+    control_plane = UpstreamBehaviour(scenario.get("control_plane", {}))
+    transformer = UpstreamBehaviour(scenario.get("transformer", {}))
+
+    models = {model["model_id"]: model for model in scenario["models"]}
+    models_by_service_name = {model_service_name(model_id): model for model_id, model in models.items()}
+    model_behaviours = {model_id: UpstreamBehaviour(model) for model_id, model in models.items()}
+    payloads = {model_id: build_prediction_payload(model["deployment_system"], model.get("response_size_bytes", 1024)) for model_id, model in models.items()}
+
+    app = FastAPI()
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.post("/validate_user")
+    async def validate_user(request: Request):
+        await control_plane.delay()
+        if control_plane.should_fail():
+            return error_response("user admin")
+        body = json.loads(await request.body())
+        token = body.get("vps-auth-token", "")
+        # One user per token so the per user rate limit of the gateway spreads over the token pool
+        return {"result": True, "username": f"user-{token[-12:]}", "entity_id": ENTITY_ID, "vps_app_id": "app-*"}
+
+    @app.get("/balance/validate/prediction")
+    async def validate_balance():
+        await control_plane.delay()
+        if control_plane.should_fail():
+            return error_response("payment")
+        return {"result": True}
+
+    @app.get("/model/exists")
+    async def model_exists(model_id: str):
+        await control_plane.delay()
+        if control_plane.should_fail():
+            return error_response("project admin")
+        model = models.get(model_id)
+        if model is None:
+            return {"result": False}
+        model_details = model.get("model_details", {"input": {"name": "input-0", "data_type": "FP32", "dims": [1, -1]}})
+        return {"result": True, "data": {
+            "model_id": model_id,
+            "project_id": PROJECT_ID,
+            "api_access": "public",
+            "model_details": json.dumps(model_details),
+            "notes": json.dumps(model.get("notes", {}))
+        }}
+
+    @app.get("/app/exists")
+    async def app_exists(app_id: str):
+        await control_plane.delay()
+        if control_plane.should_fail():
+            return error_response("project admin")
+        return {"result": True, "data": {"app_id": app_id, "auth_model_ids": list(models)}}
+
+    @app.get("/get_user_id_from_project")
+    async def get_user_id_from_project(project_id: str):
+        await control_plane.delay()
+        if control_plane.should_fail():
+            return error_response("project admin")
+        return {"entity_id": ENTITY_ID}
+
+    @app.get("/deploy/model/transformer/info")
+    async def deployment_info(model_id: str):
+        await control_plane.delay()
+        if control_plane.should_fail():
+            return error_response("deploy admin")
+        model = models.get(model_id)
+        if model is None:
+            return JSONResponse(status_code=404, content={"detail": f"No deployment for {model_id}"})
+        deployment = {
+            "deployment_id": f"dep-{model_id[4:]}",
+            "model_id": model_id,
+            "project_id": PROJECT_ID,
+            "deployment_system": model["deployment_system"],
+            "url_additions": model.get("url_additions", {"Headers": {}})
+        }
+        transformer_deployment = None
+        if model.get("transformer"):
+            transformer_deployment = {"deployment_id": f"dep-trf-{model_id[4:]}", "transformer_id": f"trf-{model_id[4:]}", "project_id": PROJECT_ID, "url_additions": {"Headers": {}}}
+        return {"model": deployment, "transformer": transformer_deployment}
+
+    @app.get("/check_transform")
+    async def check_transform(model_id: str, call_type: str):
+        await transformer.delay()
+        if transformer.should_fail():
+            return error_response("transformer")
+        return call_type in models.get(model_id, {}).get("transformer", [])
+
+    @app.post("/transform")
+    async def transform(request: Request):
+        await transformer.delay()
+        if transformer.should_fail():
+            return error_response("transformer")
+        body = json.loads(await request.body())
+        return {"data": body.get("input"), "payload_type": "content"}
+
+    async def predict(model: dict):
+        behaviour = model_behaviours[model["model_id"]]
+        await behaviour.delay()
+        if behaviour.should_fail():
+            return error_response("model")
+
+        payload = payloads[model["model_id"]]
+        if model.get("chunked", False):
+            async def stream_payload():
+                for offset in range(0, len(payload), CHUNK_SIZE):
+                    yield payload[offset:offset + CHUNK_SIZE]
+            return StreamingResponse(stream_payload(), media_type="application/json")
+        return Response(content=payload, media_type="application/json")
+
+    @app.post("/v1/models/{service_name}:predict")
+    async def kserve_v1_predict(service_name: str, request: Request):
+        await request.body()
+        model = models_by_service_name.get(service_name)
+        if model is None:
+            return JSONResponse(status_code=404, content={"detail": f"Model {service_name} not found"})
+        return await predict(model)
+
+    @app.post("/v2/models/{service_name}/infer")
+    async def kserve_v2_infer(service_name: str, request: Request):
+        await request.body()
+        model = models_by_service_name.get(service_name)
+        if model is None:
+            return JSONResponse(status_code=404, content={"detail": f"Model {service_name} not found"})
+        return await predict(model)
+
+    @app.post("/openai/v1/completions")
+    async def completions(request: Request):
+        body = json.loads(await request.body())
+        model = models_by_service_name.get(body.get("model"))
+        if model is None:
+            return JSONResponse(status_code=404, content={"detail": f"Model {body.get('model')} not found"})
+        return await predict(model)
+
+    return app
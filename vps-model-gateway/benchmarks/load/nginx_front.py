@@ -0,0 +1,70 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+"""
+Runs vps-nginx/nginx.conf in front of the gateway processes of a load test.
+
+The production config is rendered with the local ports: the listen port, the upstream servers of
+vps_model_gateway_service, the stub_status port, the njs module and script, and log, pid, cache and
+temp paths in the work directory. Everything else, keepalive, buffering, balancing and the
+auth_request included, is used exactly as shipped.
+"""
+
+import subprocess
+import shutil
+import re
+import os
+
+NGINX_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), "vps-nginx")
+NGINX_CONF = os.path.join(NGINX_DIR, "nginx.conf")
+NGINX_MODULE_DIRS = ["/etc/nginx/modules", "/usr/lib/nginx/modules", "/usr/lib64/nginx/modules", "/usr/share/nginx/modules"]
+
+def find_nginx_module(name: str):
+    for directory in NGINX_MODULE_DIRS:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            return path
+    raise RuntimeError(f"--nginx needs the {name} module, looked in {', '.join(NGINX_MODULE_DIRS)}")
+
+def render_nginx_config(listen_port: int, backend_ports: list, status_port: int, work_dir: str, source_path: str = NGINX_CONF):
+    with open(source_path, "r") as file:
+        conf = file.read()
+
+    server_options = re.search(r"^\s*server 127\.0\.0\.1:\d+(.*);", conf, re.MULTILINE).group(1)
+    servers = "".join(f"        server 127.0.0.1:{port}{server_options};\n" for port in backend_ports)
+    conf = re.sub(r"(\s*server 127\.0\.0\.1:\d+.*;\n)+", "\n" + servers, conf, count=1)
+    conf = re.sub(r"listen 80\b", f"listen 127.0.0.1:{listen_port}", conf)
+    conf = re.sub(r"listen 127\.0\.0\.1:8080;", f"listen 127.0.0.1:{status_port};", conf)
+    conf = conf.replace("/var/log/nginx/", f"{work_dir}/nginx-")
+    conf = conf.replace("/var/cache/nginx/", f"{work_dir}/nginx-cache-")
+    conf = conf.replace("/etc/nginx/edge_auth.js", os.path.join(NGINX_DIR, "edge_auth.js"))
+    conf = re.sub(r"load_module modules/(\S+);", lambda match: f"load_module {find_nginx_module(match.group(1))};", conf)
+
+    temp_paths = "".join(f"    {directive} {work_dir}/nginx-{name};\n" for directive, name in (
+        ("client_body_temp_path", "client-body"), ("proxy_temp_path", "proxy"), ("fastcgi_temp_path", "fastcgi"),
+        ("uwsgi_temp_path", "uwsgi"), ("scgi_temp_path", "scgi")))
+    conf = conf.replace("http {\n", "http {\n" + temp_paths, 1)
+    conf = f"pid {work_dir}/nginx.pid;\n" + conf
+
+    path = os.path.join(work_dir, "nginx.conf")
+    with open(path, "w") as file:
+        file.write(conf)
+    return path
+
+def nginx_command(config_path: str, work_dir: str):
+    nginx = shutil.which("nginx")
+    if nginx is None:
+        raise RuntimeError("--nginx needs the nginx binary on the PATH")
+    subprocess.run([nginx, "-t", "-p", work_dir, "-c", config_path], check=True, capture_output=True)
+    return [nginx, "-p", work_dir, "-c", config_path, "-g", "daemon off;"]
@@ -0,0 +1,396 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+"""
+Hermetic load test for /predict.
+
+Starts the upstream, S3 and Redis stand-ins and a gateway process wired to them, drives /predict
+at a fixed request rate (open loop, so a slow gateway builds a backlog instead of slowing the
+load down) and writes throughput, latency percentiles and gateway CPU/RSS to a JSON result file.
+
+Run from the vps-model-gateway directory:
+
+    python -m benchmarks.load.run_load_test --scenario benchmarks/load/scenarios/default.json
+"""
+
+from benchmarks.load.nginx_front import render_nginx_config, nginx_command
+from contextlib import ExitStack
+from datetime import datetime, timezone
+import subprocess
+import argparse
+import tempfile
+import platform
+import asyncio
+import random
+import socket
+import httpx
+import time
+import json
+import sys
+import os
+
+GATEWAY_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_RESULTS_DIR = os.path.join(GATEWAY_ROOT, "benchmarks", "load", "results")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def percentile(sorted_values: list, fraction: float):
+    # Nearest-rank percentile over an already sorted list
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def summarize_latencies(latencies_ms: list):
+    values = sorted(latencies_ms)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 3),
+        "p50": round(percentile(values, 0.50), 3),
+        "p95": round(percentile(values, 0.95), 3),
+        "p99": round(percentile(values, 0.99), 3),
+        "max": round(values[-1], 3)
+    }
+
+def build_input(model: dict):
+    if "input" in model:
+        return model["input"]
+    size = model.get("input_size_bytes", 256)
+    return [round(random.random(), 6) for _ in range(max(1, size // 10))]
+
+class ProcessSampler:
+    """Samples the summed CPU time and RSS of the gateway processes from /proc, Linux only."""
+
+    def __init__(self, pids: list):
+        self.pids = pids
+        self.samples = []
+
+    def read(self):
+        cpu_seconds = rss_bytes = 0
+        try:
+            for pid in self.pids:
+                with open(f"/proc/{pid}/stat", "r") as file:
+                    fields = file.read().rsplit(")", 1)[1].split()
+                cpu_seconds += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+                rss_bytes += int(fields[21]) * PAGE_SIZE
+            return time.monotonic(), cpu_seconds, rss_bytes
+        except (OSError, IndexError, ValueError):
+            return None
+
+    async def run(self, interval: float = 0.5):
+        while True:
+            sample = self.read()
+            if sample:
+                self.samples.append(sample)
+            await asyncio.sleep(interval)
+
+    def summary(self):
+        if len(self.samples) < 2:
+            return {"available": False}
+        (start_time, start_cpu, _), (end_time, end_cpu, _) = self.samples[0], self.samples[-1]
+        rss_values = [rss for _, _, rss in self.samples]
+        return {
+            "available": True,
+            "processes": len(self.pids),
+            "cpu_percent_mean": round(100 * (end_cpu - start_cpu) / (end_time - start_time), 2),
+            "cpu_seconds": round(end_cpu - start_cpu, 3),
+            "rss_mb_mean": round(sum(rss_values) / len(rss_values) / (1024 * 1024), 2),
+            "rss_mb_max": round(max(rss_values) / (1024 * 1024), 2)
+        }
+
+def start_process(stack: ExitStack, command: list, env: dict, log_path: str):
+    log_file = stack.enter_context(open(log_path, "w"))
+    process = subprocess.Popen(command, cwd=GATEWAY_ROOT, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+
+    def stop():
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    stack.callback(stop)
+    return process
+
+def wait_until_ready(url: str, process: subprocess.Popen = None, timeout: float = 30.0, expected_status: int = None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Process serving {url} exited with code {process.returncode}")
+        try:
+            status_code = httpx.get(url, timeout=1.0).status_code
+            if status_code == expected_status if expected_status is not None else status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process listening on {port} exited with code {process.returncode}")
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for port {port}")
+
+def build_gateway_env(args, scenario: dict, gateway_port: int, upstream_url: str, s3_url: str, redis_port: int, blueprint_dir: str):
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": GATEWAY_ROOT,
+        "SERVER_HOST": "127.0.0.1",
+        "SERVER_PORT": str(gateway_port),
+        "USER_ADMIN_SERVICE_URL": upstream_url,
+        "DEPLOY_ADMIN_SERVICE_URL": upstream_url,
+        "MODEL_KOURIER_SERVICE_URL": upstream_url,
+        "TRANSFORMER_KOURIER_SERVICE_URL": upstream_url,
+        "PROJECT_ADMIN_SERVICE_URL": upstream_url,
+        "PAYMENT_SERVICE_URL": upstream_url,
+        "LOG_LEVEL": args.gateway_log_level,
+        "REDIS_STARTUP_NODES": json.dumps([{"host": "127.0.0.1", "port": redis_port}]),
+        "MAX_POST_FILE_SIZE": "500",
+        "MAX_PAYLOAD_SIZE": str(scenario.get("max_payload_size_mb", 5)),
+        "MAX_RATE_LIMIT": str(scenario.get("max_rate_limit", 1_000_000_000)),
+        "RUNTIME_BUCKET_NAME": "benchmark-runtime-bucket",
+        "AWS_REGION": "us-east-1",
+        "AWS_ACCESS_KEY_ID": "benchmark",
+        "AWS_SECRET_ACCESS_KEY": "benchmark",
+        # botocore reads the service specific endpoint override from the environment
+        "AWS_ENDPOINT_URL_S3": s3_url,
+        "FOLDER_STRUCTURE_BLUEPRINT_DIR": blueprint_dir
+    })
+    env.update({key: str(value) for key, value in scenario.get("gateway_env", {}).items()})
+    return env
+
+async def send_prediction(client: httpx.AsyncClient, target_url: str, model: dict, token: str, input_body: bytes, results: list, measured: bool):
+    headers = {
+        "vps-auth-token": token,
+        "transaction-id": f"bench-{random.getrandbits(64):016x}",
+        "vps-env-type": "vipas-external",
+        "Content-Type": "application/json"
+    }
+    start = time.perf_counter()
+    status_code = None
+    payload_type = None
+    response_bytes = 0
+    try:
+        response = await client.post(f"{target_url}/predict", params={"model_id": model["model_id"]}, headers=headers, content=input_body)
+        status_code = response.status_code
+        response_bytes = len(response.content)
+        if status_code == 200:
+            payload_type = response.json().get("payload_type")
+    except httpx.HTTPError as e:
+        status_code = type(e).__name__
+    latency_ms = (time.perf_counter() - start) * 1000
+    if measured:
+        results.append({"model_id": model["model_id"], "status": status_code, "latency_ms": latency_ms, "payload_type": payload_type, "response_bytes": response_bytes})
+
+async def drive_load(target_url: str, scenario: dict, sampler: ProcessSampler = None):
+    rps = scenario.get("rps", 10)
+    duration = scenario.get("duration_seconds", 30)
+    warmup = scenario.get("warmup_seconds", 5)
+    models = scenario["models"]
+    weights = [model.get("weight", 1) for model in models]
+    tokens = [f"vps-benchmark-token-{index:012d}" for index in range(scenario.get("token_pool_size", 100))]
+    input_bodies = {model["model_id"]: json.dumps(build_input(model)).encode() for model in models}
+
+    limits = httpx.Limits(max_connections=scenario.get("max_connections", 1000), max_keepalive_connections=scenario.get("max_connections", 1000))
+    results = []
+    tasks = set()
+    sampler_task = None
+
+    async with httpx.AsyncClient(timeout=httpx.Timeout(scenario.get("request_timeout_seconds", 300.0)), limits=limits) as client:
+        total = int(rps * (warmup + duration))
+        start = time.perf_counter()
+        measured_start = None
+        for index in range(total):
+            scheduled_at = start + index / rps
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            measured = index >= rps * warmup
+            if measured and measured_start is None:
+                measured_start = time.perf_counter()
+                if sampler is not None:
+                    sampler_task = asyncio.create_task(sampler.run())
+
+            model = random.choices(models, weights)[0]
+            task = asyncio.create_task(send_prediction(client, target_url, model, random.choice(tokens), input_bodies[model["model_id"]], results, measured))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.wait(tasks)
+        measured_end = time.perf_counter()
+
+    if sampler_task is not None:
+        sampler_task.cancel()
+
+    return results, measured_end - (measured_start or start)
+
+def build_report(scenario_path: str, scenario: dict, results: list, elapsed: float, gateway_summary: dict, args):
+    status_codes = {}
+    for result in results:
+        status_codes[str(result["status"])] = status_codes.get(str(result["status"]), 0) + 1
+    succeeded = [result for result in results if result["status"] == 200]
+
+    per_model = {}
+    for model in scenario["models"]:
+        model_results = [result for result in results if result["model_id"] == model["model_id"]]
+        per_model[model["model_id"]] = {
+            "deployment_system": model["deployment_system"],
+            "requests": len(model_results),
+            "errors": sum(1 for result in model_results if result["status"] != 200),
+            "payload_types": sorted({result["payload_type"] for result in model_results if result["payload_type"]}),
+            "latency_ms": summarize_latencies([result["latency_ms"] for result in model_results if result["status"] == 200])
+        }
+
+    return {
+        "scenario": scenario.get("name", os.path.splitext(os.path.basename(scenario_path))[0]),
+        "scenario_file": scenario_path,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "label": args.label,
+        "git_revision": git_revision(),
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count()},
+        "load": {"target_rps": scenario.get("rps", 10), "duration_seconds": scenario.get("duration_seconds", 30), "warmup_seconds": scenario.get("warmup_seconds", 5),
+                 "gateway_workers": args.gateway_workers, "nginx": args.nginx},
+        "summary": {
+            "requests": len(results),
+            "succeeded": len(succeeded),
+            "error_rate": round(1 - len(succeeded) / len(results), 4) if results else None,
+            "throughput_rps": round(len(succeeded) / elapsed, 2) if elapsed > 0 else None,
+            "response_mb": round(sum(result["response_bytes"] for result in results) / (1024 * 1024), 3),
+            "latency_ms": summarize_latencies([result["latency_ms"] for result in succeeded])
+        },
+        "status_codes": status_codes,
+        "per_model": per_model,
+        "gateway": gateway_summary
+    }
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=GATEWAY_ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def write_report(report: dict, results_dir: str):
+    os.makedirs(results_dir, exist_ok=True)
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    label = f"-{report['label']}" if report.get("label") else ""
+    path = os.path.join(results_dir, f"{report['scenario']}{label}-{timestamp}.json")
+    with open(path, "w") as file:
+        json.dump(report, file, indent=2)
+    return path
+
+def run(args):
+    scenario_path = os.path.abspath(args.scenario)
+    with open(scenario_path, "r") as file:
+        scenario = json.load(file)
+    if args.rps is not None:
+        scenario["rps"] = args.rps
+    if args.duration is not None:
+        scenario["duration_seconds"] = args.duration
+
+    args.gateway_port = args.gateway_port or free_port()
+    upstream_port, s3_port, redis_port = free_port(), free_port(), free_port()
+    upstream_url = f"http://127.0.0.1:{upstream_port}"
+    s3_url = f"http://127.0.0.1:{s3_port}"
+
+    with ExitStack() as stack:
+        if args.keep_logs:
+            work_dir = tempfile.mkdtemp(prefix="vps-load-")
+        else:
+            work_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix="vps-load-"))
+        with open(os.path.join(work_dir, "folder_structure_blueprint.yaml"), "w") as file:
+            file.write("folder_structure_blueprint:\n  runtime_folder: \"runtime/{transaction_id}\"\n")
+
+        harness_env = dict(os.environ, PYTHONPATH=GATEWAY_ROOT, FAKE_UPSTREAM_SCENARIO=scenario_path, FAKE_S3_DISCARD_BODIES="true")
+
+        upstreams = start_process(stack, [sys.executable, "-m", "uvicorn", "benchmarks.load.fake_upstreams:create_app", "--factory",
+                                          "--host", "127.0.0.1", "--port", str(upstream_port), "--workers", str(args.upstream_workers),
+                                          "--log-level", "warning", "--no-access-log"], harness_env, os.path.join(work_dir, "upstreams.log"))
+        s3 = start_process(stack, [sys.executable, "-m", "uvicorn", "benchmarks.load.fake_s3:app", "--host", "127.0.0.1", "--port", str(s3_port),
+                                   "--log-level", "warning", "--no-access-log"], harness_env, os.path.join(work_dir, "s3.log"))
+        redis = start_process(stack, [sys.executable, "-m", "benchmarks.load.fake_redis", "--host", "127.0.0.1", "--port", str(redis_port)],
+                              harness_env, os.path.join(work_dir, "redis.log"))
+
+        wait_until_ready(f"{upstream_url}/health", upstreams)
+        wait_until_ready(f"{s3_url}/health", s3)
+        wait_for_port(redis_port, redis)
+
+        # One process per port, as src/main.py runs SERVER_WORKERS behind nginx
+        gateway_ports = [args.gateway_port] + [free_port() for _ in range(args.gateway_workers - 1)]
+        gateways = []
+        for index, gateway_port in enumerate(gateway_ports):
+            gateway_env = build_gateway_env(args, scenario, gateway_port, upstream_url, s3_url, redis_port, work_dir)
+            if args.nginx:
+                gateway_env["EDGE_AUTH_ENABLED"] = "true"
+            gateways.append(start_process(stack, [sys.executable, "-m", "uvicorn", "src.main:app", "--host", "127.0.0.1", "--port", str(gateway_port),
+                                                  "--timeout-keep-alive", gateway_env.get("SERVER_KEEPALIVE_TIMEOUT_SECONDS", "75"),
+                                                  "--log-level", "warning", "--no-access-log"], gateway_env, os.path.join(work_dir, f"gateway-{index}.log")))
+        for gateway, gateway_port in zip(gateways, gateway_ports):
+            # /readyz answers 200 once the warm-up finished and Redis and S3 are reachable
+            wait_until_ready(f"http://127.0.0.1:{gateway_port}/readyz", gateway, timeout=60.0, expected_status=200)
+
+        target_url = args.target_url or f"http://127.0.0.1:{args.gateway_port}"
+        if args.nginx:
+            nginx_port, status_port = free_port(), free_port()
+            config_path = render_nginx_config(nginx_port, gateway_ports, status_port, work_dir)
+            nginx = start_process(stack, nginx_command(config_path, work_dir), harness_env, os.path.join(work_dir, "nginx.log"))
+            wait_until_ready(f"http://127.0.0.1:{status_port}/stub_status", nginx)
+            target_url = f"http://127.0.0.1:{nginx_port}"
+
+        sampler = ProcessSampler([gateway.pid for gateway in gateways])
+        print(f"Driving {target_url}/predict at {scenario.get('rps', 10)} rps for {scenario.get('duration_seconds', 30)}s")
+        results, elapsed = asyncio.run(drive_load(target_url, scenario, sampler))
+
+        report = build_report(scenario_path, scenario, results, elapsed, sampler.summary(), args)
+        if args.keep_logs:
+            report["logs_dir"] = work_dir
+
+    path = write_report(report, args.results_dir)
+    print(json.dumps(report["summary"], indent=2))
+    print(f"Gateway: {json.dumps(report['gateway'])}")
+    print(f"Results written to {path}")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Hermetic load test for the model gateway /predict endpoint")
+    parser.add_argument("--scenario", default=os.path.join(GATEWAY_ROOT, "benchmarks", "load", "scenarios", "default.json"))
+    parser.add_argument("--rps", type=float, help="Override the request rate of the scenario")
+    parser.add_argument("--duration", type=float, help="Override the measured duration of the scenario in seconds")
+    parser.add_argument("--gateway-port", type=int, help="Port of the gateway under test, a free port by default")
+    parser.add_argument("--gateway-log-level", default="WARNING")
+    parser.add_argument("--target-url", help="Send the load here instead of straight to the gateway, e.g. an nginx in front of --gateway-port")
+    parser.add_argument("--gateway-workers", type=int, default=1, help="Gateway processes, each on its own port")
+    parser.add_argument("--nginx", action="store_true", help="Drive the load through vps-nginx/nginx.conf in front of the gateway processes, needs nginx on the PATH")
+    parser.add_argument("--upstream-workers", type=int, default=2, help="Worker processes for the fake upstreams")
+    parser.add_argument("--results-dir", default=DEFAULT_RESULTS_DIR)
+    parser.add_argument("--label", help="Free text label stored with the results, e.g. the change under test")
+    parser.add_argument("--keep-logs", action="store_true", help="Keep the process logs of the run")
+    run(parser.parse_args())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+"""
+Compression cost and bandwidth saving of the content encodings the gateway negotiates, on
+representative tensor JSON (KserveV2 outputs) and generated text (TextGeneration completions).
+
+Run from vps-model-gateway/ with
+    python -m pytest benchmarks/micro/bench_content_encoding.py --benchmark-only
+"""
+
+from benchmarks.micro.payloads import PAYLOAD_SIZES, model_response
+from src.models.env.performance_config_DTO import PerformanceConfigDTO
+from src.utils.content_encoding_util import compress_body, decompress_body, get_supported_encodings
+import json
+import pytest
+
+PAYLOAD_DEPLOYMENT_SYSTEMS = {"tensor": "KserveV2", "text": "TextGeneration"}
+
+# Link speeds in bits per second the transfer time saving is reported for
+LINK_SPEEDS = {"100Mbps": 100_000_000, "1Gbps": 1_000_000_000}
+
+def serialized_payload(payload_kind: str, size: int):
+    return json.dumps(model_response(PAYLOAD_DEPLOYMENT_SYSTEMS[payload_kind], size)).encode("utf-8")
+
+def record_compression(benchmark, encoding: str, body: bytes, encoded: bytes):
+    benchmark.group = f"{benchmark.name.split('[')[0]}-{encoding}"
+    benchmark.extra_info["encoding"] = encoding
+    benchmark.extra_info["payload_bytes"] = len(body)
+    benchmark.extra_info["encoded_bytes"] = len(encoded)
+    benchmark.extra_info["compression_ratio"] = round(len(body) / len(encoded), 2)
+    for label, bits_per_second in LINK_SPEEDS.items():
+        benchmark.extra_info[f"transfer_ms_saved_at_{label}"] = round((len(body) - len(encoded)) * 8 / bits_per_second * 1000, 3)
+
+@pytest.mark.parametrize("size_label", PAYLOAD_SIZES)
+@pytest.mark.parametrize("payload_kind", PAYLOAD_DEPLOYMENT_SYSTEMS)
+@pytest.mark.parametrize("encoding", get_supported_encodings())
+def test_compress_payload(benchmark, measure_allocations, encoding, payload_kind, size_label):
+    config = PerformanceConfigDTO()
+    body = serialized_payload(payload_kind, PAYLOAD_SIZES[size_label])
+
+    encoded = measure_allocations(compress_body, body, encoding, config)
+    record_compression(benchmark, encoding, body, encoded)
+    benchmark(compress_body, body, encoding, config)
+
+@pytest.mark.parametrize("size_label", PAYLOAD_SIZES)
+@pytest.mark.parametrize("payload_kind", PAYLOAD_DEPLOYMENT_SYSTEMS)
+@pytest.mark.parametrize("encoding", get_supported_encodings())
+def test_decompress_payload(benchmark, measure_allocations, encoding, payload_kind, size_label):
+    body = serialized_payload(payload_kind, PAYLOAD_SIZES[size_label])
+    encoded = compress_body(body, encoding)
+
+    record_compression(benchmark, encoding, body, encoded)
+    assert measure_allocations(decompress_body, encoded, encoding) == body
+    benchmark(decompress_body, encoded, encoding)
+
+@pytest.mark.parametrize("level", [1, 5, 9])
+def test_gzip_level_on_1MB_tensor(benchmark, level):
+    body = serialized_payload("tensor", PAYLOAD_SIZES["1MB"])
+    config = PerformanceConfigDTO(COMPRESSION_GZIP_LEVEL=level)
+
+    record_compression(benchmark, f"gzip-{level}", body, compress_body(body, "gzip", config))
+    benchmark(compress_body, body, "gzip", config)
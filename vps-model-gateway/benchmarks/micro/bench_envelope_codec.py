@@ -0,0 +1,95 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+"""
+Time and allocation benchmarks for the per deployment system request envelopes, response
+extraction and the extractors returned with spilled (url) payloads.
+
+Run from vps-model-gateway/ with
+    python -m pytest benchmarks/micro/bench_envelope_codec.py --benchmark-only
+"""
+
+from benchmarks.micro.payloads import PAYLOAD_SIZES, TENSOR_SIZES, PROMPT_SIZES, MODEL_DETAILS, model_input, model_response, float_list, prompt_of_size, serialized_size
+from src.utils.model_payload_envelope_util import build_model_request_envelope, extract_model_response_data
+from src.mappings.output_data_extraction_mapping import DEPLOYMENT_SYSTEM_TO_EXTRACTOR_MAPPING
+import json
+import pytest
+
+DEPLOYMENT_SYSTEMS = list(DEPLOYMENT_SYSTEM_TO_EXTRACTOR_MAPPING)
+MODEL_SERVICE_NAME = "mdl-benchmark"
+TRANSACTION_ID = "benchmark"
+
+def encode_model_request(deployment_system: str, input_data):
+    # The envelope plus the serialization httpx performs for `json=`
+    envelope = build_model_request_envelope(deployment_system, input_data, MODEL_SERVICE_NAME, MODEL_DETAILS, 100, TRANSACTION_ID)
+    return json.dumps(envelope).encode("utf-8")
+
+def decode_model_response(deployment_system: str, body: bytes):
+    return extract_model_response_data(deployment_system, json.loads(body), TRANSACTION_ID)
+
+def run_extractor(deployment_system: str, output_data):
+    scope = {"output_data": output_data}
+    exec(DEPLOYMENT_SYSTEM_TO_EXTRACTOR_MAPPING[deployment_system], scope)
+    return scope["extracted_output_data"]
+
+def record_payload(benchmark, deployment_system: str, size: int):
+    benchmark.group = f"{benchmark.name.split('[')[0]}-{deployment_system}"
+    benchmark.extra_info["deployment_system"] = deployment_system
+    benchmark.extra_info["payload_bytes"] = size
+
+@pytest.mark.parametrize("size_label", PAYLOAD_SIZES)
+@pytest.mark.parametrize("deployment_system", DEPLOYMENT_SYSTEMS)
+def test_encode_model_request(benchmark, measure_allocations, deployment_system, size_label):
+    input_data = model_input(deployment_system, PAYLOAD_SIZES[size_label])
+    record_payload(benchmark, deployment_system, serialized_size(input_data))
+
+    body = measure_allocations(encode_model_request, deployment_system, input_data)
+    assert benchmark(encode_model_request, deployment_system, input_data) == body
+
+@pytest.mark.parametrize("size_label", PAYLOAD_SIZES)
+@pytest.mark.parametrize("deployment_system", DEPLOYMENT_SYSTEMS)
+def test_decode_model_response(benchmark, measure_allocations, deployment_system, size_label):
+    body = json.dumps(model_response(deployment_system, PAYLOAD_SIZES[size_label])).encode("utf-8")
+    record_payload(benchmark, deployment_system, len(body))
+
+    data = measure_allocations(decode_model_response, deployment_system, body)
+    assert benchmark(decode_model_response, deployment_system, body) == data
+
+@pytest.mark.parametrize("size_label", PAYLOAD_SIZES)
+@pytest.mark.parametrize("deployment_system", DEPLOYMENT_SYSTEMS)
+def test_run_output_data_extractor(benchmark, measure_allocations, deployment_system, size_label):
+    output_data = model_response(deployment_system, PAYLOAD_SIZES[size_label])
+    record_payload(benchmark, deployment_system, serialized_size(output_data))
+
+    measure_allocations(run_extractor, deployment_system, output_data)
+    benchmark(run_extractor, deployment_system, output_data)
+
+@pytest.mark.parametrize("tensor_label", TENSOR_SIZES)
+def test_encode_kserve_v2_tensor(benchmark, measure_allocations, tensor_label):
+    tensor = float_list(TENSOR_SIZES[tensor_label])
+    record_payload(benchmark, "KserveV2", serialized_size(tensor))
+    benchmark.extra_info["elements"] = len(tensor)
+
+    measure_allocations(encode_model_request, "KserveV2", tensor)
+    benchmark(encode_model_request, "KserveV2", tensor)
+
+@pytest.mark.parametrize("prompt_label", PROMPT_SIZES)
+@pytest.mark.parametrize("deployment_system", ["TextGeneration", "Text2TextGeneration"])
+def test_encode_long_prompt(benchmark, measure_allocations, deployment_system, prompt_label):
+    prompt = prompt_of_size(PROMPT_SIZES[prompt_label])
+    record_payload(benchmark, deployment_system, len(prompt))
+
+    measure_allocations(encode_model_request, deployment_system, prompt)
+    benchmark(encode_model_request, deployment_system, prompt)
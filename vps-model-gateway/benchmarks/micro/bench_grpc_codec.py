@@ -0,0 +1,89 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+"""
+Encoding and decoding cost of a KserveV2 call over the gRPC transport (ModelInferRequest with raw
+tensor contents) next to the JSON body of the HTTP endpoint, for the same tensors. The wire size of
+both is reported in the extra_info.
+
+Run from vps-model-gateway/ with
+    python -m pytest benchmarks/micro/bench_grpc_codec.py --benchmark-only
+"""
+
+from benchmarks.micro.payloads import TENSOR_SIZES, float_list
+from src.utils.model_payload_envelope_util import extract_model_response_data
+import json
+import pytest
+
+pytest.importorskip("grpc")
+
+from src.utils.grpc_inference_util import get_inference_messages, build_model_infer_request, parse_model_infer_response
+
+MODEL_SERVICE_NAME = "mdl-benchmark"
+TRANSACTION_ID = "benchmark"
+
+def request_envelope(count: int):
+    return {"inputs": [{"name": "input-0", "datatype": "FP32", "shape": [1, count], "data": float_list(count)}]}
+
+def model_infer_response(count: int):
+    request, _ = build_model_infer_request(MODEL_SERVICE_NAME, request_envelope(count), TRANSACTION_ID)
+    response = get_inference_messages().ModelInferResponse(model_name=MODEL_SERVICE_NAME)
+    response.outputs.add(name="output-0", datatype="FP32", shape=[1, count])
+    response.raw_output_contents.append(request.raw_input_contents[0])
+    return response.SerializeToString()
+
+def json_response(count: int):
+    return json.dumps({"model_name": MODEL_SERVICE_NAME, "outputs": [{"name": "output-0", "datatype": "FP32", "shape": [1, count], "data": float_list(count)}]}).encode("utf-8")
+
+def encode_json_request(envelope: dict):
+    return json.dumps(envelope).encode("utf-8")
+
+def encode_grpc_request(envelope: dict):
+    request, _ = build_model_infer_request(MODEL_SERVICE_NAME, envelope, TRANSACTION_ID)
+    return request.SerializeToString()
+
+def decode_json_response(body: bytes):
+    return extract_model_response_data("KserveV2", json.loads(body), TRANSACTION_ID)
+
+def decode_grpc_response(body: bytes):
+    response = get_inference_messages().ModelInferResponse.FromString(body)
+    return extract_model_response_data("KserveV2", parse_model_infer_response(response), TRANSACTION_ID)
+
+def record_transport(benchmark, transport: str, count: int, wire_bytes: int):
+    benchmark.group = f"{benchmark.name.split('[')[0]}-{count}"
+    benchmark.extra_info["transport"] = transport
+    benchmark.extra_info["elements"] = count
+    benchmark.extra_info["wire_bytes"] = wire_bytes
+
+@pytest.mark.parametrize("transport", ["json", "grpc"])
+@pytest.mark.parametrize("tensor_label", TENSOR_SIZES)
+def test_encode_model_request(benchmark, measure_allocations, tensor_label, transport):
+    envelope = request_envelope(TENSOR_SIZES[tensor_label])
+    encode = encode_grpc_request if transport == "grpc" else encode_json_request
+
+    body = measure_allocations(encode, envelope)
+    record_transport(benchmark, transport, TENSOR_SIZES[tensor_label], len(body))
+    benchmark(encode, envelope)
+
+@pytest.mark.parametrize("transport", ["json", "grpc"])
+@pytest.mark.parametrize("tensor_label", TENSOR_SIZES)
+def test_decode_model_response(benchmark, measure_allocations, tensor_label, transport):
+    count = TENSOR_SIZES[tensor_label]
+    body = model_infer_response(count) if transport == "grpc" else json_response(count)
+    decode = decode_grpc_response if transport == "grpc" else decode_json_response
+
+    assert len(measure_allocations(decode, body)) == count
+    record_transport(benchmark, transport, count, len(body))
+    benchmark(decode, body)
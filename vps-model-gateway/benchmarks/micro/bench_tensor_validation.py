@@ -0,0 +1,97 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+"""
+Cost of validating KserveV2 inputs against the input of the model details, next to the envelope
+and serialization cost of the same tensors, for flat and nested data of every benchmarked size.
+
+Run from vps-model-gateway/ with
+    python -m pytest benchmarks/micro/bench_tensor_validation.py --benchmark-only
+"""
+
+from benchmarks.micro.payloads import TENSOR_SIZES, float_list
+from src.models.env.performance_config_DTO import PerformanceConfigDTO
+from src.utils.model_payload_envelope_util import build_model_request_envelope
+from src.utils.tensor_validation_util import validate_tensor_input
+import json
+import math
+import pytest
+
+TRANSACTION_ID = "bench-transaction"
+
+def tensor_of_layout(count: int, layout: str):
+    # Flat data, or rows of the square root of the element count, e.g. 1000 x 1000 for 1M
+    values = float_list(count)
+    if layout == "flat":
+        return values, [1, -1]
+    width = math.isqrt(count)
+    return [values[row * width:(row + 1) * width] for row in range(count // width)], [-1, width]
+
+@pytest.fixture(autouse=True)
+def performance_config(mocker):
+    # Validation is opt-in, the benchmarks measure it turned on
+    config = PerformanceConfigDTO(TENSOR_VALIDATION_ENABLED=True)
+    mocker.patch("src.utils.tensor_validation_util.get_performance_config", return_value=config)
+    return config
+
+def record_tensor(benchmark, datatype: str, count: int, layout: str):
+    benchmark.group = f"{benchmark.name.split('[')[0]}-{datatype}-{layout}"
+    benchmark.extra_info["datatype"] = datatype
+    benchmark.extra_info["elements"] = count
+    benchmark.extra_info["layout"] = layout
+
+@pytest.mark.parametrize("layout", ["flat", "nested"])
+@pytest.mark.parametrize("tensor_label", TENSOR_SIZES)
+def test_validate_fp32_tensor(benchmark, measure_allocations, tensor_label, layout):
+    tensor, dims = tensor_of_layout(TENSOR_SIZES[tensor_label], layout)
+    model_input = {"name": "input-0", "data_type": "FP32", "dims": dims}
+    record_tensor(benchmark, "FP32", TENSOR_SIZES[tensor_label], layout)
+
+    measure_allocations(validate_tensor_input, tensor, model_input, TRANSACTION_ID)
+    benchmark(validate_tensor_input, tensor, model_input, TRANSACTION_ID)
+
+@pytest.mark.parametrize("tensor_label", TENSOR_SIZES)
+def test_validate_int8_tensor(benchmark, measure_allocations, tensor_label):
+    # Integer datatypes add the range check to the datatype check
+    count = TENSOR_SIZES[tensor_label]
+    tensor = [value % 128 for value in range(count)]
+    model_input = {"name": "input-0", "data_type": "INT8", "dims": [1, -1]}
+    record_tensor(benchmark, "INT8", count, "flat")
+
+    measure_allocations(validate_tensor_input, tensor, model_input, TRANSACTION_ID)
+    benchmark(validate_tensor_input, tensor, model_input, TRANSACTION_ID)
+
+@pytest.mark.parametrize("tensor_label", TENSOR_SIZES)
+def test_validate_and_flatten_nested_tensor(benchmark, measure_allocations, performance_config, tensor_label):
+    performance_config.TENSOR_VALIDATION_FLATTEN_INPUTS = True
+    tensor, dims = tensor_of_layout(TENSOR_SIZES[tensor_label], "nested")
+    model_input = {"name": "input-0", "data_type": "FP32", "dims": dims}
+    record_tensor(benchmark, "FP32", TENSOR_SIZES[tensor_label], "nested")
+
+    measure_allocations(validate_tensor_input, tensor, model_input, TRANSACTION_ID)
+    benchmark(validate_tensor_input, tensor, model_input, TRANSACTION_ID)
+
+@pytest.mark.parametrize("validation", ["validated", "not-validated"])
+@pytest.mark.parametrize("tensor_label", TENSOR_SIZES)
+def test_encode_kserve_v2_request(benchmark, performance_config, tensor_label, validation):
+    # The share of the request encoding spent on validation
+    performance_config.TENSOR_VALIDATION_ENABLED = validation == "validated"
+    tensor, dims = tensor_of_layout(TENSOR_SIZES[tensor_label], "flat")
+    model_details = {"input": {"name": "input-0", "data_type": "FP32", "dims": dims}}
+    record_tensor(benchmark, "FP32", TENSOR_SIZES[tensor_label], validation)
+
+    def encode():
+        return json.dumps(build_model_request_envelope("KserveV2", tensor, "bench-service", model_details, 100, TRANSACTION_ID)).encode("utf-8")
+    benchmark(encode)
@@ -0,0 +1,48 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+import tracemalloc
+import logging
+import pytest
+import os
+
+@pytest.fixture(autouse=True)
+def discard_log_output():
+    # Log records are still formatted, as in production, but not written to the terminal
+    with open(os.devnull, "w") as devnull:
+        handlers = [handler for handler in logging.getLogger("src.utils.model_payload_envelope_util").handlers if isinstance(handler, logging.StreamHandler)]
+        streams = [handler.setStream(devnull) for handler in handlers]
+        yield
+        for handler, stream in zip(handlers, streams):
+            handler.setStream(stream)
+
+@pytest.fixture
+def measure_allocations(benchmark):
+    """
+    Runs the function once more under tracemalloc, outside the timed rounds so tracing does not
+    distort the timings, and records the peak and net allocated bytes in the benchmark report.
+    """
+    def measure(function, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            result = function(*args, **kwargs)
+            after, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info["peak_allocated_bytes"] = peak - before
+        benchmark.extra_info["net_allocated_bytes"] = after - before
+        return result
+    return measure
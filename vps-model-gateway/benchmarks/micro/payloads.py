@@ -0,0 +1,69 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+"""Deterministic payload generators for the micro benchmarks."""
+
+import random
+import json
+
+KB = 1024
+MB = 1024 * KB
+
+# Serialized payload sizes the envelope and extraction paths are measured at
+PAYLOAD_SIZES = {"1KB": KB, "100KB": 100 * KB, "1MB": MB, "10MB": 10 * MB}
+
+# Element counts of the KserveV2 tensor inputs, a float serializes to roughly 10 bytes
+TENSOR_SIZES = {"small-16": 16, "large-1M": 1_000_000}
+
+# Prompt lengths in characters, roughly 4 characters per token
+PROMPT_SIZES = {"4K-tokens": 16 * KB, "128K-tokens": 512 * KB}
+
+MODEL_DETAILS = {"input": {"name": "input-0", "data_type": "FP32", "dims": [1, -1]}}
+
+def float_list(count: int):
+    rng = random.Random(count)
+    return [round(rng.random(), 6) for _ in range(count)]
+
+def floats_of_size(size: int):
+    return float_list(max(1, size // 10))
+
+def prompt_of_size(size: int):
+    words = ("the", "model", "gateway", "returns", "a", "prediction", "for", "every", "request")
+    rng = random.Random(size)
+    text = []
+    length = 0
+    while length < size:
+        word = rng.choice(words)
+        text.append(word)
+        length += len(word) + 1
+    return " ".join(text)[:size]
+
+def model_input(deployment_system: str, size: int):
+    # Input data of roughly `size` serialized bytes as it reaches the envelope builder
+    if deployment_system in ("TextGeneration", "Text2TextGeneration", "TokenClassification", "TextClassification"):
+        return prompt_of_size(size)
+    if deployment_system == "MLFlow":
+        return {"name": "input-0", "datatype": "FP32", "shape": [1, -1], "data": floats_of_size(size)}
+    return floats_of_size(size)
+
+def model_response(deployment_system: str, size: int):
+    # Decoded response body of roughly `size` serialized bytes in the shape the deployment system returns
+    if deployment_system in ("KserveV1", "TokenClassification", "TextClassification"):
+        return {"predictions": [floats_of_size(size)]}
+    if deployment_system in ("KserveV2", "MLFlow"):
+        return {"model_name": "benchmark", "outputs": [{"name": "output-0", "datatype": "FP32", "shape": [1, -1], "data": floats_of_size(size)}]}
+    return {"id": "cmpl-benchmark", "object": "text_completion", "choices": [{"index": 0, "text": prompt_of_size(size), "finish_reason": "length"}]}
+
+def serialized_size(data):
+    return len(json.dumps(data).encode())
@@ -37,7 +37,9 @@ class BucketStructure:
         self.challenge_id = self.intake_artifacts_details.get("challenge_id")
 
         try:
-            blueprint_config_file = os.path.join("/app/config", "folder_structure_blueprint.yaml")
+            # The blueprint is mounted under /app/config, the override lets local stand-ins provide their own
+            blueprint_config_dir = os.environ.get("FOLDER_STRUCTURE_BLUEPRINT_DIR", "/app/config")
+            blueprint_config_file = os.path.join(blueprint_config_dir, "folder_structure_blueprint.yaml")
             with open(blueprint_config_file, "r") as file:
                 config_data = yaml.safe_load(file)
             # Iterate through the blueprint dictionary and replace the placeholders
@@ -0,0 +1,53 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from fastapi import APIRouter, Request, Response, HTTPException
+from src.utils.logger_util import setup_logger
+from src.utils.validate_auth_token_util import validate_auth_token
+from src.utils.http_client_util import shared_http_client
+from src.utils.edge_auth_util import build_edge_auth_headers, EDGE_AUTH_VERIFICATIONS_TOTAL
+
+router = APIRouter()
+logger = setup_logger(__name__)
+
+@router.get("/auth/verify")
+async def verify_auth_token(request: Request):
+    """
+    Subrequest target of the nginx auth_request. Answers 200 with the resolved user in the
+    vps-auth-* headers, or 401 for a missing or invalid token, nginx caches both verdicts.
+    """
+    transaction_id = request.headers.get("transaction-id", "edge-auth")
+    vps_auth_token = request.headers.get("vps-auth-token", None)
+    if not vps_auth_token:
+        EDGE_AUTH_VERIFICATIONS_TOTAL.labels(result="invalid").inc()
+        return Response(status_code=401)
+
+    try:
+        async with shared_http_client(request) as client:
+            user_data = await validate_auth_token(client, vps_auth_token, transaction_id)
+    except HTTPException as e:
+        if e.status_code in (401, 403, 404):
+            EDGE_AUTH_VERIFICATIONS_TOTAL.labels(result="invalid").inc()
+            return Response(status_code=401)
+        # Any other status fails the auth_request with a 500 and is not cached
+        EDGE_AUTH_VERIFICATIONS_TOTAL.labels(result="error").inc()
+        raise
+
+    if not user_data.get("username"):
+        EDGE_AUTH_VERIFICATIONS_TOTAL.labels(result="invalid").inc()
+        return Response(status_code=401)
+
+    EDGE_AUTH_VERIFICATIONS_TOTAL.labels(result="valid").inc()
+    return Response(status_code=200, headers=build_edge_auth_headers(user_data))
@@ -0,0 +1,31 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+from src.utils.warm_up_util import get_readiness_report
+
+router = APIRouter()
+
+@router.get("/healthz")
+async def liveness():
+    # Liveness only tells the process serves requests, it never depends on the upstreams
+    return {"status": "ok"}
+
+@router.get("/readyz")
+async def readiness(request: Request):
+    """Answers 200 once the worker warmed up and its dependencies are reachable, 503 before."""
+    report = await get_readiness_report(request.app)
+    return JSONResponse(status_code=200 if report["ready"] else 503, content=report)
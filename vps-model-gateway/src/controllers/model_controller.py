@@ -13,22 +13,100 @@
 # For more information, contact Vipas.AI at legal@vipas.ai
 
 
-from fastapi import APIRouter, Request, Query, Body
+from fastapi import APIRouter, Request, Query, Body, Depends, HTTPException
+from fastapi.responses import JSONResponse
 from src.utils.logger_util import setup_logger
 from src.models.env.env_config_DTO import EnvConfigDTO
 from src.services.model_service import model_prediction_service
+from src.utils.tracing_util import start_root_span
+from src.utils.usage_event_util import record_prediction_usage
+from src.utils.content_encoding_util import encode_prediction_response
+from src.utils.request_admission_util import admit_prediction_request, authenticate_prediction_request, read_prediction_body, PredictionAdmission
+from src.utils.prediction_job_util import PredictionJob, CALLBACK_URL_HEADER, validate_callback_url, get_prediction_job_runner, get_prediction_job_status
+from src.models.env.performance_config_DTO import get_performance_config
+from src.utils.memory_budget_util import request_memory_reservation
+from src.utils.prediction_input_util import get_prediction_input_reference, create_prediction_input_upload
+from src.utils.binary_tensor_util import BinaryInferencePayload, INFERENCE_HEADER_CONTENT_LENGTH, parse_binary_inference_body, build_binary_prediction_response
 from typing import Any
+import time
 
 router = APIRouter()
 config = EnvConfigDTO()
 logger = setup_logger(__name__)
 
 @router.post("/predict")
-async def model_prediction(request: Request, model_id: str = Query(..., description="Unique identifier of the model")):
+async def model_prediction(request: Request, model_id: str = Query(..., description="Unique identifier of the model"), admission: PredictionAdmission = Depends(admit_prediction_request)):
     logger.info(f"Received prediction request for model_id: {model_id}")
     
-    # Await the request body to get its content
-    input_data_bytes = await request.body()
-    input_data = input_data_bytes.decode('utf-8')
+    # Buffers of the request are reserved from the memory budget of the worker until the response is encoded
+    async with request_memory_reservation(request.headers.get("transaction-id")):
+        # The body is only read once the request passed admission
+        input_data_bytes = await read_prediction_body(request)
+        inference_header_length = request.headers.get(INFERENCE_HEADER_CONTENT_LENGTH)
+        input_reference = get_prediction_input_reference(request, input_data_bytes)
+        if input_reference is not None:
+            input_data = input_reference
+        elif inference_header_length is not None:
+            try:
+                input_data = parse_binary_inference_body(input_data_bytes, inference_header_length)
+            except ValueError as e:
+                logger.error(f"Invalid binary tensor request for model_id: {model_id}: {e}")
+                raise HTTPException(status_code=400, detail=f"Invalid binary tensor request: {e}")
+        else:
+            input_data = input_data_bytes.decode('utf-8')
 
-    return await model_prediction_service(request, model_id, input_data)
+        start_time = time.perf_counter()
+        with start_root_span("POST /predict", request.headers.get("traceparent"), request.headers.get("transaction-id"), {"vps.model_id": model_id}):
+            response = await model_prediction_service(request, model_id, input_data)
+        record_prediction_usage(request, model_id, len(input_data_bytes), response, time.perf_counter() - start_time)
+        if isinstance(response, dict) and isinstance(response.get("output_data"), BinaryInferencePayload):
+            return build_binary_prediction_response(response)
+        return await encode_prediction_response(request, response)
+
+@router.post("/predict/async")
+async def model_prediction_async(request: Request, model_id: str = Query(..., description="Unique identifier of the model"), admission: PredictionAdmission = Depends(admit_prediction_request)):
+    logger.info(f"Received asynchronous prediction request for model_id: {model_id}")
+    if not get_performance_config().ASYNC_JOBS_ENABLED:
+        raise HTTPException(status_code=503, detail="Asynchronous predictions are disabled, use /predict")
+
+    callback_url = request.headers.get(CALLBACK_URL_HEADER)
+    if callback_url:
+        validate_callback_url(callback_url)
+
+    async with request_memory_reservation(request.headers.get("transaction-id")) as reservation:
+        # The body is only read once the request passed admission
+        if request.headers.get(INFERENCE_HEADER_CONTENT_LENGTH) is not None:
+            raise HTTPException(status_code=415, detail="Binary tensor requests are not supported for asynchronous predictions, use /predict")
+        input_data_bytes = await read_prediction_body(request)
+        input_data = get_prediction_input_reference(request, input_data_bytes) or input_data_bytes.decode('utf-8')
+
+        async def run_prediction(job: PredictionJob):
+            # Runs in the task of the job, the checks of the service answer this request until the job is accepted
+            start_time = time.perf_counter()
+            try:
+                with start_root_span("POST /predict/async", request.headers.get("traceparent"), request.headers.get("transaction-id"), {"vps.model_id": model_id, "vps.job_id": job.job_id}):
+                    response = await model_prediction_service(request, model_id, input_data, job=job)
+            finally:
+                # An accepted job holds the buffers of the request until it finished, except while it is queued
+                if reservation is not None and job.accepted.done():
+                    reservation.release()
+            record_prediction_usage(request, model_id, len(input_data_bytes), response, time.perf_counter() - start_time)
+            return response
+
+        job, response = await get_prediction_job_runner().submit(request, model_id, callback_url, run_prediction)
+        if job is None:
+            # A replayed transaction is answered right away
+            return await encode_prediction_response(request, response)
+        if reservation is not None:
+            reservation.detached = True
+        return JSONResponse(status_code=202, content=job.describe())
+
+@router.get("/predict/jobs/{job_id}")
+async def prediction_job_status(request: Request, job_id: str):
+    return await get_prediction_job_status(request, job_id)
+
+@router.post("/predict/inputs")
+async def prediction_input_upload(request: Request, admission: PredictionAdmission = Depends(authenticate_prediction_request)):
+    # Presigned upload of an input too large for the body of /predict, named later in the vps-input-id header.
+    # Only the prediction using the input counts against the rate limit
+    return await create_prediction_input_upload(request, admission)
@@ -14,10 +14,19 @@
 
 from fastapi import FastAPI
 from src.models.env.env_config_DTO import EnvConfigDTO
+from src.models.env.performance_config_DTO import get_performance_config
 from dotenv import load_dotenv
-from src.controllers import model_controller
+from src.controllers import model_controller, auth_controller, health_controller
 from src.utils.redis_feature_plugin import RedisFeaturePlugin
-from src.utils.aws_feature_plugin import AWSFeaturePlugin
+from src.utils.aws_feature_plugin import AWSFeaturePlugin, shutdown_s3_executor
+from src.utils.tracing_util import get_tracer
+from src.utils.http_client_util import create_http_client, close_http_client
+from src.utils.usage_event_util import create_usage_event_emitter
+from src.utils.grpc_inference_util import get_grpc_channel_pool
+from src.utils.warm_up_util import start_warm_up
+from src.utils.prediction_job_util import get_prediction_job_runner
+from src.utils.cold_start_util import start_keep_warm
+from src.utils.worker_supervisor_util import WorkerSupervisor, prepare_metrics_dir
 from prometheus_fastapi_instrumentator import Instrumentator
 
 aws_plugin = AWSFeaturePlugin()
@@ -26,19 +35,56 @@ load_dotenv()
 app = FastAPI()
 config = EnvConfigDTO()
 
-def startup_event():
+async def startup_event():
     app.state.s3_client = aws_plugin.create_s3_client()
+    aws_plugin.warm_up_s3_client(app.state.s3_client, config.RUNTIME_BUCKET_NAME)
+    app.state.http_client = create_http_client()
+    app.state.usage_emitter = create_usage_event_emitter(app.state.http_client, app.state.s3_client)
+    if app.state.usage_emitter is not None:
+        app.state.usage_emitter.start()
+    get_tracer().configure()
+    app.state.warm_up_task = start_warm_up(app)
+    app.state.keep_warm_task = start_keep_warm(app)
 
-def shutdown_event():
+async def shutdown_event():
+    if app.state.warm_up_task is not None:
+        app.state.warm_up_task.cancel()
+    if app.state.keep_warm_task is not None:
+        app.state.keep_warm_task.cancel()
+    await get_prediction_job_runner().shutdown()
+    if app.state.usage_emitter is not None:
+        await app.state.usage_emitter.stop()
     aws_plugin.close_s3_client(app.state.s3_client)
+    shutdown_s3_executor()
+    await close_http_client(app.state.http_client)
+    await get_grpc_channel_pool().close()
+    get_tracer().shutdown()
 
 app.add_event_handler("startup", startup_event)
 app.add_event_handler("shutdown", shutdown_event)
 
 app.include_router(model_controller.router)
+app.include_router(auth_controller.router)
+app.include_router(health_controller.router)
 
 Instrumentator().instrument(app).expose(app)
 
-if __name__ == "__main__":
+def run_server(port: int):
     import uvicorn
-    uvicorn.run(app, host=config.SERVER_HOST, port=config.SERVER_PORT)
\ No newline at end of file
+    uvicorn.run("src.main:app", host=config.SERVER_HOST, port=port, timeout_keep_alive=get_performance_config().SERVER_KEEPALIVE_TIMEOUT_SECONDS)
+
+def run_workers(workers: int):
+    # One process per port so nginx can balance on open requests, uvicorn --workers shares a single socket
+    import signal
+    import sys
+
+    performance_config = get_performance_config()
+    prepare_metrics_dir(performance_config.SERVER_METRICS_DIR)
+    supervisor = WorkerSupervisor(run_server, [config.SERVER_PORT + index for index in range(workers)], performance_config)
+    signal.signal(signal.SIGTERM, supervisor.stop)
+    signal.signal(signal.SIGINT, supervisor.stop)
+    sys.exit(supervisor.run())
+
+if __name__ == "__main__":
+    # Supervised even with a single worker, the probes of the pod are answered by the supervisor
+    run_workers(max(1, get_performance_config().SERVER_WORKERS))
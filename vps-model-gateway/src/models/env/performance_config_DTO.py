@@ -0,0 +1,240 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+from functools import lru_cache
+from pydantic_settings import BaseSettings
+
+class PerformanceConfigDTO(BaseSettings):
+    """
+    Tunables for the gateway performance features, read from the environment like EnvConfigDTO.
+    Features that turn requests away which were served before are off by default and enabled per
+    deployment: idempotent replay, the model scheduler, the memory budget and tensor validation.
+    Admission, cold start handling, upstream retries, warm-up, binary tensor outputs, response
+    compression and asynchronous jobs are on, and transformer calls time out after
+    TRANSFORMER_READ_TIMEOUT_SECONDS (60s) instead of 300s. Set the matching variables to change them.
+    """
+
+    # Prediction pipeline metrics
+    METRICS_MAX_MODEL_ID_LABELS: int = 200
+
+    # Distributed tracing
+    TRACING_ENABLED: bool = False
+    TRACING_SERVICE_NAME: str = "vps-model-gateway"
+    TRACING_EXPORTER: str = "file" # file or otlp
+    TRACING_FILE_PATH: str = "/tmp/vps-model-gateway-traces.jsonl"
+    TRACING_OTLP_ENDPOINT: str = "http://localhost:4318"
+    TRACING_SAMPLE_RATIO: float = 0.01 # Share of fast and successful traces that are kept
+    TRACING_SLOW_THRESHOLD_MS: int = 1000 # Traces slower than this are always kept
+    TRACING_MAX_PENDING_TRACES: int = 2000
+    TRACING_MAX_SPANS_PER_TRACE: int = 256
+
+    # Prediction response cache, enabled per model with "prediction_cache" in the model notes
+    PREDICTION_CACHE_ENABLED: bool = True # Global switch, off disables the cache for every model
+    PREDICTION_CACHE_DEFAULT_TTL_SECONDS: int = 300
+    PREDICTION_CACHE_MAX_TTL_SECONDS: int = 86400
+    PREDICTION_CACHE_MAX_ENTRY_BYTES: int = 1024 * 1024 # Larger responses are not cached
+    PREDICTION_CACHE_L1_MAX_BYTES: int = 64 * 1024 * 1024 # In process cache capacity per worker
+    PREDICTION_CACHE_L1_TTL_SECONDS: int = 30
+
+    # Coalescing of identical concurrent predictions, enabled per model with "coalesce_requests": true in the model notes
+    PREDICTION_COALESCING_ENABLED: bool = True # Global switch, off disables coalescing for every model
+
+    # Idempotent replay of /predict requests keyed on the transaction-id header
+    IDEMPOTENCY_ENABLED: bool = False
+    IDEMPOTENCY_TTL_SECONDS: int = 3600 # How long completed content responses are replayed
+    IDEMPOTENCY_URL_TTL_SECONDS: int = 300 # Responses with presigned URLs are replayed while the URLs are valid
+    IDEMPOTENCY_IN_PROGRESS_TTL_SECONDS: int = 330 # Longer than the 300s upstream timeout, frees markers of crashed workers
+    IDEMPOTENCY_MAX_RESPONSE_BYTES: int = 1024 * 1024
+    IDEMPOTENCY_POLL_INTERVAL_MS: int = 100
+    IDEMPOTENCY_WAIT_TIMEOUT_SECONDS: int = 300
+
+    # Pooled upstream http client, shared by every request of a worker
+    HTTP_TIMEOUT_SECONDS: float = 300.0
+    HTTP_MAX_CONNECTIONS: int = 200
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 100
+    HTTP_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+
+    # Upstream retries and hedging
+    HTTP_RETRY_ENABLED: bool = True
+    HTTP_RETRY_MAX_ATTEMPTS: int = 3 # Attempts per control plane and transformer call, including the first one
+    HTTP_MODEL_RETRY_MAX_ATTEMPTS: int = 2
+    HTTP_RETRY_BASE_BACKOFF_MS: int = 50
+    HTTP_RETRY_MAX_BACKOFF_MS: int = 1000
+    HTTP_RETRY_POLICIES: dict = {} # Per upstream overrides, e.g. {"payment": {"max_attempts": 1, "hedge": false}}
+    HTTP_RETRY_BUDGET_RATIO: float = 0.1 # Retries and hedges allowed per upstream request
+    HTTP_RETRY_BUDGET_MIN_PER_SECOND: float = 10.0
+    HTTP_RETRY_BUDGET_MAX_TOKENS: float = 100.0
+    HTTP_HEDGING_ENABLED: bool = False
+    HTTP_HEDGE_PERCENTILE: float = 0.95 # A hedge is sent once a call is slower than this percentile of its upstream
+    HTTP_HEDGE_MIN_DELAY_MS: int = 20
+    HTTP_HEDGE_MIN_SAMPLES: int = 50
+    HTTP_HEDGE_LATENCY_WINDOW: int = 1000
+
+    # End to end request deadline, from the vps-request-timeout-ms header or "request_timeout_seconds" in the model notes
+    DEADLINE_DEFAULT_SECONDS: float = 300.0
+    DEADLINE_MAX_SECONDS: float = 300.0
+    CONTROL_PLANE_CONNECT_TIMEOUT_SECONDS: float = 2.0
+    CONTROL_PLANE_READ_TIMEOUT_SECONDS: float = 10.0
+    TRANSFORMER_CONNECT_TIMEOUT_SECONDS: float = 5.0
+    TRANSFORMER_READ_TIMEOUT_SECONDS: float = 60.0
+    MODEL_CONNECT_TIMEOUT_SECONDS: float = 5.0 # Model reads get whatever is left of the deadline
+
+    # Credit ledger, pre approved predictions per (entity, model) kept in Redis between payment service checks
+    CREDIT_LEDGER_ENABLED: bool = False
+    CREDIT_LEDGER_BLOCK_SIZE: int = 50 # Predictions granted by one successful balance check, bounds the overspend
+    CREDIT_LEDGER_TTL_SECONDS: int = 60 # A block is also dropped after this long, bounds how stale a grant can be
+    CREDIT_LEDGER_REFRESH_THRESHOLD: int = 10 # A new block is requested in the background below this many predictions
+    CREDIT_LEDGER_REFRESH_LOCK_SECONDS: int = 10
+
+    # Usage events of successful predictions, buffered in memory and flushed in batches to a sink
+    USAGE_EVENTS_ENABLED: bool = False
+    USAGE_EVENTS_SINK: str = "s3" # http, redis_stream or s3
+    USAGE_EVENTS_HTTP_PATH: str = "/usage/events/bulk" # Bulk endpoint on the PAYMENT_SERVICE_URL
+    USAGE_EVENTS_REDIS_STREAM: str = "vps:usage-events"
+    USAGE_EVENTS_REDIS_STREAM_MAXLEN: int = 1000000
+    USAGE_EVENTS_S3_PREFIX: str = "usage-events" # Gzipped JSONL objects in the RUNTIME_BUCKET_NAME
+    USAGE_EVENTS_BUFFER_SIZE: int = 10000 # Events held in memory, a full buffer is spilled to disk
+    USAGE_EVENTS_BATCH_SIZE: int = 500
+    USAGE_EVENTS_FLUSH_INTERVAL_SECONDS: float = 5.0
+    USAGE_EVENTS_SPILL_DIR: str = "/tmp/vps-usage-events"
+    USAGE_EVENTS_MAX_SPILL_BYTES: int = 512 * 1024 * 1024 # Events are dropped once the spill directory holds this much
+
+    # S3 client shared by all requests, and the thread pool its blocking calls and presigning run on
+    S3_MAX_POOL_CONNECTIONS: int = 64 # Also the size of the S3 thread pool
+    S3_TCP_KEEPALIVE: bool = True
+    S3_RETRY_MODE: str = "adaptive" # legacy, standard or adaptive
+    S3_MAX_ATTEMPTS: int = 3
+    S3_CONNECT_TIMEOUT_SECONDS: float = 2.0
+    S3_READ_TIMEOUT_SECONDS: float = 30.0
+    S3_ENDPOINT_URL: str = "" # e.g. a MinIO or LocalStack stand-in, the AWS endpoint when empty
+    S3_ADDRESSING_STYLE: str = "auto" # path for most local S3 stand-ins
+
+    # Content encoding of /predict responses, opted in model requests and spilled responses
+    COMPRESSION_RESPONSE_ENABLED: bool = True # Honours the Accept-Encoding header of /predict
+    COMPRESSION_MIN_BYTES: int = 1024 # Smaller payloads are sent as they are
+    COMPRESSION_OFFLOAD_BYTES: int = 1024 * 1024 # Larger payloads are compressed on a worker thread
+    COMPRESSION_GZIP_LEVEL: int = 1 # Level 1 keeps most of the saving on tensor JSON at a third of the CPU of level 5
+    COMPRESSION_ZSTD_LEVEL: int = 3
+    COMPRESSION_BROTLI_QUALITY: int = 4
+    COMPRESSION_S3_SPILL_ENABLED: bool = False # Spilled responses are stored gzipped with Content-Encoding: gzip
+
+    # Gateway processes started by src/main.py, worker N listens on SERVER_PORT + N behind the nginx upstream
+    SERVER_WORKERS: int = 1
+    SERVER_KEEPALIVE_TIMEOUT_SECONDS: int = 75 # Longer than the nginx upstream keepalive_timeout
+    SERVER_HEALTH_PORT: int = 8090 # /healthz and /readyz of the pod, answered by src/main.py from the probes of every worker
+    SERVER_HEALTH_PROBE_TIMEOUT_SECONDS: float = 3.0 # Longer than READINESS_CHECK_TIMEOUT_SECONDS of the worker
+    SERVER_READY_MIN_WORKERS: int = 1 # Ready workers the pod needs for /readyz, nginx skips the others
+    SERVER_WORKER_RESTART_BACKOFF_SECONDS: float = 1.0 # Doubled for every restart of the same worker within the window
+    SERVER_WORKER_MAX_RESTARTS: int = 5 # Within SERVER_WORKER_RESTART_WINDOW_SECONDS, the gateway exits after more so the container is restarted
+    SERVER_WORKER_RESTART_WINDOW_SECONDS: float = 300.0
+    SERVER_METRICS_DIR: str = "/tmp/vps-gateway-metrics" # PROMETHEUS_MULTIPROC_DIR of the workers, /metrics of any of them serves the counters of all
+
+    # Tokens verified by the nginx auth_request, the resolved user is forwarded in trusted headers
+    EDGE_AUTH_ENABLED: bool = False
+    EDGE_AUTH_TRUSTED_PROXIES: list = ["127.0.0.1", "::1"] # Peers whose edge auth headers are trusted
+
+    # Admission of /predict requests, header checks, token verdicts and the rate limit run before the body is read
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_MAX_BODY_BYTES: int = 10 * 1024 * 1024 # Same as the client_max_body_size of nginx
+    ADMISSION_TOKEN_CACHE_TTL_SECONDS: float = 30.0 # Valid tokens, 0 disables the cache
+    ADMISSION_NEGATIVE_TOKEN_CACHE_TTL_SECONDS: float = 10.0 # Invalid tokens
+    ADMISSION_TOKEN_CACHE_MAX_ENTRIES: int = 10000
+
+    # Binary data extension of the Open Inference Protocol for KserveV2 and MLFlow models
+    BINARY_TENSOR_OUTPUTS_ENABLED: bool = True # Binary requests ask the model for binary outputs unless their header says otherwise
+
+    # Validation of KserveV2 inputs against the input of the model details, before the model is called
+    TENSOR_VALIDATION_ENABLED: bool = False
+    TENSOR_VALIDATION_FLATTEN_INPUTS: bool = False # Nested inputs are sent as the flat, row major data of the shape
+
+    # Open Inference Protocol over gRPC, selected per deployment with "Protocol": "grpc" in its url_additions
+    GRPC_MODEL_TARGET: str = "" # host:port of the gRPC ingress, the host of MODEL_KOURIER_SERVICE_URL on port 80 when empty
+    GRPC_CHANNELS_PER_TARGET: int = 2 # Each channel is one HTTP/2 connection multiplexing the concurrent calls
+    GRPC_MAX_MESSAGE_BYTES: int = 64 * 1024 * 1024
+    GRPC_KEEPALIVE_SECONDS: int = 30
+
+    # Model details and deployment info of the control plane cached per worker, prefetched for the most requested models at startup.
+    # Opt-in: a cached model keeps its access settings, so a model made private or redeployed reaches the gateway only once its entry expired
+    MODEL_METADATA_CACHE_TTL_SECONDS: float = 0.0 # The longest a deployment or access change takes to reach every worker, 0 disables the cache and the prefetch
+    MODEL_METADATA_CACHE_MAX_ENTRIES: int = 10000
+
+    # Warm-up of a starting worker, /readyz answers 503 until it finished
+    WARMUP_ENABLED: bool = True
+    WARMUP_TIMEOUT_SECONDS: float = 30.0 # The worker turns ready with what was warmed up by then
+    WARMUP_CONNECTIONS_PER_SERVICE: int = 4 # Pooled connections opened to every configured service
+    WARMUP_TOP_MODELS: int = 50 # Most requested models whose metadata is prefetched
+    WARMUP_MODEL_IDS: list = [] # Always prefetched, on top of the most requested models
+    WARMUP_HOT_MODELS_FLUSH_SECONDS: float = 60.0 # How often a worker adds its request counts to the shared snapshot
+    READINESS_CHECK_INTERVAL_SECONDS: float = 5.0 # Dependency checks of /readyz are reused for this long
+    READINESS_CHECK_TIMEOUT_SECONDS: float = 2.0
+    READINESS_DEPENDENCIES: list = ["redis", "s3"]
+
+    # Cold starts of scaled to zero Knative models, predicted per worker from how long each model was idle
+    COLD_START_ENABLED: bool = True
+    COLD_START_IDLE_SECONDS: float = 90.0 # Knative's stable window plus the scale to zero grace period
+    COLD_START_MIN_SECONDS: float = 2.0 # A call predicted cold, of a model with a known warm latency, is a cold start when its headers took at least this long
+    COLD_START_LATENCY_FACTOR: float = 3.0 # and at least this multiple of the warm latency of the model
+    COLD_START_CONNECT_TIMEOUT_SECONDS: float = 2.0 # Connect and pool wait per attempt before the call is sent again, reads keep the remaining deadline
+    COLD_START_MAX_RETRIES: int = 1 # Extra attempts after the activator answered 502/503 or no connection was opened in time
+    COLD_START_RETRY_BACKOFF_SECONDS: float = 1.0
+    COLD_START_MAX_MODELS: int = 10000 # Models whose activity is tracked per worker, least recently requested ones are dropped
+
+    # Keep-warm pings to the readiness endpoint of models expected to be requested before they would scale to zero
+    KEEP_WARM_ENABLED: bool = False
+    KEEP_WARM_CHECK_INTERVAL_SECONDS: float = 10.0
+    KEEP_WARM_IDLE_SECONDS: float = 60.0 # Idle time after which a model is pinged, below COLD_START_IDLE_SECONDS
+    KEEP_WARM_MIN_REQUESTS: int = 5 # Requests seen before the traffic of a model is trusted to predict the next one
+    KEEP_WARM_MAX_INTERVAL_SECONDS: float = 900.0 # Models requested less often than this on average are left to scale to zero
+    KEEP_WARM_INTERVAL_TOLERANCE: float = 2.0 # Pings stop once a model was idle this many times its mean time between requests
+    KEEP_WARM_TIMEOUT_SECONDS: float = 5.0
+    KEEP_WARM_MAX_CONCURRENCY: int = 8
+
+    # Weighted fair queuing of the model calls of each worker across the calling entities, weighted by their plan tier
+    MODEL_SCHEDULER_ENABLED: bool = False
+    MODEL_SCHEDULER_MAX_CONCURRENCY: int = 64 # Calls in flight per model and worker, the model notes can set "max_concurrency"
+    MODEL_SCHEDULER_MAX_QUEUE_PER_TENANT: int = 32 # Calls an entity can have queued per model, more are rejected with a 429
+    MODEL_SCHEDULER_TIER_WEIGHTS: dict = {"free": 1, "standard": 2, "premium": 4, "enterprise": 8}
+    MODEL_SCHEDULER_DEFAULT_TIER: str = "standard"
+    MODEL_SCHEDULER_ENTITY_TIERS: dict = {} # Tier per entity id, used when the user admin response has no "plan_tier"
+
+    # Asynchronous predictions of /predict/async, run by a bounded job pool of each worker
+    ASYNC_JOBS_ENABLED: bool = True
+    ASYNC_JOBS_MAX_CONCURRENCY: int = 32 # Jobs running past their checks per worker
+    ASYNC_JOBS_MAX_QUEUED: int = 256 # Accepted jobs waiting for the pool per worker, more are rejected with a 503
+    ASYNC_JOBS_MAX_QUEUED_BYTES: int = 256 * 1024 * 1024 # Reserved bytes of the bodies of the queued jobs per worker, kept apart from the memory budget
+    ASYNC_JOBS_TTL_SECONDS: int = 86400 # How long the status and the result of a job can be polled
+    ASYNC_JOBS_WEBHOOK_MAX_ATTEMPTS: int = 3
+    ASYNC_JOBS_WEBHOOK_TIMEOUT_SECONDS: float = 10.0
+    ASYNC_JOBS_WEBHOOK_ALLOW_HTTP: bool = False # Plain http callback URLs, for local stand-ins only
+    ASYNC_JOBS_WEBHOOK_ALLOW_PRIVATE_HOSTS: bool = False # Callback hosts resolving to loopback or private addresses, for local stand-ins only
+    ASYNC_JOBS_WEBHOOK_SECRET: str = "" # Signs the webhook bodies with HMAC-SHA256 in the vps-signature header when set
+
+    # Memory budget of each worker process, request bodies, model responses and S3 part buffers are reserved from it
+    MEMORY_BUDGET_ENABLED: bool = False
+    MEMORY_BUDGET_MAX_BYTES: int = 512 * 1024 * 1024 # Per worker, the pod holds up to SERVER_WORKERS times this
+    MEMORY_BUDGET_MAX_WAIT_SECONDS: float = 2.0 # Longest a reservation waits for released bytes before a 503
+    MEMORY_BUDGET_BODY_COPIES: int = 3 # A JSON body is held as bytes, as the decoded str and as the parsed object
+    MEMORY_BUDGET_GROWTH_RESERVE_BYTES: int = 64 * 1024 * 1024 # Only granted to the responses and S3 buffers of requests already holding their body, at most half of the budget
+
+    # Inputs uploaded to the runtime bucket and named in /predict by the vps-input-id header
+    PREDICTION_INPUT_UPLOAD_EXPIRATION_SECONDS: int = 300 # Lifetime of the presigned POST of the upload
+    PREDICTION_INPUT_TTL_SECONDS: int = 3600 # How long an uploaded input can be used in predictions
+    PREDICTION_INPUT_STREAM_CHUNK_BYTES: int = 1024 * 1024 # Parts read from S3 while validating the input and streaming it to the model
+
+@lru_cache(maxsize=None)
+def get_performance_config():
+    """
+    The tunables of this worker, read from the environment once since they only change with a restart.
+    """
+    return PerformanceConfigDTO()
@@ -16,34 +16,58 @@
 from fastapi import HTTPException, Request
 from src.utils.logger_util import setup_logger
 from src.utils.validate_auth_token_util import validate_auth_token
+from src.utils.edge_auth_util import get_edge_verified_user
+from src.utils.request_admission_util import get_prediction_admission
+from src.utils.prediction_job_util import PredictionJob
+from src.utils.prediction_input_util import PredictionInputReference, PredictionInput, resolve_prediction_input, can_stream_prediction_input, get_prediction_input_download_url
 from src.utils.retrieve_deployment_info_util import retrieve_deployment_info_for_model_and_related_transformer
 from src.utils.transform_input_data_for_model_util import check_pre_or_post_transform_input_data_for_model, pre_or_post_transform_input_data_for_model
-from src.utils.model_prediction_util import get_model_prediction_for_input_data
+from src.utils.model_prediction_util import get_model_prediction_for_input_data, get_coalesced_model_prediction_for_input_data, is_prediction_coalescing_enabled
 from src.utils.retrieve_info_for_model_util import retrieve_info_for_model_and_transformer_if_exists
 from src.utils.retrieve_model_details_info_util import retrieve_model_details_info
 from src.utils.retrieve_entity_id_for_model_util import retrieve_entity_id_for_model
 from src.utils.retrieve_list_of_authorized_model_for_app_util import retrieve_list_of_authorized_model_for_app
-from src.utils.validate_entity_balance_util import validate_entity_balance
+from src.utils.credit_ledger_util import validate_entity_balance_with_ledger
 from src.config.bucket_structure import BucketStructure
 from src.utils.redis_feature_plugin import RedisFeaturePlugin
-from src.utils.aws_feature_plugin import AWSFeaturePlugin
+from src.utils.aws_feature_plugin import AWSFeaturePlugin, run_s3_operation
 from src.models.env.env_config_DTO  import EnvConfigDTO
 from src.mappings.output_data_extraction_mapping import DEPLOYMENT_SYSTEM_TO_EXTRACTOR_MAPPING
+from src.utils.prediction_metrics_util import StageTimer
+from src.utils.idempotency_util import IdempotentTransaction, build_request_fingerprint, hash_request_input
+from src.utils.prediction_cache_util import get_prediction_cache_ttl, get_deployment_version, hash_model_input, build_prediction_cache_key, get_cached_prediction, store_cached_prediction
+from src.utils.http_client_util import shared_http_client
+from src.utils.binary_tensor_util import BinaryInferencePayload, BINARY_DEPLOYMENT_SYSTEMS
+from src.utils.warm_up_util import record_hot_model
+from src.utils.tenant_scheduler_util import start_request_tenant, reset_request_tenant
+from src.utils.deadline_util import DEADLINE_HEADER, start_request_deadline, apply_model_deadline, reset_request_deadline, is_deadline_exceeded
 from botocore.exceptions import ClientError
 from typing import Any
 import json
-import httpx
 
 logger = setup_logger(__name__)
 
-async def model_prediction_service(request: Request, model_id: str, input_data: Any):
+async def model_prediction_service(request: Request, model_id: str, input_data: Any, job: PredictionJob = None):
     redis_client = None
+    transaction_id = None
+    idempotent_transaction = None
+    admission = get_prediction_admission(request)
+    #An asynchronous job outlives the response, the client of the admission is closed once the response is sent
+    owns_redis_client = admission is None or job is not None
+    deadline_token = None
+    tenant_token = None
+    stage_timer = StageTimer(model_id)
     try:
         config = EnvConfigDTO()
         logger.info(f"Received prediction request for model_id: {model_id}")
 
-        #Deserializing the input data
-        input_data = json.loads(input_data)
+        #Deserializing the input data, binary tensor inputs were already split by the controller and uploaded inputs are never loaded
+        binary_input = isinstance(input_data, BinaryInferencePayload)
+        uploaded_input = isinstance(input_data, PredictionInputReference)
+        #Hashed as received, a retry sends the same bytes
+        input_hash = hash_request_input(input_data)
+        if not binary_input and not uploaded_input:
+            input_data = json.loads(input_data)
 
         #Extracting the vps-app-id from the request headers
         vps_app_id = request.headers.get("vps-app-id", None)
@@ -64,29 +88,42 @@ async def model_prediction_service(request: Request, model_id: str, input_data:
         if transaction_id is None or len(transaction_id) == 0:
             logger.error("Transaction-id is missing or empty in the request header, stopping the prediction process.")
             raise HTTPException(status_code=400, detail="Transaction-id is missing or empty in the request header, stopping the prediction process.")
+        stage_timer.transaction_id = transaction_id
+
+        #Every upstream call below is bounded by what is left of the request deadline
+        deadline_token = start_request_deadline(request.headers.get(DEADLINE_HEADER), transaction_id)
         
         if ((vps_env_type == "vipas-streamlit") ^ (vps_auth_token.startswith("sat-"))):
             logger.error(f"Transaction-id: {transaction_id}, session token is not allowed for vps-env-type: {vps_env_type}, stopping the prediction process.")
             raise HTTPException(status_code=400, detail=f"Session token is not allowed for vps-env-type: {vps_env_type}, stopping the prediction process.")
         
-        timeout = httpx.Timeout(300.0) # Timout settings for the async process.
-
-        # Use httpx.AsyncClient for asynchronous request handling
-        async with httpx.AsyncClient(timeout=timeout) as client:
-
-            #Calling the user admin service to validate the vps-auth-token(User Authentication)
-            user_data = await validate_auth_token(client, vps_auth_token, transaction_id)
+        # Use the pooled httpx.AsyncClient of the worker for asynchronous request handling
+        async with shared_http_client(request) as client:
+
+            #Calling the user admin service to validate the vps-auth-token(User Authentication), unless nginx or the admission already did
+            user_data = admission.user_data if admission else get_edge_verified_user(request, transaction_id)
+            if user_data is None:
+                with stage_timer.stage("token_validation"):
+                    user_data = await validate_auth_token(client, vps_auth_token, transaction_id)
                
             username = user_data.get("username")
             caller_entity_id = user_data.get("entity_id")
             retrieved_app_id = user_data.get("vps_app_id")
+            #Model calls of the request are queued fairly against the other entities calling the same model
+            tenant_token = start_request_tenant(user_data, transaction_id)
 
             if not username:
                 logger.error(f"Transaction-id: {transaction_id}, Username not found for vps-auth-token: {vps_auth_token}, stopping the prediction process.")
                 raise HTTPException(status_code=404, detail=f"Username not found for vps-auth-token: {vps_auth_token}, stopping the prediction process.")
-            
+
+            logger.info(f"Transaction-id: {transaction_id}, Creating the redis client for the idempotency and rate limit checks of user: {username}")
+            redis_plugin = RedisFeaturePlugin()
+            #The admission owns its redis client and closes it once the response is sent
+            redis_client = redis_plugin.create_redis_client() if owns_redis_client else admission.redis_client
+
             logger.info(f"Transaction-id: {transaction_id}, Checking if the caller {caller_entity_id} has sufficient balance to run the model {model_id} prediction") 
-            await validate_entity_balance(client, caller_entity_id, model_id, vps_app_id, vps_env_type, transaction_id)
+            with stage_timer.stage("balance_check"):
+                await validate_entity_balance_with_ledger(client, redis_client, caller_entity_id, model_id, vps_app_id, vps_env_type, transaction_id)
             
             #Calling the project admin service to get the list of authorized models(App Authorization)
             if vps_env_type == "vipas-streamlit":
@@ -105,7 +142,8 @@ async def model_prediction_service(request: Request, model_id: str, input_data:
                     raise HTTPException(status_code=409, detail=f"Access token is assigned to the app: {retrieved_app_id}, not the app: {vps_app_id}, stopping the prediction process.")
 
                 logger.info(f"Transaction-id: {transaction_id}, App header is set, checking if the app {vps_app_id} is authorized to call the model: {model_id}")
-                auth_model_ids = await retrieve_list_of_authorized_model_for_app(client, vps_app_id, transaction_id)
+                with stage_timer.stage("app_authorization"):
+                    auth_model_ids = await retrieve_list_of_authorized_model_for_app(client, vps_app_id, transaction_id)
                 logger.info(f"Transaction-id: {transaction_id}, List of authorized models for app {vps_app_id}: {auth_model_ids}")
 
                 if model_id not in auth_model_ids:
@@ -113,10 +151,15 @@ async def model_prediction_service(request: Request, model_id: str, input_data:
                     raise HTTPException(status_code=403, detail=f"App: {vps_app_id} is not authorized to call the model: {model_id}")
             
             #Calling the project admin service to get the model details(User Authorization)
-            model = await retrieve_model_details_info(client, model_id, transaction_id)
+            with stage_timer.stage("model_details"):
+                model = await retrieve_model_details_info(client, model_id, transaction_id)
+            apply_model_deadline(model, transaction_id)
+            #Counted for the metadata prefetch of the workers that start next
+            record_hot_model(model_id, redis_client)
 
             logger.info(f"Transaction-id: {transaction_id}, Retrieving the entity id for the model: {model_id}")
-            entity_id = await retrieve_entity_id_for_model(client, model.get("project_id"), transaction_id)
+            with stage_timer.stage("entity_lookup"):
+                entity_id = await retrieve_entity_id_for_model(client, model.get("project_id"), transaction_id)
 
             logger.info(f"Transaction-id: {transaction_id}, Fetching the api access permission for the model: {model_id} for user: {username}")
             api_access = model.get("api_access")
@@ -124,25 +167,33 @@ async def model_prediction_service(request: Request, model_id: str, input_data:
                 logger.error(f"Transaction-id: {transaction_id}, User: {username} does not have access to call the model: {model_id}")
                 raise HTTPException(status_code=403, detail=f"User: {username} does not have access to call the model: {model_id}")
 
+            #Replaying the response of a completed transaction, or waiting for the request that is running it. Only
+            #once the caller passed the balance and authorization checks, a stored response is never handed out without them
+            idempotent_transaction = IdempotentTransaction(redis_client, transaction_id, build_request_fingerprint(username, model_id, input_hash))
+            with stage_timer.stage("idempotency_check"):
+                replayed_response = await idempotent_transaction.begin()
+            if replayed_response is not None:
+                logger.info(f"Transaction-id: {transaction_id}, Returning the stored response of the transaction for the model {model_id}")
+                return replayed_response
+
             logger.info(f"Transaction-id: {transaction_id}, Fetching the model details for the model: {model_id}")
             model_details = model.get("model_details", None)
             if model_details:
                 model_details = json.loads(model_details)
 
-            logger.info(f"Transaction-id: {transaction_id}, Checking if the rate limit is exceeded or not for user: {username}, creating the redis client")
+            logger.info(f"Transaction-id: {transaction_id}, Checking if the rate limit is exceeded or not for user: {username}")
             
-            #Checking if the rate limit is exceeded or not
-            redis_plugin = RedisFeaturePlugin()
-            redis_client = redis_plugin.create_redis_client()
-
-            if redis_client:
-                result = redis_plugin.check_rate_limit_exceeded_or_not_for_a_particular_user(redis_client, username, transaction_id)
+            #Checking if the rate limit is exceeded or not, admitted requests were already counted
+            if redis_client and not admission:
+                with stage_timer.stage("rate_limit"):
+                    result = redis_plugin.check_rate_limit_exceeded_or_not_for_a_particular_user(redis_client, username, transaction_id)
                 if result:
                     logger.error(f"Transaction-id: {transaction_id}, Rate limit exceeded for user: {username}, stopping the prediction process.")
                     raise HTTPException(status_code=429, detail=f"Rate limit exceeded for user: {username}, stopping the prediction process, please wait for 60 seconds.")
 
             #Calling the deploy admin service to get the deployment details for that paritcular model
-            deployment_data = await retrieve_deployment_info_for_model_and_related_transformer(client, model_id, transaction_id)
+            with stage_timer.stage("deployment_lookup"):
+                deployment_data = await retrieve_deployment_info_for_model_and_related_transformer(client, model_id, transaction_id)
 
             model_deployment = deployment_data.get("model")
             transformer_deployment = deployment_data.get("transformer")
@@ -152,19 +203,71 @@ async def model_prediction_service(request: Request, model_id: str, input_data:
                 raise HTTPException(status_code=404, detail=f"Model deployment information not found for the model_id: {model_id}")
             
             kourier_model_url, kourier_transformer_url, model_headers, transformer_headers, project_id, deployment_system, mdl_service_name = retrieve_info_for_model_and_transformer_if_exists(model, model_deployment, transformer_deployment, transaction_id)
+            stage_timer.set_deployment_system(deployment_system)
+
+            if binary_input and (deployment_system not in BINARY_DEPLOYMENT_SYSTEMS or transformer_deployment):
+                logger.error(f"Transaction-id: {transaction_id}, Binary tensor inputs are not supported for the {deployment_system} model {model_id}")
+                raise HTTPException(status_code=415, detail=f"Binary tensor inputs are only supported for {', '.join(BINARY_DEPLOYMENT_SYSTEMS)} models without a transformer")
+
+            #An uploaded input is streamed from the runtime bucket into the model request, or read by the pre transformer
+            if uploaded_input:
+                if not transformer_deployment and not can_stream_prediction_input(deployment_system, kourier_model_url):
+                    logger.error(f"Transaction-id: {transaction_id}, Uploaded inputs are not supported for the {deployment_system} model {model_id}")
+                    raise HTTPException(status_code=415, detail=f"Uploaded inputs are not supported for {deployment_system} models, send the input in the request body")
+                input_data = await resolve_prediction_input(request, redis_client, input_data, username, transaction_id)
+
+            request.state.usage = {"username": username, "entity_id": caller_entity_id, "owner_entity_id": entity_id, "project_id": project_id, "vps_app_id": vps_app_id, "vps_env_type": vps_env_type, "deployment_system": deployment_system, "source": "model"}
+
+            #Every check passed, an asynchronous job is accepted here and continues once the job pool picks it up
+            if job is not None:
+                await job.enqueue(redis_client, username)
 
             logger.info(f"Transaction-id: {transaction_id}, Started the prediction process for the model {model_id}")
             if transformer_deployment:
                 logger.info(f"Transaction-id: {transaction_id}, Transformer is present for the model {model_id}, checking if the pre transformer is present.")
                 transformer_headers["transaction-id"] = transaction_id
 
-                data = await check_pre_or_post_transform_input_data_for_model(client, project_id, model_id, transformer_deployment.get("transformer_id"), "pre_transform", kourier_transformer_url, transformer_headers, transaction_id)
-
-                if data == True:
-                    input_data = await pre_or_post_transform_input_data_for_model(client, project_id, model_id, transformer_deployment.get("transformer_id"), "pre_transform", kourier_transformer_url, transformer_headers, input_data, transaction_id)
-                    input_data = input_data.get("data")
-
-            output_data, payload_type = await get_model_prediction_for_input_data(request, client, model_id, mdl_service_name, transaction_id, deployment_system, kourier_model_url, model_headers, model_details, model, input_data)
+                with stage_timer.stage("pre_transform"):
+                    data = await check_pre_or_post_transform_input_data_for_model(client, project_id, model_id, transformer_deployment.get("transformer_id"), "pre_transform", kourier_transformer_url, transformer_headers, transaction_id)
+
+                    if data == True:
+                        if uploaded_input:
+                            #The pre transformer reads the uploaded input from its presigned URL, as the post transformer does with spilled responses
+                            input_data = {"presigned_download_url": await get_prediction_input_download_url(request, input_data, transaction_id)}
+                            transformer_headers["payload_type"] = "url"
+                        input_data = await pre_or_post_transform_input_data_for_model(client, project_id, model_id, transformer_deployment.get("transformer_id"), "pre_transform", kourier_transformer_url, transformer_headers, input_data, transaction_id)
+                        input_data = input_data.get("data")
+                        transformer_headers.pop("payload_type", None)
+
+            if isinstance(input_data, PredictionInput) and not can_stream_prediction_input(deployment_system, kourier_model_url):
+                logger.error(f"Transaction-id: {transaction_id}, Uploaded inputs are not supported for the {deployment_system} model {model_id}")
+                raise HTTPException(status_code=415, detail=f"Uploaded inputs are not supported for {deployment_system} models, send the input in the request body")
+
+            #Serving the response from the prediction cache when the model opted in to it, the checks above still ran for this request
+            cache_key = None
+            cache_ttl = get_prediction_cache_ttl(model)
+            coalesce_requests = is_prediction_coalescing_enabled(model)
+            if binary_input or isinstance(input_data, PredictionInput):
+                cache_ttl, coalesce_requests = None, False
+            if cache_ttl or coalesce_requests:
+                deployment_version = get_deployment_version(model, model_deployment, transformer_deployment)
+                input_hash = hash_model_input(input_data)
+
+            if cache_ttl:
+                with stage_timer.stage("cache_lookup"):
+                    cache_key = build_prediction_cache_key(model_id, deployment_version, input_hash)
+                    cached_response = get_cached_prediction(redis_client, cache_key, transaction_id)
+                if cached_response is not None:
+                    logger.info(f"Transaction-id: {transaction_id}, Returning the cached prediction response for the model {model_id}")
+                    request.state.usage["source"] = "cache"
+                    return idempotent_transaction.complete(cached_response)
+
+            #Identical concurrent requests share one model call, each of them went through its own checks above
+            if coalesce_requests:
+                output_data, payload_type, spill_transaction_id = await get_coalesced_model_prediction_for_input_data((model_id, deployment_version, input_hash), request, client, model_id, mdl_service_name, transaction_id, deployment_system, kourier_model_url, model_headers, model_details, model, input_data, stage_timer=stage_timer)
+            else:
+                output_data, payload_type = await get_model_prediction_for_input_data(request, client, model_id, mdl_service_name, transaction_id, deployment_system, kourier_model_url, model_headers, model_details, model, input_data, stage_timer=stage_timer)
+                spill_transaction_id = transaction_id
 
             if payload_type == "url":
                 logger.info(f"Transaction-id: {transaction_id}, Generating the presigned download URL for the prediction response for the model {model_id}")
@@ -174,13 +277,20 @@ async def model_prediction_service(request: Request, model_id: str, input_data:
                 s3_client = request.app.state.s3_client
 
                 bucket_structure = BucketStructure({"transaction_id": transaction_id}).get_bucket_structure()
-                model_prediction_response_preffix = f"{bucket_structure['runtime_folder']}/model_prediction_response.txt"
 
-                presigned_download_url = aws_plugin.generate_presigned_download_url(s3_client, config.RUNTIME_BUCKET_NAME, model_prediction_response_preffix, transaction_id)
+                #A shared prediction was spilled under the runtime folder of the transaction that made the model call
+                spill_bucket_structure = bucket_structure
+                if spill_transaction_id != transaction_id:
+                    spill_bucket_structure = BucketStructure({"transaction_id": spill_transaction_id}).get_bucket_structure()
+                model_prediction_response_preffix = f"{spill_bucket_structure['runtime_folder']}/model_prediction_response.txt"
+
+                with stage_timer.stage("presigning"):
+                    presigned_download_url = await run_s3_operation(aws_plugin.generate_presigned_download_url, s3_client, config.RUNTIME_BUCKET_NAME, model_prediction_response_preffix, transaction_id)
 
             if transformer_deployment:
                 logger.info(f"Transaction-id: {transaction_id}, Transformer is present for the model {model_id}, checking if the post transformer is present.")
-                data = await check_pre_or_post_transform_input_data_for_model(client, project_id, model_id, transformer_deployment.get("transformer_id"), "post_transform", kourier_transformer_url, transformer_headers, transaction_id)
+                with stage_timer.stage("post_transform"):
+                    data = await check_pre_or_post_transform_input_data_for_model(client, project_id, model_id, transformer_deployment.get("transformer_id"), "post_transform", kourier_transformer_url, transformer_headers, transaction_id)
 
                 if data == True:
                     if payload_type == "url":
@@ -188,7 +298,8 @@ async def model_prediction_service(request: Request, model_id: str, input_data:
 
                         post_processor_response_preffix = f"{bucket_structure['runtime_folder']}/post_processor_response.txt"
 
-                        presigned_upload_url = aws_plugin.generate_presigned_upload_url(s3_client, config.RUNTIME_BUCKET_NAME, post_processor_response_preffix, transaction_id)
+                        with stage_timer.stage("presigning"):
+                            presigned_upload_url = await run_s3_operation(aws_plugin.generate_presigned_upload_url, s3_client, config.RUNTIME_BUCKET_NAME, post_processor_response_preffix, transaction_id)
 
                         if not presigned_upload_url:
                             logger.error(f"Transaction-id: {transaction_id}, Failed to generate the presigned upload URL for the post processor response for the model {model_id}")
@@ -198,18 +309,23 @@ async def model_prediction_service(request: Request, model_id: str, input_data:
 
                     transformer_headers["payload_type"] = payload_type 
 
-                    output_data = await pre_or_post_transform_input_data_for_model(client, project_id, model_id, transformer_deployment.get("transformer_id"), "post_transform", kourier_transformer_url, transformer_headers, output_data, transaction_id)
+                    with stage_timer.stage("post_transform"):
+                        output_data = await pre_or_post_transform_input_data_for_model(client, project_id, model_id, transformer_deployment.get("transformer_id"), "post_transform", kourier_transformer_url, transformer_headers, output_data, transaction_id)
 
                     if output_data.get("payload_type") == "url":
 
                         logger.info(f"Transaction-id: {transaction_id}, Content type is {output_data.get('payload_type')}, generating the presigned download URL for the post processor response for the model {model_id}")
-                        presigned_download_url = aws_plugin.generate_presigned_download_url(s3_client, config.RUNTIME_BUCKET_NAME, post_processor_response_preffix, transaction_id)
-                        return {"output_data": None, "payload_type": output_data.get("payload_type"), "payload_url": presigned_download_url, "extractor" : None}
+                        with stage_timer.stage("presigning"):
+                            presigned_download_url = await run_s3_operation(aws_plugin.generate_presigned_download_url, s3_client, config.RUNTIME_BUCKET_NAME, post_processor_response_preffix, transaction_id)
+                        return idempotent_transaction.complete({"output_data": None, "payload_type": output_data.get("payload_type"), "payload_url": presigned_download_url, "extractor" : None})
                     
                     elif output_data.get("payload_type") == "content":
 
                         logger.info(f"Transaction-id: {transaction_id}, Content type is {output_data.get('payload_type')}, returning the output data for the model {model_id}")
-                        return {"output_data": output_data.get("data"), "payload_type": output_data.get("payload_type"), "payload_url": None, "extractor" : None}
+                        prediction_response = {"output_data": output_data.get("data"), "payload_type": output_data.get("payload_type"), "payload_url": None, "extractor" : None}
+                        if cache_key:
+                            store_cached_prediction(redis_client, cache_key, prediction_response, cache_ttl, transaction_id)
+                        return idempotent_transaction.complete(prediction_response)
                     
                     else:
                         logger.error(f"Transaction-id: {transaction_id}, Payload type {output_data.get('payload_type')} is not supported")
@@ -217,17 +333,25 @@ async def model_prediction_service(request: Request, model_id: str, input_data:
 
             if payload_type == "url":
                 logger.info(f"Transaction-id: {transaction_id}, Output data is None, returning the presigned download URL for the prediction response for the model {model_id}")
-                return {"output_data": None, "payload_type": payload_type, "payload_url": presigned_download_url, "extractor": DEPLOYMENT_SYSTEM_TO_EXTRACTOR_MAPPING.get(deployment_system)}
+                #A spilled binary response is stored as the model returned it, the JSON extractors do not apply
+                extractor = None if binary_input else DEPLOYMENT_SYSTEM_TO_EXTRACTOR_MAPPING.get(deployment_system)
+                return idempotent_transaction.complete({"output_data": None, "payload_type": payload_type, "payload_url": presigned_download_url, "extractor": extractor})
             
 
             logger.info(f"Transaction-id: {transaction_id}, Output data is present, returning the output data for the model {model_id}")
-            return {"output_data": output_data, "payload_type": payload_type, "payload_url": None, "extractor": None}
+            prediction_response = {"output_data": output_data, "payload_type": payload_type, "payload_url": None, "extractor": None}
+            if cache_key:
+                store_cached_prediction(redis_client, cache_key, prediction_response, cache_ttl, transaction_id)
+            return idempotent_transaction.complete(prediction_response)
     
     except json.JSONDecodeError as e:
         logger.error(f"Transaction-id: {transaction_id}, The model details for model {model_id} is not a valid JSON: {str(e)}")
         HTTPException(status_code=500, detail=f"The model details for model {model_id} is not a valid JSON: {str(e)}")
             
     except HTTPException as e:
+        if e.status_code >= 500 and is_deadline_exceeded():
+            logger.error(f"Transaction-id: {transaction_id}, The request deadline was exceeded while making prediction request to the deployed model {model_id}: {e.detail}")
+            raise HTTPException(status_code=504, detail=f"The request deadline was exceeded while making prediction request to the deployed model {model_id}")
         if e.status_code == 400:
             logger.info(f"Transaction-id: {transaction_id}, The model details for model {model_id} is not a valid JSON: {str(e)}")
         else:
@@ -243,8 +367,15 @@ async def model_prediction_service(request: Request, model_id: str, input_data:
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred while making prediction request to the deployed model {model_id}: {e}")
     
     finally:
+        stage_timer.finish()
+        if deadline_token:
+            reset_request_deadline(deadline_token)
+        if tenant_token:
+            reset_request_tenant(tenant_token)
+        if idempotent_transaction:
+            idempotent_transaction.release()
         logger.info(f"Closing the redis client for model {model_id}. if it was initialized")
-        if redis_client:
+        if redis_client and owns_redis_client:
             redis_plugin.close_redis_client(redis_client)
         
                 
\ No newline at end of file
@@ -15,11 +15,77 @@
 #  
 
 import boto3
+from botocore.config import Config
 from botocore.exceptions import BotoCoreError, ClientError
 from src.utils.logger_util import setup_logger  
 from src.models.env.env_config_DTO import EnvConfigDTO
+from src.models.env.performance_config_DTO import get_performance_config
+from src.utils.tracing_util import traced
 from fastapi.exceptions import HTTPException
+from prometheus_client import Histogram
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps, partial
 from boto3 import client
+import contextvars
+import asyncio
+import time
+
+S3_OPERATION_DURATION_SECONDS = Histogram(
+    "vps_s3_operation_duration_seconds",
+    "Duration of the S3 operations and presigning of the gateway, by operation and outcome.",
+    ["operation", "result"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+
+_s3_executor = None
+
+def observe_s3_operation(operation: str):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start_time = time.perf_counter()
+            result = "error"
+            try:
+                response = function(*args, **kwargs)
+                result = "success"
+                return response
+            finally:
+                S3_OPERATION_DURATION_SECONDS.labels(operation=operation, result=result).observe(time.perf_counter() - start_time)
+        return wrapper
+    return decorator
+
+def get_s3_executor():
+    global _s3_executor
+    if _s3_executor is None:
+        _s3_executor = ThreadPoolExecutor(max_workers=get_performance_config().S3_MAX_POOL_CONNECTIONS, thread_name_prefix="vps-s3")
+    return _s3_executor
+
+async def run_s3_operation(function, *args, **kwargs):
+    """
+    Runs a blocking S3 call or a presigning of the AWSFeaturePlugin on the S3 thread pool, so SigV4
+    signing and S3 round trips do not stall the event loop. The pool has one thread per pooled
+    connection and the tracing context of the request is carried over.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(get_s3_executor(), partial(context.run, function, *args, **kwargs))
+
+def shutdown_s3_executor():
+    global _s3_executor
+    if _s3_executor is not None:
+        _s3_executor.shutdown(wait=True)
+        _s3_executor = None
+
+def build_s3_client_config():
+    performance_config = get_performance_config()
+    return Config(
+        max_pool_connections=performance_config.S3_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=performance_config.S3_TCP_KEEPALIVE,
+        connect_timeout=performance_config.S3_CONNECT_TIMEOUT_SECONDS,
+        read_timeout=performance_config.S3_READ_TIMEOUT_SECONDS,
+        retries={"mode": performance_config.S3_RETRY_MODE, "max_attempts": performance_config.S3_MAX_ATTEMPTS},
+        s3={"addressing_style": performance_config.S3_ADDRESSING_STYLE},
+        signature_version="s3v4"
+    )
 
 class AWSFeaturePlugin:
     def __init__(self):
@@ -31,7 +97,9 @@ class AWSFeaturePlugin:
             self.logger.info("Creating S3 client")
             return boto3.client(
                 "s3",
-                region_name=self.config.AWS_REGION
+                region_name=self.config.AWS_REGION,
+                endpoint_url=get_performance_config().S3_ENDPOINT_URL or None,
+                config=build_s3_client_config()
             )
         except BotoCoreError as e:
             self.logger.error(f"Failed to create S3 client due to BotoCoreError: {e}")
@@ -44,9 +112,18 @@ class AWSFeaturePlugin:
             raise HTTPException(status_code=500, detail="An unexpected error occurred while creating S3 client.")
 
         
+    def warm_up_s3_client(self, s3_client : client, bucket_name: str):
+        # The first presigning resolves the credentials and the endpoint rules, which later requests then reuse
+        try:
+            s3_client.generate_presigned_url('get_object', Params={'Bucket': bucket_name, 'Key': 'warm-up'}, ExpiresIn=60)
+        except Exception as e:
+            self.logger.warning(f"Failed to warm up the S3 client: {e}")
+
     def close_s3_client(self, s3_client : client):
         s3_client.close()
     
+    @traced("s3.generate_presigned_url")
+    @observe_s3_operation("generate_presigned_url")
     def generate_presigned_download_url(self, s3_client : client, bucket_name, s3_key, transaction_id, expiration=300):
         try:
             self.logger.info(f"Transaction-id: {transaction_id}, Generating presigned URL for file: {s3_key} in bucket {bucket_name}")
@@ -64,6 +141,8 @@ class AWSFeaturePlugin:
             raise HTTPException(status_code=500, detail="An unexpected error occurred while generating presigned URL.")
     
     
+    @traced("s3.generate_presigned_post")
+    @observe_s3_operation("generate_presigned_post")
     def generate_presigned_upload_url(self, s3_client: client, bucket_name: str, s3_key: str, transaction_id: str, file_type:str = "text/plain", expiration=300):
         try:
             self.logger.info(f"Transaction-id: {transaction_id}, Generating presigned upload URL for file: {s3_key} in bucket {bucket_name}")
@@ -94,10 +173,14 @@ class AWSFeaturePlugin:
             raise HTTPException(status_code=500, detail="An unexpected error occurred while generating presigned upload URL.")
         
     
-    def create_mutlipart_upload_and_retrieve_upload_id(self, s3_client: client, bucket_name: str, s3_key: str, transaction_id: str):
+    @traced("s3.create_multipart_upload")
+    @observe_s3_operation("create_multipart_upload")
+    def create_mutlipart_upload_and_retrieve_upload_id(self, s3_client: client, bucket_name: str, s3_key: str, transaction_id: str, content_encoding: str = None):
         try:
             self.logger.info(f"Transaction-id: {transaction_id}, Creating multipart upload for file: {s3_key} in bucket {bucket_name}")
-            response = s3_client.create_multipart_upload(Bucket=bucket_name, Key=s3_key)
+            # Presigned downloads return the Content-Encoding, so HTTP clients decompress the object transparently
+            extra_arguments = {"ContentEncoding": content_encoding} if content_encoding else {}
+            response = s3_client.create_multipart_upload(Bucket=bucket_name, Key=s3_key, **extra_arguments)
             self.logger.info(f"Transaction-id: {transaction_id}, Multipart upload created successfully for {s3_key} in bucket {bucket_name}")
             return response['UploadId']
         except ClientError as e:
@@ -107,6 +190,8 @@ class AWSFeaturePlugin:
             self.logger.error(f"Transaction-id: {transaction_id}, Unexpected error while trying to create multipart upload: {e}")
             raise HTTPException(status_code=500, detail="An unexpected error occurred while creating multipart upload.")
         
+    @traced("s3.upload_part")
+    @observe_s3_operation("upload_part")
     def upload_chunk_part_for_the_multipart_upload(self, s3_client: client, upload_id: str, part_number: int, chunk: bytes, s3_key: str, bucket_name: str, transaction_id: str):
         try:
             self.logger.info(f"Transaction-id: {transaction_id}, Uploading chunk part {part_number} for file: {s3_key} in bucket {bucket_name}")
@@ -120,6 +205,8 @@ class AWSFeaturePlugin:
             self.logger.error(f"Transaction-id: {transaction_id}, Unexpected error while trying to upload chunk part {part_number}: {e}")
             raise HTTPException(status_code=500, detail="An unexpected error occurred while uploading chunk part.")
         
+    @traced("s3.complete_multipart_upload")
+    @observe_s3_operation("complete_multipart_upload")
     def complete_multipart_upload_for_the_multipart_upload(self, s3_client: client, upload_id: str, s3_key: str, bucket_name: str, parts : list, transaction_id: str):
         try:
             self.logger.info(f"Transaction-id: {transaction_id}, Completing multipart upload for file: {s3_key} in bucket {bucket_name}")
@@ -132,4 +219,26 @@ class AWSFeaturePlugin:
         except Exception as e:
             self.logger.error(f"Transaction-id: {transaction_id}, Unexpected error while trying to complete multipart upload: {e}")
             raise HTTPException(status_code=500, detail="An unexpected error occurred while completing multipart upload.")
-        
\ No newline at end of file
+        
+    @traced("s3.get_object")
+    @observe_s3_operation("get_object")
+    def open_object_stream(self, s3_client: client, bucket_name: str, s3_key: str, transaction_id: str, etag: str = None):
+        """
+        Returns the GetObject response, its Body is read in parts by the caller and its ContentLength and ETag
+        describe the object being read. None when the object does not exist. With an etag the object is only
+        returned while it is unchanged, a ClientError with the PreconditionFailed code is raised otherwise.
+        """
+        try:
+            self.logger.info(f"Transaction-id: {transaction_id}, Opening the stream of file: {s3_key} in bucket {bucket_name}")
+            if etag:
+                return s3_client.get_object(Bucket=bucket_name, Key=s3_key, IfMatch=etag)
+            return s3_client.get_object(Bucket=bucket_name, Key=s3_key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                self.logger.info(f"Transaction-id: {transaction_id}, File {s3_key} does not exist in bucket {bucket_name}")
+                return None
+            self.logger.error(f"Transaction-id: {transaction_id}, Failed to open the stream of the file due to ClientError: {e}")
+            raise
+        except Exception as e:
+            self.logger.error(f"Transaction-id: {transaction_id}, Unexpected error while trying to open the stream of the file: {e}")
+            raise HTTPException(status_code=500, detail="An unexpected error occurred while reading the file.")
@@ -0,0 +1,131 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+from src.models.env.performance_config_DTO import get_performance_config
+from src.utils.logger_util import setup_logger
+from fastapi.responses import Response
+import json
+
+logger = setup_logger(__name__)
+
+INFERENCE_HEADER_CONTENT_LENGTH = "inference-header-content-length"
+BINARY_CONTENT_TYPE = "application/octet-stream"
+
+# Deployment systems speaking the v2 (Open Inference) protocol
+BINARY_DEPLOYMENT_SYSTEMS = ("KserveV2", "MLFlow")
+
+class BinaryInferencePayload:
+    """
+    A JSON inference header followed by the raw bytes of its tensors, as in the binary data extension
+    of the Open Inference Protocol. `data` is a memoryview over the received body, the tensor bytes are
+    never copied or converted to JSON by the gateway.
+    """
+
+    def __init__(self, header: dict, data: memoryview, tensor_key: str = "inputs"):
+        self.header = header
+        self.data = data
+        self.tensor_key = tensor_key
+
+    def tensors(self):
+        # Yields (tensor, bytes) for every tensor sent as binary data, in the order of the header
+        offset = 0
+        for tensor in self.header.get(self.tensor_key, []):
+            size = (tensor.get("parameters") or {}).get("binary_data_size")
+            if size is None:
+                continue
+            yield tensor, self.data[offset:offset + size]
+            offset += size
+
+    def encode_header(self):
+        return json.dumps(self.header, separators=(",", ":")).encode("utf-8")
+
+class BinaryInferenceStream:
+    """Request body of a binary model call. Unlike an async generator it can be sent again by a retry."""
+
+    def __init__(self, header: bytes, data: memoryview):
+        self.header = header
+        self.data = data
+
+    async def __aiter__(self):
+        yield self.header
+        if len(self.data):
+            yield self.data
+
+def parse_binary_inference_body(body: bytes, header_length, tensor_key: str = "inputs"):
+    """
+    Splits a binary inference body at the Inference-Header-Content-Length, raises ValueError for a
+    malformed body or when the binary_data_size of the tensors do not add up to the bytes after the header.
+    """
+    try:
+        header_length = int(header_length)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid Inference-Header-Content-Length: {header_length}")
+    if header_length < 0 or header_length > len(body):
+        raise ValueError(f"Inference-Header-Content-Length {header_length} is outside of the {len(body)} bytes body")
+
+    view = memoryview(body)
+    header = json.loads(view[:header_length].tobytes())
+    if not isinstance(header, dict):
+        raise ValueError("The inference header must be a JSON object")
+
+    payload = BinaryInferencePayload(header, view[header_length:], tensor_key)
+    expected_size = 0
+    for tensor in header.get(tensor_key, []):
+        size = (tensor.get("parameters") or {}).get("binary_data_size")
+        if size is not None:
+            if not isinstance(size, int) or size < 0:
+                raise ValueError(f"Invalid binary_data_size of the tensor {tensor.get('name')}")
+            expected_size += size
+    if expected_size != len(payload.data):
+        raise ValueError(f"The binary_data_size of the tensors add up to {expected_size} bytes, the body has {len(payload.data)} after the header")
+    return payload
+
+def build_binary_model_request(payload: BinaryInferencePayload, deployment_system: str, model_details: dict, transaction_id: str):
+    """
+    Returns (content, headers) of the binary model call. Like the JSON envelope of KserveV2, a single
+    input without a name, datatype or shape gets them from the model details.
+    """
+    header = dict(payload.header)
+    inputs = [dict(tensor) for tensor in header.get("inputs", [])]
+    header["inputs"] = inputs
+
+    model_input = (model_details or {}).get("input") or {}
+    if deployment_system == "KserveV2" and len(inputs) == 1:
+        inputs[0].setdefault("name", model_input.get("name"))
+        inputs[0].setdefault("datatype", model_input.get("data_type"))
+        inputs[0].setdefault("shape", model_input.get("dims"))
+
+    parameters = dict(header.get("parameters") or {})
+    if get_performance_config().BINARY_TENSOR_OUTPUTS_ENABLED and "binary_data_output" not in parameters and not header.get("outputs"):
+        parameters["binary_data_output"] = True
+    if parameters:
+        header["parameters"] = parameters
+
+    encoded_header = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    logger.info(f"Transaction-id: {transaction_id}, Sending {len(inputs)} input tensors with {len(payload.data)} bytes of binary data to the {deployment_system} model")
+    headers = {
+        "Content-Type": BINARY_CONTENT_TYPE,
+        "Content-Length": str(len(encoded_header) + len(payload.data)),
+        "Inference-Header-Content-Length": str(len(encoded_header))
+    }
+    return BinaryInferenceStream(encoded_header, payload.data), headers
+
+def build_binary_prediction_response(response: dict):
+    """
+    Returns the /predict response of binary outputs: the prediction response as the JSON header, its
+    output_data being the inference header of the model, followed by the tensor bytes of the model.
+    """
+    payload = response["output_data"]
+    header = json.dumps({**response, "output_data": payload.header}, separators=(",", ":")).encode("utf-8")
+    return Response(content=b"".join((header, payload.data)), media_type=BINARY_CONTENT_TYPE, headers={"Inference-Header-Content-Length": str(len(header))})
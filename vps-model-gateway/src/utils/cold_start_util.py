@@ -0,0 +1,272 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from src.models.env.performance_config_DTO import PerformanceConfigDTO, get_performance_config
+from src.utils.logger_util import setup_logger
+from src.utils.deadline_util import get_remaining_deadline
+from src.utils.prediction_metrics_util import bounded_model_id_label
+from src.utils.retry_transport_util import COLD_START_EXTENSION
+from fastapi import FastAPI, HTTPException
+from prometheus_client import Counter, Histogram
+from contextlib import AsyncExitStack, asynccontextmanager
+from collections import OrderedDict
+import asyncio
+import httpx
+import time
+
+logger = setup_logger(__name__)
+
+# Answered by the Knative activator and the Kourier gateway while a revision scaled to zero has no ready pod yet
+COLD_START_RETRYABLE_STATUS_CODES = (502, 503)
+
+# Weight of the latest observation in the moving averages of the time between requests and the warm latency
+EWMA_ALPHA = 0.2
+
+MODEL_COLD_STARTS_TOTAL = Counter(
+    "vps_model_cold_starts_total",
+    "Calls to deployed models that waited for a scale up from zero, by model and outcome (served, failed, timed_out).",
+    ["model_id", "outcome"]
+)
+
+MODEL_COLD_START_DURATION_SECONDS = Histogram(
+    "vps_model_cold_start_duration_seconds",
+    "Time until a deployed model scaling up from zero answered with the response headers.",
+    ["model_id"],
+    buckets=(1, 2, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300)
+)
+
+MODEL_COLD_START_RETRIES_TOTAL = Counter(
+    "vps_model_cold_start_retries_total",
+    "Calls to models predicted to be cold that were sent again, by the reason of the retry.",
+    ["reason"]
+)
+
+MODEL_KEEP_WARM_PINGS_TOTAL = Counter(
+    "vps_model_keep_warm_pings_total",
+    "Readiness pings sent to keep the deployed models from scaling to zero, by outcome (ready, not_ready, failed).",
+    ["outcome"]
+)
+
+def get_keep_warm_url(kourier_model_url: str):
+    # Readiness endpoint next to the prediction endpoint, None for the transports that have none
+    if kourier_model_url.endswith(":predict"):
+        return kourier_model_url[:-len(":predict")]
+    if kourier_model_url.endswith("/infer"):
+        return kourier_model_url[:-len("/infer")] + "/ready"
+    if kourier_model_url.endswith("/completions"):
+        return kourier_model_url[:-len("/completions")] + "/models"
+    return None
+
+class ModelActivity:
+    def __init__(self):
+        self.requests = 0
+        self.last_request_at = None
+        self.last_active_at = None # Last request or successful keep-warm ping
+        self.mean_interval = None
+        self.warm_latency = None
+        self.pinged_at = None
+        self.keep_warm_url = None
+        self.keep_warm_headers = {}
+
+class ColdStartTracker:
+    """
+    Tracks the activity of every model called by this worker. A model idle for longer than
+    COLD_START_IDLE_SECONDS is predicted to be scaled to zero, and its call is counted as a cold
+    start when the activator answered 502/503 first, or when the headers took both COLD_START_MIN_SECONDS
+    and COLD_START_LATENCY_FACTOR times the known warm latency of the model. The first call of a model
+    has no warm latency to compare with, a slow model is not taken for a cold start then. The time
+    between requests drives the keep-warm pings.
+    """
+
+    def __init__(self):
+        self.models = OrderedDict()
+
+    def record_request(self, model_id: str, kourier_model_url: str, model_headers: dict, config: PerformanceConfigDTO = None):
+        # Returns whether the model is predicted to be cold
+        config = config or get_performance_config()
+        now = time.monotonic()
+        activity = self.models.get(model_id)
+        if activity is None:
+            activity = self.models[model_id] = ModelActivity()
+            while len(self.models) > config.COLD_START_MAX_MODELS:
+                self.models.popitem(last=False)
+        self.models.move_to_end(model_id)
+
+        cold = activity.last_active_at is None or now - activity.last_active_at >= config.COLD_START_IDLE_SECONDS
+        if activity.last_request_at is not None:
+            interval = now - activity.last_request_at
+            activity.mean_interval = interval if activity.mean_interval is None else (1 - EWMA_ALPHA) * activity.mean_interval + EWMA_ALPHA * interval
+        activity.requests += 1
+        activity.last_request_at = activity.last_active_at = now
+        activity.keep_warm_url = get_keep_warm_url(kourier_model_url)
+        activity.keep_warm_headers = {name: value for name, value in (model_headers or {}).items() if name.lower() != "content-type"}
+        return cold and config.COLD_START_ENABLED
+
+    def observe_response(self, model_id: str, duration: float, predicted_cold: bool, config: PerformanceConfigDTO = None, activator_retried: bool = False):
+        # Returns whether the call was a cold start, the other ones make up the warm latency of the model
+        activity = self.models.get(model_id)
+        if activity is None:
+            return False
+        activity.last_active_at = time.monotonic()
+        config = config or get_performance_config()
+        if predicted_cold:
+            if activator_retried:
+                return True
+            if activity.warm_latency is None:
+                # Neither a cold start nor a warm latency, the duration may well include a scale up
+                return False
+            if duration >= max(config.COLD_START_MIN_SECONDS, config.COLD_START_LATENCY_FACTOR * activity.warm_latency):
+                return True
+        activity.warm_latency = duration if activity.warm_latency is None else (1 - EWMA_ALPHA) * activity.warm_latency + EWMA_ALPHA * duration
+        return False
+
+    def record_ping(self, model_id: str, ready: bool):
+        activity = self.models.get(model_id)
+        if activity is not None and ready:
+            activity.last_active_at = time.monotonic()
+
+    def get_keep_warm_candidates(self):
+        """
+        Returns (model_id, url, headers) of the models to ping: requested regularly enough to trust
+        their mean time between requests, idle for KEEP_WARM_IDLE_SECONDS, and not idle for so long
+        that the traffic pattern stopped predicting the next request.
+        """
+        config = get_performance_config()
+        now = time.monotonic()
+        candidates = []
+        for model_id, activity in self.models.items():
+            if activity.keep_warm_url is None or activity.requests < config.KEEP_WARM_MIN_REQUESTS:
+                continue
+            if activity.mean_interval is None or activity.mean_interval > config.KEEP_WARM_MAX_INTERVAL_SECONDS:
+                continue
+            if now - activity.last_request_at >= activity.mean_interval * config.KEEP_WARM_INTERVAL_TOLERANCE:
+                continue
+            if now - activity.last_active_at < config.KEEP_WARM_IDLE_SECONDS:
+                continue
+            if activity.pinged_at is not None and now - activity.pinged_at < config.KEEP_WARM_IDLE_SECONDS:
+                continue
+            activity.pinged_at = now
+            candidates.append((model_id, activity.keep_warm_url, activity.keep_warm_headers))
+        return candidates
+
+    def clear(self):
+        self.models.clear()
+
+_cold_starts = ColdStartTracker()
+
+def get_cold_start_tracker():
+    return _cold_starts
+
+def has_time_for_retry(backoff: float):
+    remaining = get_remaining_deadline()
+    return remaining is None or remaining > backoff
+
+async def open_cold_model_stream(stack: AsyncExitStack, client: httpx.AsyncClient, model_id: str, url: str, headers, content, extensions: dict, transaction_id: str, config: PerformanceConfigDTO):
+    """
+    Opens the response stream of a call to a model predicted to be cold. The call is never hedged and
+    waits at most COLD_START_CONNECT_TIMEOUT_SECONDS for a connection, the response may take the rest
+    of the deadline. It is sent again after a 502/503 of the activator, or when no connection was opened
+    in time, as long as the body can be replayed.
+    """
+    extensions = {**extensions, COLD_START_EXTENSION: True}
+    replayable = isinstance(content, bytes)
+    model_id_label = bounded_model_id_label(model_id)
+    started = time.perf_counter()
+
+    attempt = 0
+    while True:
+        can_retry = replayable and attempt < config.COLD_START_MAX_RETRIES and has_time_for_retry(config.COLD_START_RETRY_BACKOFF_SECONDS)
+        attempt_stack = AsyncExitStack()
+        try:
+            response = await attempt_stack.enter_async_context(client.stream("POST", url, headers=headers, content=content, extensions=extensions))
+        except (httpx.ConnectTimeout, httpx.PoolTimeout):
+            # The request was not sent, so sending it again is safe whether the model is idempotent or not
+            if not can_retry:
+                raise
+            reason = "connect_timeout"
+        except httpx.ReadTimeout:
+            MODEL_COLD_STARTS_TOTAL.labels(model_id=model_id_label, outcome="timed_out").inc()
+            logger.error(f"Transaction-id: {transaction_id}, The deployed model {model_id} did not answer before the request deadline while scaling up from zero")
+            raise HTTPException(status_code=504, detail=f"The deployed model {model_id} did not answer before the request deadline while scaling up from zero")
+        else:
+            if response.status_code in COLD_START_RETRYABLE_STATUS_CODES and can_retry:
+                await attempt_stack.aclose()
+                reason = str(response.status_code)
+            else:
+                await stack.enter_async_context(attempt_stack)
+                duration = time.perf_counter() - started
+                if response.status_code in COLD_START_RETRYABLE_STATUS_CODES:
+                    MODEL_COLD_STARTS_TOTAL.labels(model_id=model_id_label, outcome="failed").inc()
+                elif response.status_code < 500 and _cold_starts.observe_response(model_id, duration, True, config, activator_retried=attempt > 0):
+                    MODEL_COLD_STARTS_TOTAL.labels(model_id=model_id_label, outcome="served").inc()
+                    MODEL_COLD_START_DURATION_SECONDS.labels(model_id=model_id_label).observe(duration)
+                    logger.info(f"Transaction-id: {transaction_id}, The deployed model {model_id} answered after a cold start of {duration:.2f}s")
+                return response
+
+        MODEL_COLD_START_RETRIES_TOTAL.labels(reason=reason).inc()
+        logger.warning(f"Transaction-id: {transaction_id}, The deployed model {model_id} is still scaling up from zero ({reason}), sending the call again")
+        await asyncio.sleep(config.COLD_START_RETRY_BACKOFF_SECONDS)
+        attempt += 1
+
+@asynccontextmanager
+async def stream_model_request(client: httpx.AsyncClient, model_id: str, url: str, headers, content, extensions: dict, transaction_id: str):
+    # client.stream("POST", ...) for a deployed model, with the cold start handling of the models predicted to be cold
+    config = get_performance_config()
+    predicted_cold = _cold_starts.record_request(model_id, url, headers, config)
+    async with AsyncExitStack() as stack:
+        if predicted_cold:
+            response = await open_cold_model_stream(stack, client, model_id, url, headers, content, extensions, transaction_id, config)
+        else:
+            started = time.perf_counter()
+            response = await stack.enter_async_context(client.stream("POST", url, headers=headers, content=content, extensions=extensions))
+            if response.status_code < 500:
+                _cold_starts.observe_response(model_id, time.perf_counter() - started, False, config)
+        yield response
+
+async def ping_model(client: httpx.AsyncClient, model_id: str, url: str, headers: dict, timeout: float):
+    try:
+        response = await asyncio.wait_for(client.get(url, headers=headers), timeout)
+    except (httpx.HTTPError, asyncio.TimeoutError) as e:
+        MODEL_KEEP_WARM_PINGS_TOTAL.labels(outcome="failed").inc()
+        logger.warning(f"Keep-warm ping to the deployed model {model_id} failed: {e!r}")
+        return False
+    ready = response.status_code < 400
+    MODEL_KEEP_WARM_PINGS_TOTAL.labels(outcome="ready" if ready else "not_ready").inc()
+    _cold_starts.record_ping(model_id, ready)
+    return ready
+
+async def run_keep_warm(app: FastAPI):
+    while True:
+        config = get_performance_config()
+        await asyncio.sleep(config.KEEP_WARM_CHECK_INTERVAL_SECONDS)
+        try:
+            candidates = _cold_starts.get_keep_warm_candidates()
+            if not candidates:
+                continue
+            semaphore = asyncio.Semaphore(config.KEEP_WARM_MAX_CONCURRENCY)
+
+            async def ping(model_id: str, url: str, headers: dict):
+                async with semaphore:
+                    return await ping_model(app.state.http_client, model_id, url, headers, config.KEEP_WARM_TIMEOUT_SECONDS)
+
+            results = await asyncio.gather(*(ping(*candidate) for candidate in candidates))
+            logger.info(f"Kept {sum(results)} of {len(candidates)} models warm")
+        except Exception as e:
+            logger.error(f"Keep-warm pings failed: {e!r}")
+
+def start_keep_warm(app: FastAPI):
+    if not get_performance_config().KEEP_WARM_ENABLED:
+        return None
+    return asyncio.create_task(run_keep_warm(app))
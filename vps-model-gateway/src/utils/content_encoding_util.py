@@ -0,0 +1,179 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+from src.models.env.performance_config_DTO import PerformanceConfigDTO, get_performance_config
+from src.utils.logger_util import setup_logger
+from fastapi import Request
+from fastapi.responses import Response
+from prometheus_client import Counter
+import asyncio
+import gzip
+import json
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = setup_logger(__name__)
+
+CONTENT_ENCODING_BYTES_TOTAL = Counter(
+    "vps_content_encoding_bytes_total",
+    "Payload bytes before (identity) and after (encoded) compression, by target and content encoding.",
+    ["target", "encoding", "state"]
+)
+
+# Server preference when the client accepts several encodings with the same quality
+PREFERRED_ENCODINGS = ("zstd", "br", "gzip")
+
+def get_supported_encodings():
+    encodings = ["gzip"]
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    return encodings
+
+def parse_accept_encoding(accept_encoding: str):
+    # Returns {coding: quality} of an Accept-Encoding header
+    qualities = {}
+    for item in (accept_encoding or "").split(","):
+        coding, _, parameters = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        parameter_name, _, value = parameters.strip().partition("=")
+        if parameter_name.strip().lower() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        qualities[coding] = quality
+    return qualities
+
+def negotiate_content_encoding(accept_encoding: str):
+    """Returns the best supported encoding the client accepts, None when the response goes out as it is."""
+    qualities = parse_accept_encoding(accept_encoding)
+    candidates = []
+    for rank, encoding in enumerate(PREFERRED_ENCODINGS):
+        if encoding not in get_supported_encodings():
+            continue
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > 0:
+            candidates.append((-quality, rank, encoding))
+    return min(candidates)[2] if candidates else None
+
+def compress_body(body: bytes, encoding: str, config: PerformanceConfigDTO = None):
+    config = config or get_performance_config()
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=config.COMPRESSION_GZIP_LEVEL, mtime=0)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=config.COMPRESSION_ZSTD_LEVEL).compress(body)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(body, quality=config.COMPRESSION_BROTLI_QUALITY)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+def decompress_body(body: bytes, encoding: str):
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    if encoding == "br" and brotli is not None:
+        return brotli.decompress(body)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+async def compress_payload(body: bytes, encoding: str, target: str, config: PerformanceConfigDTO = None):
+    # Compresses on a worker thread above COMPRESSION_OFFLOAD_BYTES so large payloads do not stall the event loop
+    config = config or get_performance_config()
+    if len(body) >= config.COMPRESSION_OFFLOAD_BYTES:
+        encoded = await asyncio.get_running_loop().run_in_executor(None, compress_body, body, encoding, config)
+    else:
+        encoded = compress_body(body, encoding, config)
+    CONTENT_ENCODING_BYTES_TOTAL.labels(target=target, encoding=encoding, state="identity").inc(len(body))
+    CONTENT_ENCODING_BYTES_TOTAL.labels(target=target, encoding=encoding, state="encoded").inc(len(encoded))
+    return encoded
+
+async def encode_prediction_response(request: Request, response: dict):
+    """
+    Returns the /predict response compressed with the encoding negotiated from Accept-Encoding, or the
+    response as it is when compression is disabled, not accepted or the body is below COMPRESSION_MIN_BYTES.
+    """
+    config = get_performance_config()
+    if not config.COMPRESSION_RESPONSE_ENABLED or not isinstance(response, dict):
+        return response
+    encoding = negotiate_content_encoding(request.headers.get("accept-encoding"))
+    if encoding is None:
+        return response
+
+    # Same serialization as the JSONResponse FastAPI builds for a returned dict
+    body = json.dumps(response, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+    if len(body) < config.COMPRESSION_MIN_BYTES:
+        return response
+    encoded = await compress_payload(body, encoding, "response", config)
+    return Response(content=encoded, media_type="application/json", headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"})
+
+def get_model_request_encoding(notes: dict):
+    # Models whose server accepts compressed bodies opt in with "request_encoding" in their notes
+    encoding = notes.get("request_encoding") if isinstance(notes, dict) else None
+    if encoding is None:
+        return None
+    if encoding not in get_supported_encodings():
+        logger.warning(f"Unsupported request_encoding {encoding} in the model notes, sending the request uncompressed")
+        return None
+    return encoding
+
+class GzipStreamEncoder:
+    """
+    Gzips a stream of chunks into S3 multipart parts. Compressed output is buffered until it reaches
+    the part size, because every part but the last one must be at least 5MB.
+    """
+
+    def __init__(self, part_size: int, level: int):
+        self.part_size = part_size
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        self.buffer = bytearray()
+        self.identity_bytes = 0
+        self.encoded_bytes = 0
+
+    def write(self, chunk: bytes):
+        # Returns the parts that are ready to upload
+        self.identity_bytes += len(chunk)
+        self.buffer += self.compressor.compress(chunk)
+        return self.take_parts()
+
+    def finish(self):
+        self.buffer += self.compressor.flush()
+        parts = self.take_parts()
+        if self.buffer:
+            parts.append(bytes(self.buffer))
+            self.encoded_bytes += len(self.buffer)
+            self.buffer.clear()
+        CONTENT_ENCODING_BYTES_TOTAL.labels(target="s3_spill", encoding="gzip", state="identity").inc(self.identity_bytes)
+        CONTENT_ENCODING_BYTES_TOTAL.labels(target="s3_spill", encoding="gzip", state="encoded").inc(self.encoded_bytes)
+        return parts
+
+    def take_parts(self):
+        parts = []
+        while len(self.buffer) >= self.part_size:
+            parts.append(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+            self.encoded_bytes += self.part_size
+        return parts
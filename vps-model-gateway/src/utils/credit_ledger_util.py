@@ -0,0 +1,134 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+from prometheus_client import Counter
+from rediscluster import RedisCluster
+from redis.exceptions import RedisError
+from fastapi import HTTPException
+from src.models.env.performance_config_DTO import get_performance_config
+from src.utils.validate_entity_balance_util import validate_entity_balance
+from src.utils.redis_feature_plugin import RedisFeaturePlugin
+from src.utils.logger_util import setup_logger
+from httpx import AsyncClient
+import contextvars
+import asyncio
+
+logger = setup_logger(__name__)
+
+CREDIT_LEDGER_KEY_PREFIX = "vps:credit-ledger"
+
+CREDIT_LEDGER_CHECKS_TOTAL = Counter(
+    "vps_credit_ledger_checks_total",
+    "Balance checks by outcome: reserved (served from a block), sync (payment service on the request path), refresh or refresh_failed (background).",
+    ["result"]
+)
+
+# Keeps the background refreshes referenced until they finish
+_refresh_tasks = set()
+
+def build_credit_ledger_key(entity_id: str, model_id: str, vps_app_id: str, vps_env_type: str):
+    # The payment service decision depends on the app and the environment too, the hash tag keeps both keys on one slot
+    return f"{CREDIT_LEDGER_KEY_PREFIX}:{{{entity_id}:{model_id}}}:{vps_app_id or '-'}:{vps_env_type or '-'}"
+
+async def validate_entity_balance_with_ledger(client: AsyncClient, redis_client: RedisCluster, entity_id: str, model_id: str, vps_app_id: str, vps_env_type: str, transaction_id: str):
+    """
+    Validates the balance of the entity from its block of pre approved predictions in Redis.
+
+    A successful payment service check grants CREDIT_LEDGER_BLOCK_SIZE predictions for
+    CREDIT_LEDGER_TTL_SECONDS, each request takes one with DECR. The block is renewed in the
+    background once it runs low, and the payment service is only called on the request path when
+    the block is exhausted or unknown, so an entity can overspend by at most one block.
+    """
+    config = get_performance_config()
+    if not config.CREDIT_LEDGER_ENABLED or redis_client is None:
+        return await validate_entity_balance(client, entity_id, model_id, vps_app_id, vps_env_type, transaction_id)
+
+    key = build_credit_ledger_key(entity_id, model_id, vps_app_id, vps_env_type)
+    try:
+        remaining = redis_client.decr(key)
+        if remaining == -1:
+            # DECR created the key, make sure it expires even if the check below never completes
+            redis_client.expire(key, config.CREDIT_LEDGER_TTL_SECONDS)
+    except RedisError as e:
+        logger.error(f"Transaction-id: {transaction_id}, Redis error while reading the credit ledger, validating the balance with the payment service: {e}")
+        return await validate_entity_balance(client, entity_id, model_id, vps_app_id, vps_env_type, transaction_id)
+
+    if remaining >= 0:
+        logger.info(f"Transaction-id: {transaction_id}, Entity {entity_id} has {remaining} pre approved predictions left for the model {model_id}")
+        CREDIT_LEDGER_CHECKS_TOTAL.labels(result="reserved").inc()
+        if remaining < config.CREDIT_LEDGER_REFRESH_THRESHOLD:
+            schedule_credit_refresh(client, redis_client, key, entity_id, model_id, vps_app_id, vps_env_type, transaction_id)
+        return
+
+    logger.info(f"Transaction-id: {transaction_id}, No pre approved predictions left for entity {entity_id} and model {model_id}, validating the balance with the payment service")
+    CREDIT_LEDGER_CHECKS_TOTAL.labels(result="sync").inc()
+    try:
+        await validate_entity_balance(client, entity_id, model_id, vps_app_id, vps_env_type, transaction_id)
+    except HTTPException:
+        drop_credit_block(redis_client, key, transaction_id)
+        raise
+    # This request uses the first prediction of the new block
+    grant_credit_block(redis_client, key, config.CREDIT_LEDGER_BLOCK_SIZE - 1, transaction_id)
+
+def grant_credit_block(redis_client: RedisCluster, key: str, size: int, transaction_id: str):
+    try:
+        redis_client.set(key, size, ex=get_performance_config().CREDIT_LEDGER_TTL_SECONDS)
+    except RedisError as e:
+        logger.error(f"Transaction-id: {transaction_id}, Redis error while granting a credit block: {e}")
+
+def drop_credit_block(redis_client: RedisCluster, key: str, transaction_id: str):
+    try:
+        redis_client.delete(key)
+    except RedisError as e:
+        logger.error(f"Transaction-id: {transaction_id}, Redis error while dropping a credit block: {e}")
+
+def schedule_credit_refresh(client: AsyncClient, redis_client: RedisCluster, key: str, entity_id: str, model_id: str, vps_app_id: str, vps_env_type: str, transaction_id: str):
+    # One refresh per block across the replicas, the lock expires on its own if a replica dies mid refresh
+    config = get_performance_config()
+    try:
+        if not redis_client.set(f"{key}:refresh", 1, nx=True, ex=config.CREDIT_LEDGER_REFRESH_LOCK_SECONDS):
+            return
+    except RedisError as e:
+        logger.error(f"Transaction-id: {transaction_id}, Redis error while locking the credit refresh: {e}")
+        return
+
+    async def refresh():
+        # The redis client of the request is closed when it finishes, the refresh uses its own
+        redis_plugin = RedisFeaturePlugin()
+        refresh_redis_client = None
+        try:
+            await validate_entity_balance(client, entity_id, model_id, vps_app_id, vps_env_type, transaction_id)
+            refresh_redis_client = redis_plugin.create_redis_client()
+            if refresh_redis_client:
+                grant_credit_block(refresh_redis_client, key, config.CREDIT_LEDGER_BLOCK_SIZE, transaction_id)
+            CREDIT_LEDGER_CHECKS_TOTAL.labels(result="refresh").inc()
+        except HTTPException as e:
+            logger.info(f"Transaction-id: {transaction_id}, Credit refresh for entity {entity_id} and model {model_id} was refused: {e.detail}")
+            CREDIT_LEDGER_CHECKS_TOTAL.labels(result="refresh_failed").inc()
+            if e.status_code == 402:
+                refresh_redis_client = redis_plugin.create_redis_client()
+                if refresh_redis_client:
+                    drop_credit_block(refresh_redis_client, key, transaction_id)
+        except Exception as e:
+            logger.error(f"Transaction-id: {transaction_id}, Unexpected error while refreshing the credit block: {e}")
+            CREDIT_LEDGER_CHECKS_TOTAL.labels(result="refresh_failed").inc()
+        finally:
+            if refresh_redis_client:
+                redis_plugin.close_redis_client(refresh_redis_client)
+
+    # A fresh context, so the refresh is not bound to the deadline or the trace of the request that triggered it.
+    # The task copies the context it is created in, create_task only takes a context argument from Python 3.11
+    task = contextvars.Context().run(asyncio.get_running_loop().create_task, refresh())
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
@@ -0,0 +1,112 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+from src.models.env.performance_config_DTO import PerformanceConfigDTO, get_performance_config
+from src.utils.logger_util import setup_logger
+from contextvars import ContextVar
+import json
+import time
+
+logger = setup_logger(__name__)
+
+# Sent by clients with the time they are willing to wait, and forwarded to every upstream with the time that is left
+DEADLINE_HEADER = "vps-request-timeout-ms"
+
+class RequestDeadline:
+    def __init__(self, started_at: float, timeout: float, from_header: bool):
+        self.started_at = started_at
+        self.timeout = timeout
+        self.from_header = from_header
+
+    @property
+    def expires_at(self):
+        return self.started_at + self.timeout
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+_current_deadline = ContextVar("vps_request_deadline", default=None)
+
+def parse_deadline_header(value: str):
+    # Returns the requested timeout in seconds, None for a missing or invalid header
+    try:
+        timeout_ms = float(value)
+    except (TypeError, ValueError):
+        return None
+    return timeout_ms / 1000 if timeout_ms > 0 else None
+
+def start_request_deadline(header_value: str, transaction_id: str):
+    """
+    Makes the deadline of the request current and returns the token to reset it with. The header
+    can only shorten DEADLINE_MAX_SECONDS, without it DEADLINE_DEFAULT_SECONDS applies until the
+    model notes are known.
+    """
+    config = get_performance_config()
+    timeout = parse_deadline_header(header_value)
+    from_header = timeout is not None
+    if timeout is None:
+        timeout = config.DEADLINE_DEFAULT_SECONDS
+    timeout = min(timeout, config.DEADLINE_MAX_SECONDS)
+    logger.debug(f"Transaction-id: {transaction_id}, Request deadline is {timeout}s")
+    return _current_deadline.set(RequestDeadline(time.monotonic(), timeout, from_header))
+
+def apply_model_deadline(model: dict, transaction_id: str):
+    # Applies the "request_timeout_seconds" default of the model, a deadline sent by the client takes precedence
+    deadline = _current_deadline.get()
+    if deadline is None or deadline.from_header:
+        return
+    try:
+        notes = json.loads(model.get("notes")) if model.get("notes") else {}
+    except (TypeError, ValueError):
+        return
+    timeout = notes.get("request_timeout_seconds") if isinstance(notes, dict) else None
+    if isinstance(timeout, (int, float)) and timeout > 0:
+        deadline.timeout = min(timeout, get_performance_config().DEADLINE_MAX_SECONDS)
+        logger.info(f"Transaction-id: {transaction_id}, Using the request deadline of {deadline.timeout}s from the model notes")
+
+def restart_request_deadline():
+    # An accepted asynchronous prediction gets its whole deadline once a job worker picks it up
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.started_at = time.monotonic()
+
+def reset_request_deadline(token):
+    _current_deadline.reset(token)
+
+def get_remaining_deadline():
+    # Seconds left before the current request's deadline, None outside of a request
+    deadline = _current_deadline.get()
+    return deadline.remaining() if deadline is not None else None
+
+def is_deadline_exceeded():
+    remaining = get_remaining_deadline()
+    return remaining is not None and remaining <= 0
+
+def get_stage_timeout(upstream: str, config: PerformanceConfigDTO = None):
+    """
+    Returns the httpx timeout extension for a call to the upstream: tight connect and read timeouts
+    for the control plane, a long read only for the model, all capped by the remaining deadline.
+    """
+    config = config or get_performance_config()
+    if upstream == "model":
+        connect, read = config.MODEL_CONNECT_TIMEOUT_SECONDS, config.DEADLINE_MAX_SECONDS
+    elif upstream == "transformer":
+        connect, read = config.TRANSFORMER_CONNECT_TIMEOUT_SECONDS, config.TRANSFORMER_READ_TIMEOUT_SECONDS
+    else:
+        connect, read = config.CONTROL_PLANE_CONNECT_TIMEOUT_SECONDS, config.CONTROL_PLANE_READ_TIMEOUT_SECONDS
+
+    remaining = get_remaining_deadline()
+    if remaining is not None:
+        connect, read = min(connect, remaining), min(read, remaining)
+    return {"connect": connect, "read": read, "write": read, "pool": connect}
@@ -0,0 +1,69 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+from src.models.env.performance_config_DTO import get_performance_config
+from src.utils.logger_util import setup_logger
+from fastapi import Request
+from prometheus_client import Counter
+
+logger = setup_logger(__name__)
+
+# Set by nginx from the headers of the /auth/verify response, the values of the caller are always overwritten
+EDGE_AUTH_HEADER = "vps-edge-auth"
+EDGE_USERNAME_HEADER = "vps-auth-username"
+EDGE_ENTITY_ID_HEADER = "vps-auth-entity-id"
+EDGE_APP_ID_HEADER = "vps-auth-app-id"
+EDGE_AUTH_VERIFIED = "verified"
+
+EDGE_AUTH_VERIFICATIONS_TOTAL = Counter(
+    "vps_edge_auth_verifications_total",
+    "Token verifications requested by the nginx auth_request, by verdict (valid, invalid or error). Cached verdicts never reach the gateway.",
+    ["result"]
+)
+
+EDGE_AUTH_TRUSTED_REQUESTS_TOTAL = Counter(
+    "vps_edge_auth_trusted_requests_total",
+    "Predictions whose token validation was skipped because nginx already verified the token."
+)
+
+def build_edge_auth_headers(user_data: dict):
+    # Response headers of /auth/verify, nginx copies them to the proxied /predict request
+    return {
+        EDGE_USERNAME_HEADER: str(user_data.get("username") or ""),
+        EDGE_ENTITY_ID_HEADER: str(user_data.get("entity_id") or ""),
+        EDGE_APP_ID_HEADER: str(user_data.get("vps_app_id") or "")
+    }
+
+def get_edge_verified_user(request: Request, transaction_id: str):
+    """
+    Returns the user data nginx resolved for the token, in the shape of the user admin response, or
+    None when edge auth is disabled, the request did not come through a trusted proxy or it was not verified.
+    """
+    config = get_performance_config()
+    if not config.EDGE_AUTH_ENABLED or request.headers.get(EDGE_AUTH_HEADER) != EDGE_AUTH_VERIFIED:
+        return None
+    if request.client is None or request.client.host not in config.EDGE_AUTH_TRUSTED_PROXIES:
+        logger.warning(f"Transaction-id: {transaction_id}, Ignoring the edge auth headers sent by the untrusted peer {request.client.host if request.client else None}")
+        return None
+
+    username = request.headers.get(EDGE_USERNAME_HEADER)
+    if not username:
+        return None
+    EDGE_AUTH_TRUSTED_REQUESTS_TOTAL.inc()
+    return {
+        "result": True,
+        "username": username,
+        "entity_id": request.headers.get(EDGE_ENTITY_ID_HEADER) or None,
+        "vps_app_id": request.headers.get(EDGE_APP_ID_HEADER) or None
+    }
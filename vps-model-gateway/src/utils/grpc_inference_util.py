@@ -0,0 +1,374 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from src.models.env.performance_config_DTO import get_performance_config
+from src.utils.logger_util import setup_logger
+from src.utils.tracing_util import SPAN_KIND_CLIENT, TRANSACTION_ID_HEADER, TRACEPARENT_HEADER, start_span, format_traceparent
+from src.utils.deadline_util import get_stage_timeout
+from src.utils.binary_tensor_util import BinaryInferencePayload, BINARY_DEPLOYMENT_SYSTEMS
+from src.utils.tensor_validation_util import KSERVE_V2_DATATYPES, resolve_tensor_shape
+from fastapi import HTTPException
+from prometheus_client import Counter
+from urllib.parse import urlsplit
+from typing import Any
+import numpy as np
+import struct
+import json
+
+try:
+    import grpc
+    from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+except ImportError:
+    grpc = None
+
+logger = setup_logger(__name__)
+
+GRPC_MODEL_CALLS_TOTAL = Counter(
+    "vps_grpc_model_calls_total",
+    "ModelInfer calls of the gRPC transport, by gRPC status code.",
+    ["code"]
+)
+
+GRPC_URL_SCHEME = "grpc://"
+MODEL_INFER_METHOD = "/inference.GRPCInferenceService/ModelInfer"
+
+# Deployment systems that can be called over gRPC, both speak the Open Inference (v2) protocol
+GRPC_DEPLOYMENT_SYSTEMS = BINARY_DEPLOYMENT_SYSTEMS
+
+# HTTP headers of the url_additions that are not forwarded as gRPC metadata, the Host becomes the authority
+SKIPPED_METADATA_HEADERS = ("host", "content-type", "content-length", "connection", "accept-encoding", "transfer-encoding")
+
+# Typed contents fields of InferTensorContents, used by servers that do not reply with raw contents
+CONTENTS_FIELDS = {
+    "BOOL": "bool_contents", "INT8": "int_contents", "INT16": "int_contents", "INT32": "int_contents", "INT64": "int64_contents",
+    "UINT8": "uint_contents", "UINT16": "uint_contents", "UINT32": "uint_contents", "UINT64": "uint64_contents",
+    "FP32": "fp32_contents", "FP64": "fp64_contents", "BYTES": "bytes_contents"
+}
+
+# gRPC status codes mapped to the status of the /predict response
+GRPC_STATUS_TO_HTTP = {
+    "INVALID_ARGUMENT": 400, "OUT_OF_RANGE": 400, "FAILED_PRECONDITION": 400, "UNAUTHENTICATED": 401,
+    "PERMISSION_DENIED": 403, "NOT_FOUND": 404, "ALREADY_EXISTS": 409, "RESOURCE_EXHAUSTED": 429,
+    "CANCELLED": 499, "UNIMPLEMENTED": 501, "UNAVAILABLE": 503, "DEADLINE_EXCEEDED": 504
+}
+
+class InferenceMessages:
+    """
+    Message classes of the ModelInfer call of the KServe grpc_predict_v2.proto. The descriptors are
+    built here instead of generated by protoc so they work with any installed protobuf runtime.
+    """
+
+    def __init__(self):
+        TYPE = descriptor_pb2.FieldDescriptorProto
+        file_proto = descriptor_pb2.FileDescriptorProto(name="vps_grpc_predict_v2.proto", package="inference", syntax="proto3")
+
+        def add_fields(message_proto, fields):
+            for number, (name, field_type, repeated, type_name) in enumerate(fields, start=1):
+                field = message_proto.field.add(name=name, number=number, type=field_type, label=TYPE.LABEL_REPEATED if repeated else TYPE.LABEL_OPTIONAL)
+                if type_name:
+                    field.type_name = type_name
+
+        def add_parameters_map(message_proto, number, prefix):
+            entry = message_proto.nested_type.add(name="ParametersEntry")
+            entry.options.map_entry = True
+            add_fields(entry, [("key", TYPE.TYPE_STRING, False, None), ("value", TYPE.TYPE_MESSAGE, False, ".inference.InferParameter")])
+            message_proto.field.add(name="parameters", number=number, type=TYPE.TYPE_MESSAGE, label=TYPE.LABEL_REPEATED, type_name=f".inference.{prefix}.ParametersEntry")
+
+        parameter = file_proto.message_type.add(name="InferParameter")
+        parameter.oneof_decl.add(name="parameter_choice")
+        add_fields(parameter, [("bool_param", TYPE.TYPE_BOOL, False, None), ("int64_param", TYPE.TYPE_INT64, False, None), ("string_param", TYPE.TYPE_STRING, False, None), ("double_param", TYPE.TYPE_DOUBLE, False, None), ("uint64_param", TYPE.TYPE_UINT64, False, None)])
+        for field in parameter.field:
+            field.oneof_index = 0
+
+        contents = file_proto.message_type.add(name="InferTensorContents")
+        add_fields(contents, [
+            ("bool_contents", TYPE.TYPE_BOOL, True, None), ("int_contents", TYPE.TYPE_INT32, True, None), ("int64_contents", TYPE.TYPE_INT64, True, None),
+            ("uint_contents", TYPE.TYPE_UINT32, True, None), ("uint64_contents", TYPE.TYPE_UINT64, True, None), ("fp32_contents", TYPE.TYPE_FLOAT, True, None),
+            ("fp64_contents", TYPE.TYPE_DOUBLE, True, None), ("bytes_contents", TYPE.TYPE_BYTES, True, None)
+        ])
+
+        for message_name, tensor_names, raw_field in (("ModelInferRequest", ("InferInputTensor", "InferRequestedOutputTensor"), "raw_input_contents"), ("ModelInferResponse", ("InferOutputTensor",), "raw_output_contents")):
+            message = file_proto.message_type.add(name=message_name)
+            tensor = message.nested_type.add(name=tensor_names[0])
+            add_fields(tensor, [("name", TYPE.TYPE_STRING, False, None), ("datatype", TYPE.TYPE_STRING, False, None), ("shape", TYPE.TYPE_INT64, True, None)])
+            add_parameters_map(tensor, 4, f"{message_name}.{tensor_names[0]}")
+            tensor.field.add(name="contents", number=5, type=TYPE.TYPE_MESSAGE, label=TYPE.LABEL_OPTIONAL, type_name=".inference.InferTensorContents")
+
+            add_fields(message, [("model_name", TYPE.TYPE_STRING, False, None), ("model_version", TYPE.TYPE_STRING, False, None), ("id", TYPE.TYPE_STRING, False, None)])
+            add_parameters_map(message, 4, message_name)
+            message.field.add(name="inputs" if message_name == "ModelInferRequest" else "outputs", number=5, type=TYPE.TYPE_MESSAGE, label=TYPE.LABEL_REPEATED, type_name=f".inference.{message_name}.{tensor_names[0]}")
+            if message_name == "ModelInferRequest":
+                requested_output = message.nested_type.add(name=tensor_names[1])
+                add_fields(requested_output, [("name", TYPE.TYPE_STRING, False, None)])
+                add_parameters_map(requested_output, 2, f"{message_name}.{tensor_names[1]}")
+                message.field.add(name="outputs", number=6, type=TYPE.TYPE_MESSAGE, label=TYPE.LABEL_REPEATED, type_name=f".inference.{message_name}.{tensor_names[1]}")
+            message.field.add(name=raw_field, number=7 if message_name == "ModelInferRequest" else 6, type=TYPE.TYPE_BYTES, label=TYPE.LABEL_REPEATED)
+
+        pool = descriptor_pool.DescriptorPool()
+        pool.Add(file_proto)
+        self.InferParameter = message_factory.GetMessageClass(pool.FindMessageTypeByName("inference.InferParameter"))
+        self.ModelInferRequest = message_factory.GetMessageClass(pool.FindMessageTypeByName("inference.ModelInferRequest"))
+        self.ModelInferResponse = message_factory.GetMessageClass(pool.FindMessageTypeByName("inference.ModelInferResponse"))
+
+_messages = None
+
+def get_inference_messages():
+    global _messages
+    if _messages is None:
+        _messages = InferenceMessages()
+    return _messages
+
+class GrpcChannelPool:
+    """
+    A few long lived channels per (target, authority) used round robin. Every channel is one HTTP/2
+    connection multiplexing the concurrent calls, a local subchannel pool keeps the channels of the
+    same target from sharing one connection.
+    """
+
+    def __init__(self):
+        self.channels = {}
+        self.next_index = {}
+
+    def get_channel(self, target: str, authority: str = None):
+        key = (target, authority)
+        channels = self.channels.get(key)
+        if channels is None:
+            config = get_performance_config()
+            options = [
+                ("grpc.max_send_message_length", config.GRPC_MAX_MESSAGE_BYTES),
+                ("grpc.max_receive_message_length", config.GRPC_MAX_MESSAGE_BYTES),
+                ("grpc.keepalive_time_ms", config.GRPC_KEEPALIVE_SECONDS * 1000),
+                ("grpc.keepalive_permit_without_calls", 1),
+                ("grpc.http2.max_pings_without_data", 0),
+                ("grpc.use_local_subchannel_pool", 1)
+            ]
+            if authority:
+                options.append(("grpc.default_authority", authority))
+            channels = self.channels[key] = [grpc.aio.insecure_channel(target, options=options) for _ in range(max(1, config.GRPC_CHANNELS_PER_TARGET))]
+            self.next_index[key] = 0
+            logger.info(f"Opened {len(channels)} gRPC channels to {target}")
+        index = self.next_index[key]
+        self.next_index[key] = (index + 1) % len(channels)
+        return channels[index]
+
+    async def close(self):
+        channels, self.channels, self.next_index = self.channels, {}, {}
+        for target_channels in channels.values():
+            for channel in target_channels:
+                await channel.close()
+
+_channel_pool = GrpcChannelPool()
+
+def get_grpc_channel_pool():
+    return _channel_pool
+
+def is_grpc_model_url(url: str):
+    return isinstance(url, str) and url.startswith(GRPC_URL_SCHEME)
+
+def get_grpc_model_url(url_additions: dict, kourier_service_url: str, transaction_id: str):
+    """
+    Returns the grpc://host:port url of a deployment that selected the gRPC transport, the
+    "GrpcTarget" of its url_additions, GRPC_MODEL_TARGET or the host of the Kourier url on port 80.
+    None when grpcio is not installed, the model is then called over HTTP.
+    """
+    if grpc is None:
+        logger.warning(f"Transaction-id: {transaction_id}, The deployment selected the gRPC transport but grpcio is not installed, using HTTP")
+        return None
+    target = (url_additions or {}).get("GrpcTarget") or get_performance_config().GRPC_MODEL_TARGET
+    if not target:
+        kourier_url = urlsplit(kourier_service_url)
+        target = f"{kourier_url.hostname}:{kourier_url.port or 80}"
+    return f"{GRPC_URL_SCHEME}{target}"
+
+def to_infer_parameters(parameters: dict, target):
+    # Fills a parameters map, the binary data extension parameters only apply to HTTP
+    messages = get_inference_messages()
+    for key, value in (parameters or {}).items():
+        if key in ("binary_data_size", "binary_data_output", "binary_data"):
+            continue
+        if isinstance(value, bool):
+            target[key].CopyFrom(messages.InferParameter(bool_param=value))
+        elif isinstance(value, int):
+            target[key].CopyFrom(messages.InferParameter(int64_param=value))
+        elif isinstance(value, float):
+            target[key].CopyFrom(messages.InferParameter(double_param=value))
+        elif isinstance(value, str):
+            target[key].CopyFrom(messages.InferParameter(string_param=value))
+        else:
+            target[key].CopyFrom(messages.InferParameter(string_param=json.dumps(value)))
+
+def from_infer_parameters(parameters):
+    return {key: getattr(value, value.WhichOneof("parameter_choice")) for key, value in parameters.items() if value.WhichOneof("parameter_choice")}
+
+def encode_bytes_tensor(values: list):
+    # BYTES raw contents are every element prefixed with its 4 byte little endian length
+    encoded = []
+    for value in values:
+        value = value.encode("utf-8") if isinstance(value, str) else bytes(value)
+        encoded.append(struct.pack("<I", len(value)))
+        encoded.append(value)
+    return b"".join(encoded)
+
+def decode_bytes_tensor(contents: bytes):
+    values = []
+    offset = 0
+    while offset < len(contents):
+        (size,) = struct.unpack_from("<I", contents, offset)
+        values.append(contents[offset + 4:offset + 4 + size].decode("utf-8", errors="replace"))
+        offset += 4 + size
+    return values
+
+def encode_tensor_data(tensor: dict):
+    # Returns (raw contents, concrete shape) of a JSON tensor
+    datatype = tensor.get("datatype")
+    if datatype not in KSERVE_V2_DATATYPES:
+        raise HTTPException(status_code=400, detail=f"Datatype {datatype} of the tensor {tensor.get('name')} is not supported over gRPC")
+    try:
+        if datatype == "BYTES":
+            array = np.asarray(tensor.get("data"), dtype=object)
+            contents = encode_bytes_tensor(array.ravel().tolist())
+        else:
+            array = np.asarray(tensor.get("data"), dtype=np.dtype(KSERVE_V2_DATATYPES[datatype]).newbyteorder("<"))
+            contents = array.tobytes()
+    except (ValueError, TypeError, OverflowError) as e:
+        raise HTTPException(status_code=400, detail=f"The data of the tensor {tensor.get('name')} is not a valid {datatype} tensor: {e}")
+
+    shape = tensor.get("shape") or list(array.shape)
+    if -1 in shape:
+        shape = resolve_tensor_shape(array.shape, shape)
+        if shape is None or -1 in shape:
+            raise HTTPException(status_code=400, detail=f"The shape of the tensor {tensor.get('name')} cannot be resolved from its data")
+    return contents, shape
+
+def build_model_infer_request(model_name: str, input_data: Any, transaction_id: str):
+    """
+    Builds the ModelInferRequest of a v2 JSON request body or a binary tensor payload, every input is
+    sent as raw contents. Returns the request and whether binary outputs were asked for.
+    """
+    messages = get_inference_messages()
+    binary = isinstance(input_data, BinaryInferencePayload)
+    header = input_data.header if binary else input_data
+    if not isinstance(header, dict) or not isinstance(header.get("inputs"), list):
+        raise HTTPException(status_code=400, detail="Requests sent over gRPC need the inputs of the Open Inference Protocol")
+
+    request = messages.ModelInferRequest(model_name=model_name, id=str(header.get("id", "")))
+    to_infer_parameters(header.get("parameters"), request.parameters)
+
+    offset = 0
+    for tensor in header["inputs"]:
+        binary_size = (tensor.get("parameters") or {}).get("binary_data_size") if binary else None
+        if binary_size is not None:
+            contents, shape = input_data.data[offset:offset + binary_size].tobytes(), tensor.get("shape")
+            offset += binary_size
+        else:
+            contents, shape = encode_tensor_data(tensor)
+        infer_input = request.inputs.add(name=tensor.get("name", ""), datatype=tensor.get("datatype", ""), shape=shape)
+        to_infer_parameters(tensor.get("parameters"), infer_input.parameters)
+        request.raw_input_contents.append(contents)
+
+    for output in header.get("outputs") or []:
+        requested_output = request.outputs.add(name=output.get("name", ""))
+        to_infer_parameters(output.get("parameters"), requested_output.parameters)
+
+    wants_binary_outputs = binary and (header.get("parameters") or {}).get("binary_data_output", True) is not False
+    logger.debug(f"Transaction-id: {transaction_id}, Built the ModelInferRequest of {len(request.inputs)} inputs for the model {model_name}")
+    return request, wants_binary_outputs
+
+def output_contents(tensor, raw_contents):
+    # Raw contents of an output tensor, converted from the typed contents when the server used them
+    if raw_contents is not None:
+        return raw_contents
+    field = CONTENTS_FIELDS.get(tensor.datatype)
+    if field is None:
+        return b""
+    values = list(getattr(tensor.contents, field))
+    if tensor.datatype == "BYTES":
+        return encode_bytes_tensor(values)
+    return np.asarray(values, dtype=np.dtype(KSERVE_V2_DATATYPES[tensor.datatype]).newbyteorder("<")).tobytes()
+
+def parse_model_infer_response(response, binary_outputs: bool = False):
+    """
+    Returns the ModelInferResponse as the JSON body the HTTP endpoint of the model returns, or as a
+    binary tensor payload of the outputs when binary outputs were asked for.
+    """
+    header = {"model_name": response.model_name, "model_version": response.model_version, "id": response.id, "outputs": []}
+    parameters = from_infer_parameters(response.parameters)
+    if parameters:
+        header["parameters"] = parameters
+
+    raw_outputs = list(response.raw_output_contents)
+    binary_chunks = []
+    for index, tensor in enumerate(response.outputs):
+        output = {"name": tensor.name, "datatype": tensor.datatype, "shape": list(tensor.shape)}
+        output_parameters = from_infer_parameters(tensor.parameters)
+        contents = output_contents(tensor, raw_outputs[index] if index < len(raw_outputs) else None)
+        if binary_outputs:
+            output_parameters["binary_data_size"] = len(contents)
+            binary_chunks.append(contents)
+        elif tensor.datatype == "BYTES":
+            output["data"] = decode_bytes_tensor(contents)
+        else:
+            output["data"] = np.frombuffer(contents, dtype=np.dtype(KSERVE_V2_DATATYPES[tensor.datatype]).newbyteorder("<")).tolist()
+        if output_parameters:
+            output["parameters"] = output_parameters
+        header["outputs"].append(output)
+
+    if binary_outputs:
+        return BinaryInferencePayload(header, memoryview(b"".join(binary_chunks)), "outputs")
+    return header
+
+def build_grpc_metadata(model_headers: dict, transaction_id: str):
+    # Returns (metadata, authority), the Host header of the url_additions routes the call through Kourier
+    metadata = []
+    authority = None
+    for name, value in (model_headers or {}).items():
+        name = name.lower()
+        if name == "host":
+            authority = value
+        elif name not in SKIPPED_METADATA_HEADERS:
+            metadata.append((name, str(value)))
+    if transaction_id:
+        metadata.append((TRANSACTION_ID_HEADER, transaction_id))
+    return metadata, authority
+
+async def grpc_model_infer(model_url: str, model_name: str, input_data: Any, model_headers: dict, transaction_id: str):
+    """
+    Calls ModelInfer on the pooled channel of the target and returns (ModelInferResponse, whether
+    binary outputs were asked for). Failed calls raise an HTTPException with the status matching the
+    gRPC status code.
+    """
+    messages = get_inference_messages()
+    request, binary_outputs = build_model_infer_request(model_name, input_data, transaction_id)
+    metadata, authority = build_grpc_metadata(model_headers, transaction_id)
+    channel = _channel_pool.get_channel(model_url[len(GRPC_URL_SCHEME):], authority)
+    model_infer = channel.unary_unary(MODEL_INFER_METHOD, request_serializer=messages.ModelInferRequest.SerializeToString, response_deserializer=messages.ModelInferResponse.FromString)
+
+    with start_span(f"gRPC {MODEL_INFER_METHOD}", kind=SPAN_KIND_CLIENT, attributes={"rpc.system": "grpc", "rpc.method": "ModelInfer", "server.address": model_url}) as span:
+        if span is not None:
+            metadata.append((TRACEPARENT_HEADER, format_traceparent(span)))
+        try:
+            response = await model_infer(request, metadata=metadata, timeout=get_stage_timeout("model")["read"])
+        except grpc.aio.AioRpcError as e:
+            code = e.code().name
+            GRPC_MODEL_CALLS_TOTAL.labels(code=code).inc()
+            status_code = GRPC_STATUS_TO_HTTP.get(code, 500)
+            log = logger.info if status_code < 500 else logger.error
+            log(f"Transaction-id: {transaction_id}, ModelInfer of the model {model_name} failed with {code}: {e.details()}")
+            if span is not None:
+                span.set_attribute("rpc.grpc.status_code", code)
+            raise HTTPException(status_code=status_code, detail=f"An error occurred while making prediction request to the deployed model {model_name}: {e.details()}")
+
+    GRPC_MODEL_CALLS_TOTAL.labels(code="OK").inc()
+    return response, binary_outputs
@@ -0,0 +1,53 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+from fastapi import Request
+from src.models.env.performance_config_DTO import get_performance_config
+from src.utils.retry_transport_util import RetryingTransport
+from src.utils.tracing_util import TRACING_EVENT_HOOKS
+from src.utils.logger_util import setup_logger
+from contextlib import asynccontextmanager
+import httpx
+
+logger = setup_logger(__name__)
+
+def create_http_client():
+    # One pooled client per worker, keeps the connections (and the TLS setup) to the upstreams alive between requests
+    config = get_performance_config()
+    limits = httpx.Limits(
+        max_connections=config.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY_SECONDS
+    )
+    transport = RetryingTransport(httpx.AsyncHTTPTransport(limits=limits))
+    logger.info(f"Creating the pooled http client with {config.HTTP_MAX_CONNECTIONS} max connections")
+    return httpx.AsyncClient(timeout=httpx.Timeout(config.HTTP_TIMEOUT_SECONDS), transport=transport, event_hooks=TRACING_EVENT_HOOKS)
+
+async def close_http_client(client: httpx.AsyncClient):
+    logger.info("Closing the pooled http client")
+    await client.aclose()
+
+@asynccontextmanager
+async def shared_http_client(request: Request):
+    """
+    Yields the pooled client created at startup, or a client for this request only when the app
+    was started without one.
+    """
+    client = getattr(request.app.state, "http_client", None)
+    if client is not None:
+        yield client
+        return
+
+    async with create_http_client() as client:
+        yield client
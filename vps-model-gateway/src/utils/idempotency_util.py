@@ -0,0 +1,176 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+from prometheus_client import Counter
+from rediscluster import RedisCluster
+from redis.exceptions import RedisError
+from fastapi import HTTPException
+from src.models.env.performance_config_DTO import get_performance_config
+from src.utils.logger_util import setup_logger
+from src.utils.deadline_util import get_remaining_deadline
+from src.utils.binary_tensor_util import BinaryInferencePayload
+from src.utils.prediction_input_util import PredictionInputReference
+import asyncio
+import hashlib
+import json
+import time
+
+logger = setup_logger(__name__)
+
+IDEMPOTENCY_KEY_PREFIX = "vps:idempotency"
+STATE_IN_PROGRESS = "in_progress"
+STATE_COMPLETED = "completed"
+
+IDEMPOTENCY_REQUESTS_TOTAL = Counter(
+    "vps_idempotency_requests_total",
+    "Prediction requests by idempotency outcome: new, replayed (completed transaction), attached (in progress transaction), conflict or unavailable.",
+    ["result"]
+)
+
+# Transactions owned by this worker, retries arriving here wait on them instead of polling Redis
+_local_transactions = {}
+
+def hash_request_input(input_data):
+    # Digest of the input as it was received, an uploaded input is named by its id
+    if isinstance(input_data, PredictionInputReference):
+        return input_data.input_id
+    digest = hashlib.sha256()
+    if isinstance(input_data, BinaryInferencePayload):
+        digest.update(input_data.encode_header())
+        digest.update(input_data.data)
+    else:
+        digest.update(input_data.encode("utf-8") if isinstance(input_data, str) else input_data)
+    return digest.hexdigest()
+
+def build_request_fingerprint(username: str, model_id: str, input_hash: str):
+    # A transaction-id can only be replayed by the same user for the same model and input
+    return hashlib.sha256(f"{username}:{model_id}:{input_hash}".encode("utf-8")).hexdigest()
+
+class IdempotentTransaction:
+    """
+    Records the outcome of a /predict call under its transaction-id.
+
+    begin() claims the transaction with an in progress marker (SET NX), or returns the stored
+    response of a completed one, or waits for the request that holds the marker to finish.
+    complete() stores the response returned to the client, release() removes the marker of a
+    failed request so that a retry runs the pipeline again. Redis failures disable the replay
+    for the request instead of failing it.
+    """
+
+    def __init__(self, redis_client: RedisCluster, transaction_id: str, fingerprint: str):
+        self.config = get_performance_config()
+        self.redis_client = redis_client
+        self.transaction_id = transaction_id
+        self.fingerprint = fingerprint
+        self.key = f"{IDEMPOTENCY_KEY_PREFIX}:{transaction_id}"
+        self.claimed = False
+        self.future = None
+
+    async def begin(self):
+        # Returns the response to replay, or None when this request has to run the pipeline
+        if not self.config.IDEMPOTENCY_ENABLED or self.redis_client is None:
+            return None
+
+        wait_timeout = self.config.IDEMPOTENCY_WAIT_TIMEOUT_SECONDS
+        remaining = get_remaining_deadline()
+        if remaining is not None:
+            wait_timeout = min(wait_timeout, remaining)
+        deadline = time.monotonic() + wait_timeout
+        marker = json.dumps({"state": STATE_IN_PROGRESS, "fingerprint": self.fingerprint})
+        while True:
+            try:
+                if self.redis_client.set(self.key, marker, nx=True, ex=self.config.IDEMPOTENCY_IN_PROGRESS_TTL_SECONDS):
+                    self.claimed = True
+                    self.future = asyncio.get_running_loop().create_future()
+                    _local_transactions[self.transaction_id] = self.future
+                    IDEMPOTENCY_REQUESTS_TOTAL.labels(result="new").inc()
+                    return None
+                record = self.redis_client.get(self.key)
+            except RedisError as e:
+                logger.error(f"Transaction-id: {self.transaction_id}, Redis error while checking the idempotency record, continuing without it: {e}")
+                IDEMPOTENCY_REQUESTS_TOTAL.labels(result="unavailable").inc()
+                return None
+
+            if record is None:
+                # The marker expired or was released in between, try to claim it again
+                continue
+
+            record = json.loads(record)
+            if record.get("fingerprint") != self.fingerprint:
+                logger.error(f"Transaction-id: {self.transaction_id}, Transaction-id is already used by another request, stopping the prediction process.")
+                IDEMPOTENCY_REQUESTS_TOTAL.labels(result="conflict").inc()
+                raise HTTPException(status_code=409, detail=f"Transaction-id: {self.transaction_id} is already used by another request, please use a new transaction-id.")
+
+            if record.get("state") == STATE_COMPLETED:
+                logger.info(f"Transaction-id: {self.transaction_id}, Transaction is already completed, replaying the stored response.")
+                IDEMPOTENCY_REQUESTS_TOTAL.labels(result="replayed").inc()
+                return record.get("response")
+
+            local_future = _local_transactions.get(self.transaction_id)
+            if local_future is not None:
+                logger.info(f"Transaction-id: {self.transaction_id}, Transaction is in progress on this worker, waiting for its response.")
+                response = await asyncio.shield(local_future)
+                if response is not None:
+                    IDEMPOTENCY_REQUESTS_TOTAL.labels(result="attached").inc()
+                    return response
+                continue
+
+            if time.monotonic() >= deadline:
+                logger.error(f"Transaction-id: {self.transaction_id}, Transaction is still in progress, stopping the prediction process.")
+                IDEMPOTENCY_REQUESTS_TOTAL.labels(result="conflict").inc()
+                raise HTTPException(status_code=409, detail=f"Transaction-id: {self.transaction_id} is still in progress, please retry later.")
+            await asyncio.sleep(self.config.IDEMPOTENCY_POLL_INTERVAL_MS / 1000)
+
+    def complete(self, response: dict):
+        # Stores the response for replays and hands it to the retries waiting on this worker, returns it unchanged
+        if not self.claimed:
+            return response
+        self.claimed = False
+        self._resolve(response)
+
+        ttl = self.config.IDEMPOTENCY_URL_TTL_SECONDS if response.get("payload_type") == "url" else self.config.IDEMPOTENCY_TTL_SECONDS
+        try:
+            record = json.dumps({"state": STATE_COMPLETED, "fingerprint": self.fingerprint, "response": response}, separators=(",", ":"))
+        except TypeError:
+            # Binary tensor outputs are not JSON, a retry of the transaction runs the pipeline again
+            record = None
+        try:
+            if record is None:
+                logger.info(f"Transaction-id: {self.transaction_id}, Response is not JSON serializable and is not stored for replays.")
+                self.redis_client.delete(self.key)
+            elif len(record) > self.config.IDEMPOTENCY_MAX_RESPONSE_BYTES:
+                logger.info(f"Transaction-id: {self.transaction_id}, Response of {len(record)} bytes is too large to be stored for replays.")
+                self.redis_client.delete(self.key)
+            else:
+                self.redis_client.set(self.key, record, ex=ttl)
+        except RedisError as e:
+            logger.error(f"Transaction-id: {self.transaction_id}, Redis error while storing the idempotency record: {e}")
+        return response
+
+    def release(self):
+        # Called for requests that did not complete, a retry of the transaction runs the pipeline again
+        if not self.claimed:
+            return
+        self.claimed = False
+        self._resolve(None)
+        try:
+            self.redis_client.delete(self.key)
+        except RedisError as e:
+            logger.error(f"Transaction-id: {self.transaction_id}, Redis error while releasing the idempotency record: {e}")
+
+    def _resolve(self, response):
+        if _local_transactions.get(self.transaction_id) is self.future:
+            del _local_transactions[self.transaction_id]
+        if not self.future.done():
+            self.future.set_result(response)
@@ -0,0 +1,237 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from src.models.env.performance_config_DTO import get_performance_config
+from src.utils.logger_util import setup_logger
+from src.utils.deadline_util import get_remaining_deadline
+from fastapi import HTTPException
+from prometheus_client import Counter, Gauge, Histogram
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from collections import deque
+import asyncio
+import time
+
+logger = setup_logger(__name__)
+
+MEMORY_BUDGET_RESERVED_BYTES = Gauge(
+    "vps_memory_budget_reserved_bytes",
+    "Bytes of request bodies, model responses and S3 part buffers currently reserved in the worker.",
+    multiprocess_mode="liveall"
+)
+
+MEMORY_BUDGET_CAPACITY_BYTES = Gauge(
+    "vps_memory_budget_capacity_bytes",
+    "Bytes of buffers the worker may hold at once (MEMORY_BUDGET_MAX_BYTES).",
+    multiprocess_mode="liveall"
+)
+
+MEMORY_BUDGET_WAIT_SECONDS = Histogram(
+    "vps_memory_budget_wait_seconds",
+    "Time buffer reservations waited for the memory budget, by buffer.",
+    ["buffer"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5)
+)
+
+MEMORY_BUDGET_REJECTIONS_TOTAL = Counter(
+    "vps_memory_budget_rejections_total",
+    "Buffer reservations rejected with a 503 because the memory budget stayed exhausted, by buffer.",
+    ["buffer"]
+)
+
+class MemoryBudget:
+    """
+    Byte semaphore of the worker. Reservations are granted in arrival order, one that does not fit
+    waits for the bytes to be released, at most MEMORY_BUDGET_MAX_WAIT_SECONDS and never past the
+    request deadline. A reservation larger than the whole budget is capped to it, so it can still
+    run once it has the budget to itself. Priority reservations, made by requests that already hold
+    bytes, are granted ahead of the others since they release their bytes once they are done. The
+    growth reserve is only granted to them, so the responses of requests holding their body are not
+    stuck behind new bodies that filled the budget.
+    """
+
+    def __init__(self, capacity: int, max_wait: float, growth_reserve: int = 0):
+        self.capacity = capacity
+        self.max_wait = max_wait
+        self.growth_reserve = min(growth_reserve, capacity // 2)
+        self.reserved = 0
+        self.waiters = deque()
+        MEMORY_BUDGET_CAPACITY_BYTES.set(capacity)
+
+    def limit(self, priority: bool):
+        return self.capacity if priority else self.capacity - self.growth_reserve
+
+    def can_reserve(self, nbytes: int, priority: bool = False):
+        return self.reserved + nbytes <= self.limit(priority)
+
+    async def acquire(self, nbytes: int, buffer: str, transaction_id: str = None, priority: bool = False):
+        # Returns the number of bytes reserved, to be given back with release()
+        nbytes = min(nbytes, self.limit(priority))
+        if nbytes <= 0:
+            return 0
+        if (priority or not self.waiters) and self.can_reserve(nbytes, priority):
+            self.reserve(nbytes)
+            return nbytes
+
+        timeout = self.max_wait
+        remaining = get_remaining_deadline()
+        if remaining is not None:
+            timeout = max(0.0, min(timeout, remaining))
+
+        waiter = (nbytes, asyncio.get_running_loop().create_future(), priority)
+        if priority:
+            # Behind the other priority reservations, ahead of the ones of new requests
+            index = next((i for i, (_, _, queued_priority) in enumerate(self.waiters) if not queued_priority), len(self.waiters))
+            self.waiters.insert(index, waiter)
+        else:
+            self.waiters.append(waiter)
+        started_at = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter[1]), timeout)
+        except asyncio.TimeoutError:
+            pass
+        except BaseException:
+            self.abandon(waiter)
+            raise
+
+        if not waiter[1].done():
+            self.abandon(waiter)
+            MEMORY_BUDGET_REJECTIONS_TOTAL.labels(buffer=buffer).inc()
+            logger.error(f"Transaction-id: {transaction_id}, {nbytes} bytes for the {buffer} did not fit in the memory budget of the worker, {self.reserved} of {self.capacity} bytes are reserved")
+            raise HTTPException(status_code=503, detail="The gateway is handling too many large payloads, please retry later")
+        MEMORY_BUDGET_WAIT_SECONDS.labels(buffer=buffer).observe(time.perf_counter() - started_at)
+        return nbytes
+
+    def abandon(self, waiter: tuple):
+        # A waiter that gave up, its bytes are given back when they were granted in the meantime
+        nbytes, future, _ = waiter
+        if future.done():
+            self.release(nbytes)
+            return
+        future.cancel()
+        self.waiters.remove(waiter)
+        self.wake_waiters()
+
+    def reserve(self, nbytes: int):
+        self.reserved += nbytes
+        MEMORY_BUDGET_RESERVED_BYTES.set(self.reserved)
+
+    def release(self, nbytes: int):
+        if nbytes <= 0:
+            return
+        self.reserved = max(0, self.reserved - nbytes)
+        MEMORY_BUDGET_RESERVED_BYTES.set(self.reserved)
+        self.wake_waiters()
+
+    def wake_waiters(self):
+        # Grants the queued reservations in order, a large one at the head holds back the smaller ones behind it
+        while self.waiters and self.can_reserve(self.waiters[0][0], self.waiters[0][2]):
+            nbytes, future, _ = self.waiters.popleft()
+            self.reserve(nbytes)
+            future.set_result(None)
+
+class MemoryReservation:
+    """
+    Bytes held by one request, grown as its buffers are allocated and released once it is done with
+    them. The headroom is the part no buffer uses any more, e.g. the part buffers of a finished S3
+    upload, later buffers of the request take it before they grow the reservation.
+    """
+
+    def __init__(self, budget: MemoryBudget, transaction_id: str = None):
+        self.budget = budget
+        self.transaction_id = transaction_id
+        self.reserved = 0
+        self.headroom = 0
+        self.detached = False
+
+    async def grow(self, nbytes: int, buffer: str):
+        # Returns the bytes assigned to the buffer, taken from the headroom first. Only the first
+        # reservation of the request queues behind the other requests
+        used = min(nbytes, self.headroom)
+        self.headroom -= used
+        missing = min(nbytes - used, self.budget.capacity - self.reserved)
+        if missing > 0:
+            acquired = await self.budget.acquire(missing, buffer, self.transaction_id, priority=self.reserved > 0)
+            self.reserved += acquired
+            used += acquired
+        return used
+
+    def give_back(self, nbytes: int):
+        # A buffer that is no longer needed returns its bytes to the headroom of the request
+        self.headroom = min(self.reserved, self.headroom + nbytes)
+
+    def release(self):
+        self.budget.release(self.reserved)
+        self.reserved = 0
+        self.headroom = 0
+
+_budget = None
+_current_reservation = ContextVar("vps_memory_reservation", default=None)
+
+def get_memory_budget():
+    global _budget
+    if _budget is None:
+        config = get_performance_config()
+        _budget = MemoryBudget(config.MEMORY_BUDGET_MAX_BYTES, config.MEMORY_BUDGET_MAX_WAIT_SECONDS, config.MEMORY_BUDGET_GROWTH_RESERVE_BYTES)
+    return _budget
+
+def get_current_memory_reservation():
+    return _current_reservation.get()
+
+@asynccontextmanager
+async def request_memory_reservation(transaction_id: str = None):
+    """
+    Makes a reservation current for the buffers of the request and releases it on exit, unless it
+    was detached because a task that outlives the request (an asynchronous job) took it over.
+    """
+    if not get_performance_config().MEMORY_BUDGET_ENABLED:
+        yield None
+        return
+    reservation = MemoryReservation(get_memory_budget(), transaction_id)
+    token = _current_reservation.set(reservation)
+    try:
+        yield reservation
+    finally:
+        _current_reservation.reset(token)
+        if not reservation.detached:
+            reservation.release()
+
+async def reserve_request_memory(nbytes: int, buffer: str):
+    # Adds the buffer to the reservation of the current request, buffers outside of a request are not accounted
+    reservation = _current_reservation.get()
+    if reservation is not None:
+        await reservation.grow(nbytes, buffer)
+
+@asynccontextmanager
+async def reserved_memory(nbytes: int, buffer: str, transaction_id: str = None):
+    # Reserves a short lived buffer, e.g. the part buffers of an S3 upload, for the duration of the block.
+    # Inside a request it is taken from the reservation of the request and returned to its headroom
+    if not get_performance_config().MEMORY_BUDGET_ENABLED:
+        yield
+        return
+    reservation = _current_reservation.get()
+    if reservation is not None:
+        used = await reservation.grow(nbytes, buffer)
+        try:
+            yield
+        finally:
+            reservation.give_back(used)
+        return
+    budget = get_memory_budget()
+    reserved = await budget.acquire(nbytes, buffer, transaction_id)
+    try:
+        yield
+    finally:
+        budget.release(reserved)
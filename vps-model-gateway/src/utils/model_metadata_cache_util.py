@@ -0,0 +1,67 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from src.models.env.performance_config_DTO import get_performance_config
+from src.utils.logger_util import setup_logger
+from prometheus_client import Counter
+from collections import OrderedDict
+import copy
+import time
+
+logger = setup_logger(__name__)
+
+MODEL_METADATA_CACHE_LOOKUPS_TOTAL = Counter(
+    "vps_model_metadata_cache_lookups_total",
+    "Lookups of the in-process cache of control plane metadata, by kind (model or deployment) and result (hit or miss).",
+    ["kind", "result"]
+)
+
+class ModelMetadataCache:
+    """
+    Bounded in-process cache of the model details of the project admin and the deployment info of
+    the deploy admin, keyed on (kind, model_id). Entries are copied in and out since the callers
+    add request specific headers to the dicts they get.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+
+    def get(self, kind: str, model_id: str):
+        key = (kind, model_id)
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self.entries.pop(key, None)
+            MODEL_METADATA_CACHE_LOOKUPS_TOTAL.labels(kind=kind, result="miss").inc()
+            return None
+        MODEL_METADATA_CACHE_LOOKUPS_TOTAL.labels(kind=kind, result="hit").inc()
+        return copy.deepcopy(entry[1])
+
+    def put(self, kind: str, model_id: str, value: dict):
+        config = get_performance_config()
+        if config.MODEL_METADATA_CACHE_TTL_SECONDS <= 0 or value is None:
+            return
+        key = (kind, model_id)
+        self.entries[key] = (time.monotonic() + config.MODEL_METADATA_CACHE_TTL_SECONDS, copy.deepcopy(value))
+        self.entries.move_to_end(key)
+        while len(self.entries) > config.MODEL_METADATA_CACHE_MAX_ENTRIES:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+_model_metadata = ModelMetadataCache()
+
+def get_model_metadata_cache():
+    return _model_metadata
@@ -0,0 +1,136 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+from src.utils.logger_util import setup_logger
+from src.utils.tensor_validation_util import validate_tensor_input
+from typing import Any
+import json
+
+logger = setup_logger(__name__)
+
+def build_model_request_envelope(deployment_system: str, input_data: Any, model_service_name: str, model_details: dict, max_tokens: int, transaction_id: str):
+    # Wraps the (pre transformed) input data in the request body expected by the deployment system
+    if deployment_system == "KserveV1":
+        logger.info(f"Transaction-id: {transaction_id}, Deployment system is kserve with protocol version v1, transforming the input data with instances.")
+        input_data = {"instances": [input_data]}
+
+    elif deployment_system == "KserveV2":
+
+        logger.info(f"Transaction-id: {transaction_id}, Deployment system is kserve with protocol version v2, transforming the input data with inputs.")
+        model_input = model_details.get("input")
+        kserve_data = {"inputs": []}
+        input_instance = {}
+        input_instance["data"], input_instance["shape"] = validate_tensor_input(input_data, model_input, transaction_id)
+        input_instance["datatype"] = model_input.get("data_type")
+        input_instance["name"] = model_input.get("name")
+        kserve_data["inputs"].append(input_instance)
+        input_data = kserve_data
+
+    elif deployment_system == "TextGeneration":
+        logger.info(f"Transaction-id: {transaction_id}, Deployment system is TextGeneration, transforming the input data with inputs.")
+        input_instance = {}
+        input_instance["model"] = model_service_name
+        input_instance["prompt"] = input_data
+        input_instance["stream"] = False
+        input_instance["max_tokens"] = max_tokens
+        input_data = input_instance
+
+    elif deployment_system == "Text2TextGeneration":
+        logger.info(f"Transaction-id: {transaction_id}, Deployment system is Text2TextGeneration, transforming the input data with inputs.")
+        input_instance = {}
+        input_instance["model"] = model_service_name
+        input_instance["prompt"] = input_data
+        input_instance["stream"] = False
+        input_instance["max_tokens"] = max_tokens
+        input_data = input_instance
+
+    elif deployment_system == "TokenClassification":
+        logger.info(f"Transaction-id: {transaction_id}, Deployment system is TokenClassification, transforming the input data with inputs.")
+        input_data = {"instances": [input_data]}
+
+    elif deployment_system == "TextClassification":
+        logger.info(f"Transaction-id: {transaction_id}, Deployment system is TextClassification, transforming the input data with inputs.")
+        input_data = {"instances": [input_data]}
+
+    elif deployment_system == "MLFlow":
+        logger.info(f"Transaction-id: {transaction_id}, Deployment system is MLFlow with protocol version v2, transforming the input data with inputs.")
+        if isinstance(input_data, list):
+            model_input = input_data[0]
+            mlflow_data = {"inputs": []}
+            input_instance = {}
+            input_instance["data"] = input_data
+            input_instance["shape"] = input_data["shape"]
+            input_instance["datatype"] = input_data["datatype"]
+            input_instance["name"] = input_data["name"]
+
+            mlflow_data["inputs"].append(input_instance)
+            input_data = mlflow_data
+
+    return input_data
+
+def build_model_request_envelope_frame(deployment_system: str, model_service_name: str, max_tokens: int):
+    """
+    Returns the (prefix, suffix) bytes around the JSON input in the request body of the deployment system,
+    for inputs streamed into the body without being parsed. None when the envelope needs the parsed input,
+    as the tensor validation of KserveV2. MLFlow inputs are sent as they were uploaded.
+    """
+    if deployment_system in ("KserveV1", "TokenClassification", "TextClassification"):
+        return b'{"instances": [', b']}'
+
+    if deployment_system in ("TextGeneration", "Text2TextGeneration"):
+        prefix = f'{{"model": {json.dumps(model_service_name)}, "prompt": '
+        suffix = f', "stream": false, "max_tokens": {json.dumps(max_tokens)}}}'
+        return prefix.encode("utf-8"), suffix.encode("utf-8")
+
+    if deployment_system == "MLFlow":
+        return b"", b""
+
+    return None
+
+def extract_model_response_data(deployment_system: str, data: Any, transaction_id: str):
+    # Extracts the prediction from the decoded response body of the deployment system
+    if deployment_system == "KserveV1":
+        logger.info(f"Transaction-id: {transaction_id}, Deployment system is kserve with protocol version v1, returning response directly.")
+        data = data["predictions"][0]
+
+    elif deployment_system == "KserveV2":
+        logger.info(f"Transaction-id: {transaction_id}, Deployment system is kserve with protocol version v2, returning response directly.")
+        data = data["outputs"][0]["data"]
+
+    elif deployment_system == "TextGeneration":
+        logger.info(f"Transaction-id: {transaction_id}, Deployment system is TextGeneration, returning response directly.")
+        logger.info(f"prediction data: {data}")
+        data = data
+
+    elif deployment_system == "Text2TextGeneration":
+        logger.info(f"Transaction-id: {transaction_id}, Deployment system is Text2TextGeneration, returning response directly.")
+        logger.info(f"prediction data: {data}")
+        data = data
+
+    elif deployment_system == "TokenClassification":
+        logger.info(f"Transaction-id: {transaction_id}, Deployment system is TokenClassification, returning response directly.")
+        logger.info(f"prediction data: {data}")
+        data = data
+
+    elif deployment_system == "TextClassification":
+        logger.info(f"Transaction-id: {transaction_id}, Deployment system is TextClassification, returning response directly.")
+        logger.info(f"prediction data: {data}")
+        data = data
+
+    elif deployment_system == "MLFlow":
+        logger.info(f"Transaction-id: {transaction_id}, Deployment system is MLFlow, returning response directly.")
+        logger.info(f"prediction data: {data}")
+        data = data
+
+    return data
@@ -15,19 +15,143 @@
 from fastapi import HTTPException, Request
 from src.utils.logger_util import setup_logger
 from src.utils.get_error_detail_util import get_error_detail
-from src.utils.aws_feature_plugin import AWSFeaturePlugin
+from src.utils.aws_feature_plugin import AWSFeaturePlugin, run_s3_operation
 from src.models.env.env_config_DTO  import EnvConfigDTO
 from src.config.bucket_structure import BucketStructure
+from src.utils.prediction_metrics_util import StageTimer, optional_stage, observe_prediction_response_size
+from src.utils.model_payload_envelope_util import build_model_request_envelope, build_model_request_envelope_frame, extract_model_response_data
+from src.utils.prediction_input_util import PredictionInput, stream_prediction_input
+from src.utils.single_flight_util import SingleFlight
+from src.utils.retry_transport_util import IDEMPOTENT_EXTENSION
+from src.models.env.performance_config_DTO import get_performance_config
+from src.utils.content_encoding_util import GzipStreamEncoder, get_model_request_encoding, compress_payload
+from src.utils.binary_tensor_util import BinaryInferencePayload, INFERENCE_HEADER_CONTENT_LENGTH, build_binary_model_request, parse_binary_inference_body
+from src.utils.grpc_inference_util import is_grpc_model_url, grpc_model_infer, parse_model_infer_response
+from src.utils.cold_start_util import stream_model_request
+from src.utils.tenant_scheduler_util import model_call_slot
+from src.utils.memory_budget_util import reserve_request_memory, reserved_memory
 from boto3 import client
 from botocore.exceptions import ClientError
 from httpx import AsyncClient
 from typing import Any
+import asyncio
 import httpx
 import json
+import time
 
 logger = setup_logger(__name__)
 
-async def get_model_prediction_for_input_data(request: Request, client: AsyncClient, model_id: str, model_service_name: str, transaction_id: str, deployment_system: str, kourier_model_url: str, model_headers: dict, model_details: dict, model: dict, input_data: Any):
+SPILL_PART_SIZE = 5 * 1024 * 1024 # Parts of the multipart upload of spilled responses
+
+# Concurrent identical predictions of this worker share one upstream call
+_prediction_single_flight = SingleFlight("model_prediction")
+
+def is_prediction_coalescing_enabled(model: dict):
+    # Models opt in with "coalesce_requests": true in their notes, sampling models answer the same input differently
+    if not get_performance_config().PREDICTION_COALESCING_ENABLED:
+        return False
+    try:
+        notes = json.loads(model.get("notes")) if model.get("notes") else {}
+    except (TypeError, ValueError):
+        return False
+    return isinstance(notes, dict) and notes.get("coalesce_requests") is True
+
+async def get_coalesced_model_prediction_for_input_data(coalesce_key: tuple, request: Request, client: AsyncClient, model_id: str, model_service_name: str, transaction_id: str, deployment_system: str, kourier_model_url: str, model_headers: dict, model_details: dict, model: dict, input_data: Any, stage_timer: StageTimer = None):
+    """
+    Runs get_model_prediction_for_input_data once for concurrent requests with the same
+    (model_id, deployment version, input hash) key. Returns (data, payload_type, spill_transaction_id),
+    a spilled response is stored under the runtime folder of the transaction that made the call.
+    """
+    async def predict():
+        data, payload_type = await get_model_prediction_for_input_data(request, client, model_id, model_service_name, transaction_id, deployment_system, kourier_model_url, model_headers, model_details, model, input_data, stage_timer=stage_timer)
+        return data, payload_type, transaction_id
+
+    wait_start = time.perf_counter()
+    (data, payload_type, spill_transaction_id), shared = await _prediction_single_flight.do(coalesce_key, predict)
+    if shared:
+        logger.info(f"Transaction-id: {transaction_id}, Shared the prediction of transaction {spill_transaction_id} for the model {model_id}")
+        if stage_timer:
+            stage_timer.record("coalesced_wait", time.perf_counter() - wait_start)
+    return data, payload_type, spill_transaction_id
+
+async def spill_model_response(request: Request, chunks, model_id: str, transaction_id: str):
+    """
+    Uploads a model response above MAX_PAYLOAD_SIZE, as an async iterator of byte chunks, to the runtime
+    folder of the transaction with a multipart upload and returns the number of bytes received.
+    """
+    config = EnvConfigDTO()
+    aws_plugin = AWSFeaturePlugin()
+
+    #Extracting the s3 client from the request state
+    s3_client = request.app.state.s3_client
+
+    bucket_structure = BucketStructure({"transaction_id": transaction_id}).get_bucket_structure()
+    preffix = f"{bucket_structure['runtime_folder']}/model_prediction_response.txt"
+
+    performance_config = get_performance_config()
+    encoder = GzipStreamEncoder(SPILL_PART_SIZE, performance_config.COMPRESSION_GZIP_LEVEL) if performance_config.COMPRESSION_S3_SPILL_ENABLED else None
+    upload_id = await run_s3_operation(aws_plugin.create_mutlipart_upload_and_retrieve_upload_id, s3_client, config.RUNTIME_BUCKET_NAME, preffix, transaction_id, "gzip" if encoder else None)
+
+    parts = [] # List of parts to be uploaded
+    spilled_size = 0
+
+    async def upload_part(body: bytes):
+        part_number = len(parts) + 1
+        part = await run_s3_operation(aws_plugin.upload_chunk_part_for_the_multipart_upload, s3_client, upload_id, part_number, body, preffix, config.RUNTIME_BUCKET_NAME, transaction_id)
+        parts.append({"PartNumber": part_number, "ETag": part["ETag"]})
+
+    # The chunk being received and the part being uploaded, or the compressed part the encoder is filling
+    async with reserved_memory(2 * SPILL_PART_SIZE, "s3_part", transaction_id):
+        async for chunk in chunks:
+            spilled_size += len(chunk)
+            encoded_parts = [chunk] if encoder is None else await asyncio.get_running_loop().run_in_executor(None, encoder.write, chunk)
+            for encoded_part in encoded_parts:
+                await upload_part(encoded_part)
+
+        if encoder is not None:
+            for encoded_part in encoder.finish():
+                await upload_part(encoded_part)
+
+    await run_s3_operation(aws_plugin.complete_multipart_upload_for_the_multipart_upload, s3_client, upload_id, preffix, config.RUNTIME_BUCKET_NAME, parts, transaction_id)
+    logger.info(f"Transaction-id: {transaction_id},Successfully uploaded the predicted data to S3 for the deployed model {model_id} on preffix {preffix}.")
+    return spilled_size
+
+async def get_grpc_model_prediction_for_input_data(request: Request, model_id: str, model_service_name: str, transaction_id: str, deployment_system: str, kourier_model_url: str, model_headers: dict, input_data: Any, stage_timer: StageTimer = None):
+    # ModelInfer over the gRPC transport, responses are returned or spilled like the ones of the HTTP endpoint
+    config = EnvConfigDTO()
+    inference_start = time.perf_counter()
+    response, binary_outputs = await grpc_model_infer(kourier_model_url, model_service_name, input_data, model_headers, transaction_id)
+    if stage_timer:
+        stage_timer.record("inference", time.perf_counter() - inference_start)
+
+    response_size = response.ByteSize()
+    # The size of the message is only known once it is received (at most GRPC_MAX_MESSAGE_BYTES), its copies are reserved against the request
+    await reserve_request_memory(response_size * get_performance_config().MEMORY_BUDGET_BODY_COPIES, "model_response")
+    if response_size <= config.MAX_PAYLOAD_SIZE * 1024 * 1024:
+        observe_prediction_response_size(deployment_system, "content", response_size)
+        data = parse_model_infer_response(response, binary_outputs)
+        if binary_outputs:
+            return data, "content"
+        return extract_model_response_data(deployment_system, data, transaction_id), "content"
+
+    # Spilled responses are stored as the JSON body of the HTTP endpoint, so the extractor applies to them
+    logger.info(f"Transaction-id: {transaction_id}, Response of {response_size} bytes is more than 5MB, uploading the predicted data to S3 for the deployed model {model_id}.")
+    body = json.dumps(parse_model_infer_response(response)).encode("utf-8")
+
+    async def body_chunks():
+        for offset in range(0, len(body), SPILL_PART_SIZE):
+            yield body[offset:offset + SPILL_PART_SIZE]
+
+    try:
+        with optional_stage(stage_timer, "s3_spill"):
+            spilled_size = await spill_model_response(request, body_chunks(), model_id, transaction_id)
+    except ClientError as e:
+        logger.error(f"Transaction-id: {transaction_id}, An Client error occurred while uploading the predicted data to S3 for the deployed model {model_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"An error occurred while uploading the predicted data to S3 for the deployed model {model_id}: {str(e)}")
+    observe_prediction_response_size(deployment_system, "url", spilled_size)
+    return None, "url"
+
+async def get_model_prediction_for_input_data(request: Request, client: AsyncClient, model_id: str, model_service_name: str, transaction_id: str, deployment_system: str, kourier_model_url: str, model_headers: dict, model_details: dict, model: dict, input_data: Any, stage_timer: StageTimer = None):
 
     config = EnvConfigDTO()
 
@@ -41,132 +165,73 @@ async def get_model_prediction_for_input_data(request: Request, client: AsyncCli
     if hf_max_token:
         max_tokens = hf_max_token
 
-    if deployment_system == "KserveV1":
-        logger.info(f"Transaction-id: {transaction_id}, Deployment system is kserve with protocol version v1, transforming the input data with instances.")
-        input_data = {"instances": [input_data]}
-
-    elif deployment_system == "KserveV2":
-        
-        logger.info(f"Transaction-id: {transaction_id}, Deployment system is kserve with protocol version v2, transforming the input data with inputs.")
-        model_input = model_details.get("input")
-        kserve_data = {"inputs": []}
-        input_instance = {}
-        input_instance["data"] = input_data
-        input_instance["shape"] = model_input.get("dims")
-        input_instance["datatype"] = model_input.get("data_type")
-        input_instance["name"] = model_input.get("name")
-        kserve_data["inputs"].append(input_instance)
-        input_data = kserve_data
-        
-    elif deployment_system == "TextGeneration":
-        logger.info(f"Transaction-id: {transaction_id}, Deployment system is TextGeneration, transforming the input data with inputs.")
-        input_instance = {}
-        input_instance["model"] = model_service_name
-        input_instance["prompt"] = input_data
-        input_instance["stream"] = False
-        input_instance["max_tokens"] = max_tokens
-        input_data = input_instance
-
-    elif deployment_system == "Text2TextGeneration":
-        logger.info(f"Transaction-id: {transaction_id}, Deployment system is Text2TextGeneration, transforming the input data with inputs.")
-        input_instance = {}
-        input_instance["model"] = model_service_name
-        input_instance["prompt"] = input_data
-        input_instance["stream"] = False
-        input_instance["max_tokens"] = max_tokens
-        input_data = input_instance
-    
-    elif deployment_system == "TokenClassification":
-        logger.info(f"Transaction-id: {transaction_id}, Deployment system is TokenClassification, transforming the input data with inputs.")
-        input_data = {"instances": [input_data]}
-
-    elif deployment_system == "TextClassification":
-        logger.info(f"Transaction-id: {transaction_id}, Deployment system is TextClassification, transforming the input data with inputs.")
-        input_data = {"instances": [input_data]}
-
-    elif deployment_system == "MLFlow":
-        logger.info(f"Transaction-id: {transaction_id}, Deployment system is MLFlow with protocol version v2, transforming the input data with inputs.")
-        if isinstance(input_data, list):
-            model_input = input_data[0] 
-            mlflow_data = {"inputs": []}
-            input_instance = {}
-            input_instance["data"] = input_data  
-            input_instance["shape"] = input_data["shape"]
-            input_instance["datatype"] = input_data["datatype"]
-            input_instance["name"] = input_data["name"] 
-
-            mlflow_data["inputs"].append(input_instance)
-            input_data = mlflow_data
+    binary_input = isinstance(input_data, BinaryInferencePayload)
+    uploaded_input = isinstance(input_data, PredictionInput)
+    if not binary_input and not uploaded_input:
+        input_data = build_model_request_envelope(deployment_system, input_data, model_service_name, model_details, max_tokens, transaction_id)
 
     logger.info(f"Transaction-id: {transaction_id}, Making prediction request to the deployed model {model_id}.")
 
-    async with client.stream("POST", kourier_model_url, headers=model_headers, json=input_data) as response:
+    if is_grpc_model_url(kourier_model_url):
+        async with model_call_slot(model_id, notes, transaction_id):
+            return await get_grpc_model_prediction_for_input_data(request, model_id, model_service_name, transaction_id, deployment_system, kourier_model_url, model_headers, input_data, stage_timer=stage_timer)
+
+    inference_start = time.perf_counter()
+    # Models declared idempotent in their notes can be retried after the request was sent, and hedged
+    extensions = {IDEMPOTENT_EXTENSION: True} if notes.get("idempotent") is True else {}
+
+    request_headers = httpx.Headers(model_headers or {})
+    if binary_input:
+        # Tensor bytes are streamed from the received body as they are, so the body is never compressed
+        request_body, binary_headers = build_binary_model_request(input_data, deployment_system, model_details, transaction_id)
+        request_headers.update(binary_headers)
+        request_encoding = None
+    elif uploaded_input:
+        # The uploaded object is streamed from the runtime bucket between the prefix and the suffix of the envelope
+        prefix, suffix = build_model_request_envelope_frame(deployment_system, model_service_name, max_tokens)
+        request_body = stream_prediction_input(request.app.state.s3_client, input_data, prefix, suffix, transaction_id)
+        request_headers.setdefault("Content-Type", "application/json")
+        request_headers["Content-Length"] = str(len(prefix) + input_data.size + len(suffix))
+        request_encoding = None
+    else:
+        request_body = json.dumps(input_data).encode("utf-8")
+        request_headers.setdefault("Content-Type", "application/json")
+        request_encoding = get_model_request_encoding(notes)
+    if request_encoding and len(request_body) >= get_performance_config().COMPRESSION_MIN_BYTES:
+        request_body = await compress_payload(request_body, request_encoding, "model_request")
+        request_headers["Content-Encoding"] = request_encoding
+
+    async with model_call_slot(model_id, notes, transaction_id), stream_model_request(client, model_id, kourier_model_url, request_headers, request_body, extensions, transaction_id) as response:
         try:
             response.raise_for_status()
             # Check if content length is less than 5MB
             content_length = response.headers.get("Content-Length")
             if content_length is not None and int(content_length) <= config.MAX_PAYLOAD_SIZE * 1024 * 1024:
                 logger.info(f"Content length is less than and equal to 5MB, returning response directly.")
+                # The body, its parsed form and the encoded response are held until the response is sent
+                await reserve_request_memory(int(content_length) * get_performance_config().MEMORY_BUDGET_BODY_COPIES, "model_response")
                 data = await response.aread()
+                if stage_timer:
+                    stage_timer.record("inference", time.perf_counter() - inference_start)
+                observe_prediction_response_size(deployment_system, "content", len(data))
+                inference_header_length = response.headers.get(INFERENCE_HEADER_CONTENT_LENGTH)
+                if inference_header_length is not None:
+                    logger.info(f"Transaction-id: {transaction_id}, The model {model_id} returned binary outputs, passing the tensor bytes through.")
+                    return parse_binary_inference_body(data, inference_header_length, "outputs"), "content"
                 data = json.loads(data)
 
-                if deployment_system == "KserveV1":
-                    logger.info(f"Transaction-id: {transaction_id}, Deployment system is kserve with protocol version v1, returning response directly.")
-                    data = data["predictions"][0]
-
-                elif deployment_system == "KserveV2":
-                    logger.info(f"Transaction-id: {transaction_id}, Deployment system is kserve with protocol version v2, returning response directly.")
-                    data = data["outputs"][0]["data"]
-
-                elif deployment_system == "TextGeneration":
-                    logger.info(f"Transaction-id: {transaction_id}, Deployment system is TextGeneration, returning response directly.")
-                    logger.info(f"prediction data: {data}")
-                    data = data
-
-                elif deployment_system == "Text2TextGeneration":
-                    logger.info(f"Transaction-id: {transaction_id}, Deployment system is Text2TextGeneration, returning response directly.")
-                    logger.info(f"prediction data: {data}")
-                    data = data
-
-                elif deployment_system == "TokenClassification":
-                    logger.info(f"Transaction-id: {transaction_id}, Deployment system is TokenClassification, returning response directly.")
-                    logger.info(f"prediction data: {data}")
-                    data = data
-
-                elif deployment_system == "TextClassification":
-                    logger.info(f"Transaction-id: {transaction_id}, Deployment system is TextClassification, returning response directly.")
-                    logger.info(f"prediction data: {data}")
-                    data = data
-                
-                elif deployment_system == "MLFlow":
-                    logger.info(f"Transaction-id: {transaction_id}, Deployment system is MLFlow, returning response directly.")
-                    logger.info(f"prediction data: {data}")
-                    data = data
-                        
+                data = extract_model_response_data(deployment_system, data, transaction_id)
+
                 return data, "content"
                 
             logger.info(f"Transaction-id: {transaction_id}, Content length is more than 5MB, uploading the predicted data to S3 for the deployed model {model_id}.")
-            aws_plugin = AWSFeaturePlugin()
-
-            #Extracting the s3 client from the request state
-            s3_client = request.app.state.s3_client
-
-            bucket_structure = BucketStructure({"transaction_id": transaction_id}).get_bucket_structure()
-            preffix = f"{bucket_structure['runtime_folder']}/model_prediction_response.txt"
+            if stage_timer:
+                stage_timer.record("inference", time.perf_counter() - inference_start)
+            with optional_stage(stage_timer, "s3_spill"):
+                spilled_size = await spill_model_response(request, response.aiter_bytes(chunk_size=SPILL_PART_SIZE), model_id, transaction_id)
 
-            upload_id = aws_plugin.create_mutlipart_upload_and_retrieve_upload_id(s3_client, config.RUNTIME_BUCKET_NAME, preffix, transaction_id)
+            observe_prediction_response_size(deployment_system, "url", spilled_size)
 
-            parts = [] # List of parts to be uploaded
-            part_number = 1
-
-            async for chunk in response.aiter_bytes(chunk_size=5 * 1024 * 1024): # 5 MB chunk size
-                part = aws_plugin.upload_chunk_part_for_the_multipart_upload(s3_client, upload_id, part_number, chunk, preffix, config.RUNTIME_BUCKET_NAME, transaction_id)
-                parts.append({"PartNumber": part_number, "ETag": part["ETag"]})
-                part_number += 1
-
-            aws_plugin.complete_multipart_upload_for_the_multipart_upload(s3_client, upload_id, preffix, config.RUNTIME_BUCKET_NAME, parts, transaction_id)
-
-            logger.info(f"Transaction-id: {transaction_id},Successfully uploaded the predicted data to S3 for the deployed model {model_id} on preffix {preffix}.")
             return  None, "url"
 
     
@@ -188,6 +253,11 @@ async def get_model_prediction_for_input_data(request: Request, client: AsyncCli
         except ClientError as e:
             logger.error(f"Transaction-id: {transaction_id}, An Client error occurred while uploading the predicted data to S3 for the deployed model {model_id}: {str(e)}")
             raise HTTPException(status_code=500, detail=f"An error occurred while uploading the predicted data to S3 for the deployed model {model_id}: {str(e)}")
+
+        except HTTPException as e:
+            # e.g. the memory budget of the worker stayed exhausted
+            logger.error(f"Transaction-id: {transaction_id}, An HTTP error occurred while handling the response of the deployed model {model_id}: {e.detail}")
+            raise e
                     
         except Exception as e:
             logger.error(f"Transaction-id: {transaction_id}, An unexpected error occurred while making prediction request to the deployed model {model_id}: {str(e)}")
@@ -0,0 +1,195 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+from prometheus_client import Counter
+from rediscluster import RedisCluster
+from redis.exceptions import RedisError
+from src.models.env.performance_config_DTO import get_performance_config
+from src.utils.logger_util import setup_logger
+from src.utils.tracing_util import traced
+from collections import OrderedDict
+from typing import Any
+import threading
+import hashlib
+import json
+import time
+
+logger = setup_logger(__name__)
+
+PREDICTION_CACHE_KEY_PREFIX = "vps:prediction-cache"
+
+PREDICTION_CACHE_LOOKUPS_TOTAL = Counter(
+    "vps_prediction_cache_lookups_total",
+    "Prediction response cache lookups, by the tier that answered them (l1, l2) or miss.",
+    ["result"]
+)
+
+PREDICTION_CACHE_BYTES_SAVED_TOTAL = Counter(
+    "vps_prediction_cache_bytes_saved_total",
+    "Bytes of prediction responses served from the cache instead of the deployed model."
+)
+
+PREDICTION_CACHE_STORES_TOTAL = Counter(
+    "vps_prediction_cache_stores_total",
+    "Prediction responses offered to the cache, by outcome (stored, too_large, error).",
+    ["result"]
+)
+
+class LRUByteCache:
+    """
+    In process LRU cache bounded by the total size of its values in bytes, with a TTL per entry.
+    Used as the L1 in front of Redis so hot keys do not pay a Redis round trip.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: float):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _remove(self, key: str):
+        value, _ = self.entries.pop(key)
+        self.size -= len(value)
+
+_l1_cache = LRUByteCache(get_performance_config().PREDICTION_CACHE_L1_MAX_BYTES)
+
+def get_prediction_cache_ttl(model: dict):
+    """
+    Returns the TTL in seconds when the model opted in to the response cache, None otherwise.
+    Models opt in with "prediction_cache": true, or {"ttl_seconds": N}, in their notes.
+    """
+    config = get_performance_config()
+    if not config.PREDICTION_CACHE_ENABLED:
+        return None
+
+    try:
+        notes = json.loads(model.get("notes")) if model.get("notes") else {}
+    except (TypeError, ValueError):
+        return None
+
+    setting = notes.get("prediction_cache") if isinstance(notes, dict) else None
+    if setting is True:
+        return config.PREDICTION_CACHE_DEFAULT_TTL_SECONDS
+    if isinstance(setting, dict) and setting.get("enabled", True):
+        ttl = setting.get("ttl_seconds", config.PREDICTION_CACHE_DEFAULT_TTL_SECONDS)
+        if isinstance(ttl, (int, float)) and ttl > 0:
+            return min(int(ttl), config.PREDICTION_CACHE_MAX_TTL_SECONDS)
+    return None
+
+def hash_model_input(input_data: Any):
+    # Canonical JSON, so the key does not depend on the key order or whitespace of the request
+    canonical_input = json.dumps(input_data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical_input.encode("utf-8")).hexdigest()
+
+def get_deployment_version(model: dict, model_deployment: dict, transformer_deployment: dict = None):
+    # Anything that can change the response for the same input: the model and transformer deployments and the model notes (e.g. hf_max_token)
+    transformer_deployment = transformer_deployment or {}
+    version = [
+        model_deployment.get("deployment_id"),
+        model_deployment.get("updated_at"),
+        model_deployment.get("deployment_system"),
+        transformer_deployment.get("deployment_id"),
+        transformer_deployment.get("updated_at"),
+        model.get("notes")
+    ]
+    return hashlib.sha256(json.dumps(version, default=str).encode("utf-8")).hexdigest()[:16]
+
+def build_prediction_cache_key(model_id: str, deployment_version: str, input_hash: str):
+    # The hash tag keeps the keys of one model on one cluster slot
+    return f"{PREDICTION_CACHE_KEY_PREFIX}:{{{model_id}}}:{deployment_version}:{input_hash}"
+
+@traced("redis.get_cached_prediction")
+def get_cached_prediction(redis_client: RedisCluster, cache_key: str, transaction_id: str):
+    # Returns the cached prediction response or None, Redis failures are treated as a miss
+    value = _l1_cache.get(cache_key)
+    result = "l1"
+
+    if value is None and redis_client is not None:
+        try:
+            value = redis_client.get(cache_key)
+            result = "l2"
+        except RedisError as e:
+            logger.error(f"Transaction-id: {transaction_id}, Redis error while reading the prediction cache: {e}")
+        except Exception as e:
+            logger.error(f"Transaction-id: {transaction_id}, Unexpected error while reading the prediction cache: {e}")
+
+        if value is not None:
+            _l1_cache.set(cache_key, value, get_performance_config().PREDICTION_CACHE_L1_TTL_SECONDS)
+
+    if value is None:
+        PREDICTION_CACHE_LOOKUPS_TOTAL.labels(result="miss").inc()
+        return None
+
+    logger.info(f"Transaction-id: {transaction_id}, Prediction cache hit ({result}) for key {cache_key}")
+    PREDICTION_CACHE_LOOKUPS_TOTAL.labels(result=result).inc()
+    PREDICTION_CACHE_BYTES_SAVED_TOTAL.inc(len(value))
+    return json.loads(value)
+
+@traced("redis.store_cached_prediction")
+def store_cached_prediction(redis_client: RedisCluster, cache_key: str, response: dict, ttl: int, transaction_id: str):
+    config = get_performance_config()
+    try:
+        value = json.dumps(response, separators=(",", ":"))
+    except (TypeError, ValueError) as e:
+        logger.error(f"Transaction-id: {transaction_id}, Prediction response is not cacheable: {e}")
+        PREDICTION_CACHE_STORES_TOTAL.labels(result="error").inc()
+        return
+
+    if len(value) > config.PREDICTION_CACHE_MAX_ENTRY_BYTES:
+        logger.info(f"Transaction-id: {transaction_id}, Prediction response of {len(value)} bytes exceeds the cache entry limit, not caching it")
+        PREDICTION_CACHE_STORES_TOTAL.labels(result="too_large").inc()
+        return
+
+    _l1_cache.set(cache_key, value, min(ttl, config.PREDICTION_CACHE_L1_TTL_SECONDS))
+    if redis_client is not None:
+        try:
+            redis_client.set(cache_key, value, ex=ttl)
+        except RedisError as e:
+            logger.error(f"Transaction-id: {transaction_id}, Redis error while writing the prediction cache: {e}")
+            PREDICTION_CACHE_STORES_TOTAL.labels(result="error").inc()
+            return
+        except Exception as e:
+            logger.error(f"Transaction-id: {transaction_id}, Unexpected error while writing the prediction cache: {e}")
+            PREDICTION_CACHE_STORES_TOTAL.labels(result="error").inc()
+            return
+
+    PREDICTION_CACHE_STORES_TOTAL.labels(result="stored").inc()
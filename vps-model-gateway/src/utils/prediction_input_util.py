@@ -0,0 +1,304 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from src.models.env.env_config_DTO import EnvConfigDTO
+from src.models.env.performance_config_DTO import get_performance_config
+from src.config.bucket_structure import BucketStructure
+from src.utils.logger_util import setup_logger
+from src.utils.redis_feature_plugin import RedisFeaturePlugin
+from src.utils.aws_feature_plugin import AWSFeaturePlugin, run_s3_operation
+from src.utils.request_admission_util import PredictionAdmission, check_prediction_headers, resolve_token_user
+from src.utils.memory_budget_util import reserved_memory
+from src.utils.model_payload_envelope_util import build_model_request_envelope_frame
+from src.utils.grpc_inference_util import is_grpc_model_url
+from fastapi import HTTPException, Request
+from prometheus_client import Counter
+from redis.exceptions import RedisError
+from botocore.exceptions import ClientError
+from uuid import uuid4
+import json
+import re
+
+logger = setup_logger(__name__)
+
+# Names an uploaded input in /predict instead of sending it in the body
+INPUT_ID_HEADER = "vps-input-id"
+INPUT_KEY_PREFIX = "vps:prediction_input:"
+INPUT_FILE_NAME = "model_prediction_input.json"
+INPUT_CONTENT_TYPE = "application/json"
+
+PREDICTION_INPUTS_TOTAL = Counter(
+    "vps_prediction_inputs_total",
+    "Uploaded inputs, by event (upload_requested, validated, rejected, streamed to the model, presigned for a transformer).",
+    ["event"]
+)
+
+PREDICTION_INPUT_STREAMED_BYTES_TOTAL = Counter(
+    "vps_prediction_input_streamed_bytes_total",
+    "Bytes of uploaded inputs streamed from the runtime bucket into model requests."
+)
+
+# Bytes that matter to JsonValueScanner: everything structural at the top level, brackets and quotes
+# inside a container, quotes and escapes inside a string. UTF-8 never encodes other characters with them
+NESTED_JSON_BYTES = re.compile(rb'[\[\]{}"]')
+STRING_JSON_BYTES = re.compile(rb'["\\]')
+JSON_WHITESPACE = (0x20, 0x09, 0x0A, 0x0D)
+
+class JsonValueScanner:
+    """
+    Checks incrementally that a byte stream holds exactly one JSON value. It does not parse the value,
+    the model does: strings are skipped, brackets balanced, and nothing may precede or follow the value
+    at the top level. That is what keeps an uploaded input from closing the envelope it is streamed into
+    and adding fields of its own, e.g. `[1]], "parameters": {...}, "x": [[2]`.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.state = "empty" # empty, scalar (may continue), value (a container or string is open) or done
+
+    def feed(self, chunk: bytes):
+        position, end = 0, len(chunk)
+        while position < end:
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                    position += 1
+                    continue
+                match = STRING_JSON_BYTES.search(chunk, position)
+                if match is None:
+                    return
+                position = match.end()
+                if match.group() == b"\\":
+                    self.escaped = True
+                else:
+                    self.in_string = False
+                    if self.depth == 0:
+                        self.state = "done"
+                continue
+
+            if self.depth > 0:
+                match = NESTED_JSON_BYTES.search(chunk, position)
+                if match is None:
+                    return
+                position = match.end()
+                token = match.group()
+                if token == b'"':
+                    self.in_string = True
+                elif token in (b"[", b"{"):
+                    self.depth += 1
+                else:
+                    self.depth -= 1
+                    if self.depth == 0:
+                        self.state = "done"
+                continue
+
+            # Top level, byte by byte, only the few bytes around the value get here
+            byte = chunk[position]
+            position += 1
+            if byte in JSON_WHITESPACE:
+                if self.state == "scalar":
+                    self.state = "done"
+                continue
+            if self.state == "done" or byte in b",:]}" or (self.state == "scalar" and byte in b'"[{'):
+                raise ValueError(f"unexpected {chr(byte)!r} after the top level value")
+            if byte == ord('"'):
+                self.in_string, self.state = True, "value"
+            elif byte in b"[{":
+                self.depth, self.state = 1, "value"
+            else:
+                self.state = "scalar"
+
+    def finish(self):
+        if self.in_string or self.depth > 0:
+            raise ValueError("the input ends inside a JSON value")
+        if self.state == "empty":
+            raise ValueError("the input is empty")
+
+class PredictionInputReference:
+    # An input named by the vps-input-id header, resolved by the service once the caller is known
+    def __init__(self, input_id: str):
+        self.input_id = input_id
+
+class PredictionInput:
+    # An uploaded and validated input of the caller, streamed from the runtime bucket when the model is called
+    def __init__(self, input_id: str, key: str, etag: str, size: int):
+        self.input_id = input_id
+        self.key = key
+        self.etag = etag
+        self.size = size
+
+def build_input_key(input_id: str):
+    return f"{INPUT_KEY_PREFIX}{input_id}"
+
+def get_prediction_input_reference(request: Request, body: bytes):
+    # Returns the reference of a request naming an uploaded input, such a request must not have a body
+    input_id = request.headers.get(INPUT_ID_HEADER)
+    if not input_id:
+        return None
+    if body.strip():
+        raise HTTPException(status_code=400, detail=f"A request with the {INPUT_ID_HEADER} header must not have a body")
+    return PredictionInputReference(input_id)
+
+async def create_prediction_input_upload(request: Request, admission: PredictionAdmission):
+    """
+    Returns a presigned POST for the JSON input of a later /predict call, stored under the runtime folder
+    of this transaction, with the input id to send in the vps-input-id header. The input is recorded for
+    the caller, only their predictions can use it.
+    """
+    config = get_performance_config()
+    env_config = EnvConfigDTO()
+    redis_plugin = RedisFeaturePlugin()
+    if admission is not None:
+        transaction_id, user_data, redis_client = admission.transaction_id, admission.user_data, admission.redis_client
+    else:
+        vps_auth_token, transaction_id = check_prediction_headers(request, config)
+        user_data = await resolve_token_user(request, vps_auth_token, transaction_id, config)
+        redis_client = redis_plugin.create_redis_client()
+
+    try:
+        username = user_data.get("username")
+        if not username:
+            logger.error(f"Transaction-id: {transaction_id}, Username not found for vps-auth-token, stopping the input upload.")
+            raise HTTPException(status_code=404, detail="Username not found for vps-auth-token, stopping the input upload.")
+        if redis_client is None:
+            raise HTTPException(status_code=503, detail="The input store is not reachable, please retry later")
+
+        input_id = f"inp-{uuid4().hex}"
+        bucket_structure = BucketStructure({"transaction_id": transaction_id}).get_bucket_structure()
+        key = f"{bucket_structure['runtime_folder']}/{INPUT_FILE_NAME}"
+        upload = await run_s3_operation(AWSFeaturePlugin().generate_presigned_upload_url, request.app.state.s3_client, env_config.RUNTIME_BUCKET_NAME, key, transaction_id, INPUT_CONTENT_TYPE, config.PREDICTION_INPUT_UPLOAD_EXPIRATION_SECONDS)
+
+        try:
+            redis_client.set(build_input_key(input_id), json.dumps({"username": username, "key": key}), ex=config.PREDICTION_INPUT_TTL_SECONDS)
+        except RedisError as e:
+            logger.error(f"Transaction-id: {transaction_id}, Failed to store the input {input_id}: {e}")
+            raise HTTPException(status_code=503, detail="The input store is not reachable, please retry later")
+    finally:
+        if admission is None and redis_client is not None:
+            redis_plugin.close_redis_client(redis_client)
+
+    PREDICTION_INPUTS_TOTAL.labels(event="upload_requested").inc()
+    logger.info(f"Transaction-id: {transaction_id}, Created the upload of the input {input_id} for user: {username}")
+    return {
+        "input_id": input_id,
+        "upload_url": upload["url"],
+        "upload_fields": upload["fields"],
+        "content_type": INPUT_CONTENT_TYPE,
+        "expires_in": config.PREDICTION_INPUT_UPLOAD_EXPIRATION_SECONDS,
+        "max_size_bytes": env_config.MAX_POST_FILE_SIZE * 1024 * 1024
+    }
+
+async def validate_prediction_input(s3_client, input_id: str, key: str, transaction_id: str):
+    """
+    Reads the uploaded object once and checks that it is a single JSON value, returns its (etag, size).
+    The size comes from the same GetObject as the bytes checked, the etag pins them for the later reads.
+    """
+    chunk_size = get_performance_config().PREDICTION_INPUT_STREAM_CHUNK_BYTES
+    scanner = JsonValueScanner()
+    async with reserved_memory(2 * chunk_size, "s3_input", transaction_id):
+        response = await run_s3_operation(AWSFeaturePlugin().open_object_stream, s3_client, EnvConfigDTO().RUNTIME_BUCKET_NAME, key, transaction_id)
+        if response is None:
+            logger.error(f"Transaction-id: {transaction_id}, The input {input_id} was not uploaded")
+            raise HTTPException(status_code=404, detail=f"Input {input_id} was not uploaded yet")
+        body = response["Body"]
+        try:
+            while True:
+                chunk = await run_s3_operation(body.read, chunk_size)
+                if not chunk:
+                    break
+                scanner.feed(chunk)
+            scanner.finish()
+        except ValueError as e:
+            PREDICTION_INPUTS_TOTAL.labels(event="rejected").inc()
+            logger.error(f"Transaction-id: {transaction_id}, The input {input_id} is not a single JSON value: {e}")
+            raise HTTPException(status_code=400, detail=f"Input {input_id} must be a single JSON value: {e}")
+        finally:
+            body.close()
+    PREDICTION_INPUTS_TOTAL.labels(event="validated").inc()
+    return response["ETag"], response["ContentLength"]
+
+async def resolve_prediction_input(request: Request, redis_client, reference: PredictionInputReference, username: str, transaction_id: str):
+    """
+    Opens the uploaded input named by the request, only the user that requested the upload can use it.
+    The first prediction with the input validates it, its etag and size are recorded for the next ones.
+    """
+    if redis_client is None:
+        raise HTTPException(status_code=503, detail="The input store is not reachable, please retry later")
+    input_key = build_input_key(reference.input_id)
+    try:
+        record = redis_client.get(input_key)
+    except RedisError as e:
+        logger.error(f"Transaction-id: {transaction_id}, Failed to read the input {reference.input_id}: {e}")
+        raise HTTPException(status_code=503, detail="The input store is not reachable, please retry later")
+    record = json.loads(record) if record else None
+    if record is None or record.get("username") != username:
+        logger.error(f"Transaction-id: {transaction_id}, The input {reference.input_id} does not exist for user: {username}")
+        raise HTTPException(status_code=404, detail=f"Input {reference.input_id} not found")
+
+    if not record.get("etag"):
+        record["etag"], record["size"] = await validate_prediction_input(request.app.state.s3_client, reference.input_id, record["key"], transaction_id)
+        try:
+            ttl = redis_client.ttl(input_key)
+            redis_client.set(input_key, json.dumps(record), ex=ttl if ttl and ttl > 0 else get_performance_config().PREDICTION_INPUT_TTL_SECONDS)
+        except RedisError as e:
+            # The next prediction with the input validates it again
+            logger.warning(f"Transaction-id: {transaction_id}, Failed to record the validation of the input {reference.input_id}: {e}")
+    logger.info(f"Transaction-id: {transaction_id}, Using the uploaded input {reference.input_id} of {record['size']} bytes")
+    return PredictionInput(reference.input_id, record["key"], record["etag"], record["size"])
+
+async def get_prediction_input_download_url(request: Request, prediction_input: PredictionInput, transaction_id: str):
+    # Transformers that transform the input read the uploaded object themselves
+    PREDICTION_INPUTS_TOTAL.labels(event="presigned").inc()
+    return await run_s3_operation(AWSFeaturePlugin().generate_presigned_download_url, request.app.state.s3_client, EnvConfigDTO().RUNTIME_BUCKET_NAME, prediction_input.key, transaction_id)
+
+def can_stream_prediction_input(deployment_system: str, kourier_model_url: str):
+    # The object is only streamed into HTTP model requests whose envelope does not need the parsed input
+    return not is_grpc_model_url(kourier_model_url) and build_model_request_envelope_frame(deployment_system, "", 0) is not None
+
+async def stream_prediction_input(s3_client, prediction_input: PredictionInput, prefix: bytes, suffix: bytes, transaction_id: str):
+    """
+    Request body of a model call with an uploaded input: the envelope prefix, the object read from the
+    runtime bucket in parts of PREDICTION_INPUT_STREAM_CHUNK_BYTES, and the envelope suffix. At most two
+    parts are held at once, reserved from the memory budget of the worker. Only the validated object is
+    read, an input uploaded again since then fails the call with a 409 before any of it is sent.
+    """
+    chunk_size = get_performance_config().PREDICTION_INPUT_STREAM_CHUNK_BYTES
+    PREDICTION_INPUTS_TOTAL.labels(event="streamed").inc()
+    async with reserved_memory(2 * chunk_size, "s3_input", transaction_id):
+        try:
+            response = await run_s3_operation(AWSFeaturePlugin().open_object_stream, s3_client, EnvConfigDTO().RUNTIME_BUCKET_NAME, prediction_input.key, transaction_id, prediction_input.etag)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "PreconditionFailed":
+                raise
+            response = None
+        if response is None or response["ContentLength"] != prediction_input.size:
+            logger.error(f"Transaction-id: {transaction_id}, The input {prediction_input.input_id} changed after it was validated")
+            raise HTTPException(status_code=409, detail=f"Input {prediction_input.input_id} was uploaded again after it was validated, please request a new upload")
+        body = response["Body"]
+        try:
+            if prefix:
+                yield prefix
+            while True:
+                chunk = await run_s3_operation(body.read, chunk_size)
+                if not chunk:
+                    break
+                PREDICTION_INPUT_STREAMED_BYTES_TOTAL.inc(len(chunk))
+                yield chunk
+            if suffix:
+                yield suffix
+        finally:
+            body.close()
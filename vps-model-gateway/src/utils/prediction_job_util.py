@@ -0,0 +1,449 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from src.models.env.env_config_DTO import EnvConfigDTO
+from src.models.env.performance_config_DTO import get_performance_config
+from src.config.bucket_structure import BucketStructure
+from src.utils.logger_util import setup_logger
+from src.utils.redis_feature_plugin import RedisFeaturePlugin
+from src.utils.aws_feature_plugin import AWSFeaturePlugin, run_s3_operation
+from src.utils.request_admission_util import resolve_token_user
+from src.utils.deadline_util import restart_request_deadline
+from src.utils.memory_budget_util import get_current_memory_reservation
+from fastapi import HTTPException, Request
+from prometheus_client import Counter, Gauge, Histogram
+from redis.exceptions import RedisError
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, unquote
+from uuid import uuid4
+import ipaddress
+import hashlib
+import asyncio
+import socket
+import httpx
+import hmac
+import json
+import time
+
+logger = setup_logger(__name__)
+
+JOB_KEY_PREFIX = "vps:prediction_job:"
+CALLBACK_URL_HEADER = "vps-callback-url"
+SIGNATURE_HEADER = "vps-signature"
+RESULT_FILE_NAME = "async_prediction_response.json"
+
+# Host names that resolve inside the cluster, webhooks are only sent to public endpoints
+INTERNAL_HOST_SUFFIXES = (".local", ".internal", ".svc", ".localhost")
+
+class WebhookTargetError(Exception):
+    pass
+
+PREDICTION_JOBS_TOTAL = Counter(
+    "vps_prediction_jobs_total",
+    "Asynchronous predictions, by status (accepted, rejected, succeeded, failed).",
+    ["status"]
+)
+
+PREDICTION_JOBS_QUEUED = Gauge(
+    "vps_prediction_jobs_queued",
+    "Accepted asynchronous predictions waiting for the job pool of the worker.",
+    multiprocess_mode="livesum"
+)
+
+PREDICTION_JOBS_RUNNING = Gauge(
+    "vps_prediction_jobs_running",
+    "Asynchronous predictions running in the job pool of the worker.",
+    multiprocess_mode="livesum"
+)
+
+PREDICTION_JOB_QUEUE_WAIT_SECONDS = Histogram(
+    "vps_prediction_job_queue_wait_seconds",
+    "Time accepted asynchronous predictions waited for the job pool.",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600)
+)
+
+PREDICTION_JOB_WEBHOOKS_TOTAL = Counter(
+    "vps_prediction_job_webhooks_total",
+    "Webhooks of finished asynchronous predictions, by outcome (delivered, failed, rejected).",
+    ["outcome"]
+)
+
+def build_job_key(job_id: str):
+    return f"{JOB_KEY_PREFIX}{job_id}"
+
+def utc_now():
+    return datetime.now(timezone.utc).isoformat()
+
+def validate_callback_url(callback_url: str):
+    """
+    Rejects callback URLs that would make the gateway call into the cluster or a private network. Only
+    the URL itself is checked here, the addresses its host resolves to are checked when the webhook is sent.
+    """
+    config = get_performance_config()
+    parts = urlsplit(callback_url)
+    allowed_schemes = ("https", "http") if config.ASYNC_JOBS_WEBHOOK_ALLOW_HTTP else ("https",)
+    host = (parts.hostname or "").lower()
+    if parts.scheme not in allowed_schemes or not host:
+        raise HTTPException(status_code=400, detail=f"The {CALLBACK_URL_HEADER} header must be an absolute {' or '.join(allowed_schemes)} URL")
+    if config.ASYNC_JOBS_WEBHOOK_ALLOW_PRIVATE_HOSTS:
+        return
+    try:
+        internal = not ipaddress.ip_address(host).is_global
+    except ValueError:
+        internal = host == "localhost" or "." not in host or host.endswith(INTERNAL_HOST_SUFFIXES)
+    if internal:
+        raise HTTPException(status_code=400, detail=f"The {CALLBACK_URL_HEADER} header must point to a public host")
+
+async def resolve_callback_address(host: str, port: int):
+    """
+    Resolves the host of a callback URL and returns the address the webhook is sent to. Every resolved
+    address has to be public, a name that resolves to a private address as well is rejected as a whole.
+    """
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise WebhookTargetError(f"{host} could not be resolved: {e}")
+    addresses = list(dict.fromkeys(info[4][0] for info in infos))
+    if not addresses:
+        raise WebhookTargetError(f"{host} did not resolve to any address")
+    if not get_performance_config().ASYNC_JOBS_WEBHOOK_ALLOW_PRIVATE_HOSTS:
+        # Scoped IPv6 addresses carry their interface after a %
+        private = [address for address in addresses if not ipaddress.ip_address(address.split("%")[0]).is_global]
+        if private:
+            raise WebhookTargetError(f"{host} resolves to the non public address {private[0]}")
+    return addresses[0]
+
+def build_webhook_request(client: httpx.AsyncClient, callback_url: str, address: str, body: bytes, headers: dict):
+    # Connects to the checked address instead of resolving the host again, the Host header and the
+    # TLS server name (also used to verify the certificate) still name the host of the callback URL
+    url = httpx.URL(callback_url)
+    extensions = {"sni_hostname": url.raw_host.decode("ascii")} if url.scheme == "https" else {}
+    headers = {**headers, "Host": url.netloc.decode("ascii")}
+    return client.build_request("POST", url.copy_with(host=address), content=body, headers=headers, extensions=extensions)
+
+def get_presigned_url_key(url: str, bucket_name: str):
+    # Object key of a presigned URL, path style (/bucket/key) or virtual hosted style (/key)
+    path = unquote(urlsplit(url).path).lstrip("/")
+    return path[len(bucket_name) + 1:] if path.startswith(f"{bucket_name}/") else path
+
+def store_job_record(redis_client, record: dict, ttl: int):
+    redis_client.set(build_job_key(record["job_id"]), json.dumps(record), ex=ttl)
+
+def write_job_record(record: dict, ttl: int):
+    # Job records written outside of a request use a client of their own, failures only leave a stale status
+    redis_plugin = RedisFeaturePlugin()
+    redis_client = redis_plugin.create_redis_client()
+    if redis_client is None:
+        logger.error(f"Failed to store the {record['status']} status of the job {record['job_id']}, Redis is not reachable")
+        return
+    try:
+        store_job_record(redis_client, record, ttl)
+    except RedisError as e:
+        logger.error(f"Failed to store the {record['status']} status of the job {record['job_id']}: {e}")
+    finally:
+        redis_plugin.close_redis_client(redis_client)
+
+def read_job_record(job_id: str):
+    redis_plugin = RedisFeaturePlugin()
+    redis_client = redis_plugin.create_redis_client()
+    if redis_client is None:
+        raise HTTPException(status_code=503, detail="The job store is not reachable, please retry later")
+    try:
+        value = redis_client.get(build_job_key(job_id))
+    except RedisError as e:
+        logger.error(f"Failed to read the job {job_id}: {e}")
+        raise HTTPException(status_code=503, detail="The job store is not reachable, please retry later")
+    finally:
+        redis_plugin.close_redis_client(redis_client)
+    return json.loads(value) if value else None
+
+def read_job_result(s3_client, bucket_name: str, key: str):
+    return json.loads(s3_client.get_object(Bucket=bucket_name, Key=key)["Body"].read())
+
+class PredictionJob:
+    def __init__(self, runner, model_id: str, transaction_id: str, callback_url: str = None):
+        self.runner = runner
+        self.job_id = f"job-{uuid4().hex}"
+        self.callback_url = callback_url
+        self.accepted = asyncio.get_running_loop().create_future()
+        self.running = False
+        self.enqueued_at = None
+        self.record = {
+            "job_id": self.job_id,
+            "status": "queued",
+            "model_id": model_id,
+            "transaction_id": transaction_id,
+            "username": None,
+            "created_at": utc_now(),
+            "updated_at": None,
+            "result_key": None,
+            "error": None
+        }
+
+    def describe(self):
+        return {
+            "job_id": self.job_id,
+            "status": self.record["status"],
+            "model_id": self.record["model_id"],
+            "transaction_id": self.record["transaction_id"],
+            "status_url": f"/predict/jobs/{self.job_id}"
+        }
+
+    async def enqueue(self, redis_client, username: str):
+        # Called by the service once every check passed, returns when the job pool picked the job up
+        await self.runner.enqueue(self, redis_client, username)
+
+class PredictionJobRunner:
+    """
+    Runs the asynchronous predictions of the worker. A job runs the prediction service in a task of
+    its own: the checks run while /predict/async waits, the job is accepted once they passed, and the
+    rest of the prediction waits for one of ASYNC_JOBS_MAX_CONCURRENCY slots. The result is written
+    to the runtime folder of the transaction and the job status to Redis, for polling and the webhook.
+    A queued job gives its bytes back to the memory budget, they are bounded by ASYNC_JOBS_MAX_QUEUED_BYTES
+    instead and reserved again once the pool picks the job up, so queued jobs do not crowd out /predict.
+    """
+
+    def __init__(self):
+        self.slots = None
+        self.queued = 0
+        self.queued_bytes = 0
+        self.tasks = set()
+        self.webhook_client = None
+
+    def get_slots(self):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(get_performance_config().ASYNC_JOBS_MAX_CONCURRENCY)
+        return self.slots
+
+    def get_webhook_client(self):
+        # Kept apart from the upstream client, webhooks go to user controlled hosts: no pooled connections
+        # to the internal services, no retries, no redirects and no proxy settings from the environment
+        if self.webhook_client is None:
+            config = get_performance_config()
+            self.webhook_client = httpx.AsyncClient(
+                timeout=config.ASYNC_JOBS_WEBHOOK_TIMEOUT_SECONDS,
+                limits=httpx.Limits(max_connections=config.ASYNC_JOBS_MAX_CONCURRENCY, max_keepalive_connections=0),
+                follow_redirects=False,
+                trust_env=False
+            )
+        return self.webhook_client
+
+    async def submit(self, request: Request, model_id: str, callback_url: str, run_prediction):
+        """
+        Starts run_prediction(job) and returns (job, None) once the job was accepted, or (None, response)
+        when the prediction finished without being queued, e.g. a replayed transaction. A check that
+        failed raises its HTTPException.
+        """
+        job = PredictionJob(self, model_id, request.headers.get("transaction-id"), callback_url)
+        task = asyncio.ensure_future(self.run(request, job, run_prediction))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        try:
+            await asyncio.wait({job.accepted, task}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            # The client left before the job was accepted, nobody would learn its id
+            if not job.accepted.done():
+                task.cancel()
+            raise
+        if job.accepted.done():
+            PREDICTION_JOBS_TOTAL.labels(status="accepted").inc()
+            return job, None
+        return None, task.result()
+
+    async def enqueue(self, job: PredictionJob, redis_client, username: str):
+        config = get_performance_config()
+        transaction_id = job.record["transaction_id"]
+        if self.queued >= config.ASYNC_JOBS_MAX_QUEUED:
+            PREDICTION_JOBS_TOTAL.labels(status="rejected").inc()
+            logger.error(f"Transaction-id: {transaction_id}, {self.queued} asynchronous predictions are already queued, rejecting the job")
+            raise HTTPException(status_code=503, detail="Too many asynchronous predictions are queued, please retry later")
+        reservation = get_current_memory_reservation()
+        job_bytes = reservation.reserved if reservation is not None else 0
+        if self.queued_bytes + job_bytes > config.ASYNC_JOBS_MAX_QUEUED_BYTES:
+            PREDICTION_JOBS_TOTAL.labels(status="rejected").inc()
+            logger.error(f"Transaction-id: {transaction_id}, {self.queued_bytes} bytes of asynchronous predictions are already queued, rejecting the job")
+            raise HTTPException(status_code=503, detail="Too many asynchronous predictions are queued, please retry later")
+
+        job.record.update({"username": username, "updated_at": utc_now()})
+        if redis_client is None:
+            raise HTTPException(status_code=503, detail="The job store is not reachable, please retry later")
+        try:
+            store_job_record(redis_client, job.record, config.ASYNC_JOBS_TTL_SECONDS)
+        except RedisError as e:
+            logger.error(f"Transaction-id: {transaction_id}, Failed to store the job {job.job_id}: {e}")
+            raise HTTPException(status_code=503, detail="The job store is not reachable, please retry later")
+
+        logger.info(f"Transaction-id: {transaction_id}, Accepted the asynchronous prediction {job.job_id}")
+        self.queued += 1
+        self.queued_bytes += job_bytes
+        if reservation is not None:
+            reservation.release()
+        PREDICTION_JOBS_QUEUED.inc()
+        job.enqueued_at = time.perf_counter()
+        job.accepted.set_result(None)
+        try:
+            await self.get_slots().acquire()
+        finally:
+            self.queued -= 1
+            self.queued_bytes -= job_bytes
+            PREDICTION_JOBS_QUEUED.dec()
+        job.running = True
+        PREDICTION_JOBS_RUNNING.inc()
+        PREDICTION_JOB_QUEUE_WAIT_SECONDS.observe(time.perf_counter() - job.enqueued_at)
+
+        restart_request_deadline()
+        if reservation is not None:
+            await reservation.grow(job_bytes, "request_body")
+        job.record.update({"status": "running", "updated_at": utc_now()})
+        await asyncio.get_running_loop().run_in_executor(None, write_job_record, dict(job.record), config.ASYNC_JOBS_TTL_SECONDS)
+
+    async def run(self, request: Request, job: PredictionJob, run_prediction):
+        try:
+            response = await run_prediction(job)
+        except asyncio.CancelledError:
+            # The worker is stopping, the status is kept for polling but the webhook is not sent
+            if job.accepted.done():
+                await self.finish(request, job, error={"status_code": 503, "detail": "The gateway worker stopped before the prediction finished"}, notify=False)
+            raise
+        except HTTPException as e:
+            if not job.accepted.done():
+                raise
+            await self.finish(request, job, error={"status_code": e.status_code, "detail": e.detail})
+            return None
+        except Exception as e:
+            if not job.accepted.done():
+                raise
+            logger.error(f"Transaction-id: {job.record['transaction_id']}, The asynchronous prediction {job.job_id} failed: {e!r}")
+            await self.finish(request, job, error={"status_code": 500, "detail": f"An unexpected error occurred while running the prediction: {e}"})
+            return None
+        finally:
+            if job.running:
+                job.running = False
+                PREDICTION_JOBS_RUNNING.dec()
+                self.get_slots().release()
+
+        if not job.accepted.done():
+            return response
+        await self.finish(request, job, response=response)
+        return None
+
+    async def store_result(self, request: Request, job: PredictionJob, response: dict):
+        config = EnvConfigDTO()
+        bucket_structure = BucketStructure({"transaction_id": job.record["transaction_id"]}).get_bucket_structure()
+        result_key = f"{bucket_structure['runtime_folder']}/{RESULT_FILE_NAME}"
+        try:
+            body = json.dumps(response).encode("utf-8")
+        except TypeError:
+            raise HTTPException(status_code=415, detail="Binary tensor outputs are not supported for asynchronous predictions, use /predict")
+        await run_s3_operation(request.app.state.s3_client.put_object, Bucket=config.RUNTIME_BUCKET_NAME, Key=result_key, Body=body, ContentType="application/json")
+        return result_key
+
+    async def finish(self, request: Request, job: PredictionJob, response: dict = None, error: dict = None, notify: bool = True):
+        transaction_id = job.record["transaction_id"]
+        if error is None:
+            try:
+                job.record["result_key"] = await self.store_result(request, job, response)
+            except HTTPException as e:
+                error = {"status_code": e.status_code, "detail": e.detail}
+            except Exception as e:
+                logger.error(f"Transaction-id: {transaction_id}, Failed to store the result of the asynchronous prediction {job.job_id}: {e!r}")
+                error = {"status_code": 500, "detail": "Failed to store the prediction result"}
+
+        status = "failed" if error else "succeeded"
+        PREDICTION_JOBS_TOTAL.labels(status=status).inc()
+        job.record.update({"status": status, "error": error, "updated_at": utc_now()})
+        await asyncio.get_running_loop().run_in_executor(None, write_job_record, dict(job.record), get_performance_config().ASYNC_JOBS_TTL_SECONDS)
+        logger.info(f"Transaction-id: {transaction_id}, The asynchronous prediction {job.job_id} {status}")
+
+        if job.callback_url and notify:
+            payload = {key: job.record[key] for key in ("job_id", "status", "model_id", "transaction_id", "error")}
+            if response is not None and not error:
+                payload["result"] = response
+            await self.send_webhook(job, payload)
+
+    async def send_webhook(self, job: PredictionJob, payload: dict):
+        config = get_performance_config()
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if config.ASYNC_JOBS_WEBHOOK_SECRET:
+            signature = hmac.new(config.ASYNC_JOBS_WEBHOOK_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+            headers[SIGNATURE_HEADER] = f"sha256={signature}"
+
+        client = self.get_webhook_client()
+        url = httpx.URL(job.callback_url)
+        for attempt in range(1, config.ASYNC_JOBS_WEBHOOK_MAX_ATTEMPTS + 1):
+            try:
+                # Resolved again on every attempt and checked right before the connection is opened
+                address = await resolve_callback_address(url.raw_host.decode("ascii"), url.port or (443 if url.scheme == "https" else 80))
+                webhook_request = build_webhook_request(client, job.callback_url, address, body, headers)
+                response = await asyncio.wait_for(client.send(webhook_request), config.ASYNC_JOBS_WEBHOOK_TIMEOUT_SECONDS)
+                if response.status_code < 400:
+                    PREDICTION_JOB_WEBHOOKS_TOTAL.labels(outcome="delivered").inc()
+                    return True
+                reason = f"status {response.status_code}"
+            except WebhookTargetError as e:
+                logger.error(f"Transaction-id: {job.record['transaction_id']}, Webhook of the job {job.job_id} was not sent: {e}")
+                PREDICTION_JOB_WEBHOOKS_TOTAL.labels(outcome="rejected").inc()
+                return False
+            except (httpx.HTTPError, asyncio.TimeoutError) as e:
+                reason = repr(e)
+            logger.warning(f"Transaction-id: {job.record['transaction_id']}, Webhook of the job {job.job_id} failed with {reason}, attempt {attempt} of {config.ASYNC_JOBS_WEBHOOK_MAX_ATTEMPTS}")
+            if attempt < config.ASYNC_JOBS_WEBHOOK_MAX_ATTEMPTS:
+                await asyncio.sleep(2 ** (attempt - 1))
+        PREDICTION_JOB_WEBHOOKS_TOTAL.labels(outcome="failed").inc()
+        return False
+
+    async def shutdown(self):
+        for task in list(self.tasks):
+            task.cancel()
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.webhook_client is not None:
+            await self.webhook_client.aclose()
+            self.webhook_client = None
+
+_job_runner = PredictionJobRunner()
+
+def get_prediction_job_runner():
+    return _job_runner
+
+async def get_prediction_job_status(request: Request, job_id: str):
+    """
+    Returns the status of a job of the caller, with the stored result once it succeeded. The presigned
+    URL of a spilled result is signed again, the one stored with the result has expired by then.
+    """
+    config = get_performance_config()
+    vps_auth_token = request.headers.get("vps-auth-token", None)
+    if not vps_auth_token:
+        raise HTTPException(status_code=400, detail="Vps-auth-token is missing or empty in the request header")
+    transaction_id = request.headers.get("transaction-id") or job_id
+    user_data = await resolve_token_user(request, vps_auth_token, transaction_id, config)
+
+    record = await asyncio.get_running_loop().run_in_executor(None, read_job_record, job_id)
+    if record is None or not user_data.get("username") or record.get("username") != user_data.get("username"):
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+    status = {key: record.get(key) for key in ("job_id", "status", "model_id", "transaction_id", "created_at", "updated_at")}
+    if record["status"] == "failed":
+        status["error"] = record.get("error")
+    if record["status"] == "succeeded":
+        env_config = EnvConfigDTO()
+        s3_client = request.app.state.s3_client
+        result = await run_s3_operation(read_job_result, s3_client, env_config.RUNTIME_BUCKET_NAME, record["result_key"])
+        if isinstance(result, dict) and result.get("payload_url"):
+            payload_key = get_presigned_url_key(result["payload_url"], env_config.RUNTIME_BUCKET_NAME)
+            result["payload_url"] = await run_s3_operation(AWSFeaturePlugin().generate_presigned_download_url, s3_client, env_config.RUNTIME_BUCKET_NAME, payload_key, transaction_id)
+        status["result"] = result
+    return status
@@ -0,0 +1,139 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+from prometheus_client import Histogram, Gauge
+from src.models.env.performance_config_DTO import get_performance_config
+from src.utils.logger_util import setup_logger
+from contextlib import contextmanager
+import threading
+import time
+
+logger = setup_logger(__name__)
+
+# Label used until the deployment lookup has resolved the deployment system of the model
+UNKNOWN_DEPLOYMENT_SYSTEM = "unknown"
+
+# Label used for every model id once the cardinality limit has been reached
+OVERFLOW_MODEL_ID_LABEL = "other"
+
+# Latency buckets in seconds, from sub millisecond cache hits up to the 300s upstream timeout
+STAGE_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# Size buckets in bytes, from 1KB up to 500MB spilled responses
+RESPONSE_SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 * 1024, 5 * 1024 * 1024, 10 * 1024 * 1024, 50 * 1024 * 1024, 100 * 1024 * 1024, 500 * 1024 * 1024)
+
+PREDICTION_STAGE_LATENCY_SECONDS = Histogram(
+    "vps_prediction_stage_latency_seconds",
+    "Latency of each stage of the prediction pipeline.",
+    ["stage", "deployment_system", "model_id"],
+    buckets=STAGE_LATENCY_BUCKETS
+)
+
+PREDICTION_STAGE_IN_FLIGHT = Gauge(
+    "vps_prediction_stage_in_flight",
+    "Number of prediction requests currently executing a stage of the pipeline.",
+    ["stage"],
+    multiprocess_mode="livesum"
+)
+
+PREDICTION_REQUESTS_IN_FLIGHT = Gauge(
+    "vps_prediction_requests_in_flight",
+    "Number of prediction requests currently being processed by the gateway.",
+    multiprocess_mode="livesum"
+)
+
+PREDICTION_RESPONSE_SIZE_BYTES = Histogram(
+    "vps_prediction_response_size_bytes",
+    "Size of the model prediction responses received from the deployed models.",
+    ["deployment_system", "payload_type"],
+    buckets=RESPONSE_SIZE_BUCKETS
+)
+
+_model_id_labels = set()
+_model_id_labels_lock = threading.Lock()
+
+def bounded_model_id_label(model_id: str):
+    # Keeps the model_id label cardinality bounded, the first N model ids seen keep their own series
+    if model_id in _model_id_labels:
+        return model_id
+
+    config = get_performance_config()
+    with _model_id_labels_lock:
+        if model_id in _model_id_labels:
+            return model_id
+        if len(_model_id_labels) < config.METRICS_MAX_MODEL_ID_LABELS:
+            _model_id_labels.add(model_id)
+            return model_id
+
+    return OVERFLOW_MODEL_ID_LABEL
+
+def observe_prediction_response_size(deployment_system: str, payload_type: str, size: int):
+    PREDICTION_RESPONSE_SIZE_BYTES.labels(deployment_system=deployment_system or UNKNOWN_DEPLOYMENT_SYSTEM, payload_type=payload_type).observe(size)
+
+class StageTimer:
+    """
+    Times the stages of a single prediction request.
+
+    The deployment system is only known after the deployment lookup, so the durations are
+    kept on the timer and exported with the final labels when the request finishes. A stage
+    entered more than once (e.g. two presigned URLs) is exported as a single summed observation.
+    """
+
+    def __init__(self, model_id: str, transaction_id: str = None):
+        self.model_id = model_id
+        self.transaction_id = transaction_id
+        self.deployment_system = UNKNOWN_DEPLOYMENT_SYSTEM
+        self.durations = {}
+        self.finished = False
+        PREDICTION_REQUESTS_IN_FLIGHT.inc()
+
+    def set_deployment_system(self, deployment_system: str):
+        if deployment_system:
+            self.deployment_system = deployment_system
+
+    @contextmanager
+    def stage(self, name: str):
+        in_flight = PREDICTION_STAGE_IN_FLIGHT.labels(stage=name)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+            in_flight.dec()
+
+    def record(self, name: str, duration: float):
+        # Records a stage measured by the caller, for stages that do not map onto a single block
+        self.durations[name] = self.durations.get(name, 0.0) + duration
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        PREDICTION_REQUESTS_IN_FLIGHT.dec()
+
+        model_id_label = bounded_model_id_label(self.model_id)
+        for name, duration in self.durations.items():
+            PREDICTION_STAGE_LATENCY_SECONDS.labels(stage=name, deployment_system=self.deployment_system, model_id=model_id_label).observe(duration)
+
+        logger.debug(f"Transaction-id: {self.transaction_id}, Stage timings for the model {self.model_id}: {self.durations}")
+
+@contextmanager
+def optional_stage(stage_timer: StageTimer, name: str):
+    # Lets the utils time a stage when the caller passed a timer, and run untimed otherwise
+    if stage_timer is None:
+        yield
+    else:
+        with stage_timer.stage(name):
+            yield
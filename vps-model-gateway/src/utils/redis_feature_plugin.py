@@ -17,6 +17,7 @@ from redis.exceptions import RedisError
 from fastapi import HTTPException
 from src.models.env.env_config_DTO import EnvConfigDTO
 from src.utils.logger_util import setup_logger
+from src.utils.tracing_util import traced
 
 class RedisFeaturePlugin:
     def __init__(self):
@@ -42,6 +43,7 @@ class RedisFeaturePlugin:
         self.logger.info(f"Closing Redis connection")
         client.close()
 
+    @traced("redis.check_rate_limit")
     def check_rate_limit_exceeded_or_not_for_a_particular_user(self, client: RedisCluster, username: str, transaction_id: str, expire: int = 60):        
         try:
             self.logger.info(f"Transaction-id: {transaction_id}, Checking rate limit for user: {username}")
@@ -0,0 +1,229 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+from src.models.env.performance_config_DTO import PerformanceConfigDTO, get_performance_config
+from src.utils.redis_feature_plugin import RedisFeaturePlugin
+from src.utils.validate_auth_token_util import validate_auth_token
+from src.utils.edge_auth_util import get_edge_verified_user
+from src.utils.http_client_util import shared_http_client
+from src.utils.tracing_util import start_root_span
+from src.utils.logger_util import setup_logger
+from src.utils.memory_budget_util import reserve_request_memory
+from src.utils.binary_tensor_util import INFERENCE_HEADER_CONTENT_LENGTH
+from fastapi import HTTPException, Request
+from prometheus_client import Counter
+from collections import OrderedDict
+import hashlib
+import time
+
+logger = setup_logger(__name__)
+
+ADMISSION_REJECTIONS_TOTAL = Counter(
+    "vps_admission_rejections_total",
+    "Prediction requests rejected before their body was read, by reason.",
+    ["reason"]
+)
+
+TOKEN_VERDICT_CACHE_LOOKUPS_TOTAL = Counter(
+    "vps_token_verdict_cache_lookups_total",
+    "Lookups of the in-process token verdict cache, by result (valid, invalid or miss).",
+    ["result"]
+)
+
+class TokenVerdictCache:
+    """
+    Bounded in-process cache of token validations, keyed on the sha256 of the token. A valid token
+    maps to the user admin response, an invalid one to None.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+
+    def get(self, token: str):
+        # Returns (found, user_data)
+        key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self.entries.pop(key, None)
+            TOKEN_VERDICT_CACHE_LOOKUPS_TOTAL.labels(result="miss").inc()
+            return False, None
+        TOKEN_VERDICT_CACHE_LOOKUPS_TOTAL.labels(result="valid" if entry[1] else "invalid").inc()
+        return True, entry[1]
+
+    def put(self, token: str, user_data: dict, ttl: float, max_entries: int):
+        if ttl <= 0:
+            return
+        key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        self.entries[key] = (time.monotonic() + ttl, user_data)
+        self.entries.move_to_end(key)
+        while len(self.entries) > max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+_token_verdicts = TokenVerdictCache()
+
+class PredictionAdmission:
+    # What admission learned about the request, the service reuses it instead of repeating the checks
+    def __init__(self, transaction_id: str, user_data: dict, redis_client):
+        self.transaction_id = transaction_id
+        self.user_data = user_data
+        self.redis_client = redis_client
+
+def get_prediction_admission(request: Request):
+    admission = getattr(request.state, "admission", None)
+    return admission if isinstance(admission, PredictionAdmission) else None
+
+def reject(status_code: int, reason: str, detail: str):
+    ADMISSION_REJECTIONS_TOTAL.labels(reason=reason).inc()
+    raise HTTPException(status_code=status_code, detail=detail)
+
+def check_prediction_headers(request: Request, config: PerformanceConfigDTO):
+    # Header only checks of the service, in the same order and with the same responses
+    vps_env_type = request.headers.get("vps-env-type", None)
+
+    vps_auth_token = request.headers.get("vps-auth-token", None)
+    if vps_auth_token is None or len(vps_auth_token) == 0:
+        logger.error("vps-auth-token is missing or empty in the request header, stopping the prediction process.")
+        reject(400, "missing_token", "Vps-auth-token is missing or empty in the request header, stopping the prediction process.")
+
+    transaction_id = request.headers.get("transaction-id", None)
+    if transaction_id is None or len(transaction_id) == 0:
+        logger.error("Transaction-id is missing or empty in the request header, stopping the prediction process.")
+        reject(400, "missing_transaction_id", "Transaction-id is missing or empty in the request header, stopping the prediction process.")
+
+    if ((vps_env_type == "vipas-streamlit") ^ (vps_auth_token.startswith("sat-"))):
+        logger.error(f"Transaction-id: {transaction_id}, session token is not allowed for vps-env-type: {vps_env_type}, stopping the prediction process.")
+        reject(400, "session_token", f"Session token is not allowed for vps-env-type: {vps_env_type}, stopping the prediction process.")
+
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit() and int(content_length) > config.ADMISSION_MAX_BODY_BYTES:
+        logger.error(f"Transaction-id: {transaction_id}, Request body of {content_length} bytes is larger than {config.ADMISSION_MAX_BODY_BYTES} bytes, stopping the prediction process.")
+        reject(413, "body_too_large", f"Request body is larger than {config.ADMISSION_MAX_BODY_BYTES} bytes, stopping the prediction process.")
+
+    return vps_auth_token, transaction_id
+
+async def resolve_token_user(request: Request, vps_auth_token: str, transaction_id: str, config: PerformanceConfigDTO):
+    user_data = get_edge_verified_user(request, transaction_id)
+    if user_data is not None:
+        return user_data
+
+    found, user_data = _token_verdicts.get(vps_auth_token)
+    if found and user_data is None:
+        logger.error(f"Transaction-id: {transaction_id}, the vps-auth-token was recently rejected, stopping the prediction process.")
+        reject(401, "invalid_token", "The vps-auth-token is invalid, stopping the prediction process.")
+    if found:
+        return user_data
+
+    try:
+        async with shared_http_client(request) as client:
+            user_data = await validate_auth_token(client, vps_auth_token, transaction_id)
+    except HTTPException as e:
+        if e.status_code == 401:
+            _token_verdicts.put(vps_auth_token, None, config.ADMISSION_NEGATIVE_TOKEN_CACHE_TTL_SECONDS, config.ADMISSION_TOKEN_CACHE_MAX_ENTRIES)
+            ADMISSION_REJECTIONS_TOTAL.labels(reason="invalid_token").inc()
+        raise
+
+    if user_data.get("username"):
+        _token_verdicts.put(vps_auth_token, user_data, config.ADMISSION_TOKEN_CACHE_TTL_SECONDS, config.ADMISSION_TOKEN_CACHE_MAX_ENTRIES)
+    return user_data
+
+async def authenticate_request(request: Request, config: PerformanceConfigDTO):
+    # Header checks and token verdict shared by the dependencies, returns (transaction_id, user_data, username)
+    vps_auth_token, transaction_id = check_prediction_headers(request, config)
+    # The user admin call is traced under the caller's trace like the calls of the service
+    with start_root_span(f"{request.method} {request.url.path} admission", request.headers.get("traceparent"), transaction_id):
+        user_data = await resolve_token_user(request, vps_auth_token, transaction_id, config)
+
+    username = user_data.get("username")
+    if not username:
+        logger.error(f"Transaction-id: {transaction_id}, Username not found for vps-auth-token, stopping the prediction process.")
+        reject(404, "unknown_user", "Username not found for vps-auth-token, stopping the prediction process.")
+    return transaction_id, user_data, username
+
+async def admit_prediction_request(request: Request):
+    """
+    FastAPI dependency of /predict, runs before the body is read. Checks the headers, the declared
+    body size and the token (edge verdict, in-process verdict cache or user admin), and applies the
+    rate limit. As the body is not read until admission passes, uvicorn only answers an
+    Expect: 100-continue once the request was admitted, so rejected uploads are never sent.
+    """
+    config = get_performance_config()
+    if not config.ADMISSION_ENABLED:
+        yield None
+        return
+
+    transaction_id, user_data, username = await authenticate_request(request, config)
+
+    redis_plugin = RedisFeaturePlugin()
+    redis_client = redis_plugin.create_redis_client()
+    try:
+        if redis_client and redis_plugin.check_rate_limit_exceeded_or_not_for_a_particular_user(redis_client, username, transaction_id):
+            logger.error(f"Transaction-id: {transaction_id}, Rate limit exceeded for user: {username}, stopping the prediction process.")
+            reject(429, "rate_limited", f"Rate limit exceeded for user: {username}, stopping the prediction process, please wait for 60 seconds.")
+
+        admission = PredictionAdmission(transaction_id, user_data, redis_client)
+        request.state.admission = admission
+        yield admission
+    finally:
+        if redis_client:
+            redis_plugin.close_redis_client(redis_client)
+
+async def authenticate_prediction_request(request: Request):
+    """
+    FastAPI dependency of the endpoints that only prepare a prediction, e.g. /predict/inputs. Runs the
+    checks of admission without the rate limit, the prediction they prepare is rate limited itself.
+    """
+    config = get_performance_config()
+    if not config.ADMISSION_ENABLED:
+        yield None
+        return
+
+    transaction_id, user_data, _ = await authenticate_request(request, config)
+
+    redis_plugin = RedisFeaturePlugin()
+    redis_client = redis_plugin.create_redis_client()
+    try:
+        admission = PredictionAdmission(transaction_id, user_data, redis_client)
+        request.state.admission = admission
+        yield admission
+    finally:
+        if redis_client:
+            redis_plugin.close_redis_client(redis_client)
+
+async def read_prediction_body(request: Request):
+    """
+    Reads the body of an admitted request, a chunked body without Content-Length is cut off at the limit.
+    The body and the copies the prediction makes of it are reserved from the memory budget of the worker
+    before they are read, up front when the Content-Length is known and chunk by chunk otherwise. The
+    model response is reserved once its size is known, from the growth reserve of the budget.
+    """
+    config = get_performance_config()
+    limit = config.ADMISSION_MAX_BODY_BYTES
+    # Binary tensors are sliced out of the body without being copied
+    copies = 1 if request.headers.get(INFERENCE_HEADER_CONTENT_LENGTH) is not None else config.MEMORY_BUDGET_BODY_COPIES
+    content_length = request.headers.get("content-length")
+    declared_length = content_length is not None and content_length.isdigit()
+    body_size = min(int(content_length), limit) * copies if declared_length else 0
+    await reserve_request_memory(body_size, "request_body")
+
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            reject(413, "body_too_large", f"Request body is larger than {limit} bytes, stopping the prediction process.")
+        if not declared_length:
+            await reserve_request_memory(len(chunk) * copies, "request_body")
+    return bytes(body)
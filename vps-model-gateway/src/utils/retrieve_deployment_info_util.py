@@ -16,6 +16,7 @@ from fastapi import HTTPException, Request
 from src.utils.logger_util import setup_logger
 from src.models.env.env_config_DTO import EnvConfigDTO
 from src.utils.get_error_detail_util import get_error_detail
+from src.utils.model_metadata_cache_util import get_model_metadata_cache
 from httpx import AsyncClient
 import httpx
 import json
@@ -27,6 +28,11 @@ async def retrieve_deployment_info_for_model_and_related_transformer(client: Asy
         # Making a instance of env config DTO, changing it from global to local, for testing purpose as global instance cant be mocked
         config = EnvConfigDTO()
 
+        data = get_model_metadata_cache().get("deployment", model_id)
+        if data is not None:
+            logger.info(f"Transaction-id: {transaction_id}, Got the deployment details for the model {model_id} from the metadata cache.")
+            return data
+
         logger.info(f"Transaction-id: {transaction_id}, Trying to get the deployment details for the model, sending async request to the deploy admin.")
         
         response = await client.get(f"{config.DEPLOY_ADMIN_SERVICE_URL}/deploy/model/transformer/info?model_id={model_id}")
@@ -34,6 +40,9 @@ async def retrieve_deployment_info_for_model_and_related_transformer(client: Asy
 
         data = response.json()
         logger.info(f"Transaction-id: {transaction_id}, Response for the deploy admin service: {data}")
+        #Only deployments that were found are cached
+        if isinstance(data, dict) and data.get("model"):
+            get_model_metadata_cache().put("deployment", model_id, data)
 
         return data
     except httpx.HTTPStatusError as e:
@@ -15,6 +15,7 @@
 from fastapi import HTTPException
 from src.utils.logger_util import setup_logger
 from src.models.env.env_config_DTO import EnvConfigDTO
+from src.utils.grpc_inference_util import GRPC_DEPLOYMENT_SYSTEMS, get_grpc_model_url
 from httpx import AsyncClient
 from typing import Any
 import httpx
@@ -96,6 +97,14 @@ def retrieve_info_for_model_and_transformer_if_exists(model: dict, model_deploym
         logger.error(f"Transaction-id: {transaction_id}, Deployment system not supported for the model_id: {model_id}")
         raise HTTPException(status_code=400, detail=f"Deployment system not supported for the model_id: {model_id}")
 
+    # v2 protocol deployments can select the gRPC transport in their url additions
+    url_additions = model_deployment.get("url_additions") or {}
+    if deployment_system in GRPC_DEPLOYMENT_SYSTEMS and str(url_additions.get("Protocol", "")).lower() == "grpc":
+        grpc_model_url = get_grpc_model_url(url_additions, config.MODEL_KOURIER_SERVICE_URL, transaction_id)
+        if grpc_model_url:
+            logger.info(f"Transaction-id: {transaction_id}, Calling the deployed model {model_id} over gRPC at {grpc_model_url}")
+            kourier_model_url = grpc_model_url
+
     if transformer_deployment:
         logger.info(f"Transaction-id: {transaction_id}, Extracting the transformer deployment headers, as the model has a transformer")
         transformer_headers = transformer_deployment.get("url_additions",{}).get("Headers",{})
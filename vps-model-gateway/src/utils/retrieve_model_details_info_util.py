@@ -15,6 +15,7 @@
 from fastapi import HTTPException, Request
 from src.utils.logger_util import setup_logger
 from src.models.env.env_config_DTO import EnvConfigDTO
+from src.utils.model_metadata_cache_util import get_model_metadata_cache
 from httpx import AsyncClient
 import httpx
 import json
@@ -27,6 +28,11 @@ async def retrieve_model_details_info(client: AsyncClient, model_id: str, transa
         # Making a instance of env config DTO, changing it from global to local, for testing purpose as global instance cant be mocked
         config = EnvConfigDTO()
 
+        model = get_model_metadata_cache().get("model", model_id)
+        if model is not None:
+            logger.info(f"Transaction-id: {transaction_id}, Got the model details for model {model_id} from the metadata cache.")
+            return model
+
         logger.info(f"Transaction-id: {transaction_id}, Trying to get the model details for model {model_id}, from project admin service.")
         response = await client.get(f"{config.PROJECT_ADMIN_SERVICE_URL}/model/exists?model_id={model_id}")
         response.raise_for_status()
@@ -38,6 +44,7 @@ async def retrieve_model_details_info(client: AsyncClient, model_id: str, transa
         
         model = response_data.get("data")
         logger.info(f"Transaction-id: {transaction_id},Got the model details for model {model_id} from project admin service.")
+        get_model_metadata_cache().put("model", model_id, model)
 
         return model
     
@@ -0,0 +1,285 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+from prometheus_client import Counter
+from src.models.env.env_config_DTO import EnvConfigDTO
+from src.models.env.performance_config_DTO import get_performance_config
+from src.utils.logger_util import setup_logger
+from src.utils.deadline_util import DEADLINE_HEADER, get_remaining_deadline, get_stage_timeout
+from collections import deque
+import threading
+import asyncio
+import random
+import httpx
+import time
+
+logger = setup_logger(__name__)
+
+# Request extension marking a call as safe to retry after it was sent and to hedge, e.g. a model whose notes declare it idempotent
+IDEMPOTENT_EXTENSION = "vps_idempotent"
+# Request extension marking a call to a model predicted to be scaled to zero, never hedged and with its own read timeout
+COLD_START_EXTENSION = "vps_cold_start"
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+RETRYABLE_STATUS_CODES = (502, 503, 504)
+CONTROL_PLANE_UPSTREAMS = ("user_admin", "payment", "project_admin", "deploy_admin")
+
+UPSTREAM_RETRIES_TOTAL = Counter(
+    "vps_upstream_retries_total",
+    "Retried upstream calls, by upstream and the reason of the retry.",
+    ["upstream", "reason"]
+)
+
+UPSTREAM_HEDGES_TOTAL = Counter(
+    "vps_upstream_hedges_total",
+    "Hedged upstream calls, by upstream and outcome (sent, won when the hedge answered first).",
+    ["upstream", "outcome"]
+)
+
+UPSTREAM_RETRY_BUDGET_EXHAUSTED_TOTAL = Counter(
+    "vps_upstream_retry_budget_exhausted_total",
+    "Retries and hedges that were not sent because the retry budget was exhausted.",
+    ["upstream"]
+)
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int, hedge: bool):
+        self.max_attempts = max(1, max_attempts)
+        self.hedge = hedge
+
+class RetryBudget:
+    """
+    Token bucket shared by every upstream of a worker. Each request deposits `ratio` tokens and
+    the bucket also refills at `min_per_second`, a retry or hedge spends a whole token. This keeps
+    retries to a fraction of the traffic when an upstream is down, instead of multiplying it.
+    """
+
+    def __init__(self, ratio: float, min_per_second: float, max_tokens: float):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.max_tokens, self.tokens + (now - self.updated_at) * self.min_per_second)
+            self.updated_at = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+class LatencyTracker:
+    # Rolling window of the time to response headers of an upstream, the hedge delay is its percentile
+    def __init__(self, window: int, percentile: float, min_samples: int):
+        self.samples = deque(maxlen=window)
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.cached_percentile = None
+        self.samples_since_refresh = 0
+
+    def observe(self, duration: float):
+        self.samples.append(duration)
+        self.samples_since_refresh += 1
+
+    def get_percentile(self):
+        if len(self.samples) < self.min_samples:
+            return None
+        if self.cached_percentile is None or self.samples_since_refresh >= self.min_samples:
+            ordered = sorted(self.samples)
+            self.cached_percentile = ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))]
+            self.samples_since_refresh = 0
+        return self.cached_percentile
+
+class RetryingTransport(httpx.AsyncBaseTransport):
+    """
+    Wraps the pooled transport with per upstream retry policies, a global retry budget and
+    optional request hedging.
+
+    Requests that are idempotent (GET, or marked with the vps_idempotent extension) are retried on
+    connection failures and 502/503/504 responses with jittered exponential backoff. Any other
+    request is only retried when it failed to connect, as it never reached the upstream. Hedging,
+    when enabled, sends a second copy of an idempotent request of a hedged upstream once the first
+    one is slower than the configured latency percentile and uses whichever answers first.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+        self.config = get_performance_config()
+        self.budget = RetryBudget(self.config.HTTP_RETRY_BUDGET_RATIO, self.config.HTTP_RETRY_BUDGET_MIN_PER_SECOND, self.config.HTTP_RETRY_BUDGET_MAX_TOKENS)
+        self.latency_trackers = {}
+
+        env_config = EnvConfigDTO()
+        self.upstream_urls = [
+            ("user_admin", httpx.URL(env_config.USER_ADMIN_SERVICE_URL)),
+            ("payment", httpx.URL(env_config.PAYMENT_SERVICE_URL)),
+            ("project_admin", httpx.URL(env_config.PROJECT_ADMIN_SERVICE_URL)),
+            ("deploy_admin", httpx.URL(env_config.DEPLOY_ADMIN_SERVICE_URL)),
+            ("transformer", httpx.URL(env_config.TRANSFORMER_KOURIER_SERVICE_URL)),
+            ("model", httpx.URL(env_config.MODEL_KOURIER_SERVICE_URL))
+        ]
+        self.policies = {upstream: self.build_policy(upstream) for upstream, _ in self.upstream_urls}
+        self.policies["other"] = RetryPolicy(1, False)
+
+    def build_policy(self, upstream: str):
+        if upstream == "model":
+            policy = {"max_attempts": self.config.HTTP_MODEL_RETRY_MAX_ATTEMPTS, "hedge": True}
+        else:
+            policy = {"max_attempts": self.config.HTTP_RETRY_MAX_ATTEMPTS, "hedge": upstream in CONTROL_PLANE_UPSTREAMS}
+        policy.update(self.config.HTTP_RETRY_POLICIES.get(upstream, {}))
+        if not self.config.HTTP_RETRY_ENABLED:
+            policy["max_attempts"] = 1
+        return RetryPolicy(policy["max_attempts"], policy["hedge"] and self.config.HTTP_HEDGING_ENABLED)
+
+    def resolve_upstream(self, request: httpx.Request):
+        # The model and the transformer can share the Kourier host, the transformer is told apart by its paths
+        url = request.url
+        for upstream, base_url in self.upstream_urls:
+            if url.host == base_url.host and url.port == base_url.port:
+                if upstream == "transformer" and not url.path.startswith(("/check_transform", "/transform")):
+                    continue
+                return upstream
+        return "other"
+
+    def get_latency_tracker(self, upstream: str):
+        tracker = self.latency_trackers.get(upstream)
+        if tracker is None:
+            tracker = self.latency_trackers[upstream] = LatencyTracker(self.config.HTTP_HEDGE_LATENCY_WINDOW, self.config.HTTP_HEDGE_PERCENTILE, self.config.HTTP_HEDGE_MIN_SAMPLES)
+        return tracker
+
+    async def handle_async_request(self, request: httpx.Request):
+        upstream = self.resolve_upstream(request)
+        policy = self.policies[upstream]
+        idempotent = request.method in IDEMPOTENT_METHODS or request.extensions.get(IDEMPOTENT_EXTENSION, False)
+        # Streaming request bodies can only be sent once
+        replayable = isinstance(request.stream, httpx.ByteStream)
+        self.budget.deposit()
+
+        attempt = 1
+        while True:
+            self.apply_deadline(request, upstream)
+            try:
+                if policy.hedge and idempotent and replayable and not request.extensions.get(COLD_START_EXTENSION, False):
+                    response = await self.send_hedged(request, upstream)
+                else:
+                    response = await self.send(request, upstream)
+            except httpx.TransportError as e:
+                backoff = self.get_backoff(attempt)
+                retryable = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)) or idempotent
+                if not (retryable and replayable and self.should_retry(upstream, attempt, policy, type(e).__name__, backoff)):
+                    raise
+                logger.info(f"Retrying the {request.method} call to {upstream} after {type(e).__name__}, attempt {attempt + 1} of {policy.max_attempts}")
+            else:
+                backoff = self.get_backoff(attempt)
+                if not (response.status_code in RETRYABLE_STATUS_CODES and idempotent and replayable and self.should_retry(upstream, attempt, policy, str(response.status_code), backoff)):
+                    return response
+                logger.info(f"Retrying the {request.method} call to {upstream} after status {response.status_code}, attempt {attempt + 1} of {policy.max_attempts}")
+                await response.aclose()
+
+            await asyncio.sleep(backoff)
+            attempt += 1
+
+    def apply_deadline(self, request: httpx.Request, upstream: str):
+        # Per stage timeouts capped by the request deadline, and the time left forwarded so upstreams can give up too
+        remaining = get_remaining_deadline()
+        if remaining is not None:
+            if remaining <= 0:
+                raise httpx.TimeoutException(f"The request deadline was exceeded before calling {upstream}", request=request)
+            request.headers[DEADLINE_HEADER] = str(int(remaining * 1000))
+        timeout = get_stage_timeout(upstream, self.config)
+        if request.extensions.get(COLD_START_EXTENSION, False):
+            # Only the wait for a connection is shortened, the model may take the rest of the deadline once it is up
+            timeout["connect"] = timeout["pool"] = min(timeout["connect"], self.config.COLD_START_CONNECT_TIMEOUT_SECONDS)
+        request.extensions["timeout"] = timeout
+
+    def should_retry(self, upstream: str, attempt: int, policy: RetryPolicy, reason: str, backoff: float = 0):
+        if attempt >= policy.max_attempts:
+            return False
+        remaining = get_remaining_deadline()
+        if remaining is not None and remaining <= backoff:
+            return False
+        if not self.budget.try_spend():
+            UPSTREAM_RETRY_BUDGET_EXHAUSTED_TOTAL.labels(upstream=upstream).inc()
+            return False
+        UPSTREAM_RETRIES_TOTAL.labels(upstream=upstream, reason=reason).inc()
+        return True
+
+    def get_backoff(self, attempt: int):
+        # Full jitter, spreads the retries of concurrent requests instead of synchronizing them
+        cap = min(self.config.HTTP_RETRY_MAX_BACKOFF_MS, self.config.HTTP_RETRY_BASE_BACKOFF_MS * 2 ** (attempt - 1))
+        return random.uniform(0, cap) / 1000
+
+    async def send(self, request: httpx.Request, upstream: str):
+        start = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        # Cold starts would inflate the latency percentile the hedges are sent at
+        if response.status_code < 500 and not request.extensions.get(COLD_START_EXTENSION, False):
+            self.get_latency_tracker(upstream).observe(time.perf_counter() - start)
+        return response
+
+    async def send_hedged(self, request: httpx.Request, upstream: str):
+        hedge_delay = self.get_latency_tracker(upstream).get_percentile()
+        if hedge_delay is None:
+            return await self.send(request, upstream)
+
+        primary = asyncio.ensure_future(self.send(request, upstream))
+        done, _ = await asyncio.wait({primary}, timeout=max(hedge_delay, self.config.HTTP_HEDGE_MIN_DELAY_MS / 1000))
+        if done:
+            return primary.result()
+        if not self.budget.try_spend():
+            UPSTREAM_RETRY_BUDGET_EXHAUSTED_TOTAL.labels(upstream=upstream).inc()
+            return await primary
+
+        UPSTREAM_HEDGES_TOTAL.labels(upstream=upstream, outcome="sent").inc()
+        hedge = asyncio.ensure_future(self.send(request, upstream))
+        pending = {primary, hedge}
+        finished = []
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                finished.extend(done)
+                # The first successful answer wins, a failure is only returned once both copies failed
+                winner = next((task for task in done if task.exception() is None and task.result().status_code < 500), None)
+                if winner is not None:
+                    if winner is hedge:
+                        UPSTREAM_HEDGES_TOTAL.labels(upstream=upstream, outcome="won").inc()
+                    await close_responses([task for task in finished if task is not winner])
+                    return winner.result()
+
+            await close_responses(finished[:-1])
+            return finished[-1].result()
+        finally:
+            for task in pending:
+                task.cancel()
+                task.add_done_callback(close_abandoned_response)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+def close_abandoned_response(task: asyncio.Task):
+    # Releases the connection of a hedged copy that answered after the other one was used
+    if not task.cancelled() and task.exception() is None:
+        asyncio.ensure_future(task.result().aclose())
+
+async def close_responses(tasks: list):
+    for task in tasks:
+        if task.exception() is None:
+            await task.result().aclose()
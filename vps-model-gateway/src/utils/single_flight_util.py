@@ -0,0 +1,73 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+from prometheus_client import Counter, Gauge
+from src.utils.logger_util import setup_logger
+from typing import Any, Awaitable, Callable, Hashable
+import asyncio
+
+logger = setup_logger(__name__)
+
+SINGLE_FLIGHT_CALLS_TOTAL = Counter(
+    "vps_single_flight_calls_total",
+    "Coalesced calls, by whether the caller ran the call (leader) or shared the result of a running one (follower).",
+    ["name", "role"]
+)
+
+SINGLE_FLIGHT_IN_FLIGHT = Gauge(
+    "vps_single_flight_in_flight",
+    "Number of distinct calls currently running behind a single flight group.",
+    ["name"],
+    multiprocess_mode="livesum"
+)
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution whose result, or exception,
+    is shared by every caller. Keys are only held while the call runs, nothing is cached.
+
+    The call runs as a task owned by the first caller. If that caller is cancelled (e.g. the client
+    disconnected) the call is cancelled with it, and a waiting caller runs the call again instead.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = {}
+
+    async def do(self, key: Hashable, function: Callable[[], Awaitable[Any]]):
+        # Returns (result, shared), shared is True when the result came from another caller's call
+        while True:
+            task = self.calls.get(key)
+            if task is None:
+                return await self._lead(key, function), False
+
+            SINGLE_FLIGHT_CALLS_TOTAL.labels(name=self.name, role="follower").inc()
+            # asyncio.wait does not cancel the shared task when this caller is cancelled
+            await asyncio.wait({task})
+            if not task.cancelled():
+                return task.result(), True
+            logger.info(f"Single flight call {self.name} was cancelled by its leader, retrying it")
+
+    async def _lead(self, key: Hashable, function: Callable[[], Awaitable[Any]]):
+        SINGLE_FLIGHT_CALLS_TOTAL.labels(name=self.name, role="leader").inc()
+        SINGLE_FLIGHT_IN_FLIGHT.labels(name=self.name).inc()
+        task = asyncio.ensure_future(function())
+        self.calls[key] = task
+        task.add_done_callback(lambda _: self._forget(key, task))
+        return await task
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        SINGLE_FLIGHT_IN_FLIGHT.labels(name=self.name).dec()
+        if self.calls.get(key) is task:
+            del self.calls[key]
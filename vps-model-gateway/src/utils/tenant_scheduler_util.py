@@ -0,0 +1,229 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from src.models.env.performance_config_DTO import PerformanceConfigDTO, get_performance_config
+from src.utils.logger_util import setup_logger
+from src.utils.deadline_util import get_remaining_deadline
+from fastapi import HTTPException
+from prometheus_client import Counter, Gauge, Histogram
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from collections import deque
+import asyncio
+import time
+
+logger = setup_logger(__name__)
+
+ANONYMOUS_TENANT = "anonymous"
+
+# Weight of the latest call in the moving average of the time a model holds a slot
+EWMA_ALPHA = 0.2
+
+MODEL_SCHEDULER_QUEUE_DEPTH = Gauge(
+    "vps_model_scheduler_queue_depth",
+    "Model calls waiting for a free slot of their model, by tenant class (plan tier).",
+    ["tenant_class"],
+    multiprocess_mode="livesum"
+)
+
+MODEL_SCHEDULER_WAIT_SECONDS = Histogram(
+    "vps_model_scheduler_wait_seconds",
+    "Time model calls waited for a free slot of their model, by tenant class (plan tier).",
+    ["tenant_class"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+
+MODEL_SCHEDULER_REJECTIONS_TOTAL = Counter(
+    "vps_model_scheduler_rejections_total",
+    "Model calls rejected by the scheduler, by tenant class and reason (queue_full, deadline).",
+    ["tenant_class", "reason"]
+)
+
+class Tenant:
+    def __init__(self, entity_id: str, tenant_class: str, weight: float):
+        self.entity_id = entity_id
+        self.tenant_class = tenant_class
+        self.weight = weight
+
+_current_tenant = ContextVar("vps_request_tenant", default=None)
+
+def resolve_tenant(user_data: dict):
+    # The plan tier of the user admin response, else the configured tier of the entity, else the default tier
+    config = get_performance_config()
+    entity_id = user_data.get("entity_id") or ANONYMOUS_TENANT
+    tier = user_data.get("plan_tier") or config.MODEL_SCHEDULER_ENTITY_TIERS.get(entity_id)
+    if tier not in config.MODEL_SCHEDULER_TIER_WEIGHTS:
+        tier = config.MODEL_SCHEDULER_DEFAULT_TIER
+    return Tenant(entity_id, tier, max(float(config.MODEL_SCHEDULER_TIER_WEIGHTS.get(tier, 1)), 0.001))
+
+def start_request_tenant(user_data: dict, transaction_id: str):
+    # Makes the calling entity current for the model calls of the request and returns the token to reset it with
+    tenant = resolve_tenant(user_data)
+    logger.debug(f"Transaction-id: {transaction_id}, Scheduling the model calls of the entity {tenant.entity_id} as {tenant.tenant_class}")
+    return _current_tenant.set(tenant)
+
+def reset_request_tenant(token):
+    _current_tenant.reset(token)
+
+class QueuedCall:
+    def __init__(self, tenant: Tenant, start_tag: float, finish_tag: float, expires_at: float, transaction_id: str):
+        self.tenant = tenant
+        self.transaction_id = transaction_id
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.expires_at = expires_at
+        self.enqueued_at = time.perf_counter()
+        self.future = asyncio.get_running_loop().create_future()
+
+class ModelCallScheduler:
+    """
+    Slots of one model, with a queue per calling entity once they are all taken. Freed slots go
+    to the queued call with the smallest virtual finish tag, start-time fair queuing where every
+    call costs 1 / weight of its tenant, so an entity flooding the model only delays its own calls.
+    Calls that cannot finish before their deadline, judged by the average time a call holds a
+    slot, are dropped instead of being sent.
+    """
+
+    def __init__(self, model_id: str):
+        self.model_id = model_id
+        self.limit = 1
+        self.active = 0
+        self.virtual_time = 0.0
+        self.queues = {}
+        self.last_finish_tags = {}
+        self.service_time = None
+
+    @property
+    def idle(self):
+        return self.active == 0 and not self.queues
+
+    def can_finish_in_time(self, expires_at: float):
+        return expires_at is None or expires_at - time.monotonic() > (self.service_time or 0)
+
+    def reject(self, tenant: Tenant, reason: str, transaction_id: str):
+        MODEL_SCHEDULER_REJECTIONS_TOTAL.labels(tenant_class=tenant.tenant_class, reason=reason).inc()
+        if reason == "queue_full":
+            logger.warning(f"Transaction-id: {transaction_id}, The entity {tenant.entity_id} has too many calls queued for the model {self.model_id}")
+            return HTTPException(status_code=429, detail=f"Too many requests are queued for the model {self.model_id}, please retry later")
+        logger.warning(f"Transaction-id: {transaction_id}, The call to the model {self.model_id} cannot finish before the request deadline, dropping it")
+        return HTTPException(status_code=504, detail=f"The request deadline would be exceeded before the model {self.model_id} could answer")
+
+    async def acquire(self, tenant: Tenant, limit: int, max_queue: int, transaction_id: str):
+        self.limit = limit
+        if self.active < self.limit and not self.queues:
+            self.active += 1
+            MODEL_SCHEDULER_WAIT_SECONDS.labels(tenant_class=tenant.tenant_class).observe(0)
+            return
+
+        remaining = get_remaining_deadline()
+        expires_at = time.monotonic() + remaining if remaining is not None else None
+        if not self.can_finish_in_time(expires_at):
+            raise self.reject(tenant, "deadline", transaction_id)
+        queue = self.queues.get(tenant.entity_id)
+        if queue is not None and len(queue) >= max_queue:
+            raise self.reject(tenant, "queue_full", transaction_id)
+
+        start_tag = max(self.virtual_time, self.last_finish_tags.get(tenant.entity_id, 0.0))
+        call = QueuedCall(tenant, start_tag, start_tag + 1 / tenant.weight, expires_at, transaction_id)
+        self.last_finish_tags[tenant.entity_id] = call.finish_tag
+        self.queues.setdefault(tenant.entity_id, deque()).append(call)
+        MODEL_SCHEDULER_QUEUE_DEPTH.labels(tenant_class=tenant.tenant_class).inc()
+
+        try:
+            done, _ = await asyncio.wait({call.future}, timeout=remaining)
+        except asyncio.CancelledError:
+            self.abandon(call)
+            raise
+        if not done:
+            self.abandon(call)
+            raise self.reject(tenant, "deadline", transaction_id)
+        # Raises the rejection set by the dispatch
+        call.future.result()
+        MODEL_SCHEDULER_WAIT_SECONDS.labels(tenant_class=tenant.tenant_class).observe(time.perf_counter() - call.enqueued_at)
+
+    def abandon(self, call: QueuedCall):
+        if call.future.done():
+            # The slot was handed over while the caller gave up
+            if not call.future.cancelled() and call.future.exception() is None:
+                self.release()
+            return
+        call.future.cancel()
+        queue = self.queues.get(call.tenant.entity_id)
+        queue.remove(call)
+        MODEL_SCHEDULER_QUEUE_DEPTH.labels(tenant_class=call.tenant.tenant_class).dec()
+        if not queue:
+            del self.queues[call.tenant.entity_id]
+
+    def release(self, duration: float = None):
+        self.active -= 1
+        if duration is not None:
+            self.service_time = duration if self.service_time is None else (1 - EWMA_ALPHA) * self.service_time + EWMA_ALPHA * duration
+        self.dispatch()
+
+    def dispatch(self):
+        while self.active < self.limit and self.queues:
+            entity_id, queue = min(self.queues.items(), key=lambda item: item[1][0].finish_tag)
+            call = queue.popleft()
+            if not queue:
+                del self.queues[entity_id]
+            MODEL_SCHEDULER_QUEUE_DEPTH.labels(tenant_class=call.tenant.tenant_class).dec()
+            self.virtual_time = max(self.virtual_time, call.start_tag)
+            if not self.can_finish_in_time(call.expires_at):
+                call.future.set_exception(self.reject(call.tenant, "deadline", call.transaction_id))
+                continue
+            self.active += 1
+            call.future.set_result(None)
+
+        if not self.queues:
+            # Every entity is idle again, a new busy period starts without their old finish tags
+            self.last_finish_tags.clear()
+
+_schedulers = {}
+
+def get_model_max_concurrency(notes: dict, config: PerformanceConfigDTO = None):
+    max_concurrency = notes.get("max_concurrency") if isinstance(notes, dict) else None
+    if isinstance(max_concurrency, int) and not isinstance(max_concurrency, bool) and max_concurrency > 0:
+        return max_concurrency
+    return (config or get_performance_config()).MODEL_SCHEDULER_MAX_CONCURRENCY
+
+@asynccontextmanager
+async def model_call_slot(model_id: str, notes: dict, transaction_id: str):
+    """
+    Holds one of the slots of the model for the call, queuing the calls of the current tenant
+    fairly against the other tenants when the model already has its maximum of calls in flight.
+    """
+    config = get_performance_config()
+    if not config.MODEL_SCHEDULER_ENABLED:
+        yield
+        return
+
+    tenant = _current_tenant.get() or resolve_tenant({})
+    scheduler = _schedulers.get(model_id)
+    if scheduler is None:
+        scheduler = _schedulers[model_id] = ModelCallScheduler(model_id)
+    try:
+        await scheduler.acquire(tenant, get_model_max_concurrency(notes, config), config.MODEL_SCHEDULER_MAX_QUEUE_PER_TENANT, transaction_id)
+    except BaseException:
+        if scheduler.idle:
+            _schedulers.pop(model_id, None)
+        raise
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        scheduler.release(time.perf_counter() - started)
+        if scheduler.idle and _schedulers.get(model_id) is scheduler:
+            del _schedulers[model_id]
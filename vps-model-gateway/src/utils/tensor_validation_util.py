@@ -0,0 +1,131 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from src.models.env.performance_config_DTO import get_performance_config
+from src.utils.logger_util import setup_logger
+from prometheus_client import Counter
+from fastapi import HTTPException
+from typing import Any
+import numpy as np
+import math
+
+logger = setup_logger(__name__)
+
+TENSOR_VALIDATION_FAILURES_TOTAL = Counter(
+    "vps_tensor_validation_failures_total",
+    "KserveV2 inputs rejected before the model call, by reason (structure, datatype, range or shape).",
+    ["reason"]
+)
+
+# Open Inference Protocol datatypes, BYTES tensors carry strings in the JSON data
+KSERVE_V2_DATATYPES = {
+    "BOOL": np.bool_,
+    "UINT8": np.uint8,
+    "UINT16": np.uint16,
+    "UINT32": np.uint32,
+    "UINT64": np.uint64,
+    "INT8": np.int8,
+    "INT16": np.int16,
+    "INT32": np.int32,
+    "INT64": np.int64,
+    "FP16": np.float16,
+    "FP32": np.float32,
+    "FP64": np.float64,
+    "BYTES": np.str_
+}
+
+# numpy kinds of the decoded JSON data accepted for each kind of datatype
+ACCEPTED_KINDS = {"b": "b", "u": "iu", "i": "iu", "f": "iuf", "U": "U"}
+
+def reject(reason: str, detail: str, transaction_id: str):
+    TENSOR_VALIDATION_FAILURES_TOTAL.labels(reason=reason).inc()
+    logger.error(f"Transaction-id: {transaction_id}, Invalid model input: {detail}")
+    raise HTTPException(status_code=400, detail=f"Invalid model input: {detail}")
+
+def resolve_tensor_shape(data_shape: tuple, dims: list):
+    """
+    Returns the concrete shape of data with the given nesting shape for the declared dims, -1 dims
+    being dynamic, or None when the data does not fit the dims. Data nested like the dims is matched
+    dim by dim, any other nesting is read in row major order and only its element count must fit.
+    """
+    if len(data_shape) == len(dims):
+        if all(dim == -1 or dim == size for dim, size in zip(dims, data_shape)):
+            return list(data_shape)
+        return None
+
+    count = math.prod(data_shape)
+    fixed = math.prod(dim for dim in dims if dim != -1)
+    dynamic = sum(1 for dim in dims if dim == -1)
+    if fixed == 0:
+        return list(dims) if count == 0 else None
+    if count % fixed != 0 or (dynamic == 0 and count != fixed):
+        return None
+    if dynamic == 1:
+        return [count // fixed if dim == -1 else dim for dim in dims]
+    # More than one dynamic dim cannot be resolved from the element count alone
+    return list(dims)
+
+def validate_tensor_input(input_data: Any, model_input: dict, transaction_id: str):
+    """
+    Checks the input data of a KserveV2 model against the name, data_type and dims of its model
+    details in one pass over a numpy array of the data, and returns (data, shape) for the request:
+    the shape with the dynamic dims resolved and, when TENSOR_VALIDATION_FLATTEN_INPUTS is set, the
+    data flattened. Raises a 400 HTTPException for data the model would reject.
+    """
+    config = get_performance_config()
+    dims = model_input.get("dims")
+    datatype = model_input.get("data_type")
+    if not config.TENSOR_VALIDATION_ENABLED or datatype not in KSERVE_V2_DATATYPES:
+        return input_data, dims
+
+    if not isinstance(input_data, list):
+        reject("structure", f"the data of the {datatype} tensor {model_input.get('name')} must be a list", transaction_id)
+    try:
+        array = np.asarray(input_data)
+    except (ValueError, TypeError, OverflowError):
+        # Ragged nesting, or integers beyond 64 bits
+        reject("structure", f"the data of the tensor {model_input.get('name')} is not a rectangular list of values", transaction_id)
+
+    expected = np.dtype(KSERVE_V2_DATATYPES[datatype])
+    if expected == np.uint64 and array.dtype.kind in "fO":
+        # Integers above the int64 range are decoded as floats or objects unless the dtype is given
+        try:
+            unsigned = np.asarray(input_data, dtype=np.uint64)
+        except (ValueError, TypeError, OverflowError):
+            reject("range", f"the data of the tensor {model_input.get('name')} is out of the {datatype} range", transaction_id)
+        if array.dtype.kind == "f" and not np.array_equal(unsigned.astype(np.float64), array):
+            reject("datatype", f"the data of the tensor {model_input.get('name')} does not hold {datatype} values", transaction_id)
+        array = unsigned
+
+    if array.size:
+        if array.dtype.kind not in ACCEPTED_KINDS.get(expected.kind, ""):
+            reject("datatype", f"the data of the tensor {model_input.get('name')} does not hold {datatype} values", transaction_id)
+        if expected.kind in "iu":
+            limits = np.iinfo(expected)
+            if array.min() < limits.min or array.max() > limits.max:
+                reject("range", f"the data of the tensor {model_input.get('name')} is out of the {datatype} range", transaction_id)
+        elif expected.kind == "f" and expected.itemsize < 8 and np.abs(array).max() > np.finfo(expected).max:
+            reject("range", f"the data of the tensor {model_input.get('name')} is out of the {datatype} range", transaction_id)
+
+    shape = list(array.shape)
+    if dims is not None:
+        shape = resolve_tensor_shape(array.shape, dims)
+        if shape is None:
+            reject("shape", f"data of shape {list(array.shape)} does not fit the dims {dims} of the tensor {model_input.get('name')}", transaction_id)
+
+    if array.ndim > 1 and config.TENSOR_VALIDATION_FLATTEN_INPUTS:
+        # The decoded dtype is kept, so the flattened values are the ones that were sent
+        input_data = array.ravel().tolist()
+    return input_data, shape
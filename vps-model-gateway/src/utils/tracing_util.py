@@ -0,0 +1,353 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+from src.models.env.performance_config_DTO import get_performance_config
+from src.utils.logger_util import setup_logger
+from fastapi import HTTPException
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+import threading
+import secrets
+import random
+import queue
+import httpx
+import json
+import time
+import re
+
+logger = setup_logger(__name__)
+
+TRACEPARENT_HEADER = "traceparent"
+TRANSACTION_ID_HEADER = "transaction-id"
+
+# OTLP span kinds and status codes
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+STATUS_CODE_OK = 1
+STATUS_CODE_ERROR = 2
+
+TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+_current_span = ContextVar("vps_current_span", default=None)
+_current_transaction_id = ContextVar("vps_current_transaction_id", default=None)
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_span_id: str = None, kind: int = SPAN_KIND_INTERNAL, attributes: dict = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start_time_ns = time.time_ns()
+        self.end_time_ns = None
+        self.status_code = STATUS_CODE_OK
+        self.status_message = None
+        self.local_root = False
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def set_error(self, message: str):
+        self.status_code = STATUS_CODE_ERROR
+        self.status_message = message
+
+    def end(self):
+        if self.end_time_ns is None:
+            self.end_time_ns = time.time_ns()
+            _tracer.on_span_end(self)
+
+    @property
+    def duration_ms(self):
+        end_time_ns = self.end_time_ns or time.time_ns()
+        return (end_time_ns - self.start_time_ns) / 1_000_000
+
+    def to_otlp(self):
+        otlp_span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_time_ns),
+            "endTimeUnixNano": str(self.end_time_ns or time.time_ns()),
+            "attributes": [_to_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": self.status_code}
+        }
+        if self.parent_span_id:
+            otlp_span["parentSpanId"] = self.parent_span_id
+        if self.status_message:
+            otlp_span["status"]["message"] = self.status_message
+        return otlp_span
+
+def _to_otlp_attribute(key: str, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+def format_traceparent(span: Span):
+    return f"00-{span.trace_id}-{span.span_id}-01"
+
+def parse_traceparent(traceparent: str):
+    # Returns (trace_id, parent_span_id) for a valid W3C traceparent, None otherwise
+    if not traceparent:
+        return None
+    match = TRACEPARENT_PATTERN.match(traceparent.strip().lower())
+    if not match:
+        return None
+    trace_id, parent_span_id = match.group(1), match.group(2)
+    if trace_id == "0" * 32 or parent_span_id == "0" * 16:
+        return None
+    return trace_id, parent_span_id
+
+class FileSpanExporter:
+    """Appends one OTLP/JSON ExportTraceServiceRequest per line, readable by an OTLP file receiver."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, payload: dict):
+        with open(self.path, "a") as file:
+            file.write(json.dumps(payload) + "\n")
+
+    def shutdown(self):
+        pass
+
+class OTLPHttpSpanExporter:
+    """Posts OTLP/JSON payloads to the /v1/traces endpoint of an OTLP/HTTP collector."""
+
+    def __init__(self, endpoint: str):
+        self.url = f"{endpoint.rstrip('/')}/v1/traces"
+        self.client = httpx.Client(timeout=httpx.Timeout(5.0))
+
+    def export(self, payload: dict):
+        response = self.client.post(self.url, json=payload)
+        response.raise_for_status()
+
+    def shutdown(self):
+        self.client.close()
+
+class Tracer:
+    """
+    Minimal OpenTelemetry compatible tracer with tail sampling.
+
+    Spans are buffered per trace until the root span ends, the whole trace is then kept when it
+    failed or was slow, or with TRACING_SAMPLE_RATIO probability otherwise. Kept traces are
+    handed to a background thread so exporting never blocks the event loop.
+    """
+
+    def __init__(self):
+        self.config = get_performance_config()
+        self.enabled = self.config.TRACING_ENABLED
+        self.exporter = None
+        self.pending_traces = {}
+        self.lock = threading.Lock()
+        self.export_queue = queue.Queue(maxsize=1000)
+        self.export_thread = None
+
+    def configure(self, exporter=None):
+        self.config = get_performance_config()
+        self.enabled = self.config.TRACING_ENABLED
+        if not self.enabled:
+            return
+        if exporter is None:
+            if self.config.TRACING_EXPORTER == "otlp":
+                exporter = OTLPHttpSpanExporter(self.config.TRACING_OTLP_ENDPOINT)
+            else:
+                exporter = FileSpanExporter(self.config.TRACING_FILE_PATH)
+        self.exporter = exporter
+        logger.info(f"Tracing enabled with the {exporter.__class__.__name__}")
+
+    def start_span(self, name: str, parent: Span = None, trace_id: str = None, parent_span_id: str = None, kind: int = SPAN_KIND_INTERNAL, attributes: dict = None):
+        if not self.enabled:
+            return None
+        if parent is not None:
+            trace_id, parent_span_id = parent.trace_id, parent.span_id
+        span = Span(name, trace_id or secrets.token_hex(16), parent_span_id, kind, attributes)
+        with self.lock:
+            spans = self.pending_traces.get(span.trace_id)
+            if spans is None:
+                if len(self.pending_traces) >= self.config.TRACING_MAX_PENDING_TRACES:
+                    logger.warning("Too many pending traces, dropping the span")
+                    return span
+                spans = self.pending_traces[span.trace_id] = []
+            if len(spans) < self.config.TRACING_MAX_SPANS_PER_TRACE:
+                spans.append(span)
+        return span
+
+    def on_span_end(self, span: Span):
+        # Only the local root span of a trace decides whether the buffered trace is kept
+        if span.local_root:
+            with self.lock:
+                spans = self.pending_traces.pop(span.trace_id, [])
+            if spans and self.should_keep_trace(span, spans):
+                self.enqueue_export(spans)
+
+    def should_keep_trace(self, root_span: Span, spans: list):
+        if any(span.status_code == STATUS_CODE_ERROR for span in spans):
+            return True
+        if root_span.duration_ms >= self.config.TRACING_SLOW_THRESHOLD_MS:
+            return True
+        return random.random() < self.config.TRACING_SAMPLE_RATIO
+
+    def enqueue_export(self, spans: list):
+        for span in spans:
+            if span.end_time_ns is None:
+                # Spans still open when the root finished were abandoned (e.g. a failed connection)
+                span.set_error("Span was not ended before the root span")
+                span.end_time_ns = time.time_ns()
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [_to_otlp_attribute("service.name", self.config.TRACING_SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": "vps-model-gateway"}, "spans": [span.to_otlp() for span in spans]}]
+            }]
+        }
+        try:
+            self.export_queue.put_nowait(payload)
+        except queue.Full:
+            logger.warning("Trace export queue is full, dropping the trace")
+            return
+        self.ensure_export_thread()
+
+    def ensure_export_thread(self):
+        if self.export_thread is None or not self.export_thread.is_alive():
+            self.export_thread = threading.Thread(target=self.export_loop, name="vps-trace-exporter", daemon=True)
+            self.export_thread.start()
+
+    def export_loop(self):
+        while True:
+            payload = self.export_queue.get()
+            if payload is None:
+                return
+            try:
+                self.exporter.export(payload)
+            except Exception as e:
+                logger.error(f"Failed to export the trace: {e}")
+
+    def shutdown(self):
+        if self.export_thread is not None and self.export_thread.is_alive():
+            self.export_queue.put(None)
+            self.export_thread.join(timeout=5)
+        if self.exporter is not None:
+            self.exporter.shutdown()
+
+_tracer = Tracer()
+
+def get_tracer():
+    return _tracer
+
+def get_current_span():
+    return _current_span.get()
+
+def get_current_transaction_id():
+    return _current_transaction_id.get()
+
+@contextmanager
+def start_root_span(name: str, traceparent: str = None, transaction_id: str = None, attributes: dict = None):
+    """
+    Starts the server span of an incoming request, continuing the caller's trace when a valid
+    traceparent header was sent, and makes it and the transaction id current for the request.
+    """
+    parsed = parse_traceparent(traceparent)
+    trace_id, parent_span_id = parsed if parsed else (None, None)
+    span = _tracer.start_span(name, trace_id=trace_id, parent_span_id=parent_span_id, kind=SPAN_KIND_SERVER, attributes=attributes)
+    if span is not None:
+        span.local_root = True
+        if transaction_id:
+            span.set_attribute("vps.transaction_id", transaction_id)
+
+    span_token = _current_span.set(span)
+    transaction_token = _current_transaction_id.set(transaction_id)
+    try:
+        yield span
+    except HTTPException as e:
+        if span is not None:
+            span.set_attribute("http.status_code", e.status_code)
+            if e.status_code >= 500:
+                span.set_error(str(e.detail))
+        raise
+    except Exception as e:
+        if span is not None:
+            span.set_error(str(e))
+        raise
+    finally:
+        _current_span.reset(span_token)
+        _current_transaction_id.reset(transaction_token)
+        if span is not None:
+            span.end()
+
+@contextmanager
+def start_span(name: str, attributes: dict = None, kind: int = SPAN_KIND_INTERNAL):
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    span = _tracer.start_span(name, parent=parent, kind=kind, attributes=attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except Exception as e:
+        span.set_error(str(e))
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+
+def traced(name: str):
+    # Decorator for the synchronous S3 and Redis operations of the feature plugins
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with start_span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+async def trace_upstream_request(request: httpx.Request):
+    # httpx request event hook: propagates the transaction id and the trace context to every upstream
+    transaction_id = _current_transaction_id.get()
+    if transaction_id and TRANSACTION_ID_HEADER not in request.headers:
+        request.headers[TRANSACTION_ID_HEADER] = transaction_id
+
+    parent = _current_span.get()
+    if parent is None:
+        return
+
+    span = _tracer.start_span(f"{request.method} {request.url.host}", parent=parent, kind=SPAN_KIND_CLIENT, attributes={
+        "http.method": request.method,
+        "http.url": str(request.url.copy_with(query=None)),
+        "server.address": request.url.host
+    })
+    if transaction_id:
+        span.set_attribute("vps.transaction_id", transaction_id)
+    request.headers[TRACEPARENT_HEADER] = format_traceparent(span)
+    request.extensions["vps_span"] = span
+
+async def trace_upstream_response(response: httpx.Response):
+    # httpx response event hook, runs once the response headers are received
+    span = response.request.extensions.get("vps_span")
+    if span is None:
+        return
+    span.set_attribute("http.status_code", response.status_code)
+    if response.status_code >= 500:
+        span.set_error(f"Upstream responded with status {response.status_code}")
+    span.end()
+
+TRACING_EVENT_HOOKS = {"request": [trace_upstream_request], "response": [trace_upstream_response]}
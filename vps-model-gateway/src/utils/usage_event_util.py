@@ -0,0 +1,275 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+from prometheus_client import Counter, Gauge
+from fastapi import Request
+from src.models.env.env_config_DTO import EnvConfigDTO
+from src.models.env.performance_config_DTO import PerformanceConfigDTO, get_performance_config
+from src.utils.redis_feature_plugin import RedisFeaturePlugin
+from src.utils.aws_feature_plugin import run_s3_operation
+from src.utils.logger_util import setup_logger
+from datetime import datetime, timezone
+from collections import deque
+from httpx import AsyncClient
+from uuid import uuid4
+import asyncio
+import gzip
+import json
+import time
+import os
+
+logger = setup_logger(__name__)
+
+USAGE_EVENTS_TOTAL = Counter(
+    "vps_usage_events_total",
+    "Usage events by outcome: emitted, flushed (delivered to the sink), spilled (written to disk), replayed (delivered from disk) or dropped.",
+    ["result"]
+)
+
+USAGE_EVENTS_BUFFERED = Gauge(
+    "vps_usage_events_buffered",
+    "Usage events waiting in memory for the next flush.",
+    multiprocess_mode="livesum"
+)
+
+USAGE_EVENTS_FLUSH_FAILURES_TOTAL = Counter(
+    "vps_usage_events_flush_failures_total",
+    "Batches the usage event sink failed to accept."
+)
+
+class HttpUsageEventSink:
+    # Posts {"events": [...]} to the bulk endpoint of the payment service
+    def __init__(self, client: AsyncClient, url: str):
+        self.client = client
+        self.url = url
+
+    async def send(self, events: list):
+        response = await self.client.post(self.url, json={"events": events})
+        response.raise_for_status()
+
+    async def close(self):
+        pass
+
+class RedisStreamUsageEventSink:
+    # Appends one stream entry per event, the stream is capped at about USAGE_EVENTS_REDIS_STREAM_MAXLEN entries
+    def __init__(self, stream: str, maxlen: int):
+        self.stream = stream
+        self.maxlen = maxlen
+        self.redis_plugin = RedisFeaturePlugin()
+        self.redis_client = None
+
+    def send_blocking(self, events: list):
+        if self.redis_client is None:
+            self.redis_client = self.redis_plugin.create_redis_client()
+            if self.redis_client is None:
+                raise ConnectionError("Could not connect to Redis")
+        for event in events:
+            self.redis_client.xadd(self.stream, {"event": json.dumps(event)}, maxlen=self.maxlen, approximate=True)
+
+    async def send(self, events: list):
+        await asyncio.get_running_loop().run_in_executor(None, self.send_blocking, events)
+
+    async def close(self):
+        if self.redis_client is not None:
+            self.redis_plugin.close_redis_client(self.redis_client)
+
+class S3UsageEventSink:
+    # Writes each batch as one gzipped JSONL object, partitioned by hour
+    def __init__(self, s3_client, bucket_name: str, prefix: str):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.prefix = prefix.strip("/")
+
+    def send_blocking(self, events: list):
+        now = datetime.now(timezone.utc)
+        key = f"{self.prefix}/{now:%Y/%m/%d/%H}/{now:%Y%m%dT%H%M%S}-{os.getpid()}-{uuid4().hex[:8]}.jsonl.gz"
+        body = gzip.compress("".join(json.dumps(event) + "\n" for event in events).encode("utf-8"))
+        self.s3_client.put_object(Bucket=self.bucket_name, Key=key, Body=body, ContentType="application/x-ndjson", ContentEncoding="gzip")
+
+    async def send(self, events: list):
+        await run_s3_operation(self.send_blocking, events)
+
+    async def close(self):
+        pass
+
+class UsageEventEmitter:
+    """
+    Collects usage events on the request path without doing any I/O there.
+
+    Events go to an in-memory buffer that a background task flushes in batches, every
+    USAGE_EVENTS_FLUSH_INTERVAL_SECONDS or as soon as a batch is full. When the sink fails, or is
+    too slow to keep the buffer below USAGE_EVENTS_BUFFER_SIZE, events are spilled to JSONL files
+    and delivered from there once the sink accepts batches again.
+    """
+
+    def __init__(self, sink, config: PerformanceConfigDTO = None):
+        self.sink = sink
+        self.config = config or get_performance_config()
+        self.buffer = deque()
+        self.flush_requested = asyncio.Event()
+        self.flush_task = None
+        self.spill_tasks = set()
+
+    def emit(self, event: dict):
+        self.buffer.append(event)
+        USAGE_EVENTS_TOTAL.labels(result="emitted").inc()
+        if len(self.buffer) >= self.config.USAGE_EVENTS_BUFFER_SIZE:
+            # Backpressure, the whole buffer is handed to a thread that writes it to disk
+            events, self.buffer = list(self.buffer), deque()
+            task = asyncio.get_running_loop().run_in_executor(None, self.spill, events)
+            self.spill_tasks.add(task)
+            task.add_done_callback(self.spill_tasks.discard)
+        elif len(self.buffer) >= self.config.USAGE_EVENTS_BATCH_SIZE:
+            self.flush_requested.set()
+        USAGE_EVENTS_BUFFERED.set(len(self.buffer))
+
+    def start(self):
+        os.makedirs(self.config.USAGE_EVENTS_SPILL_DIR, exist_ok=True)
+        self.flush_task = asyncio.get_running_loop().create_task(self.run())
+        logger.info(f"Usage events are flushed to the {self.sink.__class__.__name__}")
+
+    async def stop(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            try:
+                await self.flush_task
+            except asyncio.CancelledError:
+                pass
+        if self.spill_tasks:
+            await asyncio.gather(*self.spill_tasks, return_exceptions=True)
+        await self.flush(replay=False)
+        await self.sink.close()
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_requested.wait(), timeout=self.config.USAGE_EVENTS_FLUSH_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Unexpected error while flushing the usage events: {e}")
+
+    async def flush(self, replay: bool = True):
+        while self.buffer:
+            batch = [self.buffer.popleft() for _ in range(min(len(self.buffer), self.config.USAGE_EVENTS_BATCH_SIZE))]
+            USAGE_EVENTS_BUFFERED.set(len(self.buffer))
+            if not await self.send(batch):
+                await asyncio.get_running_loop().run_in_executor(None, self.spill, batch + list(self.buffer))
+                self.buffer.clear()
+                USAGE_EVENTS_BUFFERED.set(0)
+                return
+            USAGE_EVENTS_TOTAL.labels(result="flushed").inc(len(batch))
+
+        if replay:
+            await self.replay_spilled_events()
+
+    async def send(self, batch: list):
+        try:
+            await self.sink.send(batch)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to send {len(batch)} usage events to the {self.sink.__class__.__name__}: {e}")
+            USAGE_EVENTS_FLUSH_FAILURES_TOTAL.inc()
+            return False
+
+    def spill(self, events: list):
+        spill_dir = self.config.USAGE_EVENTS_SPILL_DIR
+        spilled_bytes = sum(entry.stat().st_size for entry in os.scandir(spill_dir) if entry.is_file())
+        if spilled_bytes >= self.config.USAGE_EVENTS_MAX_SPILL_BYTES:
+            logger.error(f"Usage event spill directory is full, dropping {len(events)} usage events")
+            USAGE_EVENTS_TOTAL.labels(result="dropped").inc(len(events))
+            return
+
+        path = os.path.join(spill_dir, f"usage-{time.time_ns()}-{os.getpid()}.jsonl")
+        with open(f"{path}.tmp", "w") as file:
+            for event in events:
+                file.write(json.dumps(event) + "\n")
+        # Renamed once complete, so a replaying worker never reads a partial file
+        os.replace(f"{path}.tmp", path)
+        logger.warning(f"Spilled {len(events)} usage events to {path}")
+        USAGE_EVENTS_TOTAL.labels(result="spilled").inc(len(events))
+
+    async def replay_spilled_events(self):
+        # Delivers the oldest spilled file, one per flush so a backlog does not starve the live events
+        path = await asyncio.get_running_loop().run_in_executor(None, self.claim_spilled_file)
+        if path is None:
+            return
+        with open(path, "r") as file:
+            events = [json.loads(line) for line in file if line.strip()]
+
+        for offset in range(0, len(events), self.config.USAGE_EVENTS_BATCH_SIZE):
+            batch = events[offset:offset + self.config.USAGE_EVENTS_BATCH_SIZE]
+            if not await self.send(batch):
+                # Put the undelivered events back for a later flush
+                await asyncio.get_running_loop().run_in_executor(None, self.spill, events[offset:])
+                os.remove(path)
+                return
+            USAGE_EVENTS_TOTAL.labels(result="replayed").inc(len(batch))
+        os.remove(path)
+
+    def claim_spilled_file(self):
+        # Workers can share the spill directory, renaming a file claims it for this worker
+        spill_dir = self.config.USAGE_EVENTS_SPILL_DIR
+        for name in sorted(os.listdir(spill_dir)):
+            if not (name.startswith("usage-") and name.endswith(".jsonl")):
+                continue
+            claimed_path = os.path.join(spill_dir, f"replaying-{os.getpid()}-{name}")
+            try:
+                os.rename(os.path.join(spill_dir, name), claimed_path)
+                return claimed_path
+            except FileNotFoundError:
+                continue
+        return None
+
+def create_usage_event_emitter(http_client: AsyncClient, s3_client):
+    # Returns None when usage events are disabled
+    config = get_performance_config()
+    if not config.USAGE_EVENTS_ENABLED:
+        return None
+
+    env_config = EnvConfigDTO()
+    if config.USAGE_EVENTS_SINK == "http":
+        sink = HttpUsageEventSink(http_client, f"{env_config.PAYMENT_SERVICE_URL}{config.USAGE_EVENTS_HTTP_PATH}")
+    elif config.USAGE_EVENTS_SINK == "redis_stream":
+        sink = RedisStreamUsageEventSink(config.USAGE_EVENTS_REDIS_STREAM, config.USAGE_EVENTS_REDIS_STREAM_MAXLEN)
+    elif config.USAGE_EVENTS_SINK == "s3":
+        sink = S3UsageEventSink(s3_client, env_config.RUNTIME_BUCKET_NAME, config.USAGE_EVENTS_S3_PREFIX)
+    else:
+        raise ValueError(f"Unsupported usage event sink: {config.USAGE_EVENTS_SINK}")
+    return UsageEventEmitter(sink, config)
+
+def record_prediction_usage(request: Request, model_id: str, input_bytes: int, response: dict, duration: float):
+    """
+    Emits the usage event of a successful prediction. The service fills request.state.usage once it
+    knows the caller and the deployment, so replayed transactions are not emitted again.
+    """
+    emitter = getattr(request.app.state, "usage_emitter", None)
+    usage = getattr(request.state, "usage", None)
+    if emitter is None or not isinstance(usage, dict):
+        return
+
+    event = dict(usage)
+    event.update({
+        "event_id": uuid4().hex,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "model_id": model_id,
+        "transaction_id": request.headers.get("transaction-id"),
+        "payload_type": response.get("payload_type") if isinstance(response, dict) else None,
+        "input_bytes": input_bytes,
+        "latency_ms": round(duration * 1000, 3)
+    })
+    emitter.emit(event)
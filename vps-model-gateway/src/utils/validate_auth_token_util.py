@@ -15,6 +15,7 @@
 from fastapi import HTTPException, Request
 from src.utils.logger_util import setup_logger
 from src.models.env.env_config_DTO import EnvConfigDTO
+from src.utils.retry_transport_util import IDEMPOTENT_EXTENSION
 from httpx import AsyncClient
 import httpx
 import json
@@ -27,7 +28,9 @@ async def validate_auth_token(client: AsyncClient, vps_auth_token: str, transact
         config = EnvConfigDTO()
 
         logger.info(f"Transaction-id: {transaction_id}, Trying to authenticate the vps-auth-token, sending async request to the user admin.")
-        response = await client.post(f"{config.USER_ADMIN_SERVICE_URL}/validate_user", data=json.dumps({"vps-auth-token": vps_auth_token}))
+        # Validating a token has no side effects, the POST can be retried and hedged like a GET
+        # Sent explicitly, admission validates the token before the request span makes the transaction id current
+        response = await client.post(f"{config.USER_ADMIN_SERVICE_URL}/validate_user", data=json.dumps({"vps-auth-token": vps_auth_token}), headers={"transaction-id": transaction_id} if transaction_id else None, extensions={IDEMPOTENT_EXTENSION: True})
         response.raise_for_status()
 
         data = response.json()
@@ -0,0 +1,239 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from src.models.env.env_config_DTO import EnvConfigDTO
+from src.models.env.performance_config_DTO import get_performance_config
+from src.utils.logger_util import setup_logger
+from src.utils.redis_feature_plugin import RedisFeaturePlugin
+from src.utils.aws_feature_plugin import run_s3_operation
+from src.utils.retrieve_model_details_info_util import retrieve_model_details_info
+from src.utils.retrieve_deployment_info_util import retrieve_deployment_info_for_model_and_related_transformer
+from src.utils import grpc_inference_util
+from fastapi import FastAPI, HTTPException
+from prometheus_client import Gauge
+from redis.exceptions import RedisError
+from collections import Counter
+from urllib.parse import urlsplit
+import asyncio
+import httpx
+import time
+
+logger = setup_logger(__name__)
+
+WARMUP_TRANSACTION_ID = "warm-up"
+
+# Sorted set of model ids by request count, shared by the workers of every gateway pod
+HOT_MODELS_KEY = "vps:warmup:hot_models"
+HOT_MODELS_TTL_SECONDS = 7 * 24 * 3600
+
+WARMUP_DURATION_SECONDS = Gauge(
+    "vps_warmup_duration_seconds",
+    "Duration of the last warm-up of the worker.",
+    multiprocess_mode="liveall"
+)
+
+WORKER_READY = Gauge(
+    "vps_worker_ready",
+    "1 when the last /readyz check found the worker warmed up with every dependency reachable, 0 otherwise.",
+    multiprocess_mode="liveall"
+)
+
+class HotModelTracker:
+    """
+    Counts the predictions per model on this worker and adds the counts to the shared sorted set of
+    Redis once per WARMUP_HOT_MODELS_FLUSH_SECONDS, the warm-up of new workers reads it back.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.flushed_at = time.monotonic()
+
+    def record(self, model_id: str, redis_client):
+        self.counts[model_id] += 1
+        if redis_client is not None and time.monotonic() - self.flushed_at >= get_performance_config().WARMUP_HOT_MODELS_FLUSH_SECONDS:
+            self.flush(redis_client)
+
+    def flush(self, redis_client):
+        counts, self.counts = self.counts, Counter()
+        self.flushed_at = time.monotonic()
+        if not counts:
+            return
+        try:
+            for model_id, count in counts.items():
+                redis_client.zincrby(HOT_MODELS_KEY, count, model_id)
+            redis_client.expire(HOT_MODELS_KEY, HOT_MODELS_TTL_SECONDS)
+        except RedisError as e:
+            logger.warning(f"Failed to store the request counts of {len(counts)} models: {e}")
+
+_hot_models = HotModelTracker()
+
+def record_hot_model(model_id: str, redis_client):
+    _hot_models.record(model_id, redis_client)
+
+class WorkerReadiness:
+    def __init__(self):
+        self.warmed_up = False
+        self.checks = {}
+        self.checked_at = None
+        self.lock = None
+
+    def get_lock(self):
+        # Created on first use, an asyncio.Lock made at import is bound to the wrong loop before Python 3.10
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        return self.lock
+
+_readiness = WorkerReadiness()
+
+def get_worker_readiness():
+    return _readiness
+
+def get_service_origins():
+    # scheme://host:port of every configured upstream, services sharing an ingress are warmed up once
+    config = EnvConfigDTO()
+    urls = (config.USER_ADMIN_SERVICE_URL, config.PAYMENT_SERVICE_URL, config.PROJECT_ADMIN_SERVICE_URL, config.DEPLOY_ADMIN_SERVICE_URL, config.MODEL_KOURIER_SERVICE_URL, config.TRANSFORMER_KOURIER_SERVICE_URL)
+    origins = []
+    for url in urls:
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        if parts.netloc and origin not in origins:
+            origins.append(origin)
+    return origins
+
+async def preconnect_service(client: httpx.AsyncClient, origin: str, connections: int):
+    """
+    Opens `connections` pooled connections to the service with concurrent requests, which also
+    resolves its name. Any response, whatever its status, leaves a kept alive connection behind.
+    """
+    results = await asyncio.gather(*(client.get(f"{origin}/") for _ in range(connections)), return_exceptions=True)
+    failures = [result for result in results if isinstance(result, Exception)]
+    if len(failures) == len(results):
+        logger.warning(f"Failed to open a connection to {origin}: {failures[0]!r}")
+        return False
+    logger.info(f"Opened {len(results) - len(failures)} connections to {origin}")
+    return True
+
+def read_hot_model_ids(redis_plugin: RedisFeaturePlugin, count: int):
+    redis_client = redis_plugin.create_redis_client()
+    if redis_client is None:
+        return []
+    try:
+        return redis_client.zrevrange(HOT_MODELS_KEY, 0, count - 1)
+    except RedisError as e:
+        logger.warning(f"Failed to read the most requested models: {e}")
+        return []
+    finally:
+        redis_plugin.close_redis_client(redis_client)
+
+async def prefetch_model_metadata(client: httpx.AsyncClient, model_ids: list):
+    # Fills the metadata cache through the same lookups as the predictions, returns the number of models fetched
+    semaphore = asyncio.Semaphore(8)
+
+    async def prefetch(model_id: str):
+        async with semaphore:
+            try:
+                await retrieve_model_details_info(client, model_id, WARMUP_TRANSACTION_ID)
+                await retrieve_deployment_info_for_model_and_related_transformer(client, model_id, WARMUP_TRANSACTION_ID)
+                return True
+            except HTTPException as e:
+                logger.warning(f"Failed to prefetch the metadata of the model {model_id}: {e.detail}")
+                return False
+
+    results = await asyncio.gather(*(prefetch(model_id) for model_id in model_ids))
+    return sum(results)
+
+async def warm_up(app: FastAPI):
+    config = get_performance_config()
+    client = app.state.http_client
+
+    # Lazily built state of the imports, built here instead of by the first request that needs it
+    if grpc_inference_util.grpc is not None:
+        grpc_inference_util.get_inference_messages()
+
+    origins = get_service_origins()
+    await asyncio.gather(*(preconnect_service(client, origin, config.WARMUP_CONNECTIONS_PER_SERVICE) for origin in origins))
+
+    model_ids = list(config.WARMUP_MODEL_IDS)
+    if config.WARMUP_TOP_MODELS > 0:
+        hot_model_ids = await asyncio.get_running_loop().run_in_executor(None, read_hot_model_ids, RedisFeaturePlugin(), config.WARMUP_TOP_MODELS)
+        model_ids += [model_id for model_id in hot_model_ids if model_id not in model_ids]
+    if model_ids and config.MODEL_METADATA_CACHE_TTL_SECONDS > 0:
+        prefetched = await prefetch_model_metadata(client, model_ids)
+        logger.info(f"Prefetched the metadata of {prefetched} of {len(model_ids)} models")
+
+async def run_warm_up(app: FastAPI):
+    """
+    Warms the worker up and marks it warmed up, also when the warm-up failed or ran out of its
+    WARMUP_TIMEOUT_SECONDS, since a cold worker is better than one that never turns ready.
+    """
+    config = get_performance_config()
+    started_at = time.perf_counter()
+    try:
+        await asyncio.wait_for(warm_up(app), config.WARMUP_TIMEOUT_SECONDS)
+        logger.info(f"Warm-up finished in {time.perf_counter() - started_at:.2f}s")
+    except asyncio.TimeoutError:
+        logger.warning(f"Warm-up did not finish in {config.WARMUP_TIMEOUT_SECONDS}s, continuing with what was warmed up")
+    except Exception as e:
+        logger.error(f"Warm-up failed: {e!r}")
+    WARMUP_DURATION_SECONDS.set(time.perf_counter() - started_at)
+    _readiness.warmed_up = True
+
+def start_warm_up(app: FastAPI):
+    # Runs in the background so /healthz answers while the worker warms up, /readyz waits for it
+    if not get_performance_config().WARMUP_ENABLED:
+        _readiness.warmed_up = True
+        return None
+    _readiness.warmed_up = False
+    return asyncio.create_task(run_warm_up(app))
+
+def check_redis():
+    redis_plugin = RedisFeaturePlugin()
+    redis_client = redis_plugin.create_redis_client()
+    if redis_client is None:
+        return False
+    try:
+        return bool(redis_client.ping())
+    finally:
+        redis_plugin.close_redis_client(redis_client)
+
+async def check_dependency(app: FastAPI, name: str, timeout: float):
+    try:
+        if name == "redis":
+            return await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(None, check_redis), timeout)
+        if name == "s3":
+            await asyncio.wait_for(run_s3_operation(app.state.s3_client.head_bucket, Bucket=EnvConfigDTO().RUNTIME_BUCKET_NAME), timeout)
+            return True
+        logger.warning(f"Unknown readiness dependency {name}")
+        return False
+    except Exception as e:
+        logger.warning(f"Readiness check of {name} failed: {e!r}")
+        return False
+
+async def get_readiness_report(app: FastAPI):
+    """
+    Returns {"ready", "warmed_up", "checks"}. The dependencies are checked at most once per
+    READINESS_CHECK_INTERVAL_SECONDS, concurrent probes share the running check.
+    """
+    config = get_performance_config()
+    if _readiness.warmed_up:
+        async with _readiness.get_lock():
+            if _readiness.checked_at is None or time.monotonic() - _readiness.checked_at >= config.READINESS_CHECK_INTERVAL_SECONDS:
+                results = await asyncio.gather(*(check_dependency(app, name, config.READINESS_CHECK_TIMEOUT_SECONDS) for name in config.READINESS_DEPENDENCIES))
+                _readiness.checks = dict(zip(config.READINESS_DEPENDENCIES, results))
+                _readiness.checked_at = time.monotonic()
+
+    ready = _readiness.warmed_up and all(_readiness.checks.values())
+    WORKER_READY.set(1 if ready else 0)
+    return {"ready": ready, "warmed_up": _readiness.warmed_up, "checks": dict(_readiness.checks)}
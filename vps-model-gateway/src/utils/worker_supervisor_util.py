@@ -0,0 +1,186 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+from src.models.env.env_config_DTO import EnvConfigDTO
+from src.models.env.performance_config_DTO import PerformanceConfigDTO
+from src.utils.logger_util import setup_logger
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import multiprocessing
+import urllib.request
+import urllib.error
+import threading
+import json
+import time
+import os
+
+logger = setup_logger(__name__)
+
+# Longest a crashed worker waits before it is started again
+MAX_RESTART_BACKOFF_SECONDS = 30.0
+
+# How often the supervisor looks for workers that exited
+CHECK_INTERVAL_SECONDS = 0.5
+
+def prepare_metrics_dir(path: str):
+    """
+    Makes the workers write their metrics to files of the directory, /metrics of any worker then serves
+    the counters of all of them. Must run before the workers import prometheus_client, the files of a
+    previous run are removed so their counters do not carry over.
+    """
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(path):
+        if name.endswith(".db"):
+            os.remove(os.path.join(path, name))
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+
+def mark_worker_dead(pid: int):
+    # Removes the live gauges of an exited worker, its counters keep counting in the totals
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(pid)
+
+def probe_worker(port: int, path: str, timeout: float):
+    # Status code of the probe of the worker, None when it did not answer
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=timeout) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+class WorkerSupervisor:
+    """
+    Runs one gateway process per port and starts the ones that exit again, after a backoff doubled for
+    every restart of the same worker. A worker that exits more than SERVER_WORKER_MAX_RESTARTS times within
+    SERVER_WORKER_RESTART_WINDOW_SECONDS stops the gateway, so the container is restarted as it was with a
+    single process. The probes of the pod are answered on SERVER_HEALTH_PORT from the probes of every worker.
+    """
+
+    def __init__(self, target, ports: list, config: PerformanceConfigDTO, context=None):
+        self.target = target
+        self.ports = ports
+        self.config = config
+        # Spawned workers import prometheus_client after the metrics directory is set
+        self.context = context or multiprocessing.get_context("spawn")
+        self.processes = {}
+        self.restarts = {port: deque() for port in ports}
+        self.restart_at = {}
+        self.stopping = False
+        self.health_server = None
+        self.probe_executor = None
+
+    def start_worker(self, port: int):
+        process = self.context.Process(target=self.target, args=(port,), name=f"vps-model-gateway-{port}")
+        process.start()
+        self.processes[port] = process
+        self.restart_at.pop(port, None)
+        logger.info(f"Started the gateway worker {process.pid} on port {port}")
+
+    def check_workers(self, now: float):
+        # Starts the workers that exited again once their backoff passed, False when one of them exits too often
+        for port in self.ports:
+            process = self.processes.get(port)
+            if process is None:
+                if now >= self.restart_at[port]:
+                    self.start_worker(port)
+                continue
+            if process.is_alive():
+                continue
+
+            process.join()
+            mark_worker_dead(process.pid)
+            restarts = self.restarts[port]
+            restarts.append(now)
+            while now - restarts[0] > self.config.SERVER_WORKER_RESTART_WINDOW_SECONDS:
+                restarts.popleft()
+            if len(restarts) > self.config.SERVER_WORKER_MAX_RESTARTS:
+                logger.error(f"The gateway worker on port {port} exited {len(restarts)} times within {self.config.SERVER_WORKER_RESTART_WINDOW_SECONDS}s, stopping the gateway")
+                return False
+
+            delay = min(self.config.SERVER_WORKER_RESTART_BACKOFF_SECONDS * 2 ** (len(restarts) - 1), MAX_RESTART_BACKOFF_SECONDS)
+            logger.error(f"The gateway worker {process.pid} on port {port} exited with code {process.exitcode}, starting it again in {delay}s")
+            self.processes[port] = None
+            self.restart_at[port] = now + delay
+        return True
+
+    def probe_workers(self, path: str):
+        """
+        Returns (ok, status of every worker). Liveness tolerates a worker waiting for its restart, the
+        supervisor takes care of it, but not a running worker that does not answer. Readiness needs
+        SERVER_READY_MIN_WORKERS ready workers, a crashed worker does not take the others out of rotation.
+        """
+        running = {port: process for port, process in self.processes.items() if process is not None}
+        statuses = dict(zip(running, self.probe_executor.map(lambda port: probe_worker(port, path, self.config.SERVER_HEALTH_PROBE_TIMEOUT_SECONDS), running)))
+        if path == "/readyz":
+            ready = sum(1 for status in statuses.values() if status == 200)
+            ok = ready >= max(1, min(self.config.SERVER_READY_MIN_WORKERS, len(self.ports)))
+        else:
+            ok = all(status == 200 for status in statuses.values())
+        workers = {str(port): statuses.get(port, "restarting") for port in self.ports}
+        return ok, workers
+
+    def start_health_server(self):
+        supervisor = self
+
+        class HealthHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ("/healthz", "/readyz"):
+                    self.send_error(404)
+                    return
+                ok, workers = supervisor.probe_workers(self.path)
+                body = json.dumps({"status": "ok" if ok else "unavailable", "workers": workers}).encode("utf-8")
+                self.send_response(200 if ok else 503)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Probes would flood the log
+                pass
+
+        self.probe_executor = ThreadPoolExecutor(max_workers=len(self.ports), thread_name_prefix="vps-health-probe")
+        self.health_server = ThreadingHTTPServer((EnvConfigDTO().SERVER_HOST, self.config.SERVER_HEALTH_PORT), HealthHandler)
+        threading.Thread(target=self.health_server.serve_forever, name="vps-health-server", daemon=True).start()
+        logger.info(f"Serving the probes of {len(self.ports)} gateway workers on port {self.config.SERVER_HEALTH_PORT}")
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+
+    def run(self):
+        # Returns the exit code of the gateway once it was stopped or a worker exited too often
+        for port in self.ports:
+            self.start_worker(port)
+        self.start_health_server()
+
+        exit_code = 0
+        while not self.stopping:
+            if not self.check_workers(time.monotonic()):
+                exit_code = 1
+                break
+            time.sleep(CHECK_INTERVAL_SECONDS)
+
+        self.health_server.shutdown()
+        self.probe_executor.shutdown(wait=False)
+        processes = [process for process in self.processes.values() if process is not None]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+        return exit_code
@@ -0,0 +1,27 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from src.utils.model_metadata_cache_util import get_model_metadata_cache
+from src.utils.cold_start_util import get_cold_start_tracker
+import pytest
+
+@pytest.fixture(autouse=True)
+def clear_model_metadata_cache():
+    # The metadata cache and the model activity live for the whole worker, tests must not see the models of other tests
+    get_model_metadata_cache().clear()
+    get_cold_start_tracker().clear()
+    yield
+    get_model_metadata_cache().clear()
+    get_cold_start_tracker().clear()
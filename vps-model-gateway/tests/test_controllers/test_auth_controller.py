@@ -0,0 +1,45 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from unittest.mock import patch, AsyncMock
+from src.main import app
+
+client = TestClient(app)
+
+def test_verify_auth_token_valid():
+    user_data = {"result": True, "username": "user", "entity_id": "ent-test", "vps_app_id": "app-*"}
+    with patch('src.controllers.auth_controller.validate_auth_token', new_callable=AsyncMock, return_value=user_data):
+        response = client.get("/auth/verify", headers={"vps-auth-token": "token"})
+        assert response.status_code == 200
+        assert response.headers["vps-auth-username"] == "user"
+        assert response.headers["vps-auth-entity-id"] == "ent-test"
+        assert response.headers["vps-auth-app-id"] == "app-*"
+
+def test_verify_auth_token_missing():
+    response = client.get("/auth/verify")
+    assert response.status_code == 401
+
+def test_verify_auth_token_invalid():
+    with patch('src.controllers.auth_controller.validate_auth_token', new_callable=AsyncMock, side_effect=HTTPException(status_code=401, detail="invalid")):
+        response = client.get("/auth/verify", headers={"vps-auth-token": "token"})
+        assert response.status_code == 401
+        assert "vps-auth-username" not in response.headers
+
+def test_verify_auth_token_user_admin_error():
+    with patch('src.controllers.auth_controller.validate_auth_token', new_callable=AsyncMock, side_effect=HTTPException(status_code=503, detail="unavailable")):
+        response = client.get("/auth/verify", headers={"vps-auth-token": "token"})
+        assert response.status_code == 503
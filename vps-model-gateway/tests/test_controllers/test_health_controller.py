@@ -0,0 +1,39 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from fastapi.testclient import TestClient
+from unittest.mock import patch, AsyncMock
+from src.main import app
+
+client = TestClient(app)
+
+def test_healthz():
+    response = client.get("/healthz")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok"}
+
+def test_readyz_not_ready():
+    report = {"ready": False, "warmed_up": False, "checks": {}}
+    with patch('src.controllers.health_controller.get_readiness_report', new_callable=AsyncMock, return_value=report):
+        response = client.get("/readyz")
+        assert response.status_code == 503
+        assert response.json() == report
+
+def test_readyz_ready():
+    report = {"ready": True, "warmed_up": True, "checks": {"redis": True, "s3": True}}
+    with patch('src.controllers.health_controller.get_readiness_report', new_callable=AsyncMock, return_value=report):
+        response = client.get("/readyz")
+        assert response.status_code == 200
+        assert response.json() == report
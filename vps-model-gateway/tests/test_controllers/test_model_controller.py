@@ -13,12 +13,24 @@
 # For more information, contact Vipas.AI at legal@vipas.ai
 
 from fastapi.testclient import TestClient
-from unittest.mock import patch, AsyncMock
+from unittest.mock import patch, AsyncMock, MagicMock
 import pytest
 from src.main import app  # Ensure this is the correct path to your FastAPI app
+from src.utils.request_admission_util import admit_prediction_request, authenticate_prediction_request
+from src.utils.binary_tensor_util import BinaryInferencePayload
+import json
 
 client = TestClient(app)
 
+@pytest.fixture(autouse=True)
+def admit_every_request():
+    # Admission has its own tests, the controller tests only cover what happens after it
+    app.dependency_overrides[admit_prediction_request] = lambda: None
+    app.dependency_overrides[authenticate_prediction_request] = lambda: None
+    yield
+    app.dependency_overrides.pop(admit_prediction_request, None)
+    app.dependency_overrides.pop(authenticate_prediction_request, None)
+
 @pytest.mark.asyncio
 async def test_model_prediction():
     mock_response = 'fake_response'
@@ -27,3 +39,89 @@ async def test_model_prediction():
         response = client.post(f"/predict?model_id={model_id}", json="fake_input_data")
         assert response.status_code == 200
         assert response.json() == "fake_response"
+
+def test_model_prediction_compresses_large_responses():
+    mock_response = {"output_data": [0.123456] * 1000, "payload_type": "content", "payload_url": None, "extractor": None}
+    with patch('src.controllers.model_controller.model_prediction_service', return_value=mock_response):
+        response = client.post("/predict?model_id=mdl-test", json="fake_input_data", headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.json() == mock_response
+
+        response = client.post("/predict?model_id=mdl-test", json="fake_input_data", headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in response.headers
+        assert response.json() == mock_response
+
+def test_model_prediction_rejects_before_reading_the_body():
+    app.dependency_overrides.pop(admit_prediction_request, None)
+    with patch('src.controllers.model_controller.read_prediction_body', new_callable=AsyncMock) as mock_read_body:
+        response = client.post("/predict?model_id=mdl-test", json="fake_input_data", headers={"transaction-id": "transaction1"})
+        assert response.status_code == 400
+        mock_read_body.assert_not_called()
+
+def test_model_prediction_binary_tensors():
+    header = b'{"inputs":[{"name":"a","datatype":"INT8","shape":[2],"parameters":{"binary_data_size":2}}]}'
+    output_header = {"outputs": [{"name": "out", "datatype": "INT8", "shape": [1], "parameters": {"binary_data_size": 1}}]}
+    output_data = BinaryInferencePayload(output_header, memoryview(b"\x07"), "outputs")
+    mock_service = AsyncMock(return_value={"output_data": output_data, "payload_type": "content", "payload_url": None, "extractor": None})
+    with patch('src.controllers.model_controller.model_prediction_service', mock_service):
+        response = client.post("/predict?model_id=mdl-test", content=header + b"\x01\x02", headers={"Inference-Header-Content-Length": str(len(header)), "Content-Type": "application/octet-stream"})
+        assert response.status_code == 200
+        input_data = mock_service.call_args.args[2]
+        assert [bytes(data) for _, data in input_data.tensors()] == [b"\x01\x02"]
+        response_header_length = int(response.headers["inference-header-content-length"])
+        assert json.loads(response.content[:response_header_length])["output_data"] == output_header
+        assert response.content[response_header_length:] == b"\x07"
+
+        response = client.post("/predict?model_id=mdl-test", content=header + b"\x01", headers={"Inference-Header-Content-Length": str(len(header))})
+        assert response.status_code == 400
+
+def test_model_prediction_async_returns_the_job():
+    job = MagicMock()
+    job.describe.return_value = {"job_id": "job-1", "status": "queued", "model_id": "mdl-test", "transaction_id": "transaction1", "status_url": "/predict/jobs/job-1"}
+    runner = MagicMock()
+    runner.submit = AsyncMock(return_value=(job, None))
+    with patch('src.controllers.model_controller.get_prediction_job_runner', return_value=runner):
+        response = client.post("/predict/async?model_id=mdl-test", json="fake_input_data", headers={"vps-callback-url": "https://hooks.example.com/done"})
+        assert response.status_code == 202
+        assert response.json()["status_url"] == "/predict/jobs/job-1"
+        assert runner.submit.call_args.args[1:3] == ("mdl-test", "https://hooks.example.com/done")
+
+        # A replayed transaction is answered with its stored response
+        runner.submit = AsyncMock(return_value=(None, "fake_response"))
+        response = client.post("/predict/async?model_id=mdl-test", json="fake_input_data")
+        assert response.status_code == 200
+        assert response.json() == "fake_response"
+
+def test_model_prediction_async_rejects_internal_callbacks():
+    runner = MagicMock()
+    runner.submit = AsyncMock()
+    with patch('src.controllers.model_controller.get_prediction_job_runner', return_value=runner):
+        response = client.post("/predict/async?model_id=mdl-test", json="fake_input_data", headers={"vps-callback-url": "http://10.0.0.5/hook"})
+        assert response.status_code == 400
+        runner.submit.assert_not_called()
+
+def test_prediction_job_status():
+    status = {"job_id": "job-1", "status": "running"}
+    with patch('src.controllers.model_controller.get_prediction_job_status', new_callable=AsyncMock, return_value=status) as mock_status:
+        response = client.get("/predict/jobs/job-1")
+        assert response.status_code == 200
+        assert response.json() == status
+        assert mock_status.call_args.args[1] == "job-1"
+
+def test_model_prediction_with_an_uploaded_input():
+    mock_service = AsyncMock(return_value={"output_data": [1], "payload_type": "content", "payload_url": None, "extractor": None})
+    with patch('src.controllers.model_controller.model_prediction_service', mock_service):
+        response = client.post("/predict?model_id=mdl-test", headers={"vps-input-id": "inp-1"})
+        assert response.status_code == 200
+        assert mock_service.call_args.args[2].input_id == "inp-1"
+
+        response = client.post("/predict?model_id=mdl-test", json="fake_input_data", headers={"vps-input-id": "inp-1"})
+        assert response.status_code == 400
+
+def test_prediction_input_upload():
+    upload = {"input_id": "inp-1", "upload_url": "http://s3/runtime", "upload_fields": {}}
+    with patch('src.controllers.model_controller.create_prediction_input_upload', new_callable=AsyncMock, return_value=upload):
+        response = client.post("/predict/inputs")
+        assert response.status_code == 200
+        assert response.json() == upload
@@ -16,36 +16,84 @@
 
 from unittest.mock import patch, MagicMock, AsyncMock
 from src.services.model_service import model_prediction_service
+from src.models.env.performance_config_DTO import PerformanceConfigDTO
+from src.utils.prediction_input_util import PredictionInputReference, PredictionInput
+from src.utils.deadline_util import DEADLINE_HEADER, get_remaining_deadline
 from fastapi import FastAPI,Request
 from fastapi.exceptions import HTTPException
 from botocore.exceptions import ClientError
 from uuid import uuid4
+import asyncio
 import pytest
 import json
 
+class InMemoryRedis:
+    # Keeps the idempotency records of the service, the other commands it sends are ignored
+    def __init__(self):
+        self.values = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def zincrby(self, key, amount, value):
+        pass
+
+    def expire(self, key, ttl):
+        pass
+
+    def close(self):
+        pass
+
 @pytest.fixture(name="request_mock", scope="function")
 def fixture_es_client(mocker):
 
-    redis_client_return_mock = AsyncMock()
+    redis_client_return_mock = MagicMock()
     s3_client_return_mock = MagicMock()
 
     app = FastAPI()
     app.state.redis_client = redis_client_return_mock
     app.state.s3_client = s3_client_return_mock
+    app.state.http_client = AsyncMock()
 
     # Create a mock Request object with the mock app
     request_mock = mocker.Mock(spec=Request)
     request_mock.app = app
 
+    # The service creates its own redis client when the request did not go through the admission
+    mocker.patch("src.services.model_service.RedisFeaturePlugin.create_redis_client", return_value=redis_client_return_mock)
+
     return request_mock
 
+@pytest.fixture(name="pipeline_mocks", scope="function")
+def fixture_pipeline_mocks(mocker):
+    # Upstream lookups of a KserveV1 model without a transformer, the model call answers with "fake-prediction-result"
+    return {
+        "validate_auth_token": mocker.patch("src.services.model_service.validate_auth_token", new_callable=AsyncMock, return_value={"entity_id": "fake-entity-id", "username": "fake-username"}),
+        "validate_entity_balance": mocker.patch("src.services.model_service.validate_entity_balance_with_ledger", new_callable=AsyncMock, return_value=None),
+        "retrieve_model_details_info": mocker.patch("src.services.model_service.retrieve_model_details_info", new_callable=AsyncMock, return_value={"model_id": "mdl-test", "project_id": "prj-test"}),
+        "retrieve_entity_id_for_model": mocker.patch("src.services.model_service.retrieve_entity_id_for_model", new_callable=AsyncMock, return_value="fake-entity-id"),
+        "check_rate_limit": mocker.patch("src.utils.redis_feature_plugin.RedisFeaturePlugin.check_rate_limit_exceeded_or_not_for_a_particular_user", return_value=None),
+        "retrieve_deployment_info": mocker.patch("src.services.model_service.retrieve_deployment_info_for_model_and_related_transformer", new_callable=AsyncMock, return_value={"model": {"deployment_id": "dep-test", "model_id": "mdl-test", "project_id": "prj-test"}}),
+        "retrieve_info": mocker.patch("src.services.model_service.retrieve_info_for_model_and_transformer_if_exists", return_value=("http://fake-model-kourier-url", None, {}, None, "prj-test", "KserveV1", "fake-model-service-name")),
+        "get_model_prediction": mocker.patch("src.services.model_service.get_model_prediction_for_input_data", new_callable=AsyncMock, return_value=("fake-prediction-result", "content"))
+    }
+
 @pytest.mark.asyncio
 async def test_model_prediction_service_success_transformer_present_payload_type_content(request_mock):
     transaction_id = str(uuid4())
-    request_mock.headers = {"vps-auth-token": "fake-vps-auth-token", "transaction-id": transaction_id, "vps-app-id": "fake-vps-app-id", "vps-env-type": "vipas-streamlit"}
-    with patch('src.services.model_service.httpx.AsyncClient', return_value=AsyncMock()) as mock_client, \
+    request_mock.headers = {"vps-auth-token": "sat-fake-vps-auth-token", "transaction-id": transaction_id, "vps-app-id": "fake-vps-app-id", "vps-env-type": "vipas-streamlit"}
+    with patch('src.utils.http_client_util.create_http_client', return_value=AsyncMock()) as mock_client, \
         patch('src.services.model_service.validate_auth_token', new_callable=AsyncMock) as mock_validate_auth_token, \
-        patch('src.services.model_service.validate_entity_balance', new_callable=AsyncMock) as mock_validate_entity_balance, \
+        patch('src.services.model_service.validate_entity_balance_with_ledger', new_callable=AsyncMock) as mock_validate_entity_balance, \
         patch('src.services.model_service.retrieve_list_of_authorized_model_for_app', new_callable=AsyncMock) as mock_retrieve_list_of_authorized_model_for_app, \
         patch('src.services.model_service.retrieve_model_details_info', new_callable=AsyncMock) as mock_retrieve_model_details_info, \
         patch('src.services.model_service.retrieve_entity_id_for_model', new_callable=AsyncMock) as mock_retrieve_entity_id_for_model, \
@@ -61,7 +109,7 @@ async def test_model_prediction_service_success_transformer_present_payload_type
         project_id = "prj-test"
         transformer_id = "trf-test"
 
-        mock_validate_auth_token.return_value = {"entity_id": "fake-entity-id", "username": "fake-username"}
+        mock_validate_auth_token.return_value = {"entity_id": "fake-entity-id", "username": "fake-username", "vps_app_id": "fake-vps-app-id"}
 
         mock_validate_entity_balance.return_value = None
 
@@ -86,7 +134,8 @@ async def test_model_prediction_service_success_transformer_present_payload_type
             {}, 
             {},
             project_id, 
-            "fake-deployment-system"
+            "fake-deployment-system",
+            "fake-model-service-name"
         )
 
         mock_check_pre_or_post_transform_input_data_for_model.side_effect = [True, True]
@@ -111,9 +160,9 @@ async def test_model_prediction_service_success_transformer_present_payload_type
 async def test_model_prediction_service_success_transformer_present_payload_type_url(request_mock):
     transaction_id = str(uuid4())
     request_mock.headers = {"vps-auth-token": "fake-vps-auth-token", "transaction-id": transaction_id, "vps-env-type": "vipas-external"}
-    with patch('src.services.model_service.httpx.AsyncClient', return_value=AsyncMock()) as mock_client, \
+    with patch('src.utils.http_client_util.create_http_client', return_value=AsyncMock()) as mock_client, \
         patch('src.services.model_service.validate_auth_token', new_callable=AsyncMock) as mock_validate_auth_token, \
-        patch('src.services.model_service.validate_entity_balance', new_callable=AsyncMock) as mock_validate_entity_balance, \
+        patch('src.services.model_service.validate_entity_balance_with_ledger', new_callable=AsyncMock) as mock_validate_entity_balance, \
         patch('src.services.model_service.retrieve_model_details_info', new_callable=AsyncMock) as mock_retrieve_model_details_info, \
         patch('src.services.model_service.retrieve_entity_id_for_model', new_callable=AsyncMock) as mock_retrieve_entity_id_for_model, \
         patch('src.utils.redis_feature_plugin.RedisFeaturePlugin.check_rate_limit_exceeded_or_not_for_a_particular_user', new_callable=MagicMock) as mock_check_rate_limit_exceeded_or_not_for_a_particular_user, \
@@ -153,7 +202,8 @@ async def test_model_prediction_service_success_transformer_present_payload_type
             {}, 
             {},
             project_id, 
-            "fake-deployment-system"
+            "fake-deployment-system",
+            "fake-model-service-name"
         )
 
         mock_check_pre_or_post_transform_input_data_for_model.side_effect = [True, True]
@@ -183,9 +233,9 @@ async def test_model_prediction_service_success_transformer_present_payload_type
 async def test_model_prediction_service_success_transformer_not_present_payload_type_content(request_mock):
     transaction_id = str(uuid4())
     request_mock.headers = {"vps-auth-token": "fake-vps-auth-token", "transaction-id": transaction_id, "vps-env-type": "vipas-external"}
-    with patch('src.services.model_service.httpx.AsyncClient', return_value=AsyncMock()) as mock_client, \
+    with patch('src.utils.http_client_util.create_http_client', return_value=AsyncMock()) as mock_client, \
         patch('src.services.model_service.validate_auth_token', new_callable=AsyncMock) as mock_validate_auth_token, \
-        patch('src.services.model_service.validate_entity_balance', new_callable=AsyncMock) as mock_validate_entity_balance, \
+        patch('src.services.model_service.validate_entity_balance_with_ledger', new_callable=AsyncMock) as mock_validate_entity_balance, \
         patch('src.services.model_service.retrieve_model_details_info', new_callable=AsyncMock) as mock_retrieve_model_details_info, \
         patch('src.services.model_service.retrieve_entity_id_for_model', new_callable=AsyncMock) as mock_retrieve_entity_id_for_model, \
         patch('src.utils.redis_feature_plugin.RedisFeaturePlugin.check_rate_limit_exceeded_or_not_for_a_particular_user', new_callable=MagicMock) as mock_check_rate_limit_exceeded_or_not_for_a_particular_user, \
@@ -218,7 +268,8 @@ async def test_model_prediction_service_success_transformer_not_present_payload_
             "fake-model-headers", 
             None, 
             project_id, 
-            "fake-deployment-system"
+            "fake-deployment-system",
+            "fake-model-service-name"
         )
 
         mock_get_model_prediction_for_input_data.return_value = ("fake-prediction-result", "content")
@@ -251,7 +302,7 @@ async def test_model_prediction_service_failure_transaction_id_missing(request_m
 @pytest.mark.asyncio
 async def test_model_prediction_service_failure_username_not_present(request_mock):
     request_mock.headers = {"vps-auth-token": "fake-vps-auth-token", "transaction-id": str(uuid4()),"vps-env-type": "vipas-external"}
-    with patch('src.services.model_service.httpx.AsyncClient', return_value=AsyncMock()) as mock_client, \
+    with patch('src.utils.http_client_util.create_http_client', return_value=AsyncMock()) as mock_client, \
         patch('src.services.model_service.validate_auth_token', new_callable=AsyncMock) as mock_validate_auth_token :
 
         mock_validate_auth_token.return_value = {}
@@ -263,13 +314,13 @@ async def test_model_prediction_service_failure_username_not_present(request_moc
 
 @pytest.mark.asyncio
 async def test_model_prediction_service_failure_app_not_authorized(request_mock):
-    request_mock.headers = {"vps-auth-token": "fake-vps-auth-token", "transaction-id": str(uuid4()),"vps-app-id": "fake-vps-app-id", "vps-env-type": "vipas-streamlit"}
-    with patch('src.services.model_service.httpx.AsyncClient', return_value=AsyncMock()) as mock_client, \
+    request_mock.headers = {"vps-auth-token": "sat-fake-vps-auth-token", "transaction-id": str(uuid4()),"vps-app-id": "fake-vps-app-id", "vps-env-type": "vipas-streamlit"}
+    with patch('src.utils.http_client_util.create_http_client', return_value=AsyncMock()) as mock_client, \
         patch('src.services.model_service.validate_auth_token', new_callable=AsyncMock) as mock_validate_auth_token,\
-        patch('src.services.model_service.validate_entity_balance', new_callable=AsyncMock) as mock_validate_entity_balance, \
+        patch('src.services.model_service.validate_entity_balance_with_ledger', new_callable=AsyncMock) as mock_validate_entity_balance, \
         patch('src.services.model_service.retrieve_list_of_authorized_model_for_app', new_callable=AsyncMock) as mock_retrieve_list_of_authorized_model_for_app:
 
-        mock_validate_auth_token.return_value = {"entity_id": "fake-entity-id", "username": "fake-username"}
+        mock_validate_auth_token.return_value = {"entity_id": "fake-entity-id", "username": "fake-username", "vps_app_id": "fake-vps-app-id"}
 
         mock_validate_entity_balance.return_value = None
 
@@ -286,9 +337,9 @@ async def test_model_prediction_service_failure_app_not_authorized(request_mock)
 @pytest.mark.asyncio
 async def test_model_prediction_service_failure_rate_limit_exceeded(request_mock):
     request_mock.headers = {"vps-auth-token": "fake-vps-auth-token", "transaction-id": str(uuid4()), "vps-env-type": "vipas-external"}
-    with patch('src.services.model_service.httpx.AsyncClient', return_value=AsyncMock()) as mock_client, \
+    with patch('src.utils.http_client_util.create_http_client', return_value=AsyncMock()) as mock_client, \
         patch('src.services.model_service.validate_auth_token', new_callable=AsyncMock) as mock_validate_auth_token, \
-        patch('src.services.model_service.validate_entity_balance', new_callable=AsyncMock) as mock_validate_entity_balance, \
+        patch('src.services.model_service.validate_entity_balance_with_ledger', new_callable=AsyncMock) as mock_validate_entity_balance, \
         patch('src.services.model_service.retrieve_model_details_info', new_callable=AsyncMock) as mock_retrieve_model_details_info, \
         patch('src.services.model_service.retrieve_entity_id_for_model', new_callable=AsyncMock) as mock_retrieve_entity_id_for_model, \
         patch('src.utils.redis_feature_plugin.RedisFeaturePlugin.check_rate_limit_exceeded_or_not_for_a_particular_user', new_callable=MagicMock) as mock_check_rate_limit_exceeded_or_not_for_a_particular_user :
@@ -313,9 +364,9 @@ async def test_model_prediction_service_failure_rate_limit_exceeded(request_mock
 @pytest.mark.asyncio
 async def test_model_prediction_service_failure_authorization_failure_for_caller_user(request_mock):
     request_mock.headers = {"vps-auth-token": "fake-vps-auth-token", "transaction-id": str(uuid4()), "vps-env-type": "vipas-external"}
-    with patch('src.services.model_service.httpx.AsyncClient', return_value=AsyncMock()) as mock_client, \
+    with patch('src.utils.http_client_util.create_http_client', return_value=AsyncMock()) as mock_client, \
         patch('src.services.model_service.validate_auth_token', new_callable=AsyncMock) as mock_validate_auth_token, \
-        patch('src.services.model_service.validate_entity_balance', new_callable=AsyncMock) as mock_validate_entity_balance, \
+        patch('src.services.model_service.validate_entity_balance_with_ledger', new_callable=AsyncMock) as mock_validate_entity_balance, \
         patch('src.services.model_service.retrieve_model_details_info', new_callable=AsyncMock) as mock_retrieve_model_details_info, \
         patch('src.services.model_service.retrieve_entity_id_for_model', new_callable=AsyncMock) as mock_retrieve_entity_id_for_model:
         
@@ -337,9 +388,9 @@ async def test_model_prediction_service_failure_authorization_failure_for_caller
 @pytest.mark.asyncio
 async def test_model_prediction_service_failure_model_not_found(request_mock):
     request_mock.headers = {"vps-auth-token": "fake-vps-auth-token", "transaction-id": str(uuid4()), "vps-env-type": "vipas-external"}
-    with patch('src.services.model_service.httpx.AsyncClient', return_value=AsyncMock()) as mock_client, \
+    with patch('src.utils.http_client_util.create_http_client', return_value=AsyncMock()) as mock_client, \
         patch('src.services.model_service.validate_auth_token', new_callable=AsyncMock) as mock_validate_auth_token, \
-        patch('src.services.model_service.validate_entity_balance', new_callable=AsyncMock) as mock_validate_entity_balance, \
+        patch('src.services.model_service.validate_entity_balance_with_ledger', new_callable=AsyncMock) as mock_validate_entity_balance, \
         patch('src.services.model_service.retrieve_model_details_info', new_callable=AsyncMock) as mock_retrieve_model_details_info, \
         patch('src.services.model_service.retrieve_entity_id_for_model', new_callable=AsyncMock) as mock_retrieve_entity_id_for_model, \
         patch('src.utils.redis_feature_plugin.RedisFeaturePlugin.check_rate_limit_exceeded_or_not_for_a_particular_user', new_callable=MagicMock) as mock_check_rate_limit_exceeded_or_not_for_a_particular_user, \
@@ -367,9 +418,9 @@ async def test_model_prediction_service_failure_model_not_found(request_mock):
 @pytest.mark.asyncio
 async def test_model_prediction_service_failure_presigned_upload_url(request_mock):
     request_mock.headers = {"vps-auth-token": "fake-vps-auth-token", "transaction-id": str(uuid4()), "vps-env-type": "vipas-external"}
-    with patch('src.services.model_service.httpx.AsyncClient', return_value=AsyncMock()) as mock_client, \
+    with patch('src.utils.http_client_util.create_http_client', return_value=AsyncMock()) as mock_client, \
         patch('src.services.model_service.validate_auth_token', new_callable=AsyncMock) as mock_validate_auth_token, \
-        patch('src.services.model_service.validate_entity_balance', new_callable=AsyncMock) as mock_validate_entity_balance, \
+        patch('src.services.model_service.validate_entity_balance_with_ledger', new_callable=AsyncMock) as mock_validate_entity_balance, \
         patch('src.services.model_service.retrieve_model_details_info', new_callable=AsyncMock) as mock_retrieve_model_details_info, \
         patch('src.services.model_service.retrieve_entity_id_for_model', new_callable=AsyncMock) as mock_retrieve_entity_id_for_model, \
         patch('src.utils.redis_feature_plugin.RedisFeaturePlugin.check_rate_limit_exceeded_or_not_for_a_particular_user', new_callable=MagicMock) as mock_check_rate_limit_exceeded_or_not_for_a_particular_user, \
@@ -410,7 +461,8 @@ async def test_model_prediction_service_failure_presigned_upload_url(request_moc
             {}, 
             {},
             project_id, 
-            "fake-deployment-system"
+            "fake-deployment-system",
+            "fake-model-service-name"
         )
 
         mock_check_pre_or_post_transform_input_data_for_model.side_effect = [True, True]
@@ -432,9 +484,9 @@ async def test_model_prediction_service_failure_presigned_upload_url(request_moc
 @pytest.mark.asyncio
 async def test_model_prediction_service_failure_presigned_upload_url_client_error(request_mock):
     request_mock.headers = {"vps-auth-token": "fake-vps-auth-token", "transaction-id": str(uuid4()), "vps-env-type": "vipas-external"}
-    with patch('src.services.model_service.httpx.AsyncClient', return_value=AsyncMock()) as mock_client, \
+    with patch('src.utils.http_client_util.create_http_client', return_value=AsyncMock()) as mock_client, \
         patch('src.services.model_service.validate_auth_token', new_callable=AsyncMock) as mock_validate_auth_token, \
-        patch('src.services.model_service.validate_entity_balance', new_callable=AsyncMock) as mock_validate_entity_balance, \
+        patch('src.services.model_service.validate_entity_balance_with_ledger', new_callable=AsyncMock) as mock_validate_entity_balance, \
         patch('src.services.model_service.retrieve_model_details_info', new_callable=AsyncMock) as mock_retrieve_model_details_info, \
         patch('src.services.model_service.retrieve_entity_id_for_model', new_callable=AsyncMock) as mock_retrieve_entity_id_for_model, \
         patch('src.utils.redis_feature_plugin.RedisFeaturePlugin.check_rate_limit_exceeded_or_not_for_a_particular_user', new_callable=MagicMock) as mock_check_rate_limit_exceeded_or_not_for_a_particular_user, \
@@ -474,7 +526,8 @@ async def test_model_prediction_service_failure_presigned_upload_url_client_erro
             {}, 
             {},
             project_id, 
-            "fake-deployment-system"
+            "fake-deployment-system",
+            "fake-model-service-name"
         )
 
         mock_check_pre_or_post_transform_input_data_for_model.side_effect = [True, True]
@@ -491,4 +544,104 @@ async def test_model_prediction_service_failure_presigned_upload_url_client_erro
         with pytest.raises(HTTPException) as exc_info:
             await model_prediction_service(request_mock, "fake-model-id", json.dumps("fake-input-data"))
         assert exc_info.value.status_code == 500
-        assert "An client error occurred while making prediction request to the deployed model" in str(exc_info.value.detail)
\ No newline at end of file
+        assert "An client error occurred while making prediction request to the deployed model" in str(exc_info.value.detail)
+
+@pytest.mark.asyncio
+async def test_model_prediction_service_checks_the_balance_with_the_ledger(request_mock, pipeline_mocks):
+    transaction_id = str(uuid4())
+    request_mock.headers = {"vps-auth-token": "fake-vps-auth-token", "transaction-id": transaction_id, "vps-env-type": "vipas-external"}
+    pipeline_mocks["validate_entity_balance"].side_effect = HTTPException(status_code=402, detail="Insufficient balance")
+
+    with pytest.raises(HTTPException) as exc_info:
+        await model_prediction_service(request_mock, "mdl-test", json.dumps("fake-input-data"))
+
+    assert exc_info.value.status_code == 402
+    pipeline_mocks["validate_entity_balance"].assert_awaited_once_with(
+        request_mock.app.state.http_client, request_mock.app.state.redis_client, "fake-entity-id", "mdl-test", None, "vipas-external", transaction_id
+    )
+    pipeline_mocks["get_model_prediction"].assert_not_called()
+
+@pytest.mark.asyncio
+async def test_model_prediction_service_replays_a_transaction_only_after_the_checks(request_mock, pipeline_mocks, mocker):
+    mocker.patch("src.utils.idempotency_util.get_performance_config", return_value=PerformanceConfigDTO(IDEMPOTENCY_ENABLED=True))
+    mocker.patch("src.services.model_service.RedisFeaturePlugin.create_redis_client", return_value=InMemoryRedis())
+    request_mock.headers = {"vps-auth-token": "fake-vps-auth-token", "transaction-id": str(uuid4()), "vps-env-type": "vipas-external"}
+
+    response = await model_prediction_service(request_mock, "mdl-test", json.dumps({"inputs": [1]}))
+    assert await model_prediction_service(request_mock, "mdl-test", json.dumps({"inputs": [1]})) == response
+    assert pipeline_mocks["get_model_prediction"].await_count == 1
+
+    # The transaction-id of another input is a conflict
+    with pytest.raises(HTTPException) as exc_info:
+        await model_prediction_service(request_mock, "mdl-test", json.dumps({"inputs": [2]}))
+    assert exc_info.value.status_code == 409
+
+    # A caller without balance does not get the stored response
+    pipeline_mocks["validate_entity_balance"].side_effect = HTTPException(status_code=402, detail="Insufficient balance")
+    with pytest.raises(HTTPException) as exc_info:
+        await model_prediction_service(request_mock, "mdl-test", json.dumps({"inputs": [1]}))
+    assert exc_info.value.status_code == 402
+
+@pytest.mark.asyncio
+async def test_model_prediction_service_answers_504_once_the_deadline_is_exceeded(request_mock, pipeline_mocks):
+    request_mock.headers = {"vps-auth-token": "fake-vps-auth-token", "transaction-id": str(uuid4()), "vps-env-type": "vipas-external", DEADLINE_HEADER: "50"}
+
+    async def slow_prediction(*args, **kwargs):
+        # The model call runs under the deadline of the request
+        assert 0 < get_remaining_deadline() <= 0.05
+        await asyncio.sleep(0.06)
+        raise HTTPException(status_code=502, detail="The model did not answer")
+
+    pipeline_mocks["get_model_prediction"].side_effect = slow_prediction
+
+    with pytest.raises(HTTPException) as exc_info:
+        await model_prediction_service(request_mock, "mdl-test", json.dumps("fake-input-data"))
+    assert exc_info.value.status_code == 504
+    assert get_remaining_deadline() is None
+
+@pytest.mark.asyncio
+async def test_model_prediction_service_coalesces_identical_requests_of_opted_in_models(request_mock, pipeline_mocks, mocker):
+    pipeline_mocks["retrieve_model_details_info"].return_value = {"model_id": "mdl-test", "project_id": "prj-test", "notes": json.dumps({"coalesce_requests": True})}
+
+    async def slow_prediction(*args, **kwargs):
+        await asyncio.sleep(0.01)
+        return "fake-prediction-result", "content"
+
+    shared_prediction = mocker.patch("src.utils.model_prediction_util.get_model_prediction_for_input_data", new_callable=AsyncMock, side_effect=slow_prediction)
+
+    async def predict():
+        request_mock.headers = {"vps-auth-token": "fake-vps-auth-token", "transaction-id": str(uuid4()), "vps-env-type": "vipas-external"}
+        return await model_prediction_service(request_mock, "mdl-test", json.dumps("fake-input-data"))
+
+    responses = await asyncio.gather(predict(), predict())
+
+    assert [response["output_data"] for response in responses] == ["fake-prediction-result", "fake-prediction-result"]
+    assert shared_prediction.await_count == 1
+    pipeline_mocks["get_model_prediction"].assert_not_called()
+
+    # Models that did not opt in call the model for every request
+    pipeline_mocks["retrieve_model_details_info"].return_value = {"model_id": "mdl-test", "project_id": "prj-test"}
+    await asyncio.gather(predict(), predict())
+    assert pipeline_mocks["get_model_prediction"].await_count == 2
+
+@pytest.mark.asyncio
+async def test_model_prediction_service_streams_uploaded_inputs(request_mock, pipeline_mocks, mocker):
+    transaction_id = str(uuid4())
+    request_mock.headers = {"vps-auth-token": "fake-vps-auth-token", "transaction-id": transaction_id, "vps-env-type": "vipas-external"}
+    uploaded_input = PredictionInput("inp-test", "fake-input-key", '"fake-etag"', 1000)
+    mock_resolve_prediction_input = mocker.patch("src.services.model_service.resolve_prediction_input", new_callable=AsyncMock, return_value=uploaded_input)
+    input_reference = PredictionInputReference("inp-test")
+
+    response = await model_prediction_service(request_mock, "mdl-test", input_reference)
+
+    assert response["output_data"] == "fake-prediction-result"
+    mock_resolve_prediction_input.assert_awaited_once_with(request_mock, request_mock.app.state.redis_client, input_reference, "fake-username", transaction_id)
+    assert pipeline_mocks["get_model_prediction"].await_args.args[10] is uploaded_input
+
+    # The envelope of KserveV2 needs the parsed input, the upload is not resolved
+    pipeline_mocks["retrieve_info"].return_value = ("http://fake-model-kourier-url", None, {}, None, "prj-test", "KserveV2", "fake-model-service-name")
+    request_mock.headers = {"vps-auth-token": "fake-vps-auth-token", "transaction-id": str(uuid4()), "vps-env-type": "vipas-external"}
+    with pytest.raises(HTTPException) as exc_info:
+        await model_prediction_service(request_mock, "mdl-test", input_reference)
+    assert exc_info.value.status_code == 415
+    mock_resolve_prediction_input.assert_awaited_once()
@@ -13,10 +13,12 @@
 # For more information, contact Vipas.AI at legal@vipas.ai
 
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, ANY
 from botocore.exceptions import BotoCoreError, ClientError
 from fastapi import HTTPException
-from src.utils.aws_feature_plugin import AWSFeaturePlugin
+from src.utils.aws_feature_plugin import AWSFeaturePlugin, build_s3_client_config, run_s3_operation, S3_OPERATION_DURATION_SECONDS
+from src.models.env.performance_config_DTO import PerformanceConfigDTO
+from src.utils.tracing_util import get_current_transaction_id, _current_transaction_id
 
 @pytest.fixture
 def aws_feature_plugin():
@@ -41,7 +43,36 @@ def test_create_s3_client_success(aws_feature_plugin):
         
         client = aws_feature_plugin.create_s3_client()
         assert client == mock_client
-        mock_boto_client.assert_called_once_with("s3", region_name="us-east-1")
+        mock_boto_client.assert_called_once_with("s3", region_name="us-east-1", endpoint_url=None, config=ANY)
+
+def test_create_s3_client_uses_custom_endpoint(aws_feature_plugin, mocker):
+    mocker.patch("src.utils.aws_feature_plugin.get_performance_config", return_value=PerformanceConfigDTO(S3_ENDPOINT_URL="http://localhost:9000"))
+    with patch('src.utils.aws_feature_plugin.boto3.client', new_callable=MagicMock) as mock_boto_client:
+        aws_feature_plugin.create_s3_client()
+        assert mock_boto_client.call_args.kwargs["endpoint_url"] == "http://localhost:9000"
+
+def test_build_s3_client_config(mocker):
+    mocker.patch("src.utils.aws_feature_plugin.get_performance_config", return_value=PerformanceConfigDTO(S3_MAX_POOL_CONNECTIONS=32, S3_RETRY_MODE="adaptive", S3_MAX_ATTEMPTS=5))
+    s3_config = build_s3_client_config()
+    assert s3_config.max_pool_connections == 32
+    assert s3_config.tcp_keepalive is True
+    assert s3_config.retries == {"mode": "adaptive", "max_attempts": 5}
+
+@pytest.mark.asyncio
+async def test_run_s3_operation_keeps_the_request_context(aws_feature_plugin):
+    mock_client = MagicMock()
+    mock_client.generate_presigned_url.side_effect = lambda *args, **kwargs: get_current_transaction_id()
+    token = _current_transaction_id.set("transaction1")
+    try:
+        url = await run_s3_operation(aws_feature_plugin.generate_presigned_download_url, mock_client, "test-bucket", "test-key", "transaction1")
+    finally:
+        _current_transaction_id.reset(token)
+    assert url == "transaction1"
+
+def test_s3_operation_latency_is_observed(aws_feature_plugin):
+    samples = S3_OPERATION_DURATION_SECONDS.labels(operation="generate_presigned_url", result="success")._sum.get()
+    aws_feature_plugin.generate_presigned_download_url(MagicMock(), "test-bucket", "test-key", "test-transaction-id")
+    assert S3_OPERATION_DURATION_SECONDS.labels(operation="generate_presigned_url", result="success")._sum.get() > samples
 
 def test_create_s3_client_boto_core_error(aws_feature_plugin):
     with patch('src.utils.aws_feature_plugin.boto3.client', new_callable=MagicMock) as mock_boto_client:
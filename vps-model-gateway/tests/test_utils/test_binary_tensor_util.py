@@ -0,0 +1,102 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from src.models.env.performance_config_DTO import PerformanceConfigDTO
+from src.utils.binary_tensor_util import BinaryInferencePayload, parse_binary_inference_body, build_binary_model_request, build_binary_prediction_response
+import struct
+import json
+import pytest
+
+def build_body(header: dict, data: bytes):
+    encoded_header = json.dumps(header).encode("utf-8")
+    return encoded_header + data, len(encoded_header)
+
+def test_parse_binary_inference_body_splits_the_tensors():
+    header = {"inputs": [
+        {"name": "a", "datatype": "FP32", "shape": [2], "parameters": {"binary_data_size": 8}},
+        {"name": "b", "datatype": "BYTES", "shape": [1], "data": ["json"]},
+        {"name": "c", "datatype": "INT8", "shape": [3], "parameters": {"binary_data_size": 3}}
+    ]}
+    body, header_length = build_body(header, struct.pack("<2f", 1.0, 2.0) + b"\x01\x02\x03")
+
+    payload = parse_binary_inference_body(body, str(header_length))
+
+    assert payload.header == header
+    tensors = [(tensor["name"], bytes(data)) for tensor, data in payload.tensors()]
+    assert tensors == [("a", struct.pack("<2f", 1.0, 2.0)), ("c", b"\x01\x02\x03")]
+    assert isinstance(payload.data, memoryview)
+
+@pytest.mark.parametrize("header_length", ["abc", "-1", "100000", None])
+def test_parse_binary_inference_body_rejects_invalid_header_lengths(header_length):
+    body, _ = build_body({"inputs": []}, b"")
+    with pytest.raises(ValueError):
+        parse_binary_inference_body(body, header_length)
+
+def test_parse_binary_inference_body_rejects_mismatched_sizes():
+    body, header_length = build_body({"inputs": [{"name": "a", "parameters": {"binary_data_size": 8}}]}, b"\x00" * 4)
+    with pytest.raises(ValueError):
+        parse_binary_inference_body(body, header_length)
+
+    body, header_length = build_body({"inputs": [{"name": "a", "parameters": {"binary_data_size": -4}}]}, b"")
+    with pytest.raises(ValueError):
+        parse_binary_inference_body(body, header_length)
+
+@pytest.mark.asyncio
+async def test_build_binary_model_request_fills_the_model_input(mocker):
+    mocker.patch("src.utils.binary_tensor_util.get_performance_config", return_value=PerformanceConfigDTO(BINARY_TENSOR_OUTPUTS_ENABLED=True))
+    body, header_length = build_body({"inputs": [{"parameters": {"binary_data_size": 4}}]}, b"\x00\x00\x80\x3f")
+    payload = parse_binary_inference_body(body, header_length)
+    model_details = {"input": {"name": "input-0", "data_type": "FP32", "dims": [1, 1]}}
+
+    stream, headers = build_binary_model_request(payload, "KserveV2", model_details, "transaction1")
+
+    chunks = [bytes(chunk) async for chunk in stream]
+    # The stream can be sent again by a retry
+    assert [bytes(chunk) async for chunk in stream] == chunks
+    content = b"".join(chunks)
+    assert headers["Content-Type"] == "application/octet-stream"
+    assert headers["Content-Length"] == str(len(content))
+    model_header_length = int(headers["Inference-Header-Content-Length"])
+    model_header = json.loads(content[:model_header_length])
+    assert model_header["inputs"][0] == {"name": "input-0", "datatype": "FP32", "shape": [1, 1], "parameters": {"binary_data_size": 4}}
+    assert model_header["parameters"] == {"binary_data_output": True}
+    assert content[model_header_length:] == b"\x00\x00\x80\x3f"
+    # The received header is left as it was
+    assert "name" not in payload.header["inputs"][0]
+
+def test_build_binary_model_request_keeps_requested_outputs(mocker):
+    mocker.patch("src.utils.binary_tensor_util.get_performance_config", return_value=PerformanceConfigDTO(BINARY_TENSOR_OUTPUTS_ENABLED=True))
+    header = {"inputs": [{"name": "a", "parameters": {"binary_data_size": 0}}], "outputs": [{"name": "out", "parameters": {"binary_data": False}}]}
+    body, header_length = build_body(header, b"")
+    payload = parse_binary_inference_body(body, header_length)
+
+    stream, headers = build_binary_model_request(payload, "MLFlow", {}, "transaction1")
+
+    assert headers["Content-Length"] == headers["Inference-Header-Content-Length"]
+    assert json.loads(stream.header) == header
+
+def test_build_binary_prediction_response():
+    body, header_length = build_body({"model_name": "m", "outputs": [{"name": "out", "datatype": "FP32", "shape": [1], "parameters": {"binary_data_size": 4}}]}, b"\x00\x00\x80\x3f")
+    payload = parse_binary_inference_body(body, header_length, "outputs")
+
+    response = build_binary_prediction_response({"output_data": payload, "payload_type": "content", "payload_url": None, "extractor": None})
+
+    assert response.media_type == "application/octet-stream"
+    response_header_length = int(response.headers["Inference-Header-Content-Length"])
+    response_header = json.loads(response.body[:response_header_length])
+    assert response_header["payload_type"] == "content"
+    assert response_header["output_data"]["outputs"][0]["name"] == "out"
+    assert response.body[response_header_length:] == b"\x00\x00\x80\x3f"
+    assert isinstance(payload, BinaryInferencePayload)
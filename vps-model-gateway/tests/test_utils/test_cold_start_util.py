@@ -0,0 +1,151 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from fastapi import HTTPException
+from src.models.env.performance_config_DTO import PerformanceConfigDTO
+from src.utils.cold_start_util import ColdStartTracker, get_cold_start_tracker, get_keep_warm_url, stream_model_request, ping_model
+from src.utils.retry_transport_util import IDEMPOTENT_EXTENSION, COLD_START_EXTENSION
+import httpx
+import pytest
+
+MODEL_URL = "http://kourier.test/v1/models/mdl-test:predict"
+
+@pytest.fixture(name="clock")
+def fixture_clock(mocker):
+    clock = mocker.Mock(return_value=1000.0)
+    mocker.patch("src.utils.cold_start_util.time.monotonic", clock)
+    return clock
+
+def test_get_keep_warm_url():
+    assert get_keep_warm_url(MODEL_URL) == "http://kourier.test/v1/models/mdl-test"
+    assert get_keep_warm_url("http://kourier.test/v2/models/mdl-test/infer") == "http://kourier.test/v2/models/mdl-test/ready"
+    assert get_keep_warm_url("http://kourier.test/openai/v1/completions") == "http://kourier.test/openai/v1/models"
+    assert get_keep_warm_url("grpc://kourier.test:80") is None
+
+def test_models_are_predicted_cold_after_the_idle_time(clock):
+    tracker = ColdStartTracker()
+
+    assert tracker.record_request("mdl-test", MODEL_URL, {})
+    clock.return_value += 10
+    assert not tracker.record_request("mdl-test", MODEL_URL, {})
+    clock.return_value += PerformanceConfigDTO().COLD_START_IDLE_SECONDS
+    assert tracker.record_request("mdl-test", MODEL_URL, {})
+
+def test_slow_calls_of_cold_models_are_cold_starts(clock):
+    tracker = ColdStartTracker()
+    tracker.record_request("mdl-test", MODEL_URL, {})
+
+    # Without a warm latency a slow first call is not taken for a cold start, nor counted as warm
+    assert not tracker.observe_response("mdl-test", 30.0, True)
+    assert tracker.models["mdl-test"].warm_latency is None
+    assert tracker.observe_response("mdl-test", 30.0, True, activator_retried=True)
+
+    assert not tracker.observe_response("mdl-test", 0.5, False)
+    assert not tracker.observe_response("mdl-test", 1.0, True)
+    assert tracker.observe_response("mdl-test", 30.0, True)
+    assert not tracker.observe_response("mdl-test", 30.0, False)
+
+def test_keep_warm_candidates_follow_the_traffic_pattern(mocker, clock):
+    mocker.patch("src.utils.cold_start_util.get_performance_config", return_value=PerformanceConfigDTO(KEEP_WARM_MIN_REQUESTS=3, KEEP_WARM_IDLE_SECONDS=60.0, KEEP_WARM_INTERVAL_TOLERANCE=2.0))
+    tracker = ColdStartTracker()
+    for _ in range(3):
+        tracker.record_request("mdl-test", MODEL_URL, {"Host": "mdl-test.default", "Content-Type": "application/json"})
+        clock.return_value += 120
+
+    # Idle for 120s out of a mean of 120s between requests, the next one is due
+    assert tracker.get_keep_warm_candidates() == [("mdl-test", "http://kourier.test/v1/models/mdl-test", {"Host": "mdl-test.default"})]
+    assert tracker.get_keep_warm_candidates() == []
+
+    # Idle for twice the mean time between requests, the traffic stopped
+    clock.return_value += 120
+    tracker.models["mdl-test"].pinged_at = None
+    assert tracker.get_keep_warm_candidates() == []
+
+@pytest.mark.asyncio
+async def test_cold_calls_are_sent_again_after_the_activator_failed(mocker):
+    mocker.patch("src.utils.cold_start_util.get_performance_config", return_value=PerformanceConfigDTO(COLD_START_RETRY_BACKOFF_SECONDS=0.0, COLD_START_MAX_RETRIES=1))
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(503 if len(requests) == 1 else 200, json={"predictions": [1]})
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        async with stream_model_request(client, "mdl-test", MODEL_URL, {}, b"{}", {}, "test_transaction_id") as response:
+            assert response.status_code == 200
+            assert await response.aread() == b'{"predictions": [1]}'
+
+    assert len(requests) == 2
+    assert all(request.extensions[COLD_START_EXTENSION] for request in requests)
+
+@pytest.mark.asyncio
+async def test_warm_calls_are_sent_once(mocker):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(503)
+
+    get_cold_start_tracker().record_request("mdl-test", MODEL_URL, {})
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        async with stream_model_request(client, "mdl-test", MODEL_URL, {}, b"{}", {}, "test_transaction_id") as response:
+            assert response.status_code == 503
+
+    assert len(requests) == 1
+    assert COLD_START_EXTENSION not in requests[0].extensions
+
+@pytest.mark.asyncio
+async def test_cold_calls_time_out_with_a_gateway_timeout(mocker):
+    mocker.patch("src.utils.cold_start_util.get_performance_config", return_value=PerformanceConfigDTO(COLD_START_RETRY_BACKOFF_SECONDS=0.0, COLD_START_MAX_RETRIES=1))
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        raise httpx.ReadTimeout("timed out", request=request)
+
+    # A read timeout used up the deadline, the model may still be working on the first call
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        with pytest.raises(HTTPException) as exc_info:
+            async with stream_model_request(client, "mdl-test", MODEL_URL, {}, b"{}", {IDEMPOTENT_EXTENSION: True}, "test_transaction_id"):
+                pass
+    assert exc_info.value.status_code == 504
+    assert len(requests) == 1
+
+@pytest.mark.asyncio
+async def test_cold_calls_are_sent_again_after_a_connect_timeout(mocker):
+    mocker.patch("src.utils.cold_start_util.get_performance_config", return_value=PerformanceConfigDTO(COLD_START_RETRY_BACKOFF_SECONDS=0.0, COLD_START_MAX_RETRIES=1))
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if len(requests) == 1:
+            raise httpx.ConnectTimeout("timed out", request=request)
+        return httpx.Response(200)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        async with stream_model_request(client, "mdl-test", MODEL_URL, {}, b"{}", {}, "test_transaction_id") as response:
+            assert response.status_code == 200
+    assert len(requests) == 2
+
+@pytest.mark.asyncio
+async def test_ping_model_keeps_the_model_active(clock):
+    tracker = get_cold_start_tracker()
+    tracker.record_request("mdl-test", MODEL_URL, {})
+    clock.return_value += 60
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, json={"ready": True}))) as client:
+        assert await ping_model(client, "mdl-test", "http://kourier.test/v1/models/mdl-test", {}, 1.0)
+
+    assert tracker.models["mdl-test"].last_active_at == 1060.0
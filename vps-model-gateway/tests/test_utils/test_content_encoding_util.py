@@ -0,0 +1,96 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+
+from unittest.mock import MagicMock
+from fastapi.responses import Response
+from src.models.env.performance_config_DTO import PerformanceConfigDTO
+from src.utils.content_encoding_util import negotiate_content_encoding, compress_body, decompress_body, encode_prediction_response, get_model_request_encoding, GzipStreamEncoder
+import random
+import gzip
+import json
+import pytest
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    (None, None),
+    ("", None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("deflate, gzip;q=0.5", "gzip"),
+    ("gzip;q=0", None),
+    ("*", "gzip"),
+    ("*, gzip;q=0", None),
+    ("br;q=1.0, gzip;q=0.8", "gzip"),
+])
+def test_negotiate_content_encoding(mocker, accept_encoding, expected):
+    mocker.patch("src.utils.content_encoding_util.zstandard", None)
+    mocker.patch("src.utils.content_encoding_util.brotli", None)
+    assert negotiate_content_encoding(accept_encoding) == expected
+
+def test_negotiate_content_encoding_prefers_zstd_when_available(mocker):
+    mocker.patch("src.utils.content_encoding_util.zstandard", MagicMock())
+    assert negotiate_content_encoding("gzip, zstd") == "zstd"
+    assert negotiate_content_encoding("gzip, zstd;q=0.5") == "gzip"
+
+def test_compress_body_round_trip():
+    body = json.dumps([0.5] * 1000).encode()
+    encoded = compress_body(body, "gzip")
+    assert len(encoded) < len(body)
+    assert decompress_body(encoded, "gzip") == body
+
+def test_compress_body_unsupported_encoding(mocker):
+    mocker.patch("src.utils.content_encoding_util.brotli", None)
+    with pytest.raises(ValueError):
+        compress_body(b"data", "br")
+
+@pytest.mark.asyncio
+async def test_encode_prediction_response_skips_small_payloads():
+    request = MagicMock()
+    request.headers = {"accept-encoding": "gzip"}
+    response = {"output_data": "small", "payload_type": "content"}
+    assert await encode_prediction_response(request, response) is response
+
+@pytest.mark.asyncio
+async def test_encode_prediction_response_compresses_large_payloads(mocker):
+    mocker.patch("src.utils.content_encoding_util.get_performance_config", return_value=PerformanceConfigDTO(COMPRESSION_OFFLOAD_BYTES=1))
+    request = MagicMock()
+    request.headers = {"accept-encoding": "gzip"}
+    response = {"output_data": [0.123456] * 1000, "payload_type": "content"}
+
+    encoded = await encode_prediction_response(request, response)
+
+    assert isinstance(encoded, Response)
+    assert encoded.headers["content-encoding"] == "gzip"
+    assert encoded.headers["vary"] == "Accept-Encoding"
+    assert json.loads(gzip.decompress(encoded.body)) == response
+
+def test_get_model_request_encoding(mocker):
+    mocker.patch("src.utils.content_encoding_util.zstandard", None)
+    assert get_model_request_encoding({}) is None
+    assert get_model_request_encoding({"request_encoding": "gzip"}) == "gzip"
+    assert get_model_request_encoding({"request_encoding": "zstd"}) is None
+
+def test_gzip_stream_encoder_emits_full_parts():
+    encoder = GzipStreamEncoder(part_size=1024, level=1)
+    rng = random.Random(0)
+    chunks = [bytes(rng.getrandbits(8) for _ in range(4096)) for _ in range(4)]
+
+    parts = []
+    for chunk in chunks:
+        parts.extend(encoder.write(chunk))
+    parts.extend(encoder.finish())
+
+    assert all(len(part) == 1024 for part in parts[:-1])
+    assert gzip.decompress(b"".join(parts)) == b"".join(chunks)
@@ -0,0 +1,95 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from unittest.mock import AsyncMock, MagicMock
+from fastapi import HTTPException
+from src.models.env.performance_config_DTO import PerformanceConfigDTO
+from src.utils import credit_ledger_util
+from src.utils.credit_ledger_util import validate_entity_balance_with_ledger, build_credit_ledger_key
+import asyncio
+import pytest
+
+KEY = build_credit_ledger_key("ent-test", "mdl-test", None, "vipas-external")
+
+class InMemoryRedis:
+    def __init__(self):
+        self.values = {}
+
+    def decr(self, key):
+        self.values[key] = int(self.values.get(key, 0)) - 1
+        return self.values[key]
+
+    def expire(self, key, ttl):
+        return True
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def ledger(mocker):
+    mocker.patch("src.utils.credit_ledger_util.get_performance_config", return_value=PerformanceConfigDTO(CREDIT_LEDGER_ENABLED=True, CREDIT_LEDGER_BLOCK_SIZE=3, CREDIT_LEDGER_REFRESH_THRESHOLD=1))
+    validate = mocker.patch("src.utils.credit_ledger_util.validate_entity_balance", new_callable=AsyncMock)
+    redis_client = InMemoryRedis()
+    mocker.patch("src.utils.credit_ledger_util.RedisFeaturePlugin.create_redis_client", return_value=redis_client)
+    return validate, redis_client
+
+async def check(redis_client):
+    await validate_entity_balance_with_ledger(MagicMock(), redis_client, "ent-test", "mdl-test", None, "vipas-external", "transaction1")
+
+@pytest.mark.asyncio
+async def test_disabled_ledger_always_calls_the_payment_service(mocker):
+    validate = mocker.patch("src.utils.credit_ledger_util.validate_entity_balance", new_callable=AsyncMock)
+
+    await check(InMemoryRedis())
+    await check(InMemoryRedis())
+
+    assert validate.await_count == 2
+
+@pytest.mark.asyncio
+async def test_block_serves_requests_and_is_refreshed_in_the_background(ledger):
+    validate, redis_client = ledger
+
+    await check(redis_client)
+    assert validate.await_count == 1
+    assert redis_client.values[KEY] == 2
+
+    await check(redis_client)
+    assert validate.await_count == 1
+
+    # One prediction left is below the threshold, a new block is requested without blocking the request
+    await check(redis_client)
+    await asyncio.gather(*credit_ledger_util._refresh_tasks)
+    assert validate.await_count == 2
+    assert redis_client.values[KEY] == 3
+
+@pytest.mark.asyncio
+async def test_insufficient_balance_drops_the_block(ledger):
+    validate, redis_client = ledger
+    validate.side_effect = HTTPException(status_code=402, detail="User has insufficient balance to run the model.")
+
+    with pytest.raises(HTTPException) as exc_info:
+        await check(redis_client)
+
+    assert exc_info.value.status_code == 402
+    assert KEY not in redis_client.values
@@ -0,0 +1,92 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from src.models.env.env_config_DTO import EnvConfigDTO
+from src.utils.deadline_util import DEADLINE_HEADER, parse_deadline_header, start_request_deadline, apply_model_deadline, reset_request_deadline, get_remaining_deadline, get_stage_timeout
+from src.utils.retry_transport_util import RetryingTransport
+import json
+import httpx
+import pytest
+
+@pytest.fixture
+def request_deadline():
+    tokens = []
+    def start(header_value=None):
+        tokens.append(start_request_deadline(header_value, "transaction1"))
+    yield start
+    for token in reversed(tokens):
+        reset_request_deadline(token)
+
+def test_parse_deadline_header():
+    assert parse_deadline_header("1500") == 1.5
+    assert parse_deadline_header("0") is None
+    assert parse_deadline_header("soon") is None
+    assert parse_deadline_header(None) is None
+
+def test_no_deadline_outside_of_a_request():
+    assert get_remaining_deadline() is None
+    assert get_stage_timeout("user_admin")["read"] == 10.0
+
+def test_header_deadline_caps_every_stage(request_deadline):
+    request_deadline("2000")
+
+    assert 1.9 < get_remaining_deadline() <= 2.0
+    assert get_stage_timeout("user_admin")["connect"] <= 2.0
+    assert get_stage_timeout("model")["read"] <= 2.0
+
+def test_model_notes_set_the_deadline_unless_the_client_sent_one(request_deadline):
+    model = {"notes": json.dumps({"request_timeout_seconds": 30})}
+
+    request_deadline()
+    apply_model_deadline(model, "transaction1")
+    assert 29 < get_remaining_deadline() <= 30
+
+    request_deadline("5000")
+    apply_model_deadline(model, "transaction1")
+    assert get_remaining_deadline() <= 5
+
+@pytest.mark.asyncio
+async def test_transport_forwards_the_remaining_deadline():
+    sent = []
+
+    def handler(request):
+        sent.append(request)
+        return httpx.Response(200)
+
+    # Async tests run in their own context, the deadline is started and reset within the test
+    token = start_request_deadline("3000", "transaction1")
+    try:
+        client = httpx.AsyncClient(transport=RetryingTransport(httpx.MockTransport(handler)))
+        await client.get(f"{EnvConfigDTO().USER_ADMIN_SERVICE_URL}/validate_user")
+    finally:
+        reset_request_deadline(token)
+
+    assert 2900 < int(sent[0].headers[DEADLINE_HEADER]) <= 3000
+    assert sent[0].extensions["timeout"]["read"] <= 3.0
+
+@pytest.mark.asyncio
+async def test_transport_does_not_call_upstreams_after_the_deadline(mocker):
+    handler = mocker.Mock(return_value=httpx.Response(200))
+    token = start_request_deadline("1", "transaction1")
+    mocker.patch("src.utils.deadline_util.time.monotonic", return_value=10 ** 9)
+
+    try:
+        client = httpx.AsyncClient(transport=RetryingTransport(httpx.MockTransport(handler)))
+        with pytest.raises(httpx.TimeoutException):
+            await client.get(f"{EnvConfigDTO().USER_ADMIN_SERVICE_URL}/validate_user")
+    finally:
+        reset_request_deadline(token)
+
+    handler.assert_not_called()
@@ -0,0 +1,54 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+
+from unittest.mock import MagicMock
+from src.models.env.performance_config_DTO import PerformanceConfigDTO
+from src.utils.edge_auth_util import get_edge_verified_user, build_edge_auth_headers
+import pytest
+
+EDGE_HEADERS = {"vps-edge-auth": "verified", "vps-auth-username": "user", "vps-auth-entity-id": "ent-test", "vps-auth-app-id": "app-*"}
+
+def create_request(headers: dict, host: str = "127.0.0.1"):
+    request = MagicMock()
+    request.headers = headers
+    request.client.host = host
+    return request
+
+@pytest.fixture
+def edge_auth_enabled(mocker):
+    mocker.patch("src.utils.edge_auth_util.get_performance_config", return_value=PerformanceConfigDTO(EDGE_AUTH_ENABLED=True))
+
+def test_get_edge_verified_user(edge_auth_enabled):
+    user_data = get_edge_verified_user(create_request(EDGE_HEADERS), "transaction1")
+    assert user_data == {"result": True, "username": "user", "entity_id": "ent-test", "vps_app_id": "app-*"}
+
+def test_get_edge_verified_user_disabled():
+    assert get_edge_verified_user(create_request(EDGE_HEADERS), "transaction1") is None
+
+def test_get_edge_verified_user_ignores_untrusted_peers(edge_auth_enabled):
+    assert get_edge_verified_user(create_request(EDGE_HEADERS, host="10.1.2.3"), "transaction1") is None
+
+def test_get_edge_verified_user_needs_the_verified_marker(edge_auth_enabled):
+    headers = {key: value for key, value in EDGE_HEADERS.items() if key != "vps-edge-auth"}
+    assert get_edge_verified_user(create_request(headers), "transaction1") is None
+
+def test_get_edge_verified_user_without_username(edge_auth_enabled):
+    assert get_edge_verified_user(create_request({**EDGE_HEADERS, "vps-auth-username": ""}), "transaction1") is None
+
+def test_build_edge_auth_headers():
+    assert build_edge_auth_headers({"username": "user", "entity_id": "ent-test", "vps_app_id": None}) == {
+        "vps-auth-username": "user", "vps-auth-entity-id": "ent-test", "vps-auth-app-id": ""
+    }
@@ -0,0 +1,146 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from fastapi import HTTPException
+from contextlib import asynccontextmanager
+from src.models.env.performance_config_DTO import PerformanceConfigDTO
+from src.utils.binary_tensor_util import BinaryInferencePayload
+import numpy as np
+import pytest
+
+grpc = pytest.importorskip("grpc")
+
+from src.utils.grpc_inference_util import GrpcChannelPool, get_inference_messages, build_model_infer_request, parse_model_infer_response, build_grpc_metadata, get_grpc_model_url, grpc_model_infer
+
+@asynccontextmanager
+async def model_server():
+    """Local ModelInfer stub: echoes the inputs as outputs, and records the metadata of every call."""
+    messages = get_inference_messages()
+    calls = []
+
+    async def model_infer(request, context):
+        calls.append(dict(context.invocation_metadata()))
+        if request.model_name == "missing":
+            await context.abort(grpc.StatusCode.NOT_FOUND, "Model missing is not loaded")
+        response = messages.ModelInferResponse(model_name=request.model_name, id=request.id)
+        for tensor, contents in zip(request.inputs, request.raw_input_contents):
+            response.outputs.add(name=f"output-{tensor.name}", datatype=tensor.datatype, shape=tensor.shape)
+            response.raw_output_contents.append(contents)
+        return response
+
+    handler = grpc.method_handlers_generic_handler("inference.GRPCInferenceService", {
+        "ModelInfer": grpc.unary_unary_rpc_method_handler(model_infer, request_deserializer=messages.ModelInferRequest.FromString, response_serializer=messages.ModelInferResponse.SerializeToString)
+    })
+    server = grpc.aio.server()
+    server.add_generic_rpc_handlers((handler,))
+    port = server.add_insecure_port("127.0.0.1:0")
+    await server.start()
+    try:
+        yield f"grpc://127.0.0.1:{port}", calls
+    finally:
+        await server.stop(None)
+
+@pytest.fixture
+def channel_pool(mocker):
+    pool = GrpcChannelPool()
+    mocker.patch("src.utils.grpc_inference_util._channel_pool", pool)
+    return pool
+
+def test_build_model_infer_request_sends_raw_contents():
+    input_data = {"id": "request-1", "parameters": {"priority": 1}, "inputs": [
+        {"name": "x", "datatype": "FP32", "shape": [1, -1], "data": [1.0, 2.0, 3.0]},
+        {"name": "s", "datatype": "BYTES", "shape": [2], "data": ["a", "bc"]}
+    ]}
+
+    request, binary_outputs = build_model_infer_request("mdl-service", input_data, "transaction1")
+
+    assert not binary_outputs
+    assert request.model_name == "mdl-service" and request.id == "request-1"
+    assert request.parameters["priority"].int64_param == 1
+    assert list(request.inputs[0].shape) == [1, 3]
+    assert request.raw_input_contents[0] == np.asarray([1, 2, 3], dtype="<f4").tobytes()
+    assert request.raw_input_contents[1] == b"\x01\x00\x00\x00a\x02\x00\x00\x00bc"
+
+def test_build_model_infer_request_from_binary_payload():
+    header = {"inputs": [{"name": "x", "datatype": "INT8", "shape": [2], "parameters": {"binary_data_size": 2}}, {"name": "y", "datatype": "INT32", "shape": [1], "data": [7]}]}
+    payload = BinaryInferencePayload(header, memoryview(b"\x01\x02"))
+
+    request, binary_outputs = build_model_infer_request("mdl-service", payload, "transaction1")
+
+    assert binary_outputs
+    assert list(request.raw_input_contents) == [b"\x01\x02", np.asarray([7], dtype="<i4").tobytes()]
+    assert "binary_data_size" not in request.inputs[0].parameters
+
+@pytest.mark.parametrize("input_data", [[1, 2, 3], {"inputs": [{"name": "x", "datatype": "FP32", "shape": [-1, -1], "data": [1.0, 2.0]}]}, {"inputs": [{"name": "x", "datatype": "INT32", "shape": [1], "data": ["a"]}]}])
+def test_build_model_infer_request_rejects_invalid_inputs(input_data):
+    with pytest.raises(HTTPException) as exc_info:
+        build_model_infer_request("mdl-service", input_data, "transaction1")
+
+    assert exc_info.value.status_code == 400
+
+def test_parse_model_infer_response_reads_typed_contents():
+    messages = get_inference_messages()
+    response = messages.ModelInferResponse(model_name="mdl-service")
+    output = response.outputs.add(name="out", datatype="INT64", shape=[2])
+    output.contents.int64_contents.extend([5, 6])
+
+    assert parse_model_infer_response(response)["outputs"] == [{"name": "out", "datatype": "INT64", "shape": [2], "data": [5, 6]}]
+    binary = parse_model_infer_response(response, binary_outputs=True)
+    assert binary.header["outputs"][0]["parameters"] == {"binary_data_size": 16}
+    assert bytes(binary.data) == np.asarray([5, 6], dtype="<i8").tobytes()
+
+def test_build_grpc_metadata():
+    metadata, authority = build_grpc_metadata({"Host": "mdl.models.example.com", "Content-Type": "application/json", "X-Api-Key": "key"}, "transaction1")
+
+    assert authority == "mdl.models.example.com"
+    assert metadata == [("x-api-key", "key"), ("transaction-id", "transaction1")]
+
+def test_get_grpc_model_url():
+    assert get_grpc_model_url({"GrpcTarget": "models:9000"}, "http://kourier.internal", "transaction1") == "grpc://models:9000"
+    assert get_grpc_model_url({}, "http://kourier.internal", "transaction1") == "grpc://kourier.internal:80"
+    assert get_grpc_model_url({}, "http://kourier.internal:8080/base", "transaction1") == "grpc://kourier.internal:8080"
+
+@pytest.mark.asyncio
+async def test_grpc_model_infer_round_trip(channel_pool):
+    async with model_server() as (model_url, calls):
+        input_data = {"inputs": [{"name": "x", "datatype": "FP32", "shape": [2], "data": [0.5, 1.5]}]}
+        response, binary_outputs = await grpc_model_infer(model_url, "mdl-service", input_data, {"X-Api-Key": "key"}, "transaction1")
+
+        assert parse_model_infer_response(response, binary_outputs)["outputs"] == [{"name": "output-x", "datatype": "FP32", "shape": [2], "data": [0.5, 1.5]}]
+        assert calls[0]["x-api-key"] == "key"
+        assert calls[0]["transaction-id"] == "transaction1"
+        await channel_pool.close()
+
+@pytest.mark.asyncio
+async def test_grpc_model_infer_maps_status_codes(channel_pool):
+    async with model_server() as (model_url, _):
+        with pytest.raises(HTTPException) as exc_info:
+            await grpc_model_infer(model_url, "missing", {"inputs": []}, {}, "transaction1")
+
+        assert exc_info.value.status_code == 404
+        assert "not loaded" in exc_info.value.detail
+        await channel_pool.close()
+
+@pytest.mark.asyncio
+async def test_channel_pool_round_robin(mocker):
+    mocker.patch("src.utils.grpc_inference_util.get_performance_config", return_value=PerformanceConfigDTO(GRPC_CHANNELS_PER_TARGET=2))
+    pool = GrpcChannelPool()
+
+    first, second, third = (pool.get_channel("127.0.0.1:1") for _ in range(3))
+
+    assert first is not second and first is third
+    assert pool.get_channel("127.0.0.1:1", "other.example.com") not in (first, second)
+    await pool.close()
+    assert pool.channels == {}
@@ -0,0 +1,133 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from unittest.mock import MagicMock
+from fastapi import HTTPException
+from redis.exceptions import RedisError
+from src.models.env.performance_config_DTO import PerformanceConfigDTO
+from src.utils.idempotency_util import IdempotentTransaction, build_request_fingerprint, hash_request_input
+import asyncio
+import pytest
+
+RESPONSE = {"output_data": [0.1], "payload_type": "content", "payload_url": None, "extractor": None}
+
+class InMemoryRedis:
+    def __init__(self):
+        self.values = {}
+        self.ttls = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        self.ttls[key] = ex
+        return True
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+FINGERPRINT = build_request_fingerprint("user", "mdl-test", hash_request_input('{"inputs": [1]}'))
+
+@pytest.fixture(autouse=True)
+def enable_idempotency(mocker):
+    mocker.patch("src.utils.idempotency_util.get_performance_config", return_value=PerformanceConfigDTO(IDEMPOTENCY_ENABLED=True))
+
+@pytest.mark.asyncio
+async def test_completed_transactions_are_replayed():
+    redis_client = InMemoryRedis()
+
+    original = IdempotentTransaction(redis_client, "transaction1", FINGERPRINT)
+    assert await original.begin() is None
+    assert original.complete(RESPONSE) == RESPONSE
+
+    retry = IdempotentTransaction(redis_client, "transaction1", FINGERPRINT)
+    assert await retry.begin() == RESPONSE
+    assert redis_client.ttls["vps:idempotency:transaction1"] == 3600
+
+@pytest.mark.asyncio
+async def test_transaction_id_reused_by_another_request_is_a_conflict():
+    redis_client = InMemoryRedis()
+    await IdempotentTransaction(redis_client, "transaction1", FINGERPRINT).begin()
+
+    with pytest.raises(HTTPException) as exc_info:
+        await IdempotentTransaction(redis_client, "transaction1", build_request_fingerprint("other-user", "mdl-test", hash_request_input('{"inputs": [1]}'))).begin()
+
+    assert exc_info.value.status_code == 409
+
+@pytest.mark.asyncio
+async def test_transaction_id_reused_with_another_input_is_a_conflict():
+    redis_client = InMemoryRedis()
+    original = IdempotentTransaction(redis_client, "transaction1", FINGERPRINT)
+    await original.begin()
+    original.complete(RESPONSE)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await IdempotentTransaction(redis_client, "transaction1", build_request_fingerprint("user", "mdl-test", hash_request_input('{"inputs": [2]}'))).begin()
+
+    assert exc_info.value.status_code == 409
+
+@pytest.mark.asyncio
+async def test_retry_of_an_in_progress_transaction_attaches_to_the_original():
+    redis_client = InMemoryRedis()
+    original = IdempotentTransaction(redis_client, "transaction1", FINGERPRINT)
+    await original.begin()
+
+    retry = asyncio.create_task(IdempotentTransaction(redis_client, "transaction1", FINGERPRINT).begin())
+    await asyncio.sleep(0)
+    assert not retry.done()
+
+    original.complete(RESPONSE)
+    assert await retry == RESPONSE
+
+@pytest.mark.asyncio
+async def test_released_transactions_run_again():
+    redis_client = InMemoryRedis()
+    original = IdempotentTransaction(redis_client, "transaction1", FINGERPRINT)
+    await original.begin()
+
+    retry = IdempotentTransaction(redis_client, "transaction1", FINGERPRINT)
+    retry_task = asyncio.create_task(retry.begin())
+    await asyncio.sleep(0)
+    original.release()
+
+    assert await retry_task is None
+    assert retry.claimed
+
+@pytest.mark.asyncio
+async def test_responses_that_are_not_json_are_not_stored():
+    redis_client = InMemoryRedis()
+    original = IdempotentTransaction(redis_client, "transaction1", FINGERPRINT)
+    await original.begin()
+
+    response = {"output_data": memoryview(b"\x00"), "payload_type": "content"}
+    assert original.complete(response) is response
+
+    retry = IdempotentTransaction(redis_client, "transaction1", FINGERPRINT)
+    assert await retry.begin() is None
+    assert retry.claimed
+
+@pytest.mark.asyncio
+async def test_redis_errors_disable_the_replay():
+    redis_client = MagicMock()
+    redis_client.set.side_effect = RedisError("down")
+
+    transaction = IdempotentTransaction(redis_client, "transaction1", FINGERPRINT)
+
+    assert await transaction.begin() is None
+    assert transaction.complete(RESPONSE) == RESPONSE
+    redis_client.delete.assert_not_called()
@@ -0,0 +1,216 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from fastapi import HTTPException
+from unittest.mock import MagicMock
+from src.models.env.performance_config_DTO import PerformanceConfigDTO
+from src.utils.memory_budget_util import MemoryBudget, request_memory_reservation, reserve_request_memory, reserved_memory
+from src.utils.request_admission_util import read_prediction_body
+import asyncio
+import pytest
+
+@pytest.fixture(autouse=True)
+def enable_memory_budget(mocker):
+    mocker.patch("src.utils.memory_budget_util.get_performance_config", return_value=PerformanceConfigDTO(MEMORY_BUDGET_ENABLED=True))
+
+@pytest.fixture
+def budget(mocker):
+    budget = MemoryBudget(100, 1.0)
+    mocker.patch("src.utils.memory_budget_util.get_memory_budget", return_value=budget)
+    return budget
+
+@pytest.mark.asyncio
+async def test_reservations_that_fit_are_granted_right_away():
+    budget = MemoryBudget(100, 1.0)
+    assert await budget.acquire(60, "request_body") == 60
+    assert await budget.acquire(40, "request_body") == 40
+    assert budget.reserved == 100
+
+    # A buffer larger than the whole budget is capped to it
+    budget.release(100)
+    assert await budget.acquire(500, "model_response") == 100
+
+@pytest.mark.asyncio
+async def test_waiting_reservations_are_granted_in_arrival_order():
+    budget = MemoryBudget(100, 1.0)
+    await budget.acquire(90, "request_body")
+    order = []
+
+    async def acquire(nbytes, name):
+        await budget.acquire(nbytes, "request_body")
+        order.append(name)
+
+    tasks = [asyncio.ensure_future(acquire(50, "large")), asyncio.ensure_future(acquire(5, "small"))]
+    await asyncio.sleep(0)
+    # The small reservation would fit, but it does not pass the large one queued before it
+    assert order == [] and len(budget.waiters) == 2
+
+    budget.release(90)
+    await asyncio.gather(*tasks)
+    assert order == ["large", "small"]
+    assert budget.reserved == 55
+
+@pytest.mark.asyncio
+async def test_exhausted_budget_rejects_with_503():
+    budget = MemoryBudget(100, 0.01)
+    await budget.acquire(100, "request_body")
+
+    with pytest.raises(HTTPException) as e:
+        await budget.acquire(10, "model_response")
+    assert e.value.status_code == 503
+    assert not budget.waiters
+
+    budget.release(100)
+    assert budget.reserved == 0
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_gives_its_place_back():
+    budget = MemoryBudget(100, 1.0)
+    await budget.acquire(80, "request_body")
+    waiting = asyncio.ensure_future(budget.acquire(50, "request_body"))
+    await asyncio.sleep(0)
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+
+    assert not budget.waiters
+    assert await budget.acquire(20, "request_body") == 20
+
+@pytest.mark.asyncio
+async def test_request_reservation_is_released_unless_detached(budget):
+    async with request_memory_reservation("txn-1") as reservation:
+        await reserve_request_memory(30, "request_body")
+        await reserve_request_memory(20, "model_response")
+        assert reservation.reserved == 50
+    assert budget.reserved == 0
+
+    async with request_memory_reservation("txn-2") as reservation:
+        await reserve_request_memory(30, "request_body")
+        reservation.detached = True
+    assert budget.reserved == 30
+    reservation.release()
+    assert budget.reserved == 0
+
+    # Buffers outside of a request are not accounted
+    await reserve_request_memory(30, "request_body")
+    assert budget.reserved == 0
+
+@pytest.mark.asyncio
+async def test_responses_of_requests_holding_their_body_do_not_wait(budget):
+    budget.max_wait = 0.01
+    budget.growth_reserve = 40
+
+    async def predict():
+        async with request_memory_reservation("txn-1") as reservation:
+            await reserve_request_memory(30, "request_body")
+            await asyncio.sleep(0)
+            await reserve_request_memory(20, "model_response")
+            return reservation.reserved
+
+    # Both bodies fill what new requests are granted, the responses come from the growth reserve
+    assert await asyncio.gather(predict(), predict()) == [50, 50]
+    assert budget.reserved == 0
+
+    # A new request does not get the growth reserve
+    await budget.acquire(60, "request_body")
+    with pytest.raises(HTTPException):
+        await budget.acquire(10, "request_body")
+    budget.release(60)
+
+@pytest.mark.asyncio
+async def test_many_small_concurrent_requests_are_not_turned_away(mocker):
+    config = PerformanceConfigDTO(MEMORY_BUDGET_ENABLED=True)
+    mocker.patch("src.utils.memory_budget_util.get_performance_config", return_value=config)
+    mocker.patch("src.utils.request_admission_util.get_performance_config", return_value=config)
+    budget = MemoryBudget(config.MEMORY_BUDGET_MAX_BYTES, config.MEMORY_BUDGET_MAX_WAIT_SECONDS, config.MEMORY_BUDGET_GROWTH_RESERVE_BYTES)
+    mocker.patch("src.utils.memory_budget_util.get_memory_budget", return_value=budget)
+
+    async def stream():
+        yield b"x" * 200
+
+    async def predict():
+        request = MagicMock()
+        request.headers = {"content-length": "200"}
+        request.stream = stream
+        async with request_memory_reservation("txn-1"):
+            await read_prediction_body(request)
+            await asyncio.sleep(0.01)
+            await reserve_request_memory(1000 * config.MEMORY_BUDGET_BODY_COPIES, "model_response")
+            return budget.reserved
+
+    # Only the bytes of the requests are held, not their largest possible response
+    reserved = await asyncio.gather(*(predict() for _ in range(config.MODEL_SCHEDULER_MAX_CONCURRENCY * 4)))
+    assert max(reserved) <= config.MODEL_SCHEDULER_MAX_CONCURRENCY * 4 * 3600
+    assert budget.reserved == 0
+
+@pytest.mark.asyncio
+async def test_requests_holding_a_reservation_grow_ahead_of_new_requests(budget):
+    await budget.acquire(20, "s3_part")
+    async with request_memory_reservation("txn-1") as reservation:
+        await reserve_request_memory(50, "request_body")
+        waiting = asyncio.ensure_future(budget.acquire(50, "request_body"))
+        await asyncio.sleep(0)
+        assert len(budget.waiters) == 1
+
+        # Fits next to the body although a new request is queued
+        await reserve_request_memory(20, "model_response")
+        assert reservation.reserved == 70
+
+        # Queued ahead of the new request
+        growing = asyncio.ensure_future(reserve_request_memory(20, "s3_part"))
+        await asyncio.sleep(0)
+        assert [priority for _, _, priority in budget.waiters] == [True, False]
+        budget.release(20)
+        await growing
+        assert reservation.reserved == 90 and not waiting.done()
+    await waiting
+    assert budget.reserved == 50
+
+@pytest.mark.asyncio
+async def test_reserved_memory_is_released_after_the_block(budget):
+    async with reserved_memory(40, "s3_part", "txn-1"):
+        assert budget.reserved == 40
+    assert budget.reserved == 0
+
+    # Inside a request the buffer grows the reservation of the request and goes back to its headroom
+    async with request_memory_reservation("txn-1") as reservation:
+        await reserve_request_memory(10, "request_body")
+        async with reserved_memory(40, "s3_part", "txn-1"):
+            assert reservation.reserved == 50 and reservation.headroom == 0
+        assert reservation.headroom == 40
+        await reserve_request_memory(40, "model_response")
+        assert budget.reserved == 50
+    assert budget.reserved == 0
+
+@pytest.mark.asyncio
+async def test_read_prediction_body_reserves_the_declared_length(budget, mocker):
+    mocker.patch("src.utils.request_admission_util.get_performance_config", return_value=PerformanceConfigDTO(MEMORY_BUDGET_BODY_COPIES=3))
+    async def stream(chunks):
+        for chunk in chunks:
+            yield chunk
+
+    request = MagicMock()
+    request.headers = {"content-length": "9"}
+    request.stream = lambda: stream([b"12345", b"6789"])
+    async with request_memory_reservation("txn-1") as reservation:
+        assert await read_prediction_body(request) == b"123456789"
+        assert reservation.reserved == 27
+
+    # Without a Content-Length the body is reserved as it arrives
+    request.headers = {}
+    request.stream = lambda: stream([b"12345", b"6789"])
+    async with request_memory_reservation("txn-1") as reservation:
+        await read_prediction_body(request)
+        assert reservation.reserved == 27 and reservation.headroom == 0
@@ -0,0 +1,55 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from src.utils.model_payload_envelope_util import build_model_request_envelope, build_model_request_envelope_frame, extract_model_response_data
+import pytest
+import json
+
+MODEL_DETAILS = {"input": {"name": "input-0", "data_type": "FP32", "dims": [1, 3]}}
+
+@pytest.mark.parametrize("deployment_system", ["KserveV1", "TokenClassification", "TextClassification"])
+def test_build_model_request_envelope_wraps_instances(deployment_system):
+    assert build_model_request_envelope(deployment_system, [1, 2, 3], "mdl-service", MODEL_DETAILS, 100, "transaction1") == {"instances": [[1, 2, 3]]}
+
+def test_build_model_request_envelope_kserve_v2():
+    envelope = build_model_request_envelope("KserveV2", [1, 2, 3], "mdl-service", MODEL_DETAILS, 100, "transaction1")
+
+    assert envelope == {"inputs": [{"data": [1, 2, 3], "shape": [1, 3], "datatype": "FP32", "name": "input-0"}]}
+
+@pytest.mark.parametrize("deployment_system", ["TextGeneration", "Text2TextGeneration"])
+def test_build_model_request_envelope_completions(deployment_system):
+    envelope = build_model_request_envelope(deployment_system, "Hello", "mdl-service", MODEL_DETAILS, 64, "transaction1")
+
+    assert envelope == {"model": "mdl-service", "prompt": "Hello", "stream": False, "max_tokens": 64}
+
+def test_build_model_request_envelope_mlflow_passes_dict_inputs_through():
+    input_data = {"inputs": [{"name": "input-0", "datatype": "FP32", "shape": [1], "data": [1]}]}
+
+    assert build_model_request_envelope("MLFlow", input_data, "mdl-service", MODEL_DETAILS, 100, "transaction1") is input_data
+
+@pytest.mark.parametrize("deployment_system,input_data", [("KserveV1", [1, 2, 3]), ("TextClassification", "text"), ("TextGeneration", "Hello"), ("Text2TextGeneration", "Hello"), ("MLFlow", {"inputs": []})])
+def test_build_model_request_envelope_frame_matches_the_envelope(deployment_system, input_data):
+    prefix, suffix = build_model_request_envelope_frame(deployment_system, "mdl-service", 64)
+    streamed_body = prefix + json.dumps(input_data).encode() + suffix
+
+    assert json.loads(streamed_body) == build_model_request_envelope(deployment_system, input_data, "mdl-service", MODEL_DETAILS, 64, "transaction1")
+
+def test_build_model_request_envelope_frame_kserve_v2_needs_the_parsed_input():
+    assert build_model_request_envelope_frame("KserveV2", "mdl-service", 64) is None
+
+def test_extract_model_response_data():
+    assert extract_model_response_data("KserveV1", {"predictions": [[0.5]]}, "transaction1") == [0.5]
+    assert extract_model_response_data("KserveV2", {"outputs": [{"data": [0.5]}]}, "transaction1") == [0.5]
+    assert extract_model_response_data("TextGeneration", {"choices": []}, "transaction1") == {"choices": []}
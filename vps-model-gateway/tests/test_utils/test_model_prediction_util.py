@@ -46,6 +46,8 @@ def fixture_httpx_client(mocker):
 @pytest.mark.asyncio
 async def test_get_model_prediction_for_input_data_KserveV1_success(request_mock, httpx_client_mock):
     response = AsyncMock()
+    response.status_code = 200
+    response.raise_for_status = MagicMock()
     response.aread = AsyncMock(return_value=b'{"predictions": ["prediction_result"]}')
     response.headers = {"Content-Length": "1000"}
     
@@ -56,7 +58,7 @@ async def test_get_model_prediction_for_input_data_KserveV1_success(request_mock
     httpx_client_mock.stream.return_value = stream_context_manager
 
     result, payload_type = await get_model_prediction_for_input_data(
-        request_mock, httpx_client_mock, "model1", "transaction1", "KserveV1", "http://testserver/predict", {}, {}, {"input": "data"}
+        request_mock, httpx_client_mock, "model1", "model1-service", "transaction1", "KserveV1", "http://testserver/predict", {}, {}, {}, {"input": "data"}
     )
     assert result == "prediction_result"
     assert payload_type == "content"
@@ -65,6 +67,8 @@ async def test_get_model_prediction_for_input_data_KserveV1_success(request_mock
 @pytest.mark.asyncio
 async def test_get_model_prediction_for_input_data_KserveV2_success(request_mock, httpx_client_mock):
     response = AsyncMock()
+    response.status_code = 200
+    response.raise_for_status = MagicMock()
     response.aread = AsyncMock(return_value=b'{"outputs": [{"data":"output_result"}]}')
     response.headers = {"Content-Length": "1000"}
 
@@ -75,7 +79,7 @@ async def test_get_model_prediction_for_input_data_KserveV2_success(request_mock
     httpx_client_mock.stream.return_value = stream_context_manager
 
     result, payload_type = await get_model_prediction_for_input_data(
-        request_mock, httpx_client_mock, "model1", "transaction1", "KserveV2", "http://testserver/predict", {}, {"input":{"dims": [1, 1], "data_type": "FP32"}}, {"input": "data"}
+        request_mock, httpx_client_mock, "model1", "model1-service", "transaction1", "KserveV2", "http://testserver/predict", {}, {"input":{"dims": [1, 1], "data_type": "FP32"}}, {}, [[0.5]]
     )
     assert result == "output_result"
     assert payload_type == "content"
@@ -87,6 +91,8 @@ async def test_get_model_prediction_for_input_data_large_payload(request_mock, h
         yield b'a' * 1024 * 1024  # Second chunk of 1 MB
 
     response = AsyncMock()
+    response.status_code = 200
+    response.raise_for_status = MagicMock()
     response.headers = {"Content-Length": "6000000"}  # 6MB to simulate large payload
     response.aiter_bytes = mock_aiter_bytes
 
@@ -104,7 +110,7 @@ async def test_get_model_prediction_for_input_data_large_payload(request_mock, h
         mock_bucket_structure.return_value.get_bucket_structure.return_value = {"runtime_folder": "fake-runtime-folder"}
 
         result, payload_type = await get_model_prediction_for_input_data(
-            request_mock, httpx_client_mock, "model1", "transaction1", "KserveV1", "http://testserver/predict", {}, {}, {"input": "data"}
+            request_mock, httpx_client_mock, "model1", "model1-service", "transaction1", "KserveV1", "http://testserver/predict", {}, {}, {}, {"input": "data"}
         )
 
         assert result is None
@@ -132,7 +138,7 @@ async def test_get_model_prediction_for_input_data_http_error(request_mock, http
     with patch('src.utils.get_error_detail_util.get_error_detail', return_value="Internal Server Error Detail"):
         with pytest.raises(HTTPException) as exc_info:
             await get_model_prediction_for_input_data(
-                request_mock, httpx_client_mock, "model1", "transaction1", "non-Kserve", "http://testserver/predict", {}, {}, {"input": "data"}
+                request_mock, httpx_client_mock, "model1", "model1-service", "transaction1", "non-Kserve", "http://testserver/predict", {}, {}, {}, {"input": "data"}
             )
 
     assert exc_info.value.status_code == 500
@@ -146,6 +152,8 @@ async def test_get_model_prediction_for_input_data_client_error(request_mock, ht
         yield b'a' * 1024 * 1024  # Second chunk of 1 MB
 
     response = AsyncMock()
+    response.status_code = 200
+    response.raise_for_status = MagicMock()
     response.headers = {"Content-Length": "6000000"}  # 6MB to simulate large payload
     response.aiter_bytes = mock_aiter_bytes
 
@@ -162,7 +170,7 @@ async def test_get_model_prediction_for_input_data_client_error(request_mock, ht
 
         with pytest.raises(HTTPException) as excinfo:
             await get_model_prediction_for_input_data(
-                request_mock, httpx_client_mock, "model1", "transaction1", "KserveV1", "http://testserver/predict", {}, {}, {"input": "data"}
+                request_mock, httpx_client_mock, "model1", "model1-service", "transaction1", "KserveV1", "http://testserver/predict", {}, {}, {}, {"input": "data"}
             )
 
         assert excinfo.value.status_code == 500
@@ -173,6 +181,7 @@ async def test_get_model_prediction_for_input_data_client_error(request_mock, ht
 async def test_get_model_prediction_for_input_data_request_error(request_mock, httpx_client_mock):
     request = MagicMock()
     response = MagicMock()
+    response.status_code = 200
     response.raise_for_status.side_effect = httpx.RequestError("Network error", request=request)
     response.aread = AsyncMock(return_value=b'{"detail": "Network error"}')
 
@@ -183,7 +192,7 @@ async def test_get_model_prediction_for_input_data_request_error(request_mock, h
 
     with pytest.raises(HTTPException) as excinfo:
         await get_model_prediction_for_input_data(
-            request_mock, httpx_client_mock, "model1", "transaction1", "non-Kserve", "http://testserver/predict", {}, {}, {"input": "data"}
+            request_mock, httpx_client_mock, "model1", "model1-service", "transaction1", "non-Kserve", "http://testserver/predict", {}, {}, {}, {"input": "data"}
         )
 
     assert excinfo.value.status_code == 500
@@ -194,6 +203,7 @@ async def test_get_model_prediction_for_input_data_request_error(request_mock, h
 async def test_get_model_prediction_for_input_data_unexpected_error(request_mock, httpx_client_mock):
     request = MagicMock()
     response = MagicMock()
+    response.status_code = 200
     response.raise_for_status.side_effect = Exception("Unexpected error")
     response.aread = AsyncMock(return_value=b'{"detail": "Unexpected error"}')
 
@@ -204,8 +214,30 @@ async def test_get_model_prediction_for_input_data_unexpected_error(request_mock
 
     with pytest.raises(HTTPException) as excinfo:
         await get_model_prediction_for_input_data(
-            request_mock, httpx_client_mock, "model1", "transaction1", "non-Kserve", "http://testserver/predict", {}, {}, {"input": "data"}
+            request_mock, httpx_client_mock, "model1", "model1-service", "transaction1", "non-Kserve", "http://testserver/predict", {}, {}, {}, {"input": "data"}
         )
 
     assert excinfo.value.status_code == 500
-    assert "An unexpected error occurred while making prediction request to the deployed model model1" in excinfo.value.detail
\ No newline at end of file
+    assert "An unexpected error occurred while making prediction request to the deployed model model1" in excinfo.value.detail
+@pytest.mark.asyncio
+async def test_get_grpc_model_prediction_for_input_data(request_mock, mocker):
+    grpc_inference_util = pytest.importorskip("src.utils.grpc_inference_util")
+    from src.utils.model_prediction_util import get_grpc_model_prediction_for_input_data
+    mocker.patch("src.utils.model_prediction_util.EnvConfigDTO").return_value.MAX_PAYLOAD_SIZE = 5
+    response = grpc_inference_util.get_inference_messages().ModelInferResponse(model_name="mdl-service")
+    response.outputs.add(name="out", datatype="INT32", shape=[2])
+    response.raw_output_contents.append(b"\x01\x00\x00\x00\x02\x00\x00\x00")
+    mock_infer = mocker.patch("src.utils.model_prediction_util.grpc_model_infer", new_callable=AsyncMock, return_value=(response, False))
+    mock_spill = mocker.patch("src.utils.model_prediction_util.spill_model_response", new_callable=AsyncMock, return_value=1000)
+
+    result = await get_grpc_model_prediction_for_input_data(request_mock, "mdl-1", "mdl-service", "transaction1", "KserveV2", "grpc://models:9000", {}, {"inputs": []})
+
+    assert result == ([1, 2], "content")
+    mock_infer.assert_awaited_once_with("grpc://models:9000", "mdl-service", {"inputs": []}, {}, "transaction1")
+    mock_spill.assert_not_called()
+
+    mocker.patch("src.utils.model_prediction_util.EnvConfigDTO").return_value.MAX_PAYLOAD_SIZE = 0
+    result = await get_grpc_model_prediction_for_input_data(request_mock, "mdl-1", "mdl-service", "transaction1", "KserveV2", "grpc://models:9000", {}, {"inputs": []})
+
+    assert result == (None, "url")
+    mock_spill.assert_awaited_once()
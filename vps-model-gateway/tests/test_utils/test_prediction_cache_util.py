@@ -0,0 +1,98 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from unittest.mock import MagicMock
+from prometheus_client import REGISTRY
+from redis.exceptions import RedisError
+from src.utils import prediction_cache_util
+from src.utils.prediction_cache_util import LRUByteCache, get_prediction_cache_ttl, hash_model_input, get_deployment_version, build_prediction_cache_key, get_cached_prediction, store_cached_prediction
+import json
+import pytest
+
+RESPONSE = {"output_data": [0.1, 0.9], "payload_type": "content", "payload_url": None, "extractor": None}
+
+def get_lookup_count(result):
+    return REGISTRY.get_sample_value("vps_prediction_cache_lookups_total", {"result": result}) or 0
+
+@pytest.fixture(autouse=True)
+def empty_l1_cache(mocker):
+    mocker.patch.object(prediction_cache_util, "_l1_cache", LRUByteCache(1024 * 1024))
+
+def test_get_prediction_cache_ttl_from_model_notes():
+    assert get_prediction_cache_ttl({"notes": json.dumps({"prediction_cache": True})}) == 300
+    assert get_prediction_cache_ttl({"notes": json.dumps({"prediction_cache": {"ttl_seconds": 60}})}) == 60
+    assert get_prediction_cache_ttl({"notes": json.dumps({"prediction_cache": {"enabled": False}})}) is None
+    assert get_prediction_cache_ttl({"notes": json.dumps({"hf_max_token": 10})}) is None
+    assert get_prediction_cache_ttl({}) is None
+
+def test_hash_model_input_is_canonical():
+    assert hash_model_input({"a": 1, "b": [1, 2]}) == hash_model_input({"b": [1, 2], "a": 1})
+    assert hash_model_input({"a": 1}) != hash_model_input({"a": 2})
+
+def test_deployment_version_changes_with_the_deployment():
+    model = {"notes": json.dumps({"prediction_cache": True})}
+
+    assert get_deployment_version(model, {"deployment_id": "dep-1"}) != get_deployment_version(model, {"deployment_id": "dep-2"})
+    assert get_deployment_version(model, {"deployment_id": "dep-1"}) != get_deployment_version(model, {"deployment_id": "dep-1"}, {"deployment_id": "dep-trf-1"})
+
+def test_store_then_get_is_served_from_l1_without_redis():
+    redis_client = MagicMock()
+    cache_key = build_prediction_cache_key("mdl-test", "v1", hash_model_input([1, 2]))
+    before = get_lookup_count("l1")
+
+    store_cached_prediction(redis_client, cache_key, RESPONSE, 60, "transaction1")
+
+    assert get_cached_prediction(redis_client, cache_key, "transaction1") == RESPONSE
+    redis_client.set.assert_called_once_with(cache_key, json.dumps(RESPONSE, separators=(",", ":")), ex=60)
+    redis_client.get.assert_not_called()
+    assert get_lookup_count("l1") == before + 1
+
+def test_get_falls_back_to_redis_and_fills_l1():
+    redis_client = MagicMock()
+    redis_client.get.return_value = json.dumps(RESPONSE)
+    before = get_lookup_count("l2")
+
+    assert get_cached_prediction(redis_client, "key", "transaction1") == RESPONSE
+    assert get_cached_prediction(redis_client, "key", "transaction1") == RESPONSE
+    redis_client.get.assert_called_once_with("key")
+    assert get_lookup_count("l2") == before + 1
+
+def test_redis_errors_are_a_miss():
+    redis_client = MagicMock()
+    redis_client.get.side_effect = RedisError("down")
+    before = get_lookup_count("miss")
+
+    assert get_cached_prediction(redis_client, "key", "transaction1") is None
+    assert get_lookup_count("miss") == before + 1
+
+def test_responses_over_the_entry_limit_are_not_cached(mocker):
+    mocker.patch("src.utils.prediction_cache_util.get_performance_config", autospec=True).return_value.PREDICTION_CACHE_MAX_ENTRY_BYTES = 10
+    redis_client = MagicMock()
+
+    store_cached_prediction(redis_client, "key", RESPONSE, 60, "transaction1")
+
+    redis_client.set.assert_not_called()
+
+def test_lru_byte_cache_evicts_least_recently_used_entries():
+    cache = LRUByteCache(10)
+    cache.set("a", "aaaa", 60)
+    cache.set("b", "bbbb", 60)
+    cache.get("a")
+    cache.set("c", "cccc", 60)
+
+    assert cache.get("a") == "aaaa"
+    assert cache.get("b") is None
+    assert cache.get("c") == "cccc"
+    assert cache.size == 8
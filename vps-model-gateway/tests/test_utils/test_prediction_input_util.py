@@ -0,0 +1,143 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from fastapi import HTTPException
+from unittest.mock import MagicMock, AsyncMock
+from src.utils.request_admission_util import PredictionAdmission
+from src.utils.prediction_input_util import JsonValueScanner, PredictionInput, PredictionInputReference, get_prediction_input_reference, create_prediction_input_upload, resolve_prediction_input, stream_prediction_input, can_stream_prediction_input
+from botocore.exceptions import ClientError
+import io
+import json
+import pytest
+
+def build_request(headers: dict = None):
+    request = MagicMock()
+    request.headers = headers or {}
+    return request
+
+def test_get_prediction_input_reference():
+    assert get_prediction_input_reference(build_request(), b'{"a": 1}') is None
+    assert get_prediction_input_reference(build_request({"vps-input-id": "inp-1"}), b"").input_id == "inp-1"
+
+    with pytest.raises(HTTPException) as e:
+        get_prediction_input_reference(build_request({"vps-input-id": "inp-1"}), b'{"a": 1}')
+    assert e.value.status_code == 400
+
+def test_can_stream_prediction_input():
+    assert can_stream_prediction_input("KserveV1", "http://mdl.default.svc.cluster.local")
+    assert not can_stream_prediction_input("KserveV2", "http://mdl.default.svc.cluster.local")
+
+@pytest.mark.asyncio
+async def test_create_prediction_input_upload(mocker):
+    bucket_structure = mocker.patch("src.utils.prediction_input_util.BucketStructure")
+    bucket_structure.return_value.get_bucket_structure.return_value = {"runtime_folder": "runtime/txn-1"}
+    run_s3_operation = mocker.patch("src.utils.prediction_input_util.run_s3_operation", new_callable=AsyncMock, return_value={"url": "http://s3/runtime", "fields": {"key": "runtime/txn-1/model_prediction_input.json"}})
+    redis_client = MagicMock()
+    admission = PredictionAdmission("txn-1", {"username": "user-1"}, redis_client)
+
+    upload = await create_prediction_input_upload(build_request(), admission)
+
+    assert upload["input_id"].startswith("inp-")
+    assert upload["upload_fields"] == {"key": "runtime/txn-1/model_prediction_input.json"}
+    assert run_s3_operation.call_args.args[3:6] == ("runtime/txn-1/model_prediction_input.json", "txn-1", "application/json")
+    key, record = redis_client.set.call_args.args
+    assert key == f"vps:prediction_input:{upload['input_id']}"
+    assert json.loads(record) == {"username": "user-1", "key": "runtime/txn-1/model_prediction_input.json"}
+
+def scan(data: bytes, chunk_size: int):
+    scanner = JsonValueScanner()
+    for offset in range(0, len(data), chunk_size):
+        scanner.feed(data[offset:offset + chunk_size])
+    scanner.finish()
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1024])
+def test_json_value_scanner(chunk_size):
+    for data in (b'[[1, 2], {"a": "b]\\"}"}]', b" 12.5 ", b'"a\\\\"', b"true", '["\u00fc"]'.encode("utf-8")):
+        scan(data, chunk_size)
+
+    # Anything that is not one value could close the envelope around it
+    for data in (b"", b"  ", b'[1]], "parameters": {"x": [[2', b"1, 2", b"1 2", b'"a" "b"', b"[1][2]", b"[1", b'"a\\"', b"]", b'{"a": 1}}'):
+        with pytest.raises(ValueError):
+            scan(data, chunk_size)
+
+def mock_get_object(mocker, data: bytes):
+    body = io.BytesIO(data)
+    response = {"Body": body, "ContentLength": len(data), "ETag": '"etag-1"'}
+    return mocker.patch("src.utils.prediction_input_util.AWSFeaturePlugin.open_object_stream", return_value=response), body
+
+@pytest.mark.asyncio
+async def test_resolve_prediction_input_validates_it_once(mocker):
+    redis_client = MagicMock()
+    redis_client.get.return_value = json.dumps({"username": "user-1", "key": "runtime/txn-1/model_prediction_input.json"})
+    redis_client.ttl.return_value = 600
+    open_object_stream, body = mock_get_object(mocker, b"[1, 2, 3]")
+
+    prediction_input = await resolve_prediction_input(build_request(), redis_client, PredictionInputReference("inp-1"), "user-1", "txn-2")
+    assert (prediction_input.key, prediction_input.etag, prediction_input.size) == ("runtime/txn-1/model_prediction_input.json", '"etag-1"', 9)
+    assert body.closed
+    key, record = redis_client.set.call_args.args
+    assert json.loads(record) == {"username": "user-1", "key": "runtime/txn-1/model_prediction_input.json", "etag": '"etag-1"', "size": 9}
+    assert redis_client.set.call_args.kwargs["ex"] == 600
+
+    # The recorded validation is reused
+    redis_client.get.return_value = record
+    open_object_stream.reset_mock()
+    assert (await resolve_prediction_input(build_request(), redis_client, PredictionInputReference("inp-1"), "user-1", "txn-3")).size == 9
+    open_object_stream.assert_not_called()
+
+    # Inputs of other users are not found
+    with pytest.raises(HTTPException) as e:
+        await resolve_prediction_input(build_request(), redis_client, PredictionInputReference("inp-1"), "user-2", "txn-2")
+    assert e.value.status_code == 404
+
+@pytest.mark.asyncio
+async def test_resolve_prediction_input_rejects_missing_and_invalid_inputs(mocker):
+    redis_client = MagicMock()
+    redis_client.get.return_value = json.dumps({"username": "user-1", "key": "runtime/txn-1/model_prediction_input.json"})
+
+    mocker.patch("src.utils.prediction_input_util.AWSFeaturePlugin.open_object_stream", return_value=None)
+    with pytest.raises(HTTPException) as e:
+        await resolve_prediction_input(build_request(), redis_client, PredictionInputReference("inp-1"), "user-1", "txn-2")
+    assert e.value.status_code == 404
+    assert "not uploaded" in e.value.detail
+
+    mock_get_object(mocker, b'[1]], "parameters": {"x": [[2')
+    with pytest.raises(HTTPException) as e:
+        await resolve_prediction_input(build_request(), redis_client, PredictionInputReference("inp-1"), "user-1", "txn-2")
+    assert e.value.status_code == 400
+    redis_client.set.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_stream_prediction_input(mocker):
+    mocker.patch("src.utils.prediction_input_util.get_performance_config", return_value=MagicMock(PREDICTION_INPUT_STREAM_CHUNK_BYTES=4))
+    open_object_stream, body = mock_get_object(mocker, b"[1, 2, 3]")
+
+    chunks = [chunk async for chunk in stream_prediction_input(MagicMock(), PredictionInput("inp-1", "key", '"etag-1"', 9), b'{"instances": [', b"]}", "txn-1")]
+
+    assert chunks == [b'{"instances": [', b"[1, ", b"2, 3", b"]", b"]}"]
+    assert json.loads(b"".join(chunks)) == {"instances": [[1, 2, 3]]}
+    assert body.closed
+    # Only the validated object is read
+    assert open_object_stream.call_args.args[-1] == '"etag-1"'
+
+@pytest.mark.asyncio
+async def test_stream_prediction_input_uploaded_again(mocker):
+    error = ClientError({"Error": {"Code": "PreconditionFailed"}}, "GetObject")
+    mocker.patch("src.utils.prediction_input_util.AWSFeaturePlugin.open_object_stream", side_effect=error)
+
+    with pytest.raises(HTTPException) as e:
+        async for _ in stream_prediction_input(MagicMock(), PredictionInput("inp-1", "key", '"etag-1"', 9), b"[", b"]", "txn-1"):
+            pass
+    assert e.value.status_code == 409
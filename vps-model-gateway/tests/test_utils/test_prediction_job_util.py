@@ -0,0 +1,258 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from fastapi import HTTPException
+from unittest.mock import MagicMock, AsyncMock
+from src.models.env.performance_config_DTO import PerformanceConfigDTO
+from src.utils.memory_budget_util import MemoryBudget, get_current_memory_reservation, request_memory_reservation, reserve_request_memory
+from src.utils.prediction_job_util import PredictionJobRunner, WebhookTargetError, validate_callback_url, resolve_callback_address, build_webhook_request, get_presigned_url_key, get_prediction_job_status, SIGNATURE_HEADER
+import asyncio
+import httpx
+import socket
+import hashlib
+import hmac
+import json
+import pytest
+
+def build_request(transaction_id: str = "txn-1"):
+    request = MagicMock()
+    request.headers = {"transaction-id": transaction_id, "vps-auth-token": "token-1"}
+    return request
+
+def mock_resolver(mocker, *addresses):
+    infos = [(socket.AF_INET6 if ":" in address else socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, 443)) for address in addresses]
+    loop = asyncio.get_running_loop()
+    return mocker.patch.object(loop, "getaddrinfo", new_callable=AsyncMock, return_value=infos)
+
+@pytest.fixture
+def job_store(mocker):
+    # Final job statuses are written with a client of their own, collected here per job
+    records = []
+    mocker.patch("src.utils.prediction_job_util.write_job_record", side_effect=lambda record, ttl: records.append(record))
+    bucket_structure = mocker.patch("src.utils.prediction_job_util.BucketStructure")
+    bucket_structure.return_value.get_bucket_structure.return_value = {"runtime_folder": "runtime/txn-1"}
+    mocker.patch("src.utils.prediction_job_util.run_s3_operation", new_callable=AsyncMock)
+    return records
+
+def test_validate_callback_url(mocker):
+    mocker.patch("src.utils.prediction_job_util.get_performance_config", return_value=PerformanceConfigDTO())
+    validate_callback_url("https://hooks.example.com/predictions")
+    for callback_url in ("http://hooks.example.com/predictions", "https://127.0.0.1/hook", "https://10.1.2.3/hook", "https://redis.default.svc/hook", "https://localhost/hook", "https://gateway/hook", "not a url"):
+        with pytest.raises(HTTPException) as e:
+            validate_callback_url(callback_url)
+        assert e.value.status_code == 400
+
+    # Plain http does not open up private hosts, they are allowed separately
+    mocker.patch("src.utils.prediction_job_util.get_performance_config", return_value=PerformanceConfigDTO(ASYNC_JOBS_WEBHOOK_ALLOW_HTTP=True))
+    validate_callback_url("http://hooks.example.com/predictions")
+    with pytest.raises(HTTPException):
+        validate_callback_url("http://127.0.0.1:9000/hook")
+
+    mocker.patch("src.utils.prediction_job_util.get_performance_config", return_value=PerformanceConfigDTO(ASYNC_JOBS_WEBHOOK_ALLOW_HTTP=True, ASYNC_JOBS_WEBHOOK_ALLOW_PRIVATE_HOSTS=True))
+    validate_callback_url("http://127.0.0.1:9000/hook")
+
+@pytest.mark.asyncio
+async def test_resolve_callback_address_rejects_private_addresses(mocker):
+    mock_resolver(mocker, "93.184.216.34", "2606:2800:220:1::1")
+    assert await resolve_callback_address("hooks.example.com", 443) == "93.184.216.34"
+
+    # A public name that also resolves into the cluster is rejected as a whole
+    for addresses in (("93.184.216.34", "10.0.0.5"), ("127.0.0.1",), ("169.254.169.254",), ("fe80::1%eth0",)):
+        mock_resolver(mocker, *addresses)
+        with pytest.raises(WebhookTargetError):
+            await resolve_callback_address("hooks.example.com", 443)
+
+    mocker.patch("src.utils.prediction_job_util.get_performance_config", return_value=PerformanceConfigDTO(ASYNC_JOBS_WEBHOOK_ALLOW_PRIVATE_HOSTS=True))
+    mock_resolver(mocker, "127.0.0.1")
+    assert await resolve_callback_address("localhost", 443) == "127.0.0.1"
+
+@pytest.mark.asyncio
+async def test_build_webhook_request_pins_the_resolved_address():
+    async with httpx.AsyncClient() as client:
+        request = build_webhook_request(client, "https://hooks.example.com:8443/done?job=1", "93.184.216.34", b"{}", {"Content-Type": "application/json"})
+    assert str(request.url) == "https://93.184.216.34:8443/done?job=1"
+    assert request.headers["Host"] == "hooks.example.com:8443"
+    assert request.extensions["sni_hostname"] == "hooks.example.com"
+
+def test_get_presigned_url_key():
+    assert get_presigned_url_key("http://127.0.0.1:9000/runtime/a/b%20c.json?X-Amz-Signature=1", "runtime") == "a/b c.json"
+    assert get_presigned_url_key("https://runtime.s3.amazonaws.com/a/b.json?X-Amz-Signature=1", "runtime") == "a/b.json"
+
+@pytest.mark.asyncio
+async def test_checks_that_fail_answer_the_request(job_store):
+    runner = PredictionJobRunner()
+
+    async def rejected_prediction(job):
+        raise HTTPException(status_code=402, detail="Insufficient balance")
+
+    with pytest.raises(HTTPException) as e:
+        await runner.submit(build_request(), "mdl-test", None, rejected_prediction)
+    assert e.value.status_code == 402
+
+    async def replayed_prediction(job):
+        return {"output_data": [1]}
+
+    assert await runner.submit(build_request(), "mdl-test", None, replayed_prediction) == (None, {"output_data": [1]})
+    assert job_store == []
+
+@pytest.mark.asyncio
+async def test_accepted_job_stores_the_result_and_sends_the_webhook(job_store, mocker):
+    mocker.patch("src.utils.prediction_job_util.get_performance_config", return_value=PerformanceConfigDTO(ASYNC_JOBS_WEBHOOK_SECRET="secret"))
+    runner = PredictionJobRunner()
+    webhook_client = runner.get_webhook_client()
+    mocker.patch.object(webhook_client, "send", new_callable=AsyncMock, return_value=MagicMock(status_code=200))
+    mock_resolver(mocker, "93.184.216.34")
+    redis_client = MagicMock()
+    request = build_request()
+    model_called = asyncio.Event()
+    release_model = asyncio.Event()
+
+    async def run_prediction(job):
+        await job.enqueue(redis_client, "user-1")
+        model_called.set()
+        await release_model.wait()
+        return {"output_data": [0.5], "payload_type": "content"}
+
+    job, response = await runner.submit(request, "mdl-test", "https://hooks.example.com/done", run_prediction)
+    assert response is None
+    assert job.describe()["status_url"] == f"/predict/jobs/{job.job_id}"
+    queued_record = json.loads(redis_client.set.call_args.args[1])
+    assert (queued_record["status"], queued_record["username"]) == ("queued", "user-1")
+
+    await model_called.wait()
+    assert job_store[-1]["status"] == "running"
+    release_model.set()
+    await asyncio.gather(*runner.tasks)
+
+    assert job_store[-1]["status"] == "succeeded"
+    assert job_store[-1]["result_key"] == "runtime/txn-1/async_prediction_response.json"
+    assert runner.get_slots()._value == PerformanceConfigDTO().ASYNC_JOBS_MAX_CONCURRENCY
+
+    webhook_request, = webhook_client.send.call_args.args
+    body = webhook_request.content
+    assert str(webhook_request.url) == "https://93.184.216.34/done"
+    assert webhook_request.headers["Host"] == "hooks.example.com"
+    assert json.loads(body)["result"] == {"output_data": [0.5], "payload_type": "content"}
+    signature = hmac.new(b"secret", body, hashlib.sha256).hexdigest()
+    assert webhook_request.headers[SIGNATURE_HEADER] == f"sha256={signature}"
+
+    await runner.shutdown()
+    assert runner.webhook_client is None
+
+@pytest.mark.asyncio
+async def test_webhook_to_a_private_address_is_not_sent(job_store, mocker):
+    runner = PredictionJobRunner()
+    webhook_client = runner.get_webhook_client()
+    mocker.patch.object(webhook_client, "send", new_callable=AsyncMock)
+    mock_resolver(mocker, "10.0.0.5")
+
+    async def run_prediction(job):
+        await job.enqueue(MagicMock(), "user-1")
+        return {"output_data": [0.5], "payload_type": "content"}
+
+    await runner.submit(build_request(), "mdl-test", "https://hooks.example.com/done", run_prediction)
+    await asyncio.gather(*runner.tasks)
+
+    assert job_store[-1]["status"] == "succeeded"
+    webhook_client.send.assert_not_called()
+    await runner.shutdown()
+
+@pytest.mark.asyncio
+async def test_accepted_job_that_fails_is_stored_as_failed(job_store):
+    runner = PredictionJobRunner()
+
+    async def run_prediction(job):
+        await job.enqueue(MagicMock(), "user-1")
+        raise HTTPException(status_code=502, detail="The model is not reachable")
+
+    job, _ = await runner.submit(build_request(), "mdl-test", None, run_prediction)
+    await asyncio.gather(*runner.tasks)
+
+    assert job_store[-1]["status"] == "failed"
+    assert job_store[-1]["error"] == {"status_code": 502, "detail": "The model is not reachable"}
+
+@pytest.mark.asyncio
+async def test_full_job_queue_rejects_the_request(job_store, mocker):
+    mocker.patch("src.utils.prediction_job_util.get_performance_config", return_value=PerformanceConfigDTO(ASYNC_JOBS_MAX_QUEUED=1))
+    runner = PredictionJobRunner()
+    runner.queued = 1
+
+    async def run_prediction(job):
+        await job.enqueue(MagicMock(), "user-1")
+
+    with pytest.raises(HTTPException) as e:
+        await runner.submit(build_request(), "mdl-test", None, run_prediction)
+    assert e.value.status_code == 503
+
+@pytest.mark.asyncio
+async def test_queued_jobs_hold_their_bytes_apart_from_the_memory_budget(job_store, mocker):
+    mocker.patch("src.utils.prediction_job_util.get_performance_config", return_value=PerformanceConfigDTO(ASYNC_JOBS_MAX_CONCURRENCY=1, ASYNC_JOBS_MAX_QUEUED_BYTES=50))
+    mocker.patch("src.utils.memory_budget_util.get_performance_config", return_value=PerformanceConfigDTO(MEMORY_BUDGET_ENABLED=True))
+    budget = MemoryBudget(100, 0.01)
+    mocker.patch("src.utils.memory_budget_util.get_memory_budget", return_value=budget)
+    runner = PredictionJobRunner()
+    release = asyncio.Event()
+    reserved = []
+
+    async def run_prediction(job):
+        # Released once the job finished, as /predict/async does
+        try:
+            await job.enqueue(MagicMock(), "user-1")
+            reserved.append(budget.reserved)
+            await release.wait()
+            return {"output_data": [0.5], "payload_type": "content"}
+        finally:
+            get_current_memory_reservation().release()
+
+    async def submit():
+        async with request_memory_reservation("txn-1") as reservation:
+            await reserve_request_memory(30, "request_body")
+            job, _ = await runner.submit(build_request(), "mdl-test", None, run_prediction)
+            reservation.detached = True
+            return job
+
+    # The running job holds its bytes again, the queued one gives them back to the budget
+    await submit()
+    await submit()
+    assert budget.reserved == 30 and runner.queued_bytes == 30
+
+    # Queued bytes past ASYNC_JOBS_MAX_QUEUED_BYTES are rejected
+    with pytest.raises(HTTPException) as e:
+        await submit()
+    assert e.value.status_code == 503
+
+    release.set()
+    await asyncio.gather(*runner.tasks)
+    # The queued job reserved its bytes again once the pool picked it up
+    assert reserved[-1] == 30 and runner.queued_bytes == 0 and budget.reserved == 0
+
+@pytest.mark.asyncio
+async def test_get_prediction_job_status(mocker):
+    mocker.patch("src.utils.prediction_job_util.resolve_token_user", new_callable=AsyncMock, return_value={"username": "user-1"})
+    record = {"job_id": "job-1", "status": "succeeded", "model_id": "mdl-test", "transaction_id": "txn-1", "username": "user-1", "result_key": "runtime/txn-1/async_prediction_response.json"}
+    mocker.patch("src.utils.prediction_job_util.read_job_record", return_value=record)
+    stored_result = {"output_data": None, "payload_type": "url", "payload_url": "http://127.0.0.1:9000/runtime/runtime/txn-1/output.json?X-Amz-Signature=old"}
+    mock_s3 = mocker.patch("src.utils.prediction_job_util.run_s3_operation", new_callable=AsyncMock, side_effect=[stored_result, "http://127.0.0.1:9000/fresh"])
+    mocker.patch("src.utils.prediction_job_util.EnvConfigDTO", return_value=MagicMock(RUNTIME_BUCKET_NAME="runtime"))
+
+    status = await get_prediction_job_status(build_request(), "job-1")
+    assert status["result"]["payload_url"] == "http://127.0.0.1:9000/fresh"
+    assert mock_s3.call_args.args[3] == "runtime/txn-1/output.json"
+
+    # Jobs of other users are not found
+    record["username"] = "user-2"
+    with pytest.raises(HTTPException) as e:
+        await get_prediction_job_status(build_request(), "job-1")
+    assert e.value.status_code == 404
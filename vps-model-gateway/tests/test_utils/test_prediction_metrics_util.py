@@ -0,0 +1,84 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+from prometheus_client import REGISTRY
+from src.utils import prediction_metrics_util
+from src.utils.prediction_metrics_util import StageTimer, bounded_model_id_label, optional_stage, OVERFLOW_MODEL_ID_LABEL
+import pytest
+
+def get_stage_count(stage, deployment_system, model_id):
+    return REGISTRY.get_sample_value(
+        "vps_prediction_stage_latency_seconds_count",
+        {"stage": stage, "deployment_system": deployment_system, "model_id": model_id}
+    ) or 0
+
+@pytest.fixture(autouse=True)
+def reset_model_id_labels(mocker):
+    mocker.patch.object(prediction_metrics_util, "_model_id_labels", set())
+
+def test_stage_timer_exports_stages_with_resolved_deployment_system():
+    before = get_stage_count("token_validation", "KserveV1", "mdl-metrics-1")
+
+    stage_timer = StageTimer("mdl-metrics-1", "transaction1")
+    with stage_timer.stage("token_validation"):
+        pass
+    stage_timer.set_deployment_system("KserveV1")
+    stage_timer.finish()
+
+    assert get_stage_count("token_validation", "KserveV1", "mdl-metrics-1") == before + 1
+
+def test_stage_timer_sums_repeated_stages():
+    before = get_stage_count("presigning", "KserveV2", "mdl-metrics-2")
+
+    stage_timer = StageTimer("mdl-metrics-2")
+    stage_timer.set_deployment_system("KserveV2")
+    stage_timer.record("presigning", 0.5)
+    stage_timer.record("presigning", 0.25)
+    stage_timer.finish()
+
+    assert stage_timer.durations["presigning"] == 0.75
+    assert get_stage_count("presigning", "KserveV2", "mdl-metrics-2") == before + 1
+
+def test_stage_timer_tracks_requests_in_flight():
+    before = REGISTRY.get_sample_value("vps_prediction_requests_in_flight")
+
+    stage_timer = StageTimer("mdl-metrics-3")
+    assert REGISTRY.get_sample_value("vps_prediction_requests_in_flight") == before + 1
+
+    stage_timer.finish()
+    stage_timer.finish()
+    assert REGISTRY.get_sample_value("vps_prediction_requests_in_flight") == before
+
+def test_stage_timer_records_stage_on_exception():
+    stage_timer = StageTimer("mdl-metrics-4")
+    with pytest.raises(ValueError):
+        with stage_timer.stage("inference"):
+            raise ValueError("model error")
+    stage_timer.finish()
+
+    assert "inference" in stage_timer.durations
+    assert REGISTRY.get_sample_value("vps_prediction_stage_in_flight", {"stage": "inference"}) == 0
+
+def test_optional_stage_without_timer():
+    with optional_stage(None, "s3_spill"):
+        pass
+
+def test_bounded_model_id_label_overflow(mocker):
+    mock_config = mocker.patch("src.utils.prediction_metrics_util.get_performance_config", autospec=True)
+    mock_config.return_value.METRICS_MAX_MODEL_ID_LABELS = 2
+
+    assert bounded_model_id_label("mdl-a") == "mdl-a"
+    assert bounded_model_id_label("mdl-b") == "mdl-b"
+    assert bounded_model_id_label("mdl-c") == OVERFLOW_MODEL_ID_LABEL
+    assert bounded_model_id_label("mdl-a") == "mdl-a"
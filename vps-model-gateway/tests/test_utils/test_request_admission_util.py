@@ -0,0 +1,169 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+
+from unittest.mock import AsyncMock, MagicMock
+from fastapi import HTTPException
+from src.models.env.performance_config_DTO import PerformanceConfigDTO
+from src.utils import request_admission_util
+from src.utils.tracing_util import TRACING_EVENT_HOOKS
+from src.utils.request_admission_util import admit_prediction_request, authenticate_prediction_request, read_prediction_body, get_prediction_admission, TokenVerdictCache
+import pytest
+import httpx
+
+USER_DATA = {"result": True, "username": "user", "entity_id": "ent-test", "vps_app_id": "app-*"}
+HEADERS = {"vps-auth-token": "token", "transaction-id": "transaction1", "vps-env-type": "vipas-external"}
+
+def create_request(headers: dict):
+    request = MagicMock()
+    request.headers = headers
+    request.state = MagicMock(spec=[])
+    request.app.state.http_client = AsyncMock()
+    return request
+
+@pytest.fixture(autouse=True)
+def clear_token_verdicts():
+    request_admission_util._token_verdicts.clear()
+    yield
+    request_admission_util._token_verdicts.clear()
+
+@pytest.fixture
+def redis_plugin(mocker):
+    plugin = mocker.patch("src.utils.request_admission_util.RedisFeaturePlugin").return_value
+    plugin.check_rate_limit_exceeded_or_not_for_a_particular_user.return_value = False
+    return plugin
+
+@pytest.fixture
+def validate(mocker):
+    return mocker.patch("src.utils.request_admission_util.validate_auth_token", new_callable=AsyncMock, return_value=USER_DATA)
+
+async def admit(request):
+    admission_generator = admit_prediction_request(request)
+    admission = await admission_generator.__anext__()
+    return admission, admission_generator
+
+@pytest.mark.asyncio
+async def test_admission_success(redis_plugin, validate):
+    request = create_request(HEADERS)
+    admission, admission_generator = await admit(request)
+
+    assert admission.user_data == USER_DATA
+    assert admission.redis_client is redis_plugin.create_redis_client.return_value
+    assert get_prediction_admission(request) is admission
+
+    with pytest.raises(StopAsyncIteration):
+        await admission_generator.__anext__()
+    redis_plugin.close_redis_client.assert_called_once_with(admission.redis_client)
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("headers, status_code", [
+    ({"transaction-id": "transaction1"}, 400),
+    ({"vps-auth-token": "token"}, 400),
+    ({"vps-auth-token": "token", "transaction-id": "transaction1", "vps-env-type": "vipas-streamlit"}, 400),
+    ({**HEADERS, "content-length": str(20 * 1024 * 1024)}, 413),
+])
+async def test_admission_rejects_on_headers(redis_plugin, validate, headers, status_code):
+    with pytest.raises(HTTPException) as exc_info:
+        await admit(create_request(headers))
+    assert exc_info.value.status_code == status_code
+    validate.assert_not_called()
+    redis_plugin.create_redis_client.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_admission_sends_the_transaction_id_to_the_user_admin(redis_plugin):
+    received_headers = []
+
+    def handler(request):
+        received_headers.append(request.headers)
+        return httpx.Response(200, json=USER_DATA)
+
+    request = create_request(HEADERS)
+    request.app.state.http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler), event_hooks=TRACING_EVENT_HOOKS)
+    admission, admission_generator = await admit(request)
+
+    assert admission.user_data == USER_DATA
+    assert received_headers[0]["transaction-id"] == "transaction1"
+    await request.app.state.http_client.aclose()
+
+@pytest.mark.asyncio
+async def test_admission_caches_token_verdicts(redis_plugin, validate):
+    await admit(create_request(HEADERS))
+    await admit(create_request(HEADERS))
+    validate.assert_awaited_once()
+
+    validate.side_effect = HTTPException(status_code=401, detail="invalid")
+    invalid_headers = {**HEADERS, "vps-auth-token": "invalid"}
+    for _ in range(2):
+        with pytest.raises(HTTPException) as exc_info:
+            await admit(create_request(invalid_headers))
+        assert exc_info.value.status_code == 401
+    assert validate.await_count == 2
+
+@pytest.mark.asyncio
+async def test_admission_rate_limit(redis_plugin, validate):
+    redis_plugin.check_rate_limit_exceeded_or_not_for_a_particular_user.return_value = True
+    with pytest.raises(HTTPException) as exc_info:
+        await admit(create_request(HEADERS))
+    assert exc_info.value.status_code == 429
+    redis_plugin.close_redis_client.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_authentication_does_not_use_the_rate_limit(redis_plugin, validate):
+    redis_plugin.check_rate_limit_exceeded_or_not_for_a_particular_user.return_value = True
+    request = create_request(HEADERS)
+    authentication_generator = authenticate_prediction_request(request)
+    admission = await authentication_generator.__anext__()
+
+    assert admission.user_data == USER_DATA
+    redis_plugin.check_rate_limit_exceeded_or_not_for_a_particular_user.assert_not_called()
+    with pytest.raises(StopAsyncIteration):
+        await authentication_generator.__anext__()
+    redis_plugin.close_redis_client.assert_called_once_with(admission.redis_client)
+
+    # The other checks of admission still apply
+    with pytest.raises(HTTPException) as exc_info:
+        await authenticate_prediction_request(create_request({"vps-auth-token": "token"})).__anext__()
+    assert exc_info.value.status_code == 400
+
+@pytest.mark.asyncio
+async def test_admission_disabled(mocker, validate):
+    mocker.patch("src.utils.request_admission_util.get_performance_config", return_value=PerformanceConfigDTO(ADMISSION_ENABLED=False))
+    admission, _ = await admit(create_request({}))
+    assert admission is None
+
+@pytest.mark.asyncio
+async def test_read_prediction_body_limit(mocker):
+    mocker.patch("src.utils.request_admission_util.get_performance_config", return_value=PerformanceConfigDTO(ADMISSION_MAX_BODY_BYTES=10))
+    async def stream(chunks):
+        for chunk in chunks:
+            yield chunk
+
+    request = MagicMock()
+    request.stream = lambda: stream([b"12345", b"6789"])
+    assert await read_prediction_body(request) == b"123456789"
+
+    request.stream = lambda: stream([b"12345", b"678901"])
+    with pytest.raises(HTTPException) as exc_info:
+        await read_prediction_body(request)
+    assert exc_info.value.status_code == 413
+
+def test_token_verdict_cache_bounds():
+    cache = TokenVerdictCache()
+    for index in range(3):
+        cache.put(f"token-{index}", USER_DATA, 60, 2)
+    assert cache.get("token-0") == (False, None)
+    assert cache.get("token-2") == (True, USER_DATA)
+    cache.put("expired", USER_DATA, 0, 2)
+    assert cache.get("expired") == (False, None)
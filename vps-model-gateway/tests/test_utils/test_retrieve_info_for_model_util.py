@@ -33,13 +33,13 @@ def test_retrieve_info_success_with_transformer_and_KserveV1():
             "transformer_id": "trf-5678",
             "url_additions": {"Headers": {"Authorization": "Bearer transformer_token"}}
         }
-        result = retrieve_info_for_model_and_transformer_if_exists("mdl-1234", model, transformer, "test-transaction-id")
+        result = retrieve_info_for_model_and_transformer_if_exists({"model_id": "mdl-1234"}, model, transformer, "test-transaction-id")
         expected_model_url = "http://testserver/kourier/v1/models/mdl-1234-1234:predict"
         expected_transformer_url = "http://testserver/kourier"
         expected_model_headers = {"Authorization": "Bearer token", "Content-Type": "application/json"}
         expected_transformer_headers = {"Authorization": "Bearer transformer_token", "Content-Type": "application/json"}
 
-        assert result == (expected_model_url, expected_transformer_url, expected_model_headers, expected_transformer_headers, "prj-1234", "KserveV1")
+        assert result == (expected_model_url, expected_transformer_url, expected_model_headers, expected_transformer_headers, "prj-1234", "KserveV1", "mdl-1234-1234")
 
 def test_retrieve_info_success_with_transformer_and_KserveV2():
     with patch('src.utils.retrieve_info_for_model_util.EnvConfigDTO') as mock_config_class:
@@ -57,13 +57,13 @@ def test_retrieve_info_success_with_transformer_and_KserveV2():
             "transformer_id": "trf-5678",
             "url_additions": {"Headers": {"Authorization": "Bearer transformer_token"}}
         }
-        result = retrieve_info_for_model_and_transformer_if_exists("mdl-1234", model, transformer, "test-transaction-id")
+        result = retrieve_info_for_model_and_transformer_if_exists({"model_id": "mdl-1234"}, model, transformer, "test-transaction-id")
         expected_model_url = "http://testserver/kourier/v2/models/mdl-1234-1234/infer"
         expected_transformer_url = "http://testserver/kourier"
         expected_model_headers = {"Authorization": "Bearer token", "Content-Type": "application/json"}
         expected_transformer_headers = {"Authorization": "Bearer transformer_token", "Content-Type": "application/json"}
 
-        assert result == (expected_model_url, expected_transformer_url, expected_model_headers, expected_transformer_headers, "prj-1234", "KserveV2")
+        assert result == (expected_model_url, expected_transformer_url, expected_model_headers, expected_transformer_headers, "prj-1234", "KserveV2", "mdl-1234-1234")
 
 
 def test_retrieve_info_success_without_transformer():
@@ -79,11 +79,11 @@ def test_retrieve_info_success_without_transformer():
             "url_additions": {"Headers": {"Authorization": "Bearer token"}}
         }
         transformer = None
-        result = retrieve_info_for_model_and_transformer_if_exists("mdl-1234", model, transformer, "test-transaction-id")
+        result = retrieve_info_for_model_and_transformer_if_exists({"model_id": "mdl-1234"}, model, transformer, "test-transaction-id")
         expected_model_url = "http://testserver/kourier/v1/models/mdl-1234-1234:predict"
         expected_model_headers = {"Authorization": "Bearer token", "Content-Type": "application/json"}
 
-        assert result == (expected_model_url, None, expected_model_headers, {}, "prj-1234", "KserveV1")
+        assert result == (expected_model_url, None, expected_model_headers, {}, "prj-1234", "KserveV1", "mdl-1234-1234")
 
 def test_retrieve_info_missing_project_id():
     with patch('src.utils.retrieve_info_for_model_util.EnvConfigDTO') as mock_config_class:
@@ -98,7 +98,7 @@ def test_retrieve_info_missing_project_id():
         }
         transformer = None
         with pytest.raises(HTTPException) as excinfo:
-            retrieve_info_for_model_and_transformer_if_exists("mdl-1234", model, transformer, "test-transaction-id")
+            retrieve_info_for_model_and_transformer_if_exists({"model_id": "mdl-1234"}, model, transformer, "test-transaction-id")
         assert excinfo.value.status_code == 404
         assert "Project id not found in the model deployment information for the model_id" in excinfo.value.detail
 
@@ -116,7 +116,7 @@ def test_retrieve_info_unsupported_deployment_system():
         }
         transformer = None
         with pytest.raises(HTTPException) as excinfo:
-            retrieve_info_for_model_and_transformer_if_exists("mdl-1234", model, transformer, "test-transaction-id")
+            retrieve_info_for_model_and_transformer_if_exists({"model_id": "mdl-1234"}, model, transformer, "test-transaction-id")
         assert excinfo.value.status_code == 400
         assert "Deployment system not supported for the model_id" in excinfo.value.detail
 
@@ -133,6 +133,24 @@ def test_retrieve_info_no_deployment_system():
         }
         transformer = None
         with pytest.raises(HTTPException) as excinfo:
-            retrieve_info_for_model_and_transformer_if_exists("mdl-1234", model, transformer, "test-transaction-id")
+            retrieve_info_for_model_and_transformer_if_exists({"model_id": "mdl-1234"}, model, transformer, "test-transaction-id")
         assert excinfo.value.status_code == 400
         assert "No deployment system specified for model_id" in excinfo.value.detail
+
+def test_retrieve_info_selects_the_grpc_transport():
+    pytest.importorskip("grpc")
+    with patch('src.utils.retrieve_info_for_model_util.EnvConfigDTO') as mock_config_class:
+        mock_config_class.return_value.MODEL_KOURIER_SERVICE_URL = "http://kourier.internal"
+
+        model = {"model_id": "mdl-1234"}
+        deployment = {
+            "project_id": "prj-1234",
+            "deployment_system": "KserveV2",
+            "url_additions": {"Headers": {"Host": "mdl.models.example.com"}, "Protocol": "grpc"}
+        }
+        result = retrieve_info_for_model_and_transformer_if_exists(model, deployment, None, "test-transaction-id")
+        assert result[0] == "grpc://kourier.internal:80"
+
+        deployment["deployment_system"] = "KserveV1"
+        result = retrieve_info_for_model_and_transformer_if_exists(model, deployment, None, "test-transaction-id")
+        assert result[0] == "http://kourier.internal/v1/models/mdl-1234-1234:predict"
@@ -20,6 +20,7 @@ import pytest
 import httpx
 import json
 from src.models.env.env_config_DTO import EnvConfigDTO
+from src.models.env.performance_config_DTO import PerformanceConfigDTO
 
 @pytest.fixture(name="httpx_client_mock", scope="function")
 def fixture_httpx_client(mocker):
@@ -79,3 +80,31 @@ async def test_retrieve_model_details_info_unexpected_error(httpx_client_mock, m
         await retrieve_model_details_info(httpx_client_mock, model_id, "test_transaction_id")
     assert exc_info.value.status_code == 500
     assert "An unexpected error occurred while getting the model details" in str(exc_info.value.detail)
+
+@pytest.mark.asyncio
+async def test_retrieve_model_details_info_cached(httpx_client_mock, mocker):
+    mocker.patch("src.utils.model_metadata_cache_util.get_performance_config", return_value=PerformanceConfigDTO(MODEL_METADATA_CACHE_TTL_SECONDS=30.0))
+    model_id = "cached_model_id"
+    request = Request("GET", f"http://testserver/model/exists?model_id={model_id}")
+    response = Response(200, json={"result": True, "data": {"model_details": '{"key": "value"}'}}, request=request)
+    httpx_client_mock.get = AsyncMock(return_value=response)
+
+    first = await retrieve_model_details_info(httpx_client_mock, model_id, "test_transaction_id")
+    first["model_details"] = "changed by the caller"
+    second = await retrieve_model_details_info(httpx_client_mock, model_id, "test_transaction_id")
+
+    assert second == {"model_details": '{"key": "value"}'}
+    httpx_client_mock.get.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_retrieve_model_details_info_not_cached_by_default(httpx_client_mock, mocker):
+    mocker.patch("src.utils.model_metadata_cache_util.get_performance_config", return_value=PerformanceConfigDTO())
+    model_id = "cached_model_id"
+    request = Request("GET", f"http://testserver/model/exists?model_id={model_id}")
+    response = Response(200, json={"result": True, "data": {"api_access": "public"}}, request=request)
+    httpx_client_mock.get = AsyncMock(return_value=response)
+
+    # Access settings changed in the project admin apply to the next request
+    await retrieve_model_details_info(httpx_client_mock, model_id, "test_transaction_id")
+    await retrieve_model_details_info(httpx_client_mock, model_id, "test_transaction_id")
+    assert httpx_client_mock.get.await_count == 2
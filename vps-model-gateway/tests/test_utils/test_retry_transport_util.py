@@ -0,0 +1,141 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from src.models.env.env_config_DTO import EnvConfigDTO
+from src.models.env.performance_config_DTO import PerformanceConfigDTO
+from src.utils.retry_transport_util import RetryingTransport, RetryBudget, IDEMPOTENT_EXTENSION, COLD_START_EXTENSION
+import asyncio
+import httpx
+import pytest
+
+def create_client(handler, mocker, **config):
+    # A config of its own, the one of get_performance_config is shared by the whole worker
+    mocker.patch("src.utils.retry_transport_util.get_performance_config", return_value=PerformanceConfigDTO(**config))
+    transport = RetryingTransport(httpx.MockTransport(handler))
+    mocker.patch.object(transport, "get_backoff", return_value=0)
+    return httpx.AsyncClient(transport=transport), transport
+
+def project_admin_url(path):
+    return f"{EnvConfigDTO().PROJECT_ADMIN_SERVICE_URL}{path}"
+
+@pytest.mark.asyncio
+async def test_idempotent_get_is_retried_on_unavailable_upstream(mocker):
+    statuses = [503, 200]
+
+    def handler(request):
+        return httpx.Response(statuses.pop(0))
+
+    client, _ = create_client(handler, mocker)
+    response = await client.get(project_admin_url("/model/exists?model_id=mdl-test"))
+
+    assert response.status_code == 200
+    assert statuses == []
+
+@pytest.mark.asyncio
+async def test_post_is_only_retried_when_it_failed_to_connect(mocker):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            raise httpx.ConnectError("connection refused", request=request)
+        return httpx.Response(503)
+
+    client, _ = create_client(handler, mocker)
+    response = await client.post(project_admin_url("/transform"), content=b"{}")
+
+    assert response.status_code == 503
+    assert len(calls) == 2
+
+@pytest.mark.asyncio
+async def test_requests_marked_idempotent_are_retried_after_read_errors(mocker):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            raise httpx.ReadError("connection reset", request=request)
+        return httpx.Response(200)
+
+    client, _ = create_client(handler, mocker)
+    response = await client.post(project_admin_url("/validate_user"), content=b"{}", extensions={IDEMPOTENT_EXTENSION: True})
+
+    assert response.status_code == 200
+    assert len(calls) == 2
+
+@pytest.mark.asyncio
+async def test_retries_stop_when_the_budget_is_exhausted(mocker):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(503)
+
+    client, transport = create_client(handler, mocker)
+    transport.budget = RetryBudget(ratio=0, min_per_second=0, max_tokens=1)
+
+    await client.get(project_admin_url("/model/exists"))
+    await client.get(project_admin_url("/model/exists"))
+
+    # Three attempts are allowed per call, the budget only had room for one retry
+    assert len(calls) == 3
+
+@pytest.mark.asyncio
+async def test_slow_requests_are_hedged(mocker):
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            await asyncio.sleep(1)
+            return httpx.Response(200, text="slow")
+        return httpx.Response(200, text="hedge")
+
+    client, transport = create_client(handler, mocker, HTTP_HEDGE_MIN_DELAY_MS=10)
+    transport.policies["project_admin"].hedge = True
+    tracker = transport.get_latency_tracker("project_admin")
+    for _ in range(tracker.min_samples):
+        tracker.observe(0.01)
+
+    response = await client.get(project_admin_url("/model/exists"))
+
+    assert response.text == "hedge"
+    assert len(calls) == 2
+
+def test_resolves_the_transformer_and_the_model_on_a_shared_host():
+    config = EnvConfigDTO()
+    transport = RetryingTransport(httpx.MockTransport(lambda request: httpx.Response(200)))
+
+    assert transport.resolve_upstream(httpx.Request("GET", f"{config.TRANSFORMER_KOURIER_SERVICE_URL}/check_transform")) == "transformer"
+    assert transport.resolve_upstream(httpx.Request("POST", f"{config.MODEL_KOURIER_SERVICE_URL}/v1/models/mdl-test:predict")) == "model"
+    assert transport.resolve_upstream(httpx.Request("GET", "http://unknown-host/")) == "other"
+
+@pytest.mark.asyncio
+async def test_cold_start_calls_use_their_connect_timeout_and_are_not_hedged(mocker):
+    timeouts = []
+
+    def handler(request):
+        timeouts.append(request.extensions["timeout"])
+        return httpx.Response(200)
+
+    client, transport = create_client(handler, mocker, COLD_START_CONNECT_TIMEOUT_SECONDS=1.0)
+    transport.policies["model"].hedge = True
+    send_hedged = mocker.spy(transport, "send_hedged")
+    response = await client.post(f"{EnvConfigDTO().MODEL_KOURIER_SERVICE_URL}/v1/models/mdl-test:predict", content=b"{}", extensions={IDEMPOTENT_EXTENSION: True, COLD_START_EXTENSION: True})
+
+    assert response.status_code == 200
+    assert (timeouts[0]["connect"], timeouts[0]["pool"]) == (1.0, 1.0)
+    assert timeouts[0]["read"] == PerformanceConfigDTO().DEADLINE_MAX_SECONDS
+    send_hedged.assert_not_called()
@@ -0,0 +1,112 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from unittest.mock import patch, AsyncMock, MagicMock
+from src.utils.single_flight_util import SingleFlight
+from src.utils.model_prediction_util import get_coalesced_model_prediction_for_input_data, is_prediction_coalescing_enabled
+import asyncio
+import json
+import pytest
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_with_the_same_key_share_one_execution():
+    single_flight = SingleFlight("test")
+    calls = []
+    release = asyncio.Event()
+
+    async def call():
+        calls.append(1)
+        await release.wait()
+        return "result"
+
+    leader = asyncio.create_task(single_flight.do("key", call))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(single_flight.do("key", call))
+    other = asyncio.create_task(single_flight.do("other-key", call))
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await leader == ("result", False)
+    assert await follower == ("result", True)
+    assert await other == ("result", False)
+    assert len(calls) == 2
+    assert single_flight.calls == {}
+
+@pytest.mark.asyncio
+async def test_exceptions_are_shared_with_followers():
+    single_flight = SingleFlight("test")
+    release = asyncio.Event()
+
+    async def call():
+        await release.wait()
+        raise ValueError("upstream failed")
+
+    leader = asyncio.create_task(single_flight.do("key", call))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(single_flight.do("key", call))
+    await asyncio.sleep(0)
+    release.set()
+
+    with pytest.raises(ValueError):
+        await leader
+    with pytest.raises(ValueError):
+        await follower
+
+@pytest.mark.asyncio
+async def test_follower_retries_when_the_leader_is_cancelled():
+    single_flight = SingleFlight("test")
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    leader = asyncio.create_task(single_flight.do("key", call))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(single_flight.do("key", call))
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    assert await follower == (2, False)
+    assert leader.cancelled()
+
+def test_is_prediction_coalescing_enabled_from_model_notes():
+    assert is_prediction_coalescing_enabled({"notes": json.dumps({"coalesce_requests": True})})
+    assert not is_prediction_coalescing_enabled({"notes": None})
+    assert not is_prediction_coalescing_enabled({"notes": json.dumps({"coalesce_requests": False})})
+    assert not is_prediction_coalescing_enabled({"notes": "not json"})
+
+@pytest.mark.asyncio
+async def test_coalesced_prediction_returns_the_spill_transaction_of_the_leader():
+    release = asyncio.Event()
+
+    async def predict(*args, **kwargs):
+        await release.wait()
+        return None, "url"
+
+    with patch("src.utils.model_prediction_util.get_model_prediction_for_input_data", new=AsyncMock(side_effect=predict)) as mock_predict:
+        def call(transaction_id):
+            return asyncio.create_task(get_coalesced_model_prediction_for_input_data(("mdl-test", "v1", "hash"), MagicMock(), MagicMock(), "mdl-test", "mdl-service", transaction_id, "KserveV1", "url", {}, {}, {}, [1]))
+
+        leader = call("transaction1")
+        await asyncio.sleep(0)
+        follower = call("transaction2")
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await leader == (None, "url", "transaction1")
+        assert await follower == (None, "url", "transaction1")
+        mock_predict.assert_called_once()
@@ -0,0 +1,148 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from fastapi import HTTPException
+from src.models.env.performance_config_DTO import PerformanceConfigDTO
+from src.utils.deadline_util import start_request_deadline, reset_request_deadline
+from src.utils.tenant_scheduler_util import ModelCallScheduler, Tenant, resolve_tenant, model_call_slot, start_request_tenant, reset_request_tenant
+from src.utils import tenant_scheduler_util
+import asyncio
+import pytest
+
+FREE = Tenant("ent-free", "free", 1.0)
+ENTERPRISE = Tenant("ent-enterprise", "enterprise", 8.0)
+
+@pytest.fixture(autouse=True)
+def enable_scheduler(mocker):
+    mocker.patch("src.utils.tenant_scheduler_util.get_performance_config", return_value=PerformanceConfigDTO(MODEL_SCHEDULER_ENABLED=True))
+
+async def queue_calls(scheduler: ModelCallScheduler, calls: list, order: list):
+    tasks = []
+    for tenant, name in calls:
+        async def call(tenant=tenant, name=name):
+            await scheduler.acquire(tenant, 1, 32, name)
+            order.append(name)
+        tasks.append(asyncio.ensure_future(call()))
+        await asyncio.sleep(0)
+    return tasks
+
+def test_resolve_tenant(mocker):
+    mocker.patch("src.utils.tenant_scheduler_util.get_performance_config", return_value=PerformanceConfigDTO(MODEL_SCHEDULER_ENTITY_TIERS={"ent-big": "enterprise"}))
+
+    assert resolve_tenant({"entity_id": "ent-a", "plan_tier": "premium"}).weight == 4
+    assert resolve_tenant({"entity_id": "ent-big"}).tenant_class == "enterprise"
+    assert resolve_tenant({"entity_id": "ent-a", "plan_tier": "unknown"}).tenant_class == "standard"
+    assert resolve_tenant({}).entity_id == "anonymous"
+
+@pytest.mark.asyncio
+async def test_calls_below_the_limit_are_not_queued():
+    scheduler = ModelCallScheduler("mdl-test")
+    await scheduler.acquire(FREE, 2, 32, "txn-1")
+    await scheduler.acquire(FREE, 2, 32, "txn-2")
+
+    assert scheduler.active == 2
+    assert not scheduler.queues
+
+@pytest.mark.asyncio
+async def test_freed_slots_go_to_the_tenant_with_the_smallest_finish_tag():
+    scheduler = ModelCallScheduler("mdl-test")
+    await scheduler.acquire(FREE, 1, 32, "holder")
+    order = []
+    tasks = await queue_calls(scheduler, [(FREE, "free-1"), (FREE, "free-2"), (FREE, "free-3"), (ENTERPRISE, "enterprise-1"), (ENTERPRISE, "enterprise-2")], order)
+
+    for _ in range(5):
+        scheduler.release()
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+
+    # The enterprise calls arrived last but their small cost lets them pass the queued free calls
+    assert order == ["enterprise-1", "enterprise-2", "free-1", "free-2", "free-3"]
+
+@pytest.mark.asyncio
+async def test_a_flooding_tenant_only_delays_its_own_calls():
+    scheduler = ModelCallScheduler("mdl-test")
+    await scheduler.acquire(FREE, 1, 32, "holder")
+    other = Tenant("ent-other", "free", 1.0)
+    order = []
+    tasks = await queue_calls(scheduler, [(FREE, f"flood-{index}") for index in range(5)] + [(other, "other-1")], order)
+
+    for _ in range(6):
+        scheduler.release()
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+
+    assert order.index("other-1") <= 1
+
+@pytest.mark.asyncio
+async def test_full_tenant_queues_are_rejected():
+    scheduler = ModelCallScheduler("mdl-test")
+    await scheduler.acquire(FREE, 1, 1, "holder")
+    waiting = asyncio.ensure_future(scheduler.acquire(FREE, 1, 1, "txn-1"))
+    await asyncio.sleep(0)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await scheduler.acquire(FREE, 1, 1, "txn-2")
+    assert exc_info.value.status_code == 429
+
+    waiting.cancel()
+    await asyncio.gather(waiting, return_exceptions=True)
+    assert not scheduler.queues
+
+@pytest.mark.asyncio
+async def test_queued_calls_are_dropped_at_the_deadline():
+    scheduler = ModelCallScheduler("mdl-test")
+    await scheduler.acquire(FREE, 1, 32, "holder")
+
+    deadline_token = start_request_deadline("50", "txn-1")
+    try:
+        with pytest.raises(HTTPException) as exc_info:
+            await scheduler.acquire(FREE, 1, 32, "txn-1")
+    finally:
+        reset_request_deadline(deadline_token)
+    assert exc_info.value.status_code == 504
+    assert not scheduler.queues
+
+@pytest.mark.asyncio
+async def test_calls_that_cannot_finish_in_time_are_not_sent():
+    scheduler = ModelCallScheduler("mdl-test")
+    scheduler.service_time = 10.0
+    await scheduler.acquire(FREE, 1, 32, "holder")
+
+    deadline_token = start_request_deadline("1000", "txn-1")
+    try:
+        with pytest.raises(HTTPException) as exc_info:
+            await scheduler.acquire(FREE, 1, 32, "txn-1")
+    finally:
+        reset_request_deadline(deadline_token)
+    assert exc_info.value.status_code == 504
+
+@pytest.mark.asyncio
+async def test_model_call_slot_uses_the_tenant_of_the_request(mocker):
+    mocker.patch("src.utils.tenant_scheduler_util.get_performance_config", return_value=PerformanceConfigDTO(MODEL_SCHEDULER_ENABLED=True, MODEL_SCHEDULER_MAX_CONCURRENCY=1))
+    tenant_token = start_request_tenant({"entity_id": "ent-test", "plan_tier": "premium"}, "txn-1")
+    try:
+        async with model_call_slot("mdl-test", {}, "txn-1"):
+            scheduler = tenant_scheduler_util._schedulers["mdl-test"]
+            assert scheduler.active == 1
+            assert scheduler.limit == 1
+    finally:
+        reset_request_tenant(tenant_token)
+
+    assert "mdl-test" not in tenant_scheduler_util._schedulers
+
+@pytest.mark.asyncio
+async def test_model_call_slot_honours_the_max_concurrency_of_the_notes():
+    async with model_call_slot("mdl-test", {"max_concurrency": 3}, "txn-1"):
+        assert tenant_scheduler_util._schedulers["mdl-test"].limit == 3
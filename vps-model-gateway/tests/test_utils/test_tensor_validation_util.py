@@ -0,0 +1,103 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from fastapi import HTTPException
+from src.models.env.performance_config_DTO import PerformanceConfigDTO
+from src.utils.tensor_validation_util import validate_tensor_input, resolve_tensor_shape
+import pytest
+
+@pytest.fixture(autouse=True)
+def enable_tensor_validation(mocker):
+    mocker.patch("src.utils.tensor_validation_util.get_performance_config", return_value=PerformanceConfigDTO(TENSOR_VALIDATION_ENABLED=True))
+
+def model_input(data_type: str, dims: list):
+    return {"name": "input-0", "data_type": data_type, "dims": dims}
+
+@pytest.mark.parametrize("data_shape, dims, expected", [
+    ((1, 3), [1, 3], [1, 3]),
+    ((2, 3), [-1, 3], [2, 3]),
+    ((2, 3), [1, 3], None),
+    ((6,), [2, 3], [2, 3]),
+    ((6,), [1, -1], [1, 6]),
+    ((7,), [-1, 2], None),
+    ((5,), [1, 3], None),
+    ((12,), [-1, -1, 3], [-1, -1, 3]),
+    ((2, 2, 3), [4, 3], [4, 3]),
+    ((0,), [0, 3], [0, 3]),
+])
+def test_resolve_tensor_shape(data_shape, dims, expected):
+    assert resolve_tensor_shape(data_shape, dims) == expected
+
+def test_validate_tensor_input_resolves_dynamic_dims():
+    data = [[0.5, 1.5], [2.5, 3.5], [4.5, 5.5]]
+
+    assert validate_tensor_input(data, model_input("FP32", [-1, 2]), "transaction1") == (data, [3, 2])
+
+@pytest.mark.parametrize("data_type, data", [
+    ("BOOL", [True, False]),
+    ("INT8", [-128, 127]),
+    ("UINT8", [0, 255]),
+    ("INT64", [-2**63, 2**63 - 1]),
+    ("UINT64", [0, 2**64 - 1]),
+    ("FP16", [1, 0.5]),
+    ("FP64", [1e300, -1e300]),
+    ("BYTES", ["a", "bc"]),
+])
+def test_validate_tensor_input_accepts_datatypes(data_type, data):
+    assert validate_tensor_input(data, model_input(data_type, [-1]), "transaction1") == (data, [2])
+
+@pytest.mark.parametrize("data_type, data, reason", [
+    ("FP32", [[1.0, 2.0], [3.0]], "ragged"),
+    ("FP32", {"a": 1}, "not a list"),
+    ("FP32", ["a", "b"], "strings"),
+    ("INT32", [1.5, 2.0], "floats"),
+    ("INT8", [1, 128], "out of range"),
+    ("UINT8", [-1, 2], "negative"),
+    ("UINT64", [-1, 2**64 - 1], "negative"),
+    ("UINT64", [1.5, 2**64 - 1], "floats"),
+    ("FP16", [70000.0, 1.0], "out of range"),
+    ("BOOL", [1, 0], "integers"),
+    ("BYTES", [1, 2], "numbers"),
+    ("FP32", [{"a": 1}, {"b": 2}], "objects"),
+])
+def test_validate_tensor_input_rejects_invalid_data(data_type, data, reason):
+    with pytest.raises(HTTPException) as exc_info:
+        validate_tensor_input(data, model_input(data_type, [-1]), "transaction1")
+
+    assert exc_info.value.status_code == 400
+
+def test_validate_tensor_input_rejects_mismatched_shapes():
+    with pytest.raises(HTTPException) as exc_info:
+        validate_tensor_input([1.0, 2.0, 3.0], model_input("FP32", [1, 4]), "transaction1")
+
+    assert exc_info.value.status_code == 400
+    assert "[1, 4]" in exc_info.value.detail
+
+def test_validate_tensor_input_flattens_nested_data(mocker):
+    mocker.patch("src.utils.tensor_validation_util.get_performance_config", return_value=PerformanceConfigDTO(TENSOR_VALIDATION_ENABLED=True, TENSOR_VALIDATION_FLATTEN_INPUTS=True))
+
+    data, shape = validate_tensor_input([[1, 2, 3], [4, 5, 6]], model_input("INT32", [-1, 3]), "transaction1")
+
+    assert data == [1, 2, 3, 4, 5, 6]
+    assert all(type(value) is int for value in data)
+    assert shape == [2, 3]
+
+def test_validate_tensor_input_can_be_disabled(mocker):
+    mocker.patch("src.utils.tensor_validation_util.get_performance_config", return_value=PerformanceConfigDTO(TENSOR_VALIDATION_ENABLED=False))
+
+    assert validate_tensor_input(["a"], model_input("FP32", [1, -1]), "transaction1") == (["a"], [1, -1])
+
+def test_validate_tensor_input_skips_unknown_datatypes():
+    assert validate_tensor_input({"a": 1}, model_input("CUSTOM", [1]), "transaction1") == ({"a": 1}, [1])
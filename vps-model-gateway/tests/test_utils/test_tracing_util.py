@@ -0,0 +1,133 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+from unittest.mock import MagicMock
+from fastapi import HTTPException
+from src.utils.tracing_util import (
+    get_tracer, start_root_span, start_span, traced, parse_traceparent,
+    FileSpanExporter, TRACING_EVENT_HOOKS, STATUS_CODE_ERROR
+)
+import pytest
+import httpx
+import json
+
+@pytest.fixture(name="exporter")
+def fixture_exporter(mocker):
+    mock_config = mocker.patch("src.utils.tracing_util.get_performance_config", autospec=True)
+    mock_config.return_value.TRACING_ENABLED = True
+    mock_config.return_value.TRACING_SAMPLE_RATIO = 0.0
+    mock_config.return_value.TRACING_SLOW_THRESHOLD_MS = 10000
+    mock_config.return_value.TRACING_MAX_PENDING_TRACES = 10
+    mock_config.return_value.TRACING_MAX_SPANS_PER_TRACE = 10
+    mock_config.return_value.TRACING_SERVICE_NAME = "vps-model-gateway-test"
+
+    exporter = MagicMock()
+    tracer = get_tracer()
+    tracer.configure(exporter=exporter)
+    # Export synchronously so the assertions do not race the export thread
+    mocker.patch.object(tracer, "ensure_export_thread", side_effect=lambda: exporter.export(tracer.export_queue.get_nowait()))
+    yield exporter
+    tracer.enabled = False
+
+def exported_spans(exporter):
+    payload = exporter.export.call_args.args[0]
+    return payload["resourceSpans"][0]["scopeSpans"][0]["spans"]
+
+def make_client(handler):
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler), event_hooks=TRACING_EVENT_HOOKS)
+
+def test_parse_traceparent():
+    assert parse_traceparent("00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01") == ("4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7")
+    assert parse_traceparent("00-00000000000000000000000000000000-00f067aa0ba902b7-01") is None
+    assert parse_traceparent("not-a-traceparent") is None
+    assert parse_traceparent(None) is None
+
+@pytest.mark.asyncio
+async def test_upstream_calls_carry_traceparent_and_transaction_id(exporter):
+    received_headers = []
+
+    def handler(request):
+        received_headers.append(request.headers)
+        return httpx.Response(500)
+
+    incoming_traceparent = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+    async with make_client(handler) as client:
+        with start_root_span("POST /predict", incoming_traceparent, "transaction1") as root_span:
+            await client.get("http://test-user-admin/validate_user")
+
+    assert received_headers[0]["transaction-id"] == "transaction1"
+    assert received_headers[0]["traceparent"].startswith("00-4bf92f3577b34da6a3ce929d0e0e4736-")
+
+    spans = exported_spans(exporter)
+    client_span = next(span for span in spans if span["kind"] == 3)
+    assert client_span["parentSpanId"] == root_span.span_id
+    assert client_span["status"]["code"] == STATUS_CODE_ERROR
+    assert received_headers[0]["traceparent"] == f"00-{root_span.trace_id}-{client_span['spanId']}-01"
+
+@pytest.mark.asyncio
+async def test_fast_successful_trace_is_dropped(exporter):
+    async with make_client(lambda request: httpx.Response(200)) as client:
+        with start_root_span("POST /predict", None, "transaction1"):
+            await client.get("http://test-project-admin/model/exists")
+
+    exporter.export.assert_not_called()
+    assert get_tracer().pending_traces == {}
+
+def test_server_error_trace_is_kept(exporter):
+    with pytest.raises(HTTPException):
+        with start_root_span("POST /predict", None, "transaction1"):
+            with start_span("redis.check_rate_limit"):
+                pass
+            raise HTTPException(status_code=503, detail="Model unavailable")
+
+    spans = exported_spans(exporter)
+    assert [span["name"] for span in spans] == ["POST /predict", "redis.check_rate_limit"]
+    assert spans[0]["status"] == {"code": STATUS_CODE_ERROR, "message": "Model unavailable"}
+
+def test_traced_operation_records_exception(exporter):
+    @traced("s3.upload_part")
+    def upload_part():
+        raise ValueError("S3 error")
+
+    with pytest.raises(ValueError):
+        with start_root_span("POST /predict"):
+            upload_part()
+
+    spans = exported_spans(exporter)
+    assert spans[1]["name"] == "s3.upload_part"
+    assert spans[1]["status"]["code"] == STATUS_CODE_ERROR
+
+@pytest.mark.asyncio
+async def test_transaction_id_propagated_when_tracing_disabled():
+    received_headers = []
+
+    def handler(request):
+        received_headers.append(request.headers)
+        return httpx.Response(200)
+
+    async with make_client(handler) as client:
+        with start_root_span("POST /predict", None, "transaction1") as root_span:
+            await client.get("http://test-deploy-admin/deploy/model/transformer/info")
+
+    assert root_span is None
+    assert received_headers[0]["transaction-id"] == "transaction1"
+    assert "traceparent" not in received_headers[0]
+
+def test_file_span_exporter(tmp_path):
+    exporter = FileSpanExporter(str(tmp_path / "traces.jsonl"))
+    exporter.export({"resourceSpans": []})
+    exporter.export({"resourceSpans": []})
+
+    lines = (tmp_path / "traces.jsonl").read_text().splitlines()
+    assert [json.loads(line) for line in lines] == [{"resourceSpans": []}, {"resourceSpans": []}]
@@ -0,0 +1,127 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+
+from unittest.mock import MagicMock
+from src.models.env.performance_config_DTO import PerformanceConfigDTO
+from src.utils.usage_event_util import UsageEventEmitter, S3UsageEventSink, record_prediction_usage
+import asyncio
+import gzip
+import json
+import os
+import pytest
+
+class FakeSink:
+    def __init__(self):
+        self.batches = []
+        self.fail = False
+
+    async def send(self, events):
+        if self.fail:
+            raise ConnectionError("sink is down")
+        self.batches.append(events)
+
+    async def close(self):
+        pass
+
+def create_emitter(tmp_path, **settings):
+    config = PerformanceConfigDTO(USAGE_EVENTS_SPILL_DIR=str(tmp_path), USAGE_EVENTS_BATCH_SIZE=2, USAGE_EVENTS_BUFFER_SIZE=5, **settings)
+    os.makedirs(config.USAGE_EVENTS_SPILL_DIR, exist_ok=True)
+    return UsageEventEmitter(FakeSink(), config)
+
+def spilled_files(tmp_path):
+    return sorted(name for name in os.listdir(tmp_path) if name.endswith(".jsonl"))
+
+@pytest.mark.asyncio
+async def test_flush_sends_batches(tmp_path):
+    emitter = create_emitter(tmp_path)
+    for index in range(3):
+        emitter.emit({"index": index})
+
+    assert emitter.flush_requested.is_set()
+    await emitter.flush()
+
+    assert emitter.sink.batches == [[{"index": 0}, {"index": 1}], [{"index": 2}]]
+    assert not emitter.buffer
+
+@pytest.mark.asyncio
+async def test_failed_flush_spills_and_replays(tmp_path):
+    emitter = create_emitter(tmp_path)
+    emitter.sink.fail = True
+    for index in range(3):
+        emitter.emit({"index": index})
+
+    await emitter.flush()
+    assert not emitter.buffer
+    assert len(spilled_files(tmp_path)) == 1
+
+    emitter.sink.fail = False
+    await emitter.flush()
+
+    assert [event["index"] for batch in emitter.sink.batches for event in batch] == [0, 1, 2]
+    assert os.listdir(tmp_path) == []
+
+@pytest.mark.asyncio
+async def test_full_buffer_spills_without_blocking(tmp_path):
+    emitter = create_emitter(tmp_path)
+    for index in range(5):
+        emitter.emit({"index": index})
+
+    assert not emitter.buffer
+    await asyncio.gather(*emitter.spill_tasks)
+    with open(os.path.join(tmp_path, spilled_files(tmp_path)[0])) as file:
+        assert [json.loads(line)["index"] for line in file] == [0, 1, 2, 3, 4]
+
+@pytest.mark.asyncio
+async def test_spill_drops_events_over_the_limit(tmp_path):
+    emitter = create_emitter(tmp_path, USAGE_EVENTS_MAX_SPILL_BYTES=1)
+    emitter.spill([{"index": 0}])
+    emitter.spill([{"index": 1}])
+
+    assert len(spilled_files(tmp_path)) == 1
+
+@pytest.mark.asyncio
+async def test_stop_flushes_remaining_events(tmp_path):
+    emitter = create_emitter(tmp_path, USAGE_EVENTS_FLUSH_INTERVAL_SECONDS=60)
+    emitter.start()
+    emitter.emit({"index": 0})
+    await emitter.stop()
+
+    assert emitter.sink.batches == [[{"index": 0}]]
+
+@pytest.mark.asyncio
+async def test_s3_sink_writes_gzipped_jsonl():
+    s3_client = MagicMock()
+    await S3UsageEventSink(s3_client, "bucket", "usage-events").send([{"index": 0}, {"index": 1}])
+
+    arguments = s3_client.put_object.call_args.kwargs
+    assert arguments["Key"].startswith("usage-events/")
+    assert arguments["ContentEncoding"] == "gzip"
+    assert [json.loads(line) for line in gzip.decompress(arguments["Body"]).splitlines()] == [{"index": 0}, {"index": 1}]
+
+def test_record_prediction_usage_needs_service_usage():
+    request = MagicMock()
+    request.headers = {"transaction-id": "transaction1"}
+    request.state.usage = None
+    record_prediction_usage(request, "mdl-test", 10, {"payload_type": "content"}, 0.5)
+    request.app.state.usage_emitter.emit.assert_not_called()
+
+    request.state.usage = {"username": "user", "source": "model"}
+    record_prediction_usage(request, "mdl-test", 10, {"payload_type": "content"}, 0.5)
+    event = request.app.state.usage_emitter.emit.call_args.args[0]
+    assert event["transaction_id"] == "transaction1"
+    assert event["input_bytes"] == 10
+    assert event["latency_ms"] == 500.0
+    assert event["username"] == "user"
@@ -0,0 +1,145 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+
+from unittest.mock import AsyncMock
+from fastapi import HTTPException
+from redis.exceptions import RedisError
+from src.models.env.performance_config_DTO import PerformanceConfigDTO
+from src.utils import warm_up_util
+from src.utils.warm_up_util import HotModelTracker, HOT_MODELS_KEY, get_service_origins, preconnect_service, prefetch_model_metadata, run_warm_up, get_readiness_report
+from types import SimpleNamespace
+import asyncio
+import httpx
+import pytest
+
+@pytest.fixture(autouse=True)
+def reset_readiness():
+    readiness = warm_up_util.get_worker_readiness()
+    readiness.warmed_up, readiness.checks, readiness.checked_at = False, {}, None
+    yield
+    readiness.warmed_up, readiness.checks, readiness.checked_at = False, {}, None
+
+def test_hot_model_tracker_flushes_counts_after_the_interval(mocker):
+    mocker.patch("src.utils.warm_up_util.get_performance_config", return_value=PerformanceConfigDTO(WARMUP_HOT_MODELS_FLUSH_SECONDS=0.0))
+    redis_client = mocker.Mock()
+    tracker = HotModelTracker()
+
+    tracker.record("mdl-a", None)
+    tracker.record("mdl-a", redis_client)
+
+    redis_client.zincrby.assert_called_once_with(HOT_MODELS_KEY, 2, "mdl-a")
+    redis_client.expire.assert_called_once()
+    assert not tracker.counts
+
+def test_hot_model_tracker_keeps_counting_before_the_interval(mocker):
+    mocker.patch("src.utils.warm_up_util.get_performance_config", return_value=PerformanceConfigDTO(WARMUP_HOT_MODELS_FLUSH_SECONDS=3600.0))
+    redis_client = mocker.Mock()
+    tracker = HotModelTracker()
+
+    tracker.record("mdl-a", redis_client)
+    tracker.record("mdl-b", redis_client)
+
+    redis_client.zincrby.assert_not_called()
+    assert tracker.counts == {"mdl-a": 1, "mdl-b": 1}
+
+def test_hot_model_tracker_ignores_redis_errors(mocker):
+    redis_client = mocker.Mock()
+    redis_client.zincrby.side_effect = RedisError("down")
+    tracker = HotModelTracker()
+    tracker.counts["mdl-a"] = 3
+
+    tracker.flush(redis_client)
+    assert not tracker.counts
+
+def test_get_service_origins_deduplicates_shared_hosts(mocker):
+    config = SimpleNamespace(
+        USER_ADMIN_SERVICE_URL="http://control-plane:8080/user",
+        PAYMENT_SERVICE_URL="http://control-plane:8080/payment",
+        PROJECT_ADMIN_SERVICE_URL="http://control-plane:8080/project",
+        DEPLOY_ADMIN_SERVICE_URL="http://deploy:8080",
+        MODEL_KOURIER_SERVICE_URL="http://kourier.internal",
+        TRANSFORMER_KOURIER_SERVICE_URL="http://kourier.internal"
+    )
+    mocker.patch("src.utils.warm_up_util.EnvConfigDTO", return_value=config)
+
+    assert get_service_origins() == ["http://control-plane:8080", "http://deploy:8080", "http://kourier.internal"]
+
+@pytest.mark.asyncio
+async def test_preconnect_service_opens_the_requested_connections():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(404)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        assert await preconnect_service(client, "http://deploy:8080", 3)
+    assert len(requests) == 3
+    assert all(str(request.url) == "http://deploy:8080/" for request in requests)
+
+@pytest.mark.asyncio
+async def test_preconnect_service_reports_unreachable_services():
+    def handler(request):
+        raise httpx.ConnectError("refused", request=request)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        assert not await preconnect_service(client, "http://deploy:8080", 2)
+
+@pytest.mark.asyncio
+async def test_prefetch_model_metadata_counts_the_fetched_models(mocker):
+    details = mocker.patch("src.utils.warm_up_util.retrieve_model_details_info", new_callable=AsyncMock, side_effect=[{}, HTTPException(status_code=404, detail="not found")])
+    deployment = mocker.patch("src.utils.warm_up_util.retrieve_deployment_info_for_model_and_related_transformer", new_callable=AsyncMock, return_value={})
+
+    assert await prefetch_model_metadata(mocker.Mock(), ["mdl-a", "mdl-b"]) == 1
+    assert details.await_count == 2
+    deployment.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_run_warm_up_marks_the_worker_warmed_up_after_a_timeout(mocker):
+    mocker.patch("src.utils.warm_up_util.get_performance_config", return_value=PerformanceConfigDTO(WARMUP_TIMEOUT_SECONDS=0.01))
+
+    async def slow_warm_up(app):
+        await asyncio.sleep(1)
+    mocker.patch("src.utils.warm_up_util.warm_up", side_effect=slow_warm_up)
+
+    await run_warm_up(mocker.Mock())
+    assert warm_up_util.get_worker_readiness().warmed_up
+
+@pytest.mark.asyncio
+async def test_run_warm_up_marks_the_worker_warmed_up_after_a_failure(mocker):
+    mocker.patch("src.utils.warm_up_util.warm_up", new_callable=AsyncMock, side_effect=RuntimeError("boom"))
+
+    await run_warm_up(mocker.Mock())
+    assert warm_up_util.get_worker_readiness().warmed_up
+
+@pytest.mark.asyncio
+async def test_get_readiness_report_skips_the_checks_before_the_warm_up(mocker):
+    check = mocker.patch("src.utils.warm_up_util.check_dependency", new_callable=AsyncMock, return_value=True)
+
+    report = await get_readiness_report(mocker.Mock())
+    assert report == {"ready": False, "warmed_up": False, "checks": {}}
+    check.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_get_readiness_report_caches_the_dependency_checks(mocker):
+    mocker.patch("src.utils.warm_up_util.get_performance_config", return_value=PerformanceConfigDTO(READINESS_CHECK_INTERVAL_SECONDS=60.0, READINESS_DEPENDENCIES=["redis", "s3"]))
+    check = mocker.patch("src.utils.warm_up_util.check_dependency", new_callable=AsyncMock, side_effect=[True, False])
+    warm_up_util.get_worker_readiness().warmed_up = True
+
+    report = await get_readiness_report(mocker.Mock())
+    assert report == {"ready": False, "warmed_up": True, "checks": {"redis": True, "s3": False}}
+
+    await get_readiness_report(mocker.Mock())
+    assert check.await_count == 2
@@ -0,0 +1,146 @@
+# Copyright (c) 2024 Vipas.AI
+#
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of a proprietary license which prohibits
+# redistribution and use in any form, without the express prior written consent
+# of Vipas.AI.
+#
+# This code is proprietary to Vipas.AI and is protected by copyright and
+# other intellectual property laws. You may not modify, reproduce, perform,
+# display, create derivative works from, repurpose, or distribute this code or any portion of it
+# without the express prior written permission of Vipas.AI.
+#
+# For more information, contact Vipas.AI at legal@vipas.ai
+
+from concurrent.futures import ThreadPoolExecutor
+from src.models.env.performance_config_DTO import PerformanceConfigDTO
+from src.utils.worker_supervisor_util import WorkerSupervisor, prepare_metrics_dir
+import itertools
+import os
+
+class FakeProcess:
+    pids = itertools.count(100)
+
+    def __init__(self, target, args, name):
+        self.args = args
+        self.pid = next(self.pids)
+        self.exitcode = None
+        self.alive = False
+
+    def start(self):
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+    def join(self):
+        pass
+
+    def crash(self):
+        self.alive = False
+        self.exitcode = 1
+
+class FakeContext:
+    def __init__(self):
+        self.started = []
+
+    def Process(self, target, args, name):
+        process = FakeProcess(target, args, name)
+        self.started.append(process)
+        return process
+
+def create_supervisor(ports, **config):
+    context = FakeContext()
+    supervisor = WorkerSupervisor(lambda port: None, ports, PerformanceConfigDTO(**config), context=context)
+    for port in ports:
+        supervisor.start_worker(port)
+    return supervisor, context
+
+def test_exited_workers_are_started_again_after_a_backoff():
+    supervisor, context = create_supervisor([8000, 8001], SERVER_WORKER_RESTART_BACKOFF_SECONDS=1.0)
+
+    supervisor.processes[8000].crash()
+    assert supervisor.check_workers(10.0)
+    assert supervisor.processes[8000] is None
+    assert len(context.started) == 2
+
+    # Started again once the backoff passed, the other worker is left alone
+    assert supervisor.check_workers(10.5)
+    assert supervisor.check_workers(11.0)
+    assert len(context.started) == 3
+    assert supervisor.processes[8000] is context.started[2]
+    assert supervisor.processes[8001] is context.started[1]
+
+    # The backoff doubles for every restart within the window
+    supervisor.processes[8000].crash()
+    supervisor.check_workers(12.0)
+    assert supervisor.restart_at[8000] == 14.0
+
+def test_worker_exiting_too_often_stops_the_gateway():
+    supervisor, context = create_supervisor([8000], SERVER_WORKER_RESTART_BACKOFF_SECONDS=0.0, SERVER_WORKER_MAX_RESTARTS=2, SERVER_WORKER_RESTART_WINDOW_SECONDS=60.0)
+
+    for now in (1.0, 2.0):
+        supervisor.processes[8000].crash()
+        assert supervisor.check_workers(now)
+        assert supervisor.check_workers(now)
+
+    supervisor.processes[8000].crash()
+    assert not supervisor.check_workers(3.0)
+
+    # Restarts that left the window do not count
+    supervisor, context = create_supervisor([8000], SERVER_WORKER_RESTART_BACKOFF_SECONDS=0.0, SERVER_WORKER_MAX_RESTARTS=2, SERVER_WORKER_RESTART_WINDOW_SECONDS=60.0)
+    for now in (1.0, 2.0, 100.0):
+        supervisor.processes[8000].crash()
+        assert supervisor.check_workers(now)
+        assert supervisor.check_workers(now)
+
+def test_probes_reflect_every_worker(mocker):
+    supervisor, context = create_supervisor([8000, 8001])
+    supervisor.probe_executor = ThreadPoolExecutor(max_workers=2)
+    statuses = {8000: 200, 8001: 200}
+    mocker.patch("src.utils.worker_supervisor_util.probe_worker", side_effect=lambda port, path, timeout: statuses[port])
+
+    assert supervisor.probe_workers("/healthz") == (True, {"8000": 200, "8001": 200})
+    assert supervisor.probe_workers("/readyz") == (True, {"8000": 200, "8001": 200})
+
+    # A running worker that does not answer fails both probes
+    statuses[8001] = None
+    assert supervisor.probe_workers("/healthz") == (False, {"8000": 200, "8001": None})
+
+    # A worker waiting for its restart leaves the pod live and ready with the other one
+    statuses[8001] = 200
+    supervisor.processes[8001] = None
+    assert supervisor.probe_workers("/healthz") == (True, {"8000": 200, "8001": "restarting"})
+    assert supervisor.probe_workers("/readyz") == (True, {"8000": 200, "8001": "restarting"})
+
+    # Unready once no worker is ready
+    statuses[8000] = 503
+    assert supervisor.probe_workers("/readyz") == (False, {"8000": 503, "8001": "restarting"})
+    supervisor.probe_executor.shutdown()
+
+def test_readiness_needs_the_configured_ready_workers(mocker):
+    supervisor, context = create_supervisor([8000, 8001, 8002], SERVER_READY_MIN_WORKERS=2)
+    supervisor.probe_executor = ThreadPoolExecutor(max_workers=3)
+    statuses = {8000: 200, 8001: 503, 8002: 200}
+    mocker.patch("src.utils.worker_supervisor_util.probe_worker", side_effect=lambda port, path, timeout: statuses[port])
+
+    assert supervisor.probe_workers("/readyz")[0]
+    supervisor.processes[8002] = None
+    assert not supervisor.probe_workers("/readyz")[0]
+
+    # A quorum larger than the workers needs all of them
+    supervisor, context = create_supervisor([8000], SERVER_READY_MIN_WORKERS=4)
+    supervisor.probe_executor = ThreadPoolExecutor(max_workers=1)
+    assert supervisor.probe_workers("/readyz") == (True, {"8000": 200})
+    supervisor.probe_executor.shutdown()
+
+def test_prepare_metrics_dir_removes_the_files_of_the_previous_run(tmp_path, monkeypatch):
+    monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR", raising=False)
+    (tmp_path / "counter_100.db").write_bytes(b"stale")
+    (tmp_path / "notes.txt").write_text("kept")
+
+    prepare_metrics_dir(str(tmp_path))
+
+    assert os.environ["PROMETHEUS_MULTIPROC_DIR"] == str(tmp_path)
+    assert sorted(os.listdir(tmp_path)) == ["notes.txt"]
+    monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR")
@@ -0,0 +1,23 @@
+// Copyright (c) 2024 Vipas.AI
+//
+// All rights reserved. This program and the accompanying materials
+// are made available under the terms of a proprietary license which prohibits
+// redistribution and use in any form, without the express prior written consent
+// of Vipas.AI.
+//
+// This code is proprietary to Vipas.AI and is protected by copyright and
+// other intellectual property laws. You may not modify, reproduce, perform,
+// display, create derivative works from, repurpose, or distribute this code or any portion of it
+// without the express prior written permission of Vipas.AI.
+//
+// For more information, contact Vipas.AI at legal@vipas.ai
+
+// Cache key of the auth verdicts, nginx writes the key into every cache file so the raw token must not be used
+const crypto = require('crypto');
+
+function token_hash(r) {
+    const token = r.headersIn['vps-auth-token'] || '';
+    return crypto.createHash('sha256').update(token).digest('hex');
+}
+
+export default { token_hash };